@@ -20,6 +20,9 @@ from cnns.nnlib.datasets.transformations.denorm_round_norm import \
     DenormRoundNorm
 from foolbox.attacks.additive_noise import AdditiveUniformNoiseAttack
 from cnns.nnlib.robustness.randomized_defense import defend
+from cnns.nnlib.robustness.randomized_defense import defend_torch
+from cnns.nnlib.robustness.batch_attack.cw import CW
+from cnns.nnlib.robustness.channels.channel_pipeline import ChannelPipeline
 from foolbox.attacks.additive_noise import AdditiveGaussianNoiseAttack
 from cnns.nnlib.attacks.adversarial_round_fft import AdversarialRoundFFT
 from cnns.nnlib.robustness.utils import AdditiveLaplaceNoiseAttack
@@ -220,6 +223,82 @@ class CarliniWagnerL2AttackRoundFFT(CarliniWagnerL2Attack):
                 image = np.clip(image, a_min=self.args.min, a_max=self.args.max)
         return image
 
+    def get_batch_channel(self):
+        """
+        :return: the torch version of add_one_distortion for a batch of
+        (normalized) images or None if the attack type has no distortion
+        """
+        args = self.args
+        specs = {
+            AttackType.FFT_RECOVERY: f'fft:{args.compress_fft_layer}',
+            AttackType.SVD_RECOVERY: f'svd:{args.svd_compress}',
+            AttackType.GAUSS_RECOVERY: f'gauss:{args.noise_sigma}',
+            AttackType.UNIFORM_RECOVERY: f'uniform:{args.noise_epsilon}',
+            AttackType.LAPLACE_RECOVERY: f'laplace:{args.laplace_epsilon}',
+        }
+        if args.attack_type == AttackType.ROUND_RECOVERY:
+            # The rounding is done in the range [0, 1].
+            pipeline = ChannelPipeline(
+                spec=f'round:{args.values_per_channel}', fuse=False)
+            mean = torch.tensor(args.mean_array).view(1, -1, 1, 1)
+            std = torch.tensor(args.std_array).view(1, -1, 1, 1)
+
+            def round_channel(images):
+                mean_, std_ = mean.to(images), std.to(images)
+                return (pipeline(images * std_ + mean_) - mean_) / std_
+
+            return round_channel
+        if args.attack_type in specs:
+            return ChannelPipeline(spec=specs[args.attack_type],
+                                   bounds=(args.min, args.max), fuse=False)
+        return None
+
+    def attack_batch(self, images, labels, model=None, binary_search_steps=5,
+                     max_iterations=1000, confidence=0, learning_rate=5e-3,
+                     initial_const=1e-2, abort_early=True):
+        """
+        The C&W attack run for a batch of images on the device of the model
+        (with the binary search over the constant for each image).
+
+        The distortion (add_one_distortion) is applied to the adversarial
+        images in the loss. If noise_iterations > 0, an image is adversarial
+        if the class selected by the noise trials of the randomized defense
+        (run on the device) differs from its label.
+
+        :param images: the (normalized) images (N, C, H, W)
+        :param labels: the labels of the images (N)
+        :param model: the pytorch model (the model of the foolbox model by
+        default)
+        :return: the best adversarial images (or the original images if not
+        found) and the mask of the images for which the adversarial was found
+        """
+        args = self.args
+        if model is None:
+            model = self._default_model._model
+        device = next(model.parameters()).device
+        images = torch.as_tensor(images, device=device)
+        labels = torch.as_tensor(labels, device=device)
+        model.eval()
+
+        defense = None
+        if args.noise_iterations > 0:
+            def defense(adv_images, adv_labels):
+                results, _, _ = defend_torch(
+                    images=adv_images, model=model, args=args,
+                    iters=args.noise_iterations,
+                    early_stop_alpha=args.recover_early_stop_alpha)
+                class_ids = torch.tensor([result.class_id for result in
+                                          results], device=device)
+                return class_ids != adv_labels
+
+        cw = CW(model=model, binary_search_steps=binary_search_steps,
+                max_iterations=max_iterations, confidence=confidence,
+                learning_rate=learning_rate, initial_const=initial_const,
+                abort_early=abort_early, bounds=(args.min, args.max),
+                channel=self.get_batch_channel(), defense=defense)
+        adv_images, best_l2, _ = cw.attack(images, labels)
+        return adv_images, ~torch.isinf(best_l2)
+
     def get_roundfft_adversarial(self):
         """
         :return: the current best adversarial against the rounding defnese or
@@ -409,7 +488,11 @@ class CarliniWagnerL2AttackRoundFFT(CarliniWagnerL2Attack):
                         image=x,
                         fmodel=self._default_model,
                         args=self.args,
-                        iters=self.args.noise_iterations)
+                        iters=self.args.noise_iterations,
+                        # The torch defense engine only with --torch_defense.
+                        model=getattr(self._default_model, '_model', None)
+                        if getattr(self.args, 'torch_defense', False)
+                        else None)
 
                     # Our defense does not rely on the logits/predictions but
                     # on pluralism method: class with the highest count is
@@ -6,6 +6,7 @@ from cnns.nnlib.robustness.channels.channels_definition import \
     fft_zero_low_magnitudes
 from cnns.nnlib.robustness.channels.channels_definition import \
     replace_frequencies_numpy
+from cnns.nnlib.robustness.channels.channels_definition import FFTSpectrum
 import torch
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_xfft_hw
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_ifft_hw
@@ -32,46 +33,65 @@ def pytorch_net(net):
     return net_wrapper
 
 
-def bisearch_to_decrease_rate(input, label, func, net, low=0, high=100,
-                              resolution=1.0):
+def batch_search_rate(func, label, net, low=0, high=100.0, resolution=1.0,
+                      increase=False, num_candidates=16):
+    """
+    The vectorized binary search over the rates: in each pass, the
+    num_candidates rates spread over [low, high] are evaluated at once (as a
+    single batch) and the interval is narrowed to the neighbours of the first
+    (or the last) adversarial rate. A search over 100 rates with the
+    resolution 1 takes 2 passes instead of 7 sequential bisection steps.
+
+    :param func: maps a vector of rates (R) to the batch of images (R, ...)
+    :param label: the correct label
+    :param net: maps a batch of images to the predictions (R, num_classes)
+    :param increase: find the largest (instead of the smallest) rate for
+    which the image is adversarial
+    :return: the adversarial image for the found rate and the rate
+    """
     last_adv_image = None
-    last_compression_rate = None
+    last_rate = None
 
     while low <= high:
-        mid = (high + low) / 2
-        adv_image = func(input, mid)
-        predictions = net(adv_image)
-        predicted_class_id = np.argmax(predictions)
-
-        if predicted_class_id != label:
-            last_adv_image = adv_image
-            last_compression_rate = mid
-            # binary search
-            high = mid - resolution
+        num = int(min(num_candidates, np.floor((high - low) / resolution) + 1))
+        rates = np.linspace(low, high, max(num, 2)) if num > 1 else np.array(
+            [low])
+        adv_images = func(rates)
+        predictions = net(adv_images)
+        is_adv = np.argmax(predictions, axis=1) != label
+        adv_ids = np.nonzero(is_adv)[0]
+        if len(adv_ids) == 0:
+            break
+        i = adv_ids[-1] if increase else adv_ids[0]
+        last_adv_image = adv_images[i]
+        last_rate = rates[i]
+        if increase:
+            if i == len(rates) - 1:
+                break
+            low, high = rates[i] + resolution, rates[i + 1] - resolution
         else:
-            low = mid + resolution
-    return last_adv_image, last_compression_rate
+            if i == 0:
+                break
+            low, high = rates[i - 1] + resolution, rates[i] - resolution
+    return last_adv_image, last_rate
 
 
-def bisearch_to_increase_rate(input, label, func, net, low=0, high=100.0,
-                              resolution=1.0):
-    last_compression_rate = None
-    last_adv_image = None
+def get_numpy_spectrum(image):
+    """
+    :param image: the numpy image (C, H, W)
+    :return: the spectrum of the image (as a batch of 1 image)
+    """
+    return FFTSpectrum(input=torch.from_numpy(image).unsqueeze(dim=0),
+                       is_next_power2=False)
 
-    while low <= high:
-        mid = (high + low) / 2
-        adv_image = func(input, mid)
-        predictions = net(adv_image)
-        predicted_class_id = np.argmax(predictions)
-
-        if predicted_class_id != label:
-            last_adv_image = adv_image
-            last_compression_rate = mid
-            # binary search
-            low = mid + resolution
-        else:
-            high = mid - resolution
-    return last_adv_image, last_compression_rate
+
+def compress_numpy(spectrum, compress_rates, inverse_compress_rates=None):
+    """
+    :return: the numpy images (R, C, H, W) compressed by the compress rates
+    """
+    images = spectrum.compress(compress_rates=compress_rates,
+                               inverse_compress_rates=inverse_compress_rates)
+    return images.squeeze(dim=1).cpu().numpy()
 
 
 class FFTHighFrequencyAttack(Attack):
@@ -83,9 +103,14 @@ class FFTHighFrequencyAttack(Attack):
 class FFTHighFrequencyAttackAdversary(Attack):
 
     def __call__(self, input_or_adv, label=None, unpack=True, net=None):
-        adv_image, _ = bisearch_to_decrease_rate(input=input_or_adv,
-                                                 label=label, net=net,
-                                                 func=fft_numpy)
+        """
+        :param net: maps a batch of images to the predictions (e.g.
+        fmodel.forward)
+        """
+        spectrum = get_numpy_spectrum(input_or_adv)
+        adv_image, _ = batch_search_rate(
+            label=label, net=net,
+            func=lambda rates: compress_numpy(spectrum, rates))
         return adv_image
 
 
@@ -94,27 +119,28 @@ class FFTLimitFrequencyAttack(Attack):
     def __call__(self, input_or_adv, label=None, unpack=True, net=None,
                  compress_rate=50, compress_resolution=1.0):
         """
-        Binary search for the highest inverse_compress_rate so that we can
+        Search for the highest inverse_compress_rate so that we can
         recover as many high frequency coefficient as possible.
 
         :param input_or_adv: the adversarial image
         :param label: the correct label
         :param unpack: not used
-        :param net: the ml model
+        :param net: the ml model that maps a batch of images to the
+        predictions (e.g. fmodel.forward)
         :param compress_rate: how much to compress
         :return: an adversarial image
         """
+        spectrum = get_numpy_spectrum(input_or_adv)
 
-        def func(image, rate):
-            return fft_numpy(numpy_array=image,
-                             compress_rate=compress_rate,
-                             inverse_compress_rate=rate)
+        def func(rates):
+            return compress_numpy(
+                spectrum, compress_rates=[compress_rate] * len(rates),
+                inverse_compress_rates=rates)
 
-        adv_image, _ = bisearch_to_increase_rate(input_or_adv,
-                                                 label=label,
-                                                 func=func,
-                                                 net=net,
-                                                 high=compress_rate)
+        adv_image, _ = batch_search_rate(func=func, label=label, net=net,
+                                         high=compress_rate,
+                                         resolution=compress_resolution,
+                                         increase=True)
         return adv_image
 
 
@@ -123,34 +149,34 @@ class FFTLimitFrequencyAttackAdversary(Attack):
     def __call__(self, input_or_adv, label=None, unpack=True, net=None,
                  compress_resolution=1.0):
         """
-        Binary search for the highest inverse_compress_rate so that we can
+        Search for the highest inverse_compress_rate so that we can
         recover as many high frequency coefficient as possible.
 
         :param input_or_adv: the adversarial image
         :param label: the correct label
         :param unpack: not used
-        :param net: the ml model
+        :param net: the ml model that maps a batch of images to the
+        predictions (e.g. fmodel.forward)
         :param compress_rate: how much to compress
         :return: an adversarial image
         """
-        adv_image, compress_rate = bisearch_to_decrease_rate(input=input_or_adv,
-                                                             label=label,
-                                                             net=net,
-                                                             func=fft_numpy)
+        spectrum = get_numpy_spectrum(input_or_adv)
+        adv_image, compress_rate = batch_search_rate(
+            label=label, net=net, resolution=compress_resolution,
+            func=lambda rates: compress_numpy(spectrum, rates))
 
         if adv_image is None:
             return None
 
-        def func(image, rate):
-            return fft_numpy(numpy_array=image,
-                             compress_rate=compress_rate,
-                             inverse_compress_rate=rate)
+        def func(rates):
+            return compress_numpy(
+                spectrum, compress_rates=[compress_rate] * len(rates),
+                inverse_compress_rates=rates)
 
-        adv_image2, _ = bisearch_to_increase_rate(input_or_adv,
-                                                  label=label,
-                                                  func=func,
-                                                  net=net,
-                                                  high=compress_rate)
+        adv_image2, _ = batch_search_rate(func=func, label=label, net=net,
+                                          high=compress_rate,
+                                          resolution=compress_resolution,
+                                          increase=True)
         if adv_image2 is not None:
             adv_image = adv_image2
 
@@ -252,7 +278,7 @@ class FFTSingleFrequencyAttack(Attack):
 
     @call_decorator
     def __call__(self, input_or_adv, label=None, unpack=True,
-                 max_frequencies=1000):
+                 max_frequencies=1000, block_size=64):
 
         """Perturbs just a single frequency and sets it to the min or max.
 
@@ -271,6 +297,9 @@ class FFTSingleFrequencyAttack(Attack):
             the Adversarial object.
         max_pixels : int
             Maximum number of pixels to try.
+        block_size : int
+            Number of frequencies whose candidates (min and max value) are
+            evaluated in a single batch.
 
         """
         a = input_or_adv
@@ -298,28 +327,23 @@ class FFTSingleFrequencyAttack(Attack):
         total_freqs = H_fft * W_xfft
         freqs = nprng.permutation(total_freqs)
         # freqs = freqs[:max_frequencies]
-        for i, freq in enumerate(freqs):
-            w = freq % W_xfft
-            h = freq // W_xfft
-
-            location = [h, w]
-            # Add the channel dimension.
-            location.insert(channel_axis, slice(None))
-            # Add the batch dim.
-            location.insert(0, slice(None))
-            location = tuple(location)
-
-            for value in [minf, maxf]:
-                perturbed_xfft = xfft.clone()
-                value = check_real_vals(
-                    H_fft=H_fft, W_fft=W_fft, h=h, w=w, value=value)
-                perturbed_xfft[location] = value
-                perturbed = get_ifft_hw(
-                    xfft=perturbed_xfft, H_fft=H_fft, W_fft=W_fft, H=H, W=W)
-                perturbed = perturbed.detach().cpu().numpy().squeeze()
-                _, is_adv = a.predictions(perturbed)
-                if is_adv:
-                    return
+        for start in range(0, total_freqs, block_size):
+            block_freqs = freqs[start:start + block_size]
+            # The candidates in the order: (freq, min), (freq, max), ...
+            hs = np.repeat(block_freqs // W_xfft, 2)
+            ws = np.repeat(block_freqs % W_xfft, 2)
+            values = torch.stack([
+                check_real_vals(H_fft=H_fft, W_fft=W_fft, h=h, w=w,
+                                value=value.clone())
+                for h, w, value in zip(hs, ws, [minf, maxf] * len(
+                    block_freqs))])
+            perturbed_xfft = xfft.repeat(len(values), 1, 1, 1, 1)
+            perturbed_xfft[np.arange(len(values)), :, hs, ws] = \
+                values.unsqueeze(1)
+            is_adv, _, _ = predict_first_adversarial(
+                a=a, xfft=perturbed_xfft, H_fft=H_fft, W_fft=W_fft, H=H, W=W)
+            if is_adv:
+                return
 
 
 class FFTMultipleFrequencyAttack(Attack):
@@ -328,7 +352,8 @@ class FFTMultipleFrequencyAttack(Attack):
 
     def __init__(self, args, model=None, criterion=Misclassification(),
                  distance=MSE, threshold=None, max_frequencies_percent=30,
-                 iterations=100, is_strict=True, is_debug=True, is_fast=False):
+                 iterations=100, is_strict=True, is_debug=True, is_fast=False,
+                 block_size=64):
         super(FFTMultipleFrequencyAttack, self).__init__(
             model=model, criterion=criterion, distance=distance,
             threshold=threshold)
@@ -338,6 +363,8 @@ class FFTMultipleFrequencyAttack(Attack):
         self.is_strict = is_strict
         self.is_debug = is_debug
         self.is_fast = is_fast
+        # The number of the candidates evaluated in a single batch.
+        self.block_size = block_size
 
     @call_decorator
     def __call__(self, input_or_adv, label=None, unpack=True):
@@ -385,38 +412,29 @@ class FFTMultipleFrequencyAttack(Attack):
         W_xfft = xfft.shape[-2]
         total_freqs = H_fft * W_xfft
         max_frequencies = int(total_freqs * self.max_frequencies_percent / 100)
+        clip = (self.args.min, self.args.max) if self.is_strict else None
         for iter in range(self.iterations):
             freqs = nprng.permutation(total_freqs)
             freqs = freqs[:max_frequencies]
+            # The candidate k has the frequencies freqs[:k + 1] set to value.
             perturbed_xfft = xfft.clone()
-            for num_freqs, freq in enumerate(freqs):
-                w = freq % W_xfft
-                h = freq // W_xfft
-
-                location = [h, w]
-                # Add the channel dimension.
-                location.insert(channel_axis, slice(None))
-                # Add the batch dim.
-                location.insert(0, slice(None))
-                location = tuple(location)
-
-                # if np.random.randint(0, 2) == 1:
-                #     value = minf
-                # else:
-                #     value = maxf
-                # value = check_real_vals(
-                #     H_fft=H_fft, W_fft=W_fft, h=h, w=w, value=value)
-                perturbed_xfft[location] = value
-                perturbed = get_ifft_hw(
-                    xfft=perturbed_xfft, H_fft=H_fft, W_fft=W_fft, H=H, W=W)
-                perturbed = perturbed.detach().cpu().numpy().squeeze()
-                if self.is_strict:
-                    perturbed = np.clip(perturbed, a_min=self.args.min,
-                                        a_max=self.args.max)
-                _, is_adv, _, dist = a.predictions(
-                    perturbed, return_details=True)
+            for start in range(0, len(freqs), self.block_size):
+                block_freqs = freqs[start:start + self.block_size]
+                B = len(block_freqs)
+                # The lower triangular mask: candidate j of the block zeroes
+                # out the block frequencies 0..j (on top of the previous
+                # blocks).
+                masks = torch.ones(B, H_fft, W_xfft, dtype=xfft.dtype)
+                masks[:, block_freqs // W_xfft, block_freqs % W_xfft] = 1 - (
+                    torch.ones(B, B, dtype=xfft.dtype).tril())
+                masks = masks.unsqueeze(1).unsqueeze(-1)
+                block_xfft = perturbed_xfft * masks + value * (1 - masks)
+                is_adv, index, dist = predict_first_adversarial(
+                    a=a, xfft=block_xfft, H_fft=H_fft, W_fft=W_fft, H=H, W=W,
+                    clip=clip)
                 if is_adv:
                     if self.is_debug:
+                        num_freqs = start + index
                         dist = np.sqrt(dist.value)
                         print(f'iterations: {iter}, '
                               f'number of modified frequencies: {num_freqs}, '
@@ -424,6 +442,7 @@ class FFTMultipleFrequencyAttack(Attack):
                     if self.is_fast:
                         return
                     break
+                perturbed_xfft = block_xfft[-1:]
 
 
 class FFTMultipleFrequencyBinarySearchAttack(Attack):
@@ -517,6 +536,27 @@ class FFTMultipleFrequencyBinarySearchAttack(Attack):
                     low = mid + self.resolution
 
 
+def predict_first_adversarial(a, xfft, H_fft, W_fft, H, W, clip=None):
+    """
+    Evaluate a block of candidates with one inverse FFT and one batched
+    forward pass. The candidates are checked in the block order, so the first
+    adversarial one is the same as for the sequential evaluation.
+
+    :param a: the Adversarial object
+    :param xfft: the spectra of the candidates (B, C, H_fft, W_xfft, 2)
+    :param clip: the (min, max) range to clip the candidates to
+    :return: is adversarial, the index of the first adversarial candidate,
+    its distance
+    """
+    perturbed = get_ifft_hw(xfft=xfft, H_fft=H_fft, W_fft=W_fft, H=H, W=W)
+    perturbed = perturbed.detach().cpu().numpy()
+    if clip is not None:
+        perturbed = np.clip(perturbed, a_min=clip[0], a_max=clip[1])
+    _, is_adv, index, _, dist = a.batch_predictions(
+        perturbed, greedy=True, return_details=True)
+    return is_adv, index, dist
+
+
 def check_real_vals(H_fft, W_fft, h, w, value):
     """
     Check if x,y coordinates are subject to the real value constraint. If so,
@@ -642,7 +682,7 @@ class FFTLimitValuesAttack(Attack):
 
     def __call__(self, input_or_adv, label=None, unpack=True, net=None):
         """
-        Binary search for magnitudes to zero out.
+        Search for values to zero out.
 
         :param input_or_adv: the adversarial image
         :param label: the correct label
@@ -650,59 +690,16 @@ class FFTLimitValuesAttack(Attack):
         :param net: the ml model
         :return: an adversarial image
         """
-        onesided = True
-        is_next_power2 = False
-        net = self._default_model._model  # we operate directly in Pytorch
-        if torch.cuda.is_available():
-            device = torch.device('cuda')
-        else:
-            device = torch.device('cpu')
-        net.to(device)
-        net = pytorch_net(net)
-        input = torch.tensor(input_or_adv).unsqueeze(dim=0).to(device)
-        xfft, _, _ = get_xfft_hw(input=input, onesided=onesided,
-                                 is_next_power2=is_next_power2)
-        spectrum = get_spectrum(xfft, squeeze=False)
-        min = spectrum.min()
-        max = spectrum.max()
-
-        def decrease_func(image, high):
-            return fft_zero_values(
-                input=image, high=high, low=min, is_next_power2=is_next_power2,
-                onesided=onesided)
-
-        adv_image, high = bisearch_to_decrease_rate(input=input,
-                                                    label=label,
-                                                    net=net,
-                                                    low=min,
-                                                    high=max,
-                                                    func=decrease_func)
-
-        if adv_image is None:
-            return None
-
-        def increase_func(image, low):
-            return fft_zero_values(
-                input=image, high=high, low=low, is_next_power2=is_next_power2,
-                onesided=onesided)
-
-        adv_image2, _ = bisearch_to_increase_rate(input=input,
-                                                  label=label,
-                                                  net=net,
-                                                  low=min,
-                                                  high=high,
-                                                  func=increase_func)
-        if adv_image2 is not None:
-            adv_image = adv_image2
-
-        return adv_image.detach().squeeze().cpu().numpy()
+        return limit_spectrum_attack(
+            attack=self, input_or_adv=input_or_adv, label=label,
+            zero_values=True)
 
 
 class FFTLimitMagnitudesAttack(Attack):
 
     def __call__(self, input_or_adv, label=None, unpack=True, net=None):
         """
-        Binary search for magnitudes to zero out.
+        Search for magnitudes to zero out.
 
         :param input_or_adv: the adversarial image
         :param label: the correct label
@@ -710,49 +707,69 @@ class FFTLimitMagnitudesAttack(Attack):
         :param net: the ml model
         :return: an adversarial image
         """
-        onesided = True
-        is_next_power2 = False
-        net = self._default_model._model  # we operate directly in Pytorch
-        if torch.cuda.is_available():
-            device = torch.device('cuda')
-        else:
-            device = torch.device('cpu')
-        net.to(device)
-        net = pytorch_net(net)
-        input = torch.tensor(input_or_adv).unsqueeze(dim=0).to(device)
-        xfft, _, _ = get_xfft_hw(input=input, onesided=onesided,
-                                 is_next_power2=is_next_power2)
-        spectrum = get_spectrum(xfft, squeeze=False)
-        min = spectrum.min()
-        max = spectrum.max()
-
-        def decrease_func(image, high):
-            return fft_zero_low_magnitudes(
-                input=image, high=high, low=min, is_next_power2=is_next_power2,
-                onesided=onesided)
-
-        _, high = bisearch_to_decrease_rate(input=input,
-                                            label=label,
-                                            net=net,
-                                            low=min,
-                                            high=max,
-                                            func=decrease_func)
-
-        if high is None:
-            return None
+        return limit_spectrum_attack(
+            attack=self, input_or_adv=input_or_adv, label=label,
+            zero_values=False)
+
 
-        def increase_func(image, low):
-            return fft_zero_low_magnitudes(
-                input=image, high=high, low=low, is_next_power2=is_next_power2,
-                onesided=onesided)
-
-        adv_image, _ = bisearch_to_increase_rate(input=input,
-                                                 label=label,
-                                                 net=net,
-                                                 low=min,
-                                                 high=high,
-                                                 func=increase_func)
+def limit_spectrum_attack(attack, input_or_adv, label, zero_values=True):
+    """
+    Search for the range [low, high] of the values (or magnitudes) of the
+    coefficients to zero out. The spectrum of the image is computed once and
+    the candidate thresholds are evaluated in batches.
+
+    :param attack: the attack with the default (foolbox) model
+    :param zero_values: zero out the values of the real and imaginary parts
+    (or the magnitudes of the coefficients)
+    :return: an adversarial image
+    """
+    onesided = True
+    is_next_power2 = False
+    net = attack._default_model._model  # we operate directly in Pytorch
+    if torch.cuda.is_available():
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+    net.to(device)
+    net = pytorch_net(net)
+    input = torch.tensor(input_or_adv).unsqueeze(dim=0).to(device)
+    spectrum = FFTSpectrum(input=input, onesided=onesided,
+                           is_next_power2=is_next_power2)
+    magnitudes = spectrum.get_spectrum()
+    min = magnitudes.min().item()
+    max = magnitudes.max().item()
+    if zero_values:
+        zero_fn = spectrum.zero_values
+    else:
+        zero_fn = spectrum.zero_low_magnitudes
+
+    def decrease_func(highs):
+        return zero_fn(highs=highs, lows=[min] * len(highs)).squeeze(dim=1)
+
+    adv_image, high = batch_search_rate(func=decrease_func,
+                                        label=label,
+                                        net=net,
+                                        low=min,
+                                        high=max)
+
+    if adv_image is None:
+        return None
+
+    def increase_func(lows):
+        return zero_fn(highs=[high] * len(lows), lows=lows).squeeze(dim=1)
+
+    adv_image2, _ = batch_search_rate(func=increase_func,
+                                      label=label,
+                                      net=net,
+                                      low=min,
+                                      high=high,
+                                      increase=True)
+    if zero_values:
+        if adv_image2 is not None:
+            adv_image = adv_image2
+    else:
+        # The image is taken only from the search for the low magnitude.
+        adv_image = adv_image2
         if adv_image is None:
             return None
-        else:
-            return adv_image.detach().squeeze().cpu().numpy()
+    return adv_image.detach().cpu().numpy()
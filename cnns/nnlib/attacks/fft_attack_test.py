@@ -0,0 +1,165 @@
+import unittest
+from unittest import mock
+import numpy as np
+import torch
+from foolbox.adversarial import Adversarial
+from foolbox.criteria import Misclassification
+from foolbox.models import PyTorchModel
+
+from cnns.nnlib.attacks import fft_attack
+from cnns.nnlib.attacks.fft_attack import FFTMultipleFrequencyAttack
+from cnns.nnlib.attacks.fft_attack import FFTSingleFrequencyAttack
+from cnns.nnlib.attacks.fft_attack import check_real_vals
+from cnns.nnlib.attacks.fft_attack import predict_first_adversarial
+from cnns.nnlib.pytorch_layers.pytorch_utils import get_ifft_hw
+from cnns.nnlib.pytorch_layers.pytorch_utils import get_max_min_complex
+from cnns.nnlib.pytorch_layers.pytorch_utils import get_xfft_hw
+from cnns.nnlib.utils.object import Object
+
+
+class DistanceNet(torch.nn.Module):
+    """
+    Predict the class 1 (the adversarial one) if the squared L2 distance from
+    the image is larger than the threshold.
+    """
+
+    def __init__(self, image, threshold):
+        super(DistanceNet, self).__init__()
+        self.image = torch.from_numpy(image)
+        self.threshold = threshold
+
+    def forward(self, x):
+        dist = (x - self.image).pow(2).flatten(1).sum(dim=1)
+        return torch.stack([torch.full_like(dist, self.threshold), dist],
+                           dim=1)
+
+
+class TestFFTAttack(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        # The zero mean image, so the energy is not only in the DC terms.
+        self.image = np.random.RandomState(31).rand(3, 8, 8).astype(
+            np.float32) - 0.5
+        self.energy = float((self.image ** 2).sum())
+        self.xfft, self.H_fft, self.W_fft = get_xfft_hw(
+            input=torch.from_numpy(self.image).unsqueeze(0))
+
+    def get_adversarial(self, threshold):
+        net = DistanceNet(image=self.image, threshold=threshold).eval()
+        # The perturbed spectra are not clipped to the image range.
+        model = PyTorchModel(net, bounds=(-100, 100), num_classes=2,
+                             device='cpu')
+        return Adversarial(model=model, criterion=Misclassification(),
+                           original_image=self.image, original_class=0)
+
+    def get_images(self, xfft):
+        images = get_ifft_hw(xfft=xfft, H_fft=self.H_fft, W_fft=self.W_fft,
+                             H=8, W=8)
+        return images.detach().numpy()
+
+    def get_dists(self, xfft):
+        return ((self.get_images(xfft) - self.image) ** 2).reshape(
+            len(xfft), -1).sum(axis=1)
+
+    def test_predict_first_adversarial(self):
+        a = self.get_adversarial(threshold=0.5 * self.energy)
+        # The squared distances: 0, 4, 1 and 0.25 of the energy of the image.
+        factors = torch.tensor([1.0, -1.0, 0.0, 0.5]).view(-1, 1, 1, 1, 1)
+        xfft = self.xfft * factors
+        is_adv, index, _ = predict_first_adversarial(
+            a=a, xfft=xfft, H_fft=self.H_fft, W_fft=self.W_fft, H=8, W=8)
+        self.assertTrue(is_adv)
+        # The first adversarial and not the closest one (index 2).
+        self.assertEqual(index, 1)
+        np.testing.assert_allclose(actual=a.image, desired=-self.image,
+                                   rtol=1e-5, atol=1e-5)
+        # The clipped candidates are all zero (adversarial).
+        a = self.get_adversarial(threshold=0.5 * self.energy)
+        is_adv, index, _ = predict_first_adversarial(
+            a=a, xfft=xfft, H_fft=self.H_fft, W_fft=self.W_fft, H=8, W=8,
+            clip=(0, 0))
+        self.assertTrue(is_adv)
+        self.assertEqual(index, 0)
+        a = self.get_adversarial(threshold=5 * self.energy)
+        is_adv, _, _ = predict_first_adversarial(
+            a=a, xfft=xfft, H_fft=self.H_fft, W_fft=self.W_fft, H=8, W=8)
+        self.assertFalse(is_adv)
+        self.assertIsNone(a.image)
+
+    def test_single_frequency_blocks(self):
+        # No candidate is adversarial, so all the frequencies are checked.
+        a = self.get_adversarial(threshold=100 * self.energy)
+        attack = FFTSingleFrequencyAttack()
+        with mock.patch.object(fft_attack, 'predict_first_adversarial',
+                               wraps=predict_first_adversarial) as predict:
+            attack(a, block_size=16)
+        blocks = [call[1]['xfft'] for call in predict.call_args_list]
+        W_xfft = self.xfft.shape[-2]
+        total_freqs = self.H_fft * W_xfft
+        # The min and max candidates for each frequency of a block.
+        self.assertEqual([len(block) for block in blocks], [32, 32, 16])
+        maxf, minf = get_max_min_complex(xfft=self.xfft)
+        freqs = []
+        for block in blocks:
+            for index, candidate in enumerate(block):
+                changed = (candidate != self.xfft[0]).any(dim=-1).any(dim=0)
+                positions = changed.nonzero().tolist()
+                self.assertEqual(len(positions), 1)
+                h, w = positions[0]
+                value = check_real_vals(
+                    H_fft=self.H_fft, W_fft=self.W_fft, h=h, w=w,
+                    value=[minf, maxf][index % 2].clone())
+                # The same value in all the channels.
+                for channel in candidate[:, h, w]:
+                    self.assertTrue(torch.equal(channel, value))
+                if index % 2 == 0:
+                    freqs.append(h * W_xfft + w)
+                else:
+                    self.assertEqual(freqs[-1], h * W_xfft + w)
+        self.assertEqual(sorted(freqs), list(range(total_freqs)))
+
+    def test_multiple_frequencies_blocks(self):
+        # The distance grows with the number of the zeroed frequencies.
+        threshold = 0.5 * self.energy
+        a = self.get_adversarial(threshold=threshold)
+        args = Object()
+        args.min, args.max = -1, 1
+        attack = FFTMultipleFrequencyAttack(
+            args=args, max_frequencies_percent=100, iterations=1,
+            is_strict=False, is_debug=False, is_fast=True, block_size=8)
+        with mock.patch.object(fft_attack, 'predict_first_adversarial',
+                               wraps=predict_first_adversarial) as predict:
+            attack(a)
+        blocks = [call[1]['xfft'] for call in predict.call_args_list]
+        zeroed = set()
+        for block_index, block in enumerate(blocks):
+            self.assertLessEqual(len(block), 8)
+            for index, candidate in enumerate(block):
+                is_zero = (candidate == 0).all(dim=-1).all(dim=0)
+                positions = set(map(tuple, is_zero.nonzero().tolist()))
+                # The lower triangular mask: the candidate j zeroes one more
+                # frequency than the candidate j - 1.
+                self.assertTrue(zeroed < positions)
+                self.assertEqual(len(positions),
+                                 block_index * 8 + index + 1)
+                zeroed = positions
+                # The other coefficients are not changed.
+                keep = ~is_zero
+                self.assertTrue(torch.equal(candidate[:, keep],
+                                            self.xfft[0][:, keep]))
+        # Only the last block has an adversarial and the first one in the
+        # block order is the one returned.
+        self.assertGreater(len(blocks), 1)
+        for block in blocks[:-1]:
+            self.assertTrue((self.get_dists(block) <= threshold).all())
+        dists = self.get_dists(blocks[-1])
+        first = np.argmax(dists > threshold)
+        self.assertGreater(dists[first], threshold)
+        np.testing.assert_allclose(actual=a.image,
+                                   desired=self.get_images(blocks[-1])[first],
+                                   rtol=1e-5, atol=1e-5)
+
+
+if __name__ == '__main__':
+    unittest.main()
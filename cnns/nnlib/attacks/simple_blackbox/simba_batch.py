@@ -0,0 +1,186 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from cnns.nnlib.attacks.simple_blackbox.torch_01_range import Ranger
+
+
+def get_dct_matrix(size, device=None, dtype=torch.float32):
+    """
+    :param size: the length of the signal
+    :return: the orthonormal DCT-II matrix (size, size), row k is the k-th
+    basis vector (the same as idct of the k-th unit vector with norm='ortho')
+    """
+    n = torch.arange(size, dtype=torch.float64)
+    k = n.unsqueeze(1)
+    matrix = torch.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(
+        2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.to(device=device, dtype=dtype)
+
+
+class SimbaBatch(object):
+    """
+    The batched SimBA attack (untargeted or targeted): N images are attacked
+    in parallel on the device of the model.
+
+    In each iteration every active image gets a single basis direction q (its
+    own random order of the coordinates). The images x - eps * q and
+    x + eps * q of all the active images are evaluated in a single forward
+    pass and the candidate that lowers the probability of the true label (or
+    raises the one of the target label) is kept. The images that became
+    adversarial are dropped from the active set, so the batch shrinks as the
+    attack progresses.
+
+    The basis:
+    pixel - q is a single pixel, the step is applied with index_put on the
+    flattened images (no dense difference vector),
+    dct - q is a low frequency 2D DCT basis image (in the freq_dims x
+    freq_dims top left corner of the spectrum) of a single channel, it is
+    the outer product of two rows of the DCT matrix (computed for the active
+    images only).
+
+    Unlike in run_simba, the DCT steps are accumulated in the pixel space and
+    the image is clipped to [0, 1] after each step (as in simba_single).
+    """
+
+    def __init__(self, model, dataset='imagenet', epsilon=0.2,
+                 num_iters=10000, basis='pixel', freq_dims=None,
+                 targeted=False):
+        """
+        :param model: the model that takes the normalized images
+        :param dataset: mnist, cifar or imagenet (for the normalization)
+        :param epsilon: the step size
+        :param num_iters: the max number of iterations per image
+        :param basis: pixel or dct
+        :param freq_dims: the size of the low frequency block for the dct
+        basis (the whole image by default)
+        :param targeted: the labels are the targets
+        """
+        if basis not in ('pixel', 'dct'):
+            raise Exception(f'Unknown basis: {basis}')
+        self.model = model
+        self.dataset = dataset
+        self.epsilon = epsilon
+        self.num_iters = num_iters
+        self.basis = basis
+        self.freq_dims = freq_dims
+        self.targeted = targeted
+
+    def get_probs(self, x, labels):
+        """
+        :return: the probabilities for all the classes and for the labels
+        """
+        with torch.no_grad():
+            output = self.model(self.ranger.to_torch(x, dataset=self.dataset))
+        probs = F.softmax(output, dim=-1)
+        return probs, probs.gather(1, labels.unsqueeze(1)).squeeze(1)
+
+    def is_done(self, probs, labels):
+        if self.targeted:
+            return probs.argmax(dim=1) == labels
+        return probs.argmax(dim=1) != labels
+
+    def get_order(self, n, n_dims, device):
+        """
+        :return: the random order of the coordinates for each image (n,
+        min(num_iters, n_dims))
+        """
+        num_iters = min(self.num_iters, n_dims)
+        return torch.stack(
+            [torch.randperm(n_dims, device=device)[:num_iters] for _ in
+             range(n)])
+
+    def step(self, x, coords, dct=None):
+        """
+        :param x: the active images (A, C, H, W)
+        :param coords: the coordinate for each active image (A)
+        :param dct: the DCT matrices for the rows and the columns of the image
+        and freq_dims (for the dct basis)
+        :return: the candidates: x - eps * q for the first A images and
+        x + eps * q for the next A images (2A, C, H, W)
+        """
+        A = x.size(0)
+        rows = torch.arange(A, device=x.device)
+        candidates = torch.cat((x, x))
+        if self.basis == 'pixel':
+            flat = candidates.view(2 * A, -1)
+            flat[rows, coords] -= self.epsilon
+            flat[rows + A, coords] += self.epsilon
+        else:
+            dct_rows, dct_cols, freq_dims = dct
+            channels = coords // (freq_dims * freq_dims)
+            row_freqs = coords % (freq_dims * freq_dims) // freq_dims
+            col_freqs = coords % freq_dims
+            basis = dct_rows[row_freqs].unsqueeze(2) * dct_cols[
+                col_freqs].unsqueeze(1) * self.epsilon
+            candidates[rows, channels] -= basis
+            candidates[rows + A, channels] += basis
+        return candidates.clamp_(0, 1)
+
+    def __call__(self, x, labels):
+        """
+        :param x: the images in the range [0, 1] (N, C, H, W)
+        :param labels: the true labels (or the targets if targeted) (N)
+        :return: the images (adversarial where successful), the success mask
+        (N) and the number of queries per image (N) - counted as in SimBA,
+        1 if the minus candidate is accepted, 2 otherwise (both candidates are
+        evaluated in the same forward pass)
+        """
+        x = x.clone()
+        device = x.device
+        N, C, H, W = x.size()
+        labels = labels.to(device)
+        self.ranger = Ranger(device=device)
+        dct = None
+        if self.basis == 'pixel':
+            n_dims = C * H * W
+        else:
+            freq_dims = H if self.freq_dims is None else self.freq_dims
+            n_dims = C * freq_dims * freq_dims
+            dct = (get_dct_matrix(H, device=device, dtype=x.dtype),
+                   get_dct_matrix(W, device=device, dtype=x.dtype), freq_dims)
+        order = self.get_order(n=N, n_dims=n_dims, device=device)
+        probs, last_probs = self.get_probs(x, labels)
+        success = self.is_done(probs, labels)
+        queries = torch.zeros(N, dtype=torch.long, device=device)
+        active = (~success).nonzero().squeeze(1)
+        for i in range(order.size(1)):
+            if active.numel() == 0:
+                break
+            A = active.numel()
+            active_labels = labels[active]
+            candidates = self.step(x[active], order[active, i], dct)
+            probs, label_probs = self.get_probs(
+                candidates, torch.cat((active_labels, active_labels)))
+            prev_probs = last_probs[active]
+            if self.targeted:
+                minus_better = label_probs[:A] > prev_probs
+                plus_better = ~minus_better & (label_probs[A:] > prev_probs)
+            else:
+                minus_better = label_probs[:A] < prev_probs
+                plus_better = ~minus_better & (label_probs[A:] < prev_probs)
+            queries[active] += 2 - minus_better.long()
+            # Pick the accepted candidate: minus, plus or the same image.
+            pick = torch.where(minus_better, torch.arange(A, device=device),
+                               torch.arange(A, 2 * A, device=device))
+            accepted = minus_better | plus_better
+            x[active[accepted]] = candidates[pick[accepted]]
+            last_probs[active[accepted]] = label_probs[pick[accepted]]
+            done = accepted & self.is_done(probs[pick], active_labels)
+            success[active[done]] = True
+            active = active[~done]
+        return x, success, queries
+
+
+def simba_batch(model, x, y, num_iters=10000, epsilon=0.2, dataset='imagenet',
+                basis='pixel', freq_dims=None, targeted=False):
+    """
+    Run SimbaBatch on a batch of images in the range [0, 1].
+
+    :return: the images (adversarial where successful), the success mask and
+    the number of queries per image
+    """
+    attack = SimbaBatch(model=model, dataset=dataset, epsilon=epsilon,
+                        num_iters=num_iters, basis=basis,
+                        freq_dims=freq_dims, targeted=targeted)
+    return attack(x, y)
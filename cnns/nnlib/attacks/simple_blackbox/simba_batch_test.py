@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+import torch
+from scipy.fftpack import idct
+
+from cnns.nnlib.attacks.simple_blackbox.simba_batch import get_dct_matrix
+from cnns.nnlib.attacks.simple_blackbox.simba_batch import simba_batch
+from cnns.nnlib.attacks.simple_blackbox.simba_single import simba_single
+from cnns.nnlib.attacks.simple_blackbox.torch_01_range import Ranger
+
+
+class TestSimbaBatch(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(),
+                                         torch.nn.Linear(3 * 8 * 8, 4))
+        self.images = torch.rand(6, 3, 8, 8)
+        normalized = Ranger().to_torch(self.images, dataset='cifar')
+        self.labels = self.model(normalized).argmax(dim=1).detach()
+
+    def get_labels(self, images):
+        normalized = Ranger().to_torch(images, dataset='cifar')
+        return self.model(normalized).argmax(dim=1)
+
+    def test_dct_matrix(self):
+        matrix = get_dct_matrix(8)
+        np.testing.assert_allclose(
+            actual=matrix.numpy(),
+            desired=idct(np.eye(8), axis=0, norm='ortho').T, atol=1e-6)
+
+    def test_pixel_basis(self):
+        adv, success, queries = simba_batch(
+            self.model, self.images, self.labels, num_iters=200, epsilon=0.2,
+            dataset='cifar')
+        self.assertEqual(adv.shape, self.images.shape)
+        self.assertTrue(success.all())
+        self.assertTrue((self.get_labels(adv) != self.labels).all())
+        self.assertTrue((queries > 0).all())
+        self.assertTrue((queries <= 400).all())
+        # Each step changes a single pixel by at most epsilon.
+        diff = (adv - self.images).abs().flatten(1)
+        self.assertTrue((diff <= 0.2 + 1e-6).all())
+        self.assertTrue(((diff > 0).sum(dim=1) <= queries).all())
+
+    def test_dct_basis(self):
+        adv, success, _ = simba_batch(
+            self.model, self.images, self.labels, num_iters=48, epsilon=0.5,
+            dataset='cifar', basis='dct', freq_dims=4)
+        self.assertTrue(success.any())
+        adv_labels = self.get_labels(adv)
+        self.assertTrue((adv_labels[success] != self.labels[success]).all())
+        self.assertTrue((adv_labels[~success] == self.labels[~success]).all())
+        self.assertLessEqual(adv.max().item(), 1.0)
+        self.assertGreaterEqual(adv.min().item(), 0.0)
+
+    def test_targeted(self):
+        targets = (self.labels + 1) % 4
+        adv, success, _ = simba_batch(
+            self.model, self.images, targets, num_iters=200, epsilon=0.2,
+            dataset='cifar', targeted=True)
+        self.assertTrue(
+            (self.get_labels(adv)[success] == targets[success]).all())
+
+    def test_single(self):
+        adv = simba_single(self.model, self.images[:1], self.labels[0].item(),
+                           num_iters=200, dataset='cifar')
+        self.assertIsNotNone(adv)
+        self.assertNotEqual(self.get_labels(adv).item(), self.labels[0].item())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import torch
 import torch.nn.functional as F
+from cnns.nnlib.attacks.simple_blackbox.simba_batch import simba_batch
 from cnns.nnlib.attacks.simple_blackbox.torch_01_range import Ranger
 
 
@@ -13,7 +14,8 @@ def get_probs(model, x, dataset):
 
 
 # 20-line implementation of (untargeted) SimBA for single image input
-def simba_single(model, x, y, num_iters=10000, epsilon=0.2, dataset='imagenet'):
+def simba_single_reference(model, x, y, num_iters=10000, epsilon=0.2,
+                           dataset='imagenet'):
     n_dims = x.numel()
     perm = torch.randperm(n_dims)
     last_probs = get_probs(model, x, dataset=dataset)
@@ -36,3 +38,18 @@ def simba_single(model, x, y, num_iters=10000, epsilon=0.2, dataset='imagenet'):
             return x
         last_probs = probs
     return None
+
+
+def simba_single(model, x, y, num_iters=10000, epsilon=0.2, dataset='imagenet'):
+    """
+    SimBA for a single image (1, C, H, W) run with simba_batch on the device
+    of the image.
+
+    :return: the adversarial image or None if the attack failed
+    """
+    y = torch.as_tensor(y, device=x.device).view(1)
+    adv, success, _ = simba_batch(model, x, y, num_iters=num_iters,
+                                  epsilon=epsilon, dataset=dataset)
+    if not success.item():
+        return None
+    return adv
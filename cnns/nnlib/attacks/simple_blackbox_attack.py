@@ -1,4 +1,4 @@
-from cnns.nnlib.attacks.simple_blackbox.simba_single import simba_single
+from cnns.nnlib.attacks.simple_blackbox.simba_batch import simba_batch
 from foolbox.attacks.base import Attack
 import torch
 from cnns.nnlib.attacks.simple_blackbox.torch_01_range import Ranger
@@ -17,26 +17,34 @@ class SimbaSingle(Attack):
         self.epsilon = epsilon
         self.ranger = Ranger(device=args.device)
 
-    def __call__(self, input_or_adv, label=None, unpack=True, unused=None):
-        input_tensor = torch.tensor(input_or_adv).unsqueeze(0)
-        # input_tensor = self.args.denormalizer(input_tensor.detach())
-        input_tensor = self.ranger.to_01(input_tensor.detach(),
-                                         dataset=self.dataset)
-        output_tensor = simba_single(
+    def attack_batch(self, images, labels):
+        """
+        Attack a batch of the normalized images on the device.
+
+        :param images: the normalized images (N, C, H, W)
+        :param labels: the true labels (N)
+        :return: the normalized images (adversarial where successful), the
+        success mask and the number of queries per image
+        """
+        images = images.detach().to(self.args.device)
+        images = self.ranger.to_01(images, dataset=self.dataset)
+        adv, success, queries = simba_batch(
             self.model,
-            input_tensor,
-            label,
+            images,
+            labels.to(self.args.device),
             num_iters=self.iterations,
             epsilon=self.epsilon,
             dataset=self.dataset)
+        adv = self.ranger.to_torch(adv, dataset=self.dataset)
+        return adv, success, queries
 
-        if output_tensor is None:
+    def __call__(self, input_or_adv, label=None, unpack=True, unused=None):
+        input_tensor = torch.as_tensor(input_or_adv).unsqueeze(0)
+        adv, success, _ = self.attack_batch(input_tensor,
+                                            torch.tensor([label]))
+        if not success.item():
             return None
-        # output_tensor = self.args.normalizer(output_tensor.detach())
-        output_tensor = self.ranger.to_torch(output_tensor.detach(),
-                                             dataset=self.dataset)
-        return output_tensor.cpu().squeeze().numpy()
-
+        return adv.cpu().squeeze(0).numpy()
 
 if __name__ == "__main__":
     print('SimbaSingle')
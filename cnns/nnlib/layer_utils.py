@@ -1,5 +1,4 @@
 from cnns.nnlib.layers import *
-from cnns.nnlib.fast_layers import *
 
 
 def affine_relu_forward(x, w, b):
@@ -69,7 +68,7 @@ def conv_relu_forward(x, w, b, conv_param):
     - out: Output from the ReLU
     - cache: Object to give to the backward pass
     """
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+    a, conv_cache = conv_forward(x, w, b, conv_param)
     out, relu_cache = relu_forward(a)
     cache = (conv_cache, relu_cache)
     return out, cache
@@ -81,12 +80,12 @@ def conv_relu_backward(dout, cache):
     """
     conv_cache, relu_cache = cache
     da = relu_backward(dout, relu_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
+    dx, dw, db = conv_backward(da, conv_cache)
     return dx, dw, db
 
 
 def conv_bn_relu_forward(x, w, b, gamma, beta, conv_param, bn_param):
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+    a, conv_cache = conv_forward(x, w, b, conv_param)
     an, bn_cache = spatial_batchnorm_forward(a, gamma, beta, bn_param)
     out, relu_cache = relu_forward(an)
     cache = (conv_cache, bn_cache, relu_cache)
@@ -97,7 +96,7 @@ def conv_bn_relu_backward(dout, cache):
     conv_cache, bn_cache, relu_cache = cache
     dan = relu_backward(dout, relu_cache)
     da, dgamma, dbeta = spatial_batchnorm_backward(dan, bn_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
+    dx, dw, db = conv_backward(da, conv_cache)
     return dx, dw, db, dgamma, dbeta
 
 
@@ -307,10 +306,10 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
     - cache: Object to give to the backward pass
     """
     #print("conv_param: ", conv_param)
-    a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+    a, conv_cache = conv_forward(x, w, b, conv_param)
     # print("shape of conv output: ", a.shape)
     s, relu_cache = relu_forward(a)
-    out, pool_cache = max_pool_forward_fast(s, pool_param)
+    out, pool_cache = max_pool_forward(s, pool_param)
     # print("shape of pool out: ", out.shape)
     cache = (conv_cache, relu_cache, pool_cache)
     return out, cache
@@ -321,7 +320,7 @@ def conv_relu_pool_backward(dout, cache):
     Backward pass for the conv-relu-pool convenience layer
     """
     conv_cache, relu_cache, pool_cache = cache
-    ds = max_pool_backward_fast(dout, pool_cache)
+    ds = max_pool_backward(dout, pool_cache)
     da = relu_backward(ds, relu_cache)
-    dx, dw, db = conv_backward_fast(da, conv_cache)
+    dx, dw, db = conv_backward(da, conv_cache)
     return dx, dw, db
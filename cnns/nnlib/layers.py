@@ -658,7 +658,7 @@ def conv_forward_fftw_1D(x, w, b, conv_param, preserve_energy_rate=1.0):
     padded_x = (np.pad(x, ((0, 0), (0, 0), (pad, pad)), 'constant'))
 
     # Calculate output spatial/time domain dimensions.
-    out_W = np.int(((W + 2 * pad - WW) / stride) + 1)
+    out_W = int(((W + 2 * pad - WW) / stride) + 1)
 
     # Initialise the output.
     out = np.zeros([N, F, out_W])
@@ -1410,7 +1410,7 @@ def conv_forward_naive_1D(x, w, b, conv_param):
     padded_x = (np.pad(x, ((0, 0), (0, 0), (pad_left, pad_right)), 'constant'))
 
     # Calculate output spatial dimensions.
-    out_W = np.int(((W + pad_left + pad_right - WW) / stride) + 1)
+    out_W = int(((W + pad_left + pad_right - WW) / stride) + 1)
 
     # Initialise the output.
     out = np.zeros([N, F, out_W])
@@ -1593,7 +1593,7 @@ def fft_pool_forward_1D(x, pool_param):
     N, C, W = x.shape
 
     # Calculate output spatial dimensions of the output of max pool.
-    out_W = np.int(((W - pool_width) // stride) + 1)
+    out_W = int(((W - pool_width) // stride) + 1)
 
     # Initialise output.
     out = np.zeros([N, C, out_W])
@@ -1657,7 +1657,7 @@ def max_pool_forward_naive_1D(x, pool_param):
     N, C, W = x.shape
 
     # Calculate output spatial dimensions of the output of max pool.
-    out_W = np.int(((W - pool_width) // stride) + 1)
+    out_W = int(((W - pool_width) // stride) + 1)
 
     # Initialise output.
     out = np.zeros([N, C, out_W])
@@ -1815,7 +1815,7 @@ def conv_backward_naive_1D(dout, cache):
                                                                 w[ff, ...]
 
     # Remove the padding from dx so it matches the shape of x.
-    dx = dx_temp[:, :, pad_left: W + pad_right]
+    dx = dx_temp[:, :, pad_left: pad_left + W]
 
     return dx, dw, db
 
@@ -1837,8 +1837,8 @@ def get_conv_shape(x_shape, w_shape, conv_param):
     HH, WW = w_shape
 
     # Calculate output spatial dimensions.
-    out_H = np.int(((H + 2 * pad - HH) / stride) + 1)
-    out_W = np.int(((W + 2 * pad - WW) / stride) + 1)
+    out_H = int(((H + 2 * pad - HH) / stride) + 1)
+    out_W = int(((W + 2 * pad - WW) / stride) + 1)
 
     return out_H, out_W
 
@@ -2150,8 +2150,8 @@ def get_out_pool_shape(x_shape, pool_param):
     H, W = x_shape
 
     # Calculate output spatial dimensions.
-    out_H = np.int(((H - pool_height) / stride) + 1)
-    out_W = np.int(((W - pool_width) / stride) + 1)
+    out_H = int(((H - pool_height) / stride) + 1)
+    out_W = int(((W - pool_width) / stride) + 1)
 
     return out_H, out_W
 
@@ -2304,6 +2304,374 @@ def max_pool_backward_naive(dout, cache):
     return dx
 
 
+def get_workspace_buffer(param, name, shape, dtype):
+    """
+    Get a buffer from the workspace of the layer (a dict under the 'workspace'
+    key of the conv_param/pool_param) so that the buffers are allocated once
+    and reused by the following calls with the same shapes. Without the
+    workspace a new buffer is allocated.
+
+    :param param: the conv_param or pool_param of the layer
+    :param name: the name of the buffer
+    :param shape: the shape of the buffer
+    :param dtype: the dtype of the buffer
+    :return: the buffer (zeroed if new)
+    """
+    workspace = param.get('workspace')
+    dtype = np.dtype(dtype)
+    if workspace is None:
+        return np.zeros(shape, dtype=dtype)
+    key = (name, tuple(shape), dtype.str)
+    buffer = workspace.get(key)
+    if buffer is None:
+        buffer = np.zeros(shape, dtype=dtype)
+        workspace[key] = buffer
+    return buffer
+
+
+def pad_spatial(x, pads, param):
+    """
+    Zero pad the spatial dimensions of x (all but N and C) in the workspace.
+
+    :param x: the input of shape (N, C, ...)
+    :param pads: the (left, right) padding for each spatial dimension
+    :param param: the conv_param with the (optional) workspace
+    :return: the padded input
+    """
+    if all(left == 0 and right == 0 for left, right in pads):
+        return x
+    shape = x.shape[:2] + tuple(size + left + right for size, (left, right) in
+                                zip(x.shape[2:], pads))
+    padded_x = get_workspace_buffer(param, ('padded_x', tuple(pads)), shape,
+                                    x.dtype)
+    # Only the interior is written, the borders stay zero (the padding is a
+    # part of the key of the buffer).
+    interior = tuple(slice(left, left + size) for size, (left, _) in
+                     zip(x.shape[2:], pads))
+    padded_x[(slice(None), slice(None)) + interior] = x
+    return padded_x
+
+
+def get_windows(x, window_shape, stride):
+    """
+    Get the sliding windows of the spatial dimensions of x as a view (no data
+    is copied) with the stride tricks.
+
+    :param x: the input of shape (N, C, S_1, ..., S_d)
+    :param window_shape: the shape of a window (K_1, ..., K_d)
+    :param stride: the stride of the windows (the same for all dimensions)
+    :return: the read-only view of shape (N, C, out_1, ..., out_d, K_1, ...,
+    K_d) where out_i = (S_i - K_i) // stride + 1
+
+    >>> x = np.arange(5.0).reshape(1, 1, 5)
+    >>> get_windows(x, (3,), stride=2)[0, 0]
+    array([[0., 1., 2.],
+           [2., 3., 4.]])
+    """
+    spatial = x.shape[2:]
+    out_shape = tuple((size - window) // stride + 1 for size, window in
+                      zip(spatial, window_shape))
+    shape = x.shape[:2] + out_shape + tuple(window_shape)
+    strides = x.strides[:2] + tuple(
+        step * stride for step in x.strides[2:]) + x.strides[2:]
+    return np.lib.stride_tricks.as_strided(x, shape=shape, strides=strides,
+                                           writeable=False)
+
+
+def col2im(dcols, dx, stride):
+    """
+    Accumulate the gradients of the windows into the gradient of the input
+    (the adjoint of get_windows). There is a single (vectorized) addition for
+    each position in the window.
+
+    :param dcols: the gradients of the windows (N, C, out_1, ..., out_d, K_1,
+    ..., K_d)
+    :param dx: the zeroed gradient of the input (N, C, S_1, ..., S_d)
+    :param stride: the stride of the windows
+    :return: dx
+    """
+    d = dx.ndim - 2
+    out_shape = dcols.shape[2:2 + d]
+    window_shape = dcols.shape[2 + d:]
+    for index in np.ndindex(*window_shape):
+        target = tuple(slice(start, start + stride * (size - 1) + 1, stride)
+                       for start, size in zip(index, out_shape))
+        dx[(slice(None), slice(None)) + target] += dcols[(Ellipsis,) + index]
+    return dx
+
+
+def get_cols(padded_x, window_shape, stride, param):
+    """
+    Copy the windows of the padded input to the im2col matrix (in the
+    workspace).
+
+    :return: the im2col matrix of shape (N * out_1 * ... * out_d, C * K_1 *
+    ... * K_d) and the output spatial shape
+    """
+    d = padded_x.ndim - 2
+    N, C = padded_x.shape[:2]
+    windows = get_windows(padded_x, window_shape, stride)
+    out_shape = windows.shape[2:2 + d]
+    # N, C, out..., K... -> N, out..., C, K...
+    windows = windows.transpose(
+        (0,) + tuple(range(2, 2 + d)) + (1,) + tuple(range(2 + d, 2 + 2 * d)))
+    cols = get_workspace_buffer(param, 'cols', windows.shape, padded_x.dtype)
+    cols[:] = windows
+    return cols.reshape(N * int(np.prod(out_shape)), -1), out_shape
+
+
+def get_pads(pad, d):
+    """
+    :param pad: an int (the same padding on both sides) or a (left, right)
+    pair (1D only)
+    :param d: the number of the spatial dimensions
+    :return: the (left, right) padding for each spatial dimension
+    """
+    if pad is None:
+        pad = 0
+    if isinstance(pad, (int, np.integer)):
+        return ((pad, pad),) * d
+    return (tuple(pad),) * d
+
+
+def conv_forward_im2col_nd(x, w, b, conv_param):
+    """
+    The im2col forward pass of the convolution for any number of the spatial
+    dimensions: the windows of the padded input are copied to a matrix and
+    multiplied with the matrix of the filters (a single GEMM).
+    """
+    d = x.ndim - 2
+    N, F = x.shape[0], w.shape[0]
+    stride = conv_param.get('stride')
+    padded_x = pad_spatial(x, get_pads(conv_param.get('pad'), d), conv_param)
+    cols, out_shape = get_cols(padded_x, w.shape[2:], stride, conv_param)
+    out = cols.dot(w.reshape(F, -1).T) + b
+    # N * out..., F -> N, F, out...
+    out = out.reshape((N,) + out_shape + (F,))
+    out = np.ascontiguousarray(np.moveaxis(out, -1, 1))
+    cache = (x, w, b, conv_param)
+    return out, cache
+
+
+def conv_backward_im2col_nd(dout, cache):
+    """
+    The im2col backward pass of the convolution for any number of the
+    spatial dimensions.
+    """
+    x, w, b, conv_param = cache
+    d = x.ndim - 2
+    F = w.shape[0]
+    stride = conv_param.get('stride')
+    pads = get_pads(conv_param.get('pad'), d)
+    padded_x = pad_spatial(x, pads, conv_param)
+    cols, out_shape = get_cols(padded_x, w.shape[2:], stride, conv_param)
+
+    db = dout.sum(axis=(0,) + tuple(range(2, 2 + d))).astype(b.dtype)
+    # N, F, out... -> N * out..., F
+    dout_mat = np.moveaxis(dout, 1, -1).reshape(-1, F)
+    dw = dout_mat.T.dot(cols).reshape(w.shape).astype(w.dtype)
+
+    dcols = dout_mat.dot(w.reshape(F, -1))
+    # N * out..., C * K... -> N, C, out..., K...
+    dcols = dcols.reshape((x.shape[0],) + out_shape + w.shape[1:])
+    dcols = np.moveaxis(dcols, 1 + d, 1)
+    dx_padded = get_workspace_buffer(conv_param, 'dx_padded', padded_x.shape,
+                                     dcols.dtype)
+    dx_padded[:] = 0
+    col2im(dcols, dx_padded, stride)
+    interior = tuple(slice(left, left + size) for size, (left, _) in
+                     zip(x.shape[2:], pads))
+    # Copy, so that dx does not share the memory with the workspace.
+    dx = dx_padded[(slice(None), slice(None)) + interior].copy()
+    return dx, dw, db
+
+
+def conv_forward_im2col(x, w, b, conv_param):
+    """
+    The im2col (stride tricks) implementation of the forward pass for a
+    convolutional layer, the same inputs and outputs as in conv_forward_naive.
+    The optional conv_param['workspace'] (a dict) keeps the buffers of the
+    padded input and the im2col matrix between the calls.
+
+    >>> x = np.random.randn(2, 3, 7, 7)
+    >>> w = np.random.randn(4, 3, 3, 3)
+    >>> b = np.random.randn(4)
+    >>> conv_param = {'stride': 2, 'pad': 1, 'workspace': {}}
+    >>> out, _ = conv_forward_im2col(x, w, b, conv_param)
+    >>> expected, _ = conv_forward_naive(x, w, b, conv_param)
+    >>> np.testing.assert_array_almost_equal(out, expected)
+    """
+    return conv_forward_im2col_nd(x, w, b, conv_param)
+
+
+def conv_backward_im2col(dout, cache):
+    """
+    The im2col implementation of the backward pass for a convolutional layer,
+    the same inputs and outputs as in conv_backward_naive.
+    """
+    return conv_backward_im2col_nd(dout, cache)
+
+
+def conv_forward_im2col_1D(x, w, b, conv_param):
+    """
+    The im2col implementation of the forward pass for a 1D convolutional
+    layer, the same inputs and outputs as in conv_forward_naive_1D.
+
+    >>> x = np.array([[[1., 2., 3.]]])
+    >>> h = np.array([[[2., 1.]]])
+    >>> b = np.array([0.0])
+    >>> conv_param = {'pad' : 0, 'stride' :1}
+    >>> result, cache = conv_forward_im2col_1D(x, h, b, conv_param)
+    >>> expected_result = np.correlate(x[0, 0,:], h[0, 0,:], mode="valid")
+    >>> np.testing.assert_array_almost_equal(result, np.array([[expected_result]]))
+    """
+    return conv_forward_im2col_nd(x, w, b, conv_param)
+
+
+def conv_backward_im2col_1D(dout, cache):
+    """
+    The im2col implementation of the backward pass for a 1D convolutional
+    layer, the same inputs and outputs as in conv_backward_naive_1D.
+    """
+    return conv_backward_im2col_nd(dout, cache)
+
+
+def max_pool_forward_im2col_nd(x, window_shape, pool_param):
+    """
+    The forward pass of the max pooling (the max of each window view) for any
+    number of the spatial dimensions.
+    """
+    d = x.ndim - 2
+    windows = get_windows(x, window_shape, pool_param.get('stride'))
+    out = windows.max(axis=tuple(range(2 + d, 2 + 2 * d)))
+    cache = (x, pool_param)
+    return out, cache
+
+
+def max_pool_backward_im2col_nd(dout, x, window_shape, pool_param):
+    """
+    The backward pass of the max pooling for any number of the spatial
+    dimensions. As in the naive version, the gradient goes to all the
+    positions in the window with the max value.
+    """
+    d = x.ndim - 2
+    stride = pool_param.get('stride')
+    windows = get_windows(x, window_shape, stride)
+    expand = (Ellipsis,) + (np.newaxis,) * d
+    out = windows.max(axis=tuple(range(2 + d, 2 + 2 * d)))
+    dcols = (windows == out[expand]) * dout[expand]
+    dx = get_workspace_buffer(pool_param, 'dx', x.shape, dcols.dtype)
+    dx[:] = 0
+    col2im(dcols, dx, stride)
+    return dx.copy()
+
+
+def max_pool_forward_im2col(x, pool_param):
+    """
+    The stride tricks implementation of the forward pass for a max pooling
+    layer, the same inputs and outputs as in max_pool_forward_naive.
+
+    >>> x = np.random.randn(2, 3, 8, 8)
+    >>> pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    >>> out, _ = max_pool_forward_im2col(x, pool_param)
+    >>> expected, _ = max_pool_forward_naive(x, pool_param)
+    >>> np.testing.assert_array_equal(out, expected)
+    """
+    window_shape = (pool_param.get('pool_height'), pool_param.get('pool_width'))
+    return max_pool_forward_im2col_nd(x, window_shape, pool_param)
+
+
+def max_pool_backward_im2col(dout, cache):
+    """
+    The stride tricks implementation of the backward pass for a max pooling
+    layer, the same inputs and outputs as in max_pool_backward_naive.
+    """
+    x, pool_param = cache
+    window_shape = (pool_param.get('pool_height'), pool_param.get('pool_width'))
+    return max_pool_backward_im2col_nd(dout, x, window_shape, pool_param)
+
+
+def max_pool_forward_im2col_1D(x, pool_param):
+    """
+    The stride tricks implementation of the forward pass for a 1D max pooling
+    layer, the same inputs and outputs as in max_pool_forward_naive_1D.
+    """
+    return max_pool_forward_im2col_nd(x, (pool_param.get('pool_width'),),
+                                      pool_param)
+
+
+def max_pool_backward_im2col_1D(dout, cache):
+    """
+    The stride tricks implementation of the backward pass for a 1D max
+    pooling layer, the same inputs and outputs as in max_pool_backward_naive_1D.
+    """
+    x, pool_param = cache
+    return max_pool_backward_im2col_nd(dout, x, (pool_param.get('pool_width'),),
+                                       pool_param)
+
+
+# The implementations selected with the 'method' key of the conv_param and
+# pool_param: (forward, backward).
+CONV_METHODS = {
+    'naive': (conv_forward_naive, conv_backward_naive),
+    'im2col': (conv_forward_im2col, conv_backward_im2col)}
+CONV_METHODS_1D = {
+    'naive': (conv_forward_naive_1D, conv_backward_naive_1D),
+    'im2col': (conv_forward_im2col_1D, conv_backward_im2col_1D)}
+POOL_METHODS = {
+    'naive': (max_pool_forward_naive, max_pool_backward_naive),
+    'im2col': (max_pool_forward_im2col, max_pool_backward_im2col)}
+POOL_METHODS_1D = {
+    'naive': (max_pool_forward_naive_1D, max_pool_backward_naive_1D),
+    'im2col': (max_pool_forward_im2col_1D, max_pool_backward_im2col_1D)}
+
+
+def get_method(methods, param):
+    """
+    :param methods: the dict of the implementations
+    :param param: the conv_param or pool_param (the 'method' key, im2col by
+    default)
+    :return: the (forward, backward) pair of the selected implementation
+    """
+    method = param.get('method', 'im2col')
+    if method not in methods:
+        raise ValueError(f"Unknown method: {method}, choose from: "
+                         f"{', '.join(methods)}")
+    return methods[method]
+
+
+def conv_forward(x, w, b, conv_param):
+    return get_method(CONV_METHODS, conv_param)[0](x, w, b, conv_param)
+
+
+def conv_backward(dout, cache):
+    return get_method(CONV_METHODS, cache[3])[1](dout, cache)
+
+
+def conv_forward_1D(x, w, b, conv_param):
+    return get_method(CONV_METHODS_1D, conv_param)[0](x, w, b, conv_param)
+
+
+def conv_backward_1D(dout, cache):
+    return get_method(CONV_METHODS_1D, cache[3])[1](dout, cache)
+
+
+def max_pool_forward(x, pool_param):
+    return get_method(POOL_METHODS, pool_param)[0](x, pool_param)
+
+
+def max_pool_backward(dout, cache):
+    return get_method(POOL_METHODS, cache[1])[1](dout, cache)
+
+
+def max_pool_forward_1D(x, pool_param):
+    return get_method(POOL_METHODS_1D, pool_param)[0](x, pool_param)
+
+
+def max_pool_backward_1D(dout, cache):
+    return get_method(POOL_METHODS_1D, cache[1])[1](dout, cache)
+
+
 def spatial_batchnorm_forward(x, gamma, beta, bn_param):
     """
     Computes the forward pass for spatial batch normalization.
@@ -0,0 +1,66 @@
+import time
+import unittest
+import numpy as np
+
+from cnns.nnlib.layers import conv_backward
+from cnns.nnlib.layers import conv_backward_1D
+from cnns.nnlib.layers import conv_forward
+from cnns.nnlib.layers import conv_forward_1D
+from cnns.nnlib.layers import max_pool_backward
+from cnns.nnlib.layers import max_pool_forward
+
+
+def time_method(forward, backward, inputs, param, repeat=1):
+    """
+    :return: the average time of the forward and backward pass (in sec) and
+    the output of the forward pass
+    """
+    start = time.time()
+    for _ in range(repeat):
+        out, cache = forward(*inputs, param)
+        backward(np.ones_like(out), cache)
+    return (time.time() - start) / repeat, out
+
+
+class TestLayersBenchmark(unittest.TestCase):
+
+    def compare(self, name, forward, backward, inputs, param):
+        naive_time, expected = time_method(forward, backward, inputs,
+                                           dict(param, method='naive'))
+        im2col_param = dict(param, method='im2col', workspace={})
+        # Warm up the workspace.
+        time_method(forward, backward, inputs, im2col_param)
+        im2col_time, out = time_method(forward, backward, inputs, im2col_param,
+                                       repeat=10)
+        print(f"\n{name}: naive time: {naive_time}, im2col time: "
+              f"{im2col_time}, im2col is faster: {naive_time / im2col_time} "
+              f"X times")
+        np.testing.assert_allclose(actual=out, desired=expected, rtol=1e-7,
+                                   atol=1e-10)
+
+    def test_conv_cifar(self):
+        # A part of a CIFAR-10 batch with the first layer of the CNN.
+        random = np.random.RandomState(31)
+        x = random.randn(8, 3, 32, 32)
+        w = random.randn(32, 3, 3, 3)
+        b = random.randn(32)
+        self.compare("conv 2D", conv_forward, conv_backward, (x, w, b),
+                     {'pad': 1, 'stride': 1})
+
+    def test_max_pool_cifar(self):
+        random = np.random.RandomState(31)
+        x = random.randn(8, 32, 32, 32)
+        self.compare("max pool 2D", max_pool_forward, max_pool_backward, (x,),
+                     {'pool_height': 2, 'pool_width': 2, 'stride': 2})
+
+    def test_conv_1D(self):
+        random = np.random.RandomState(31)
+        x = random.randn(16, 1, 512)
+        w = random.randn(16, 1, 8)
+        b = random.randn(16)
+        self.compare("conv 1D", conv_forward_1D, conv_backward_1D, (x, w, b),
+                     {'pad': 0, 'stride': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,13 +9,19 @@ class Noise(nn.Module):
         super(Noise, self).__init__()
         self.std = std
         self.buffer = None
+        # Draw the noise in antithetic pairs: the second half of the batch
+        # gets the negated noise of the first half (set by the EOT attacks).
+        self.antithetic = False
 
     def forward(self, x):
         if self.std > 0:
             if self.buffer is None:
-                self.buffer = torch.zeros_like(x, requires_grad=False).normal_(0, self.std).cuda()
+                self.buffer = torch.zeros_like(x, requires_grad=False).normal_(0, self.std)
             else:
                 self.buffer.resize_(x.size()).normal_(0, self.std)
+            if self.antithetic and x.size(0) % 2 == 0:
+                half = x.size(0) // 2
+                torch.neg(self.buffer[:half], out=self.buffer[half:])
             return x + self.buffer
         return x
 
@@ -5,6 +5,7 @@ import torch.utils.model_zoo as model_zoo
 from cnns.nnlib.pytorch_layers.conv_picker import Conv
 from cnns.nnlib.pytorch_layers.conv2D_fft import Conv2dfft
 from cnns.nnlib.pytorch_layers.round import Round
+from cnns.nnlib.pytorch_layers.svd2D import SVDcompress
 from cnns.nnlib.pytorch_layers.noise import NoiseGauss
 from cnns.nnlib.pytorch_layers.noise import NoiseUniform
 from cnns.nnlib.pytorch_layers.noise import NoiseLaplace
@@ -24,7 +25,6 @@ from cnns.nnlib.datasets.svhn import svhn_std, svhn_mean
 from cnns.nnlib.datasets.imagenet.imagenet_pytorch import imagenet_std, \
     imagenet_mean
 from cnns.nnlib.robustness.utils import AdditiveLaplaceNoiseAttack
-from cnns.nnlib.utils.svd2d import compress_svd_batch
 from cnns.nnlib.robustness.channels.channels_definition import get_svd_index
 
 __all__ = ['ResNet', 'resnet18svd', 'resnet34', 'resnet50', 'resnet101',
@@ -243,7 +243,7 @@ class ResNet(nn.Module):
             self.band = FFTBand2DcomplexMask(args=args)
         else:
             # identity function
-            self.band = lambda x: x
+            self.band = nn.Identity()
 
         if args.values_per_channel > 0:
             self.rounder = Round(args=args)
@@ -255,31 +255,31 @@ class ResNet(nn.Module):
             #     std=self.std, mean=self.mean, device=args.device)
         else:
             # identity function
-            self.rounder = lambda x: x
+            self.rounder = nn.Identity()
 
         if args.svd_compress > 0:
-            self.svd = lambda x: compress_svd_batch(x,
-                                                    compress_rate=args.svd_compress)
+            self.svd = SVDcompress(args=args)
         else:
-            self.svd = lambda x: x
+            # identity function
+            self.svd = nn.Identity()
 
         if args.noise_sigma > 0:
             self.gauss = NoiseGauss(args=args)
         else:
             # identity function
-            self.gauss = lambda x: x
+            self.gauss = nn.Identity()
 
         if args.noise_epsilon > 0:
             self.noise = NoiseUniform(args=args)
         else:
             # identity function
-            self.noise = lambda x: x
+            self.noise = nn.Identity()
 
         if args.laplace_epsilon > 0:
             self.laplace = NoiseLaplace(args=args)
         else:
             # identity function
-            self.laplace = lambda x: x
+            self.laplace = nn.Identity()
 
         self.bn1 = nn.BatchNorm2d(64)
         self.relu = nn.ReLU(inplace=True)
@@ -0,0 +1,37 @@
+import torch
+
+
+def straight_through(input, output):
+    """
+    BPDA (the backward pass differentiable approximation): the output in the
+    forward pass and the identity in the backward pass.
+
+    This is the same as the backward of RoundFunction, NoiseFunction and
+    FFTBandFunctionComplexMask2D (the gradient of the output is passed to the
+    input unchanged) but uses only tensor ops, so the layers can be traced
+    and scripted with torch.jit.
+
+    The sum is computed in float32 for half and bfloat16, otherwise the
+    output would be shifted by the rounding errors of input + (output - input).
+
+    :param input: the input of the (non-differentiable) defense
+    :param output: the output of the defense for the input
+    :return: the output with the gradient of the identity
+    """
+    if input.dtype == torch.half or input.dtype == torch.bfloat16:
+        x = input.float()
+        return restore_format(x + (output.float() - x).detach(), input)
+    return input + (output - input).detach()
+
+
+def restore_format(output, input):
+    """
+    :param output: the output computed in a different dtype or memory format
+    :param input: the input of the layer
+    :return: the output with the dtype and memory format (channels_last or
+    contiguous) of the input
+    """
+    if input.dim() == 4 and input.is_contiguous(
+            memory_format=torch.channels_last):
+        return output.to(dtype=input.dtype, memory_format=torch.channels_last)
+    return output.to(dtype=input.dtype)
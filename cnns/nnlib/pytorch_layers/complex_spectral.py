@@ -0,0 +1,222 @@
+"""
+The spectral engine on the native complex tensors (complex64/complex128).
+
+The fft based layers keep the complex numbers as the last dimension of size
+2 (the real and imaginary parts, as returned by the old torch.rfft). The
+arithmetic on such pairs is done by hand: each complex multiplication slices
+the pairs, allocates a few full-size temporaries and concatenates the parts
+back with torch.cat. Here the pairs are viewed (without a copy, when the
+memory layout allows it) as complex tensors, the arithmetic is done by the
+native complex kernels and the result is viewed back as the pairs. The sum
+over the channels is a single complex einsum (a batched complex matrix
+multiplication for each frequency), so the full product of the inputs and
+the filters (N, F, C, H, W) is never materialised.
+
+The half precision pairs are computed in float32 and the integer pairs in
+float64 (there are no complex types for them), the results are cast back.
+"""
+import torch
+import torch.nn.functional as F
+
+COMPLEX_DTYPES = (torch.float32, torch.float64)
+
+
+def to_complex(x):
+    """
+    :param x: the complex numbers as the last dimension of size 2
+    :return: the complex tensor (a view of x if its layout allows it)
+
+    >>> z = to_complex(torch.tensor([[1., 2.], [3., -4.]]))
+    >>> z.dtype
+    torch.complex64
+    >>> z.tolist()
+    [(1+2j), (3-4j)]
+    """
+    if x.is_complex():
+        return x
+    if x.dtype not in COMPLEX_DTYPES:
+        x = x.to(torch.float32 if x.is_floating_point() else torch.float64)
+    try:
+        return torch.view_as_complex(x)
+    except RuntimeError:
+        # The strides of the real and imaginary parts do not allow a view.
+        return torch.view_as_complex(x.contiguous())
+
+
+def to_real(z, dtype=None):
+    """
+    :param z: the complex tensor
+    :param dtype: the dtype of the result (None: the real dtype of z)
+    :return: the complex numbers as the last dimension of size 2
+
+    >>> to_real(torch.tensor([1 + 2j, 3 - 4j]), dtype=torch.int64).tolist()
+    [[1, 2], [3, -4]]
+    """
+    x = torch.view_as_real(z.resolve_conj())
+    if dtype is not None and x.dtype != dtype:
+        x = x.to(dtype)
+    return x
+
+
+def rfft_pairs(input, signal_ndim, normalized=False, onesided=True):
+    """
+    The fft of the real input on the last signal_ndim dimensions with the
+    spectrum returned as the pairs (the layout of the removed torch.rfft).
+
+    :param input: the real signals
+    :param signal_ndim: the number of the transformed (last) dimensions
+    :param normalized: the orthonormal fft
+    :param onesided: only the half of the last dimension of the spectrum
+    :return: the spectrum (pairs)
+
+    >>> rfft_pairs(torch.tensor([1., 2., 3., 0.]), signal_ndim=1).tolist()
+    [[6.0, 0.0], [-2.0, -2.0], [2.0, 0.0]]
+    """
+    dim = tuple(range(-signal_ndim, 0))
+    norm = "ortho" if normalized else "backward"
+    if onesided:
+        return to_real(torch.fft.rfftn(input, dim=dim, norm=norm))
+    return to_real(torch.fft.fftn(input, dim=dim, norm=norm))
+
+
+def irfft_pairs(input, signal_ndim, normalized=False, onesided=True,
+                signal_sizes=None):
+    """
+    The inverse of rfft_pairs: the real signals from the spectrum (pairs).
+
+    :param input: the spectrum (pairs)
+    :param signal_ndim: the number of the transformed dimensions
+    :param normalized: the orthonormal fft
+    :param onesided: the spectrum has only the half of the last dimension
+    :param signal_sizes: the sizes of the signals (by default the even size
+    of the last dimension for the onesided spectrum)
+    :return: the real signals
+
+    >>> irfft_pairs(torch.tensor([[6., 0.], [-2., -2.], [2., 0.]]),
+    ... signal_ndim=1, signal_sizes=(4,)).tolist()
+    [1.0, 2.0, 3.0, 0.0]
+    """
+    dim = tuple(range(-signal_ndim, 0))
+    norm = "ortho" if normalized else "backward"
+    if onesided:
+        return torch.fft.irfftn(to_complex(input), s=signal_sizes, dim=dim,
+                                norm=norm)
+    return torch.fft.ifftn(to_complex(input), s=signal_sizes, dim=dim,
+                           norm=norm).real
+
+
+def complex_multiply(x, y):
+    """
+    :param x: the first array of complex numbers (pairs)
+    :param y: the second array of complex numbers (pairs), broadcastable
+    with x
+    :return: the element-wise products (pairs)
+
+    >>> complex_multiply(torch.tensor([[1., 2.]]),
+    ... torch.tensor([[2., 3.]])).tolist()
+    [[-4.0, 7.0]]
+    """
+    return to_real(to_complex(x) * to_complex(y), dtype=x.dtype)
+
+
+def complex_multiply_out(x, y, out):
+    """
+    Write the element-wise products of x and y to out without a temporary
+    (out is viewed as the complex tensor if its dtype and layout allow it,
+    otherwise the products are copied).
+
+    :param x: the first array of complex numbers (pairs)
+    :param y: the second array of complex numbers (pairs)
+    :param out: the output array of complex numbers (pairs)
+
+    >>> out = torch.empty(1, 2)
+    >>> complex_multiply_out(torch.tensor([[1., 2.]]),
+    ... torch.tensor([[2., 3.]]), out)
+    >>> out.tolist()
+    [[-4.0, 7.0]]
+    """
+    if out.dtype in COMPLEX_DTYPES:
+        try:
+            torch.mul(to_complex(x), to_complex(y),
+                      out=torch.view_as_complex(out))
+            return
+        except RuntimeError:
+            # The strides of the real and imaginary parts do not allow a view.
+            pass
+    out.copy_(complex_multiply(x, y))
+
+
+def complex_conjugate(x):
+    """
+    :param x: the complex numbers (pairs)
+    :return: the conjugated complex numbers (pairs, a new tensor)
+
+    >>> complex_conjugate(torch.tensor([[1, 2], [3, -4]])).tolist()
+    [[1, -2], [3, 4]]
+    """
+    return to_real(to_complex(x).conj(), dtype=x.dtype)
+
+
+def get_squared_magnitude(x):
+    """
+    :param x: the complex numbers (pairs)
+    :return: the squared magnitudes |x|^2 (the last dimension is removed)
+
+    >>> get_squared_magnitude(torch.tensor([[3., 4.], [1., -1.]])).tolist()
+    [25.0, 2.0]
+    """
+    z = to_complex(x)
+    squared = z.real ** 2 + z.imag ** 2
+    if x.is_floating_point():
+        squared = squared.to(x.dtype)
+    return squared
+
+
+def complex_zero_pad(x, pad):
+    """
+    Pad the complex numbers (pairs) with zeros.
+
+    :param x: the complex numbers (pairs)
+    :param pad: the padding of the complex dimensions (as in F.pad, starting
+    from the last complex dimension, that is, the last but one of x)
+    :return: the padded complex numbers (pairs)
+
+    >>> complex_zero_pad(torch.tensor([[1., 2.]]), pad=(0, 1)).tolist()
+    [[1.0, 2.0], [0.0, 0.0]]
+    """
+    return to_real(F.pad(to_complex(x), pad), dtype=x.dtype)
+
+
+def complex_matmul(x, y):
+    """
+    The batched complex matrix multiplication.
+
+    :param x: the complex numbers (pairs) with dims (..., N, C, 2)
+    :param y: the complex numbers (pairs) with dims (..., C, F, 2)
+    :return: the products (pairs) with dims (..., N, F, 2)
+
+    >>> x = torch.tensor([[[1., 2.], [0., 1.]]])
+    >>> y = torch.tensor([[[2., 3.]], [[1., 0.]]])
+    >>> complex_matmul(x, y).tolist()
+    [[[-4.0, 8.0]]]
+    """
+    return to_real(torch.matmul(to_complex(x), to_complex(y)), dtype=x.dtype)
+
+
+def complex_einsum(equation, x, y):
+    """
+    The complex contraction of two tensors (e.g. the sum of the products over
+    the channels), the complex dimension (of size 2) is not in the equation.
+
+    :param equation: the equation of torch.einsum for the complex tensors
+    :param x: the first complex numbers (pairs)
+    :param y: the second complex numbers (pairs)
+    :return: the contraction (pairs)
+
+    >>> x = torch.tensor([[[1., 2.], [0., 1.]]])
+    >>> y = torch.tensor([[[2., 3.], [1., 0.]]])
+    >>> complex_einsum('nc,fc->nf', x, y).tolist()
+    [[[-4.0, 8.0]]]
+    """
+    return to_real(torch.einsum(equation, to_complex(x), to_complex(y)),
+                   dtype=x.dtype)
@@ -0,0 +1,80 @@
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_einsum
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_matmul
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_multiply
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_multiply_out
+from cnns.nnlib.pytorch_layers.complex_spectral import get_squared_magnitude
+from cnns.nnlib.pytorch_layers.complex_spectral import to_complex
+
+
+def get_numpy_complex(x):
+    x = x.detach().double().numpy()
+    return x[..., 0] + 1.0j * x[..., 1]
+
+
+class TestComplexSpectral(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+
+    def test_multiply(self):
+        x = torch.randn(2, 1, 3, 4, 2)
+        y = torch.randn(5, 3, 4, 2)
+        expected = get_numpy_complex(x) * get_numpy_complex(y)
+        result = get_numpy_complex(complex_multiply(x, y))
+        np.testing.assert_allclose(actual=result, desired=expected, rtol=1e-5,
+                                   atol=1e-5)
+        # The half precision is computed in float32 and cast back.
+        result = complex_multiply(x.half(), y.half())
+        self.assertEqual(result.dtype, torch.float16)
+        np.testing.assert_allclose(actual=get_numpy_complex(result),
+                                   desired=expected, rtol=1e-2, atol=1e-2)
+
+    def test_multiply_out(self):
+        x = torch.randn(2, 1, 3, 4, 2)
+        y = torch.randn(5, 3, 4, 2)
+        expected = complex_multiply(x, y)
+        out = torch.empty(2, 5, 3, 4, 2)
+        complex_multiply_out(x, y, out)
+        self.assertTrue(torch.equal(out, expected))
+        # The layout of the slice does not allow a view (it is copied).
+        out = torch.empty(2, 5, 3, 4, 3)[..., 1:]
+        complex_multiply_out(x, y, out)
+        self.assertTrue(torch.equal(out, expected))
+
+    def test_view(self):
+        x = torch.randn(3, 4, 6, 2)
+        # A view without a copy.
+        self.assertEqual(to_complex(x).data_ptr(), x.data_ptr())
+        # The layout of the slice does not allow a view (it is copied).
+        x = torch.randn(3, 4, 3)[..., 1:]
+        np.testing.assert_allclose(actual=to_complex(x).numpy(),
+                                   desired=get_numpy_complex(x))
+        np.testing.assert_allclose(
+            actual=get_squared_magnitude(x).numpy(),
+            desired=np.abs(get_numpy_complex(x)) ** 2, rtol=1e-5)
+
+    def test_contraction(self):
+        xfft = torch.randn(2, 3, 4, 5, 2, requires_grad=True)
+        yfft = torch.randn(6, 3, 4, 5, 2)
+        result = complex_einsum('nchw,fchw->nfhw', xfft, yfft)
+        expected = np.einsum('nchw,fchw->nfhw', get_numpy_complex(xfft),
+                             get_numpy_complex(yfft))
+        np.testing.assert_allclose(actual=get_numpy_complex(result),
+                                   desired=expected, rtol=1e-4, atol=1e-4)
+        # The gradients flow through the complex views.
+        result.sum().backward()
+        self.assertEqual(xfft.grad.shape, xfft.shape)
+        x = torch.randn(4, 5, 2, 3, 2)
+        y = torch.randn(4, 5, 3, 6, 2)
+        expected = np.matmul(get_numpy_complex(x), get_numpy_complex(y))
+        np.testing.assert_allclose(
+            actual=get_numpy_complex(complex_matmul(x, y)), desired=expected,
+            rtol=1e-4, atol=1e-4)
+
+
+if __name__ == '__main__':
+    unittest.main()
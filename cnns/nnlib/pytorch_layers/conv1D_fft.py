@@ -11,6 +11,7 @@ import numpy as np
 import torch
 from torch import tensor
 from torch.nn import Module
+from torch.nn.functional import conv1d
 from torch.nn.functional import pad as torch_pad
 from torch.nn.parameter import Parameter
 # from memory_profiler import profile
@@ -20,6 +21,14 @@ import os
 # os.environ['CUDA_VISIBLE_DEVICES'] = '0'
 # os.environ['GPU_DEBUG'] = '0'
 
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import to_complex
+from cnns.nnlib.pytorch_layers.complex_spectral import to_real
+from cnns.nnlib.pytorch_layers.conv_tiled import conv1D_tiled
+from cnns.nnlib.pytorch_layers.conv_tuner import get_tuner
+from cnns.nnlib.pytorch_layers.conv_tuner import is_compressed
+from cnns.nnlib.pytorch_layers.filter_cache import FilterSpectrumCache
 from cnns.nnlib.pytorch_layers.pytorch_utils import complex_pad_simple
 from cnns.nnlib.pytorch_layers.pytorch_utils import correlate_fft_signals
 from cnns.nnlib.pytorch_layers.pytorch_utils import fast_jmul
@@ -41,6 +50,8 @@ from cnns.nnlib.pytorch_layers.pytorch_utils import get_spectrum
 from cnns.nnlib.utils.general_utils import additional_log_file, next_power2
 from cnns.nnlib.utils.general_utils import CompressType
 from cnns.nnlib.utils.general_utils import ConvExecType
+from cnns.nnlib.utils.general_utils import FFTSizeType
+from cnns.nnlib.utils.general_utils import get_fft_size
 from cnns.nnlib.utils.general_utils import StrideType
 from cnns.nnlib.utils.general_utils import plot_signal_freq
 from cnns.nnlib.utils.general_utils import plot_signal_time
@@ -77,7 +88,7 @@ class Conv1dfftFunction(torch.autograd.Function):
     # @profile
     def forward(ctx, input, filter, bias=None, padding=0, stride=1,
                 args=Arguments(), out_size=None, is_manual=tensor([0]),
-                conv_index=None):
+                conv_index=None, filter_cache=None):
         """
         Compute the forward pass for the 1D convolution.
 
@@ -113,6 +124,8 @@ class Conv1dfftFunction(torch.autograd.Function):
         representation in the frequency domain? STANDARD: cut off the same
         number of coefficients for each signal and filter in the batch based on
         the whole energy of the signals in the batch.
+        :param filter_cache: the cache of the spectra of the filter (for the
+        inference mode), None: compute the spectrum of the filter.
 
         :return: the result of convolution.
         """
@@ -128,6 +141,7 @@ class Conv1dfftFunction(torch.autograd.Function):
             compress_rate = args.compress_rate
             preserve_energy = args.preserve_energy
             use_next_power2 = args.next_power2
+            fft_size_type = args.fft_size_type
             is_debug = args.is_debug
             compress_type = args.compress_type
             stride_type = args.stride_type
@@ -135,6 +149,7 @@ class Conv1dfftFunction(torch.autograd.Function):
             compress_rate = None
             preserve_energy = None
             use_next_power2 = False
+            fft_size_type = None
             is_debug = False
             compress_type = CompressType.STANDARD
             stride_type = StrideType.STANDARD
@@ -240,10 +255,10 @@ class Conv1dfftFunction(torch.autograd.Function):
         init_fft_size = W + 2 * padding_count + 2 * conv_pad
         # init_fft_size = W + 2 * conv_pad
 
-        if use_next_power2:
-            fft_size = next_power2(init_fft_size)
-        else:
-            fft_size = init_fft_size
+        if fft_size_type is None:
+            fft_size_type = FFTSizeType.POWER2 if use_next_power2 else \
+                FFTSizeType.EXACT
+        fft_size = get_fft_size(init_fft_size, fft_size_type)
 
         # How many padded (zero) values there are because of going to the next
         # power of 2?
@@ -266,8 +281,7 @@ class Conv1dfftFunction(torch.autograd.Function):
             cuda_mem_show(info="input pad")
 
         # fft of the input signals.
-        xfft = torch.rfft(input, signal_ndim=Conv1dfftFunction.signal_ndim,
-                          onesided=True)
+        xfft = to_real(torch.fft.rfftn(input, dim=(-1,)))
         N, C, init_xfft_size, _ = xfft.size()
         del input
 
@@ -364,26 +378,12 @@ class Conv1dfftFunction(torch.autograd.Function):
             # At least 1 coefficient in the filter.
             fft_size_filter = max(1, (half_fft_compressed_size - 1) * 2)
 
-        # fft_padding_filter = fft_size_filter - (WW + 2 * filter_pad)
-        fft_padding_filter = fft_size_filter - WW
-        # We have to pad the filter (at least the filter size - 1).
-        # fft_padding_filter can be a negative number
-        # right_filter_pad = max(filter_pad, filter_pad + fft_padding_filter)
-        right_filter_pad = fft_padding_filter
-        # filter = torch_pad(filter, (filter_pad, right_filter_pad),
-        #                    'constant', 0)
-        filter = torch_pad(filter, (0, right_filter_pad), 'constant', 0)
-
-        if is_debug:
-            cuda_mem_show(info="filter pad")
-
-        yfft = torch.rfft(filter, signal_ndim=Conv1dfftFunction.signal_ndim,
-                          onesided=True)
-        del filter
         if is_debug:
             filter_bank = 0
             filter_channel = 0
-            yfft_signal = yfft[filter_bank, filter_channel]
+            yfft_signal = get_filter_spectrum1D(
+                filter, fft_size_filter=fft_size_filter)[
+                filter_bank, filter_channel]
             spectrum = get_spectrum(yfft_signal)
             filter_spectrum_np = spectrum.cpu().numpy()
             print("filter_spectrum_np: ", filter_spectrum_np)
@@ -397,15 +397,30 @@ class Conv1dfftFunction(torch.autograd.Function):
         if is_debug:
             print("conv_name," + "conv" + str(conv_index))
 
-        if half_fft_compressed_size is not None:
-            # yfft = yfft[:, :, :half_fft_compressed_size, :]
-            if is_lead_reversed:
-                yfft_compressed = yfft[..., -half_fft_compressed_size:, :]
-            else:
-                yfft_compressed = yfft.narrow(dim=-2, start=0,
-                                              length=half_fft_compressed_size)
-            del yfft
-            yfft = yfft_compressed
+        # The spectrum of the filter is compressed in the same way as the
+        # spectrum of the input.
+        filter_compression = {
+            'half_fft_compressed_size': half_fft_compressed_size,
+            'is_lead_reversed': is_lead_reversed}
+        if compress_type is CompressType.BIG_COEFF or (
+                compress_type is CompressType.LOW_COEFF):
+            filter_compression['compress_type'] = compress_type
+            if preserve_energy is not None and preserve_energy < 100:
+                filter_compression['preserve_energy'] = preserve_energy
+            elif index_back_fft is not None and index_back_fft > 0:
+                filter_compression['index_back'] = index_back_fft
+
+        def compute_spectrum(filter):
+            return get_filter_spectrum1D(filter,
+                                         fft_size_filter=fft_size_filter,
+                                         **filter_compression)
+
+        if filter_cache is None:
+            yfft = compute_spectrum(filter)
+        else:
+            key = (fft_size_filter,) + tuple(sorted(filter_compression.items()))
+            yfft = filter_cache.get(filter, key=key, compute=compute_spectrum)
+        del filter
 
         if is_debug:
             cuda_mem_show(info="compress filter")
@@ -414,18 +429,13 @@ class Conv1dfftFunction(torch.autograd.Function):
             if preserve_energy is not None and preserve_energy < 100:
                 xfft = retain_big_coef_bulk(xfft,
                                             preserve_energy=preserve_energy)
-                yfft = retain_big_coef_bulk(yfft,
-                                            preserve_energy=preserve_energy)
             elif index_back_fft is not None and index_back_fft > 0:
                 xfft = retain_big_coef_bulk(xfft, index_back=index_back_fft)
-                yfft = retain_big_coef_bulk(yfft, index_back=index_back_fft)
         elif compress_type is CompressType.LOW_COEFF:
             if preserve_energy is not None and preserve_energy < 100:
                 xfft = retain_low_coef(xfft, preserve_energy=preserve_energy)
-                yfft = retain_low_coef(yfft, preserve_energy=preserve_energy)
             elif index_back_fft is not None and index_back_fft > 0:
                 xfft = retain_low_coef(xfft, index_back=index_back_fft)
-                yfft = retain_low_coef(yfft, index_back=index_back_fft)
 
         if is_debug is True:
             if half_fft_compressed_size is None:
@@ -575,8 +585,8 @@ class Conv1dfftFunction(torch.autograd.Function):
                 outfft = complex_pad_simple(xfft=outfft, fft_size=fft_size)
                 # print("freq mul size: ", freq_mul.size())
 
-                output = torch.irfft(
-                    input=outfft, signal_ndim=1, signal_sizes=(fft_size,))
+                output = torch.fft.irfftn(to_complex(outfft), s=(fft_size,),
+                                          dim=(-1,))
                 # global global_complex_time
                 # global_complex_time += time.time() - start_complex_time
                 # print("complex multiply time: ", global_complex_time)
@@ -758,8 +768,7 @@ class Conv1dfftFunction(torch.autograd.Function):
         if is_debug:
             cuda_mem_show(info="gradient pad", omit_objs=omit_objs)
 
-        doutfft = torch.rfft(dout, signal_ndim=Conv1dfftFunction.signal_ndim,
-                             onesided=True)
+        doutfft = to_real(torch.fft.rfftn(dout, dim=(-1,)))
         del dout
 
         if is_debug:
@@ -930,10 +939,8 @@ class Conv1dfftFunction(torch.autograd.Function):
 
                     dxfft = complex_pad_simple(xfft=dxfft, fft_size=fft_size)
 
-                    dx = torch.irfft(input=dxfft,
-                                     signal_ndim=Conv1dfftFunction.signal_ndim,
-                                     signal_sizes=(fft_size,),
-                                     onesided=True)
+                    dx = torch.fft.irfftn(to_complex(dxfft), s=(fft_size,),
+                                          dim=(-1,))
                     # global global_complex_time
                     # global_complex_time += time.time() - start_complex_time
                     # print("complex multiply time: ", global_complex_time)
@@ -1042,9 +1049,8 @@ class Conv1dfftFunction(torch.autograd.Function):
 
                     dwfft = complex_pad_simple(xfft=dwfft, fft_size=fft_size)
 
-                    dw = torch.irfft(
-                        input=dwfft, signal_ndim=1, signal_sizes=(fft_size,),
-                        onesided=True)
+                    dw = torch.fft.irfftn(to_complex(dwfft), s=(fft_size,),
+                                          dim=(-1,))
                     if dw.shape[-1] > WW:
                         dw = dw.narrow(dim=-1, start=0, length=WW)
                     elif dw.shape[-1] < W:
@@ -1065,7 +1071,43 @@ class Conv1dfftFunction(torch.autograd.Function):
         if is_debug:
             cuda_mem_show(info="backward end", omit_objs=omit_objs)
 
-        return dx, dw, db, None, None, None, None, None, None
+        return dx, dw, db, None, None, None, None, None, None, None
+
+
+def get_filter_spectrum1D(filter, fft_size_filter,
+                          half_fft_compressed_size=None,
+                          is_lead_reversed=False, compress_type=None,
+                          preserve_energy=None, index_back=None):
+    """
+    Compute the spectrum of the filter for the correlation with the input.
+
+    :param filter: the filter (F, C, WW)
+    :param fft_size_filter: the size of the fft of the filter
+    :param half_fft_compressed_size: the number of the retained coefficients
+    (None: no compression)
+    :param is_lead_reversed: retain the last coefficients
+    :param compress_type: BIG_COEFF or LOW_COEFF: retain the coefficients
+    with the preserve_energy or index_back
+    :return: the spectrum of the filter padded to the fft size and compressed
+    """
+    WW = filter.size(-1)
+    # fft_padding_filter can be a negative number
+    filter = torch_pad(filter, (0, fft_size_filter - WW), 'constant', 0)
+    # The spectrum is viewed as the pairs (the last dimension of size 2).
+    yfft = torch.view_as_real(torch.fft.rfftn(filter, dim=(-1,)))
+    if half_fft_compressed_size is not None:
+        if is_lead_reversed:
+            yfft = yfft[..., -half_fft_compressed_size:, :]
+        else:
+            yfft = yfft.narrow(dim=-2, start=0,
+                               length=half_fft_compressed_size)
+    if compress_type is CompressType.BIG_COEFF:
+        yfft = retain_big_coef_bulk(yfft, preserve_energy=preserve_energy,
+                                    index_back=index_back)
+    elif compress_type is CompressType.LOW_COEFF:
+        yfft = retain_low_coef(yfft, preserve_energy=preserve_energy,
+                               index_back=index_back)
+    return yfft
 
 
 class Conv1dfft(Module):
@@ -1077,6 +1119,9 @@ class Conv1dfft(Module):
     2d fft layers .
     """
     conv_index_counter = 0
+    # The conv exec types supported by the layer (for the tuner).
+    conv_exec_types = (ConvExecType.SERIAL, ConvExecType.BATCH,
+                       ConvExecType.CUDA)
 
     def __init__(self, in_channels=None, out_channels=None, kernel_size=None,
                  stride=1, padding=0, dilation=None, groups=None, bias=True,
@@ -1198,8 +1243,61 @@ class Conv1dfft(Module):
         self.conv_index = Conv1dfft.conv_index_counter
         Conv1dfft.conv_index_counter += 1
 
+        self.filter_cache = None
+        if args is not None and args.filter_cache:
+            self.set_filter_cache(is_enabled=True)
+
+        # The conv exec type and fft size picked by the tuner for the last
+        # shape of the input.
+        self.tuner = None
+        self.tuned_key = None
+        self.tuned_args = None
+        if args is not None and args.conv_tuning:
+            self.set_tuner(get_tuner(args.tuning_file))
+
         self.reset_parameters()
 
+    def set_tuner(self, tuner):
+        """
+        :param tuner: the ConvTuner that picks the conv exec type and the fft
+        size for each shape of the input (None: use the args)
+        """
+        self.tuner = tuner
+        self.tuned_key = None
+        self.tuned_args = None
+
+    def get_filter(self):
+        return self.filter
+
+    def set_filter_cache(self, is_enabled=True):
+        """
+        Cache the spectra of the filters in the inference mode (the cache is
+        cleared when the filters change or the layer is switched to the train
+        mode).
+        """
+        self.filter_cache = FilterSpectrumCache() if is_enabled else None
+
+    def get_filter_cache(self):
+        """
+        :return: the filter spectrum cache if it can be used in this pass
+        """
+        if self.training:
+            return None
+        return self.filter_cache
+
+    def get_filter_cache_memory(self):
+        """
+        :return: the number of bytes held by the cached spectra of the filters
+        """
+        if self.filter_cache is None:
+            return 0
+        return self.filter_cache.get_memory_size()
+
+    def train(self, mode=True):
+        if self.filter_cache is not None:
+            self.filter_cache.clear()
+        return super(Conv1dfft, self).train(mode)
+
     def reset_parameters(self):
         n = self.in_channels
         # We have only a single kernel size for 1D convolution.
@@ -1218,9 +1316,37 @@ class Conv1dfft(Module):
         :param input: the input map (e.g., an image)
         :return: the result of 1D convolution
         """
+        args = self.args
+        if self.tuner is not None:
+            args = self.tuner.get_layer_args(self, input)
+            if args is None:
+                return self.forward_standard(input)
+        return self.forward_fft(input, args=args,
+                                filter_cache=self.get_filter_cache())
+
+    def forward_fft(self, input, args, filter_cache=None):
+        if args.conv_exec_type is ConvExecType.TILED:
+            if is_compressed(self):
+                raise Exception("The tiled conv does not support the "
+                                "compression.")
+            padding = 0 if self.padding is None else self.padding
+            stride = 1 if self.stride is None else self.stride
+            return conv1D_tiled(input, self.filter, self.bias,
+                                padding=padding, stride=stride,
+                                tile_size=args.tile_size,
+                                memory_size=args.tile_memory_size)
         return Conv1dfftFunction.apply(
             input, self.filter, self.bias, self.padding, self.stride,
-            self.args, self.out_size, self.is_manual, self.conv_index)
+            args, self.out_size, self.is_manual, self.conv_index,
+            filter_cache)
+
+    def forward_standard(self, input):
+        """
+        The standard PyTorch convolution (the same result as the fft based
+        one without compression).
+        """
+        return conv1d(input, self.filter, self.bias, stride=self.stride,
+                      padding=self.padding)
 
 
 class Conv1dfftAutograd(Conv1dfft):
@@ -1365,10 +1491,10 @@ class Conv1dfftSimple(Conv1dfftAutograd):
 
         # Pad and transform the input.
         input = torch_pad(input, (0, self.kernel_size - 1))
-        input = torch.rfft(input, 1)
+        input = rfft_pairs(input, 1)
         # Pad and transform the filters.
         filter = torch_pad(self.filter, (0, input_size - 1))
-        filter = torch.rfft(filter, 1)
+        filter = rfft_pairs(filter, 1)
 
         if self.compress_rate is not None and self.compress_rate > 0:
             # 4 dims: batch, channel, time-series, complex values.
@@ -1381,7 +1507,7 @@ class Conv1dfftSimple(Conv1dfftAutograd):
         out = fast_jmul(input, conj(filter))
         if out.shape[-1] < fft_size:
             out = complex_pad_simple(out, fft_size)
-        out = torch.irfft(out, 1, signal_sizes=(fft_size,))
+        out = irfft_pairs(out, 1, signal_sizes=(fft_size,))
         if out.shape[-1] > out_size:
             out = out[..., :out_size]
 
@@ -1461,10 +1587,10 @@ class Conv1dfftSimpleForLoop(Conv1dfftAutograd):
 
         # Pad and transform the input.
         input = torch_pad(input, (0, fft_size - input_size))
-        input = torch.rfft(input, 1)
+        input = rfft_pairs(input, 1)
         # Pad and transform the filters.
         filter = torch_pad(self.filter, (0, fft_size - self.kernel_size))
-        filter = torch.rfft(filter, 1)
+        filter = rfft_pairs(filter, 1)
 
         # Change from the percentage of how many coefficient should be discarded
         # to the the actual number of coefficients to discard.
@@ -1516,7 +1642,7 @@ class Conv1dfftSimpleForLoop(Conv1dfftAutograd):
                                             fft_size=fft_size)
             else:
                 out = fast_jmul(signal, conj(filter))
-                out = torch.irfft(out, 1, signal_sizes=(fft_size,))
+                out = irfft_pairs(out, 1, signal_sizes=(fft_size,))
             if out.shape[-1] > out_size:
                 out = out[..., :out_size]
             elif out.shape[-1] < out_size:
@@ -1607,7 +1733,7 @@ class Conv1dfftCompressSignalOnly(Conv1dfftAutograd):
         # The input after fft is roughly 2 times smaller (in complex
         # representation) in terms of the length of the signal in the frequency
         # domain.
-        input = torch.rfft(input, 1)
+        input = rfft_pairs(input, 1)
         init_half_fft_size = input.shape[-2]
 
         out_size = input_size - self.kernel_size + 1
@@ -1661,7 +1787,7 @@ class Conv1dfftCompressSignalOnly(Conv1dfftAutograd):
         # Pad and transform the filters - after fft_size was decreased for the
         # input signal via compression.
         filter = torch_pad(self.filter, (0, fft_size - filter_size))
-        filter = torch.rfft(filter, 1)
+        filter = rfft_pairs(filter, 1)
 
         output = torch.zeros([batch_num, filter_num, out_size],
                              dtype=input.dtype, device=input.device)
@@ -1672,7 +1798,7 @@ class Conv1dfftCompressSignalOnly(Conv1dfftAutograd):
             out = fast_jmul(signal, conj(filter))
             if out.shape[-1] < fft_size:
                 out = complex_pad_simple(out, fft_size)
-            out = torch.irfft(out, 1, signal_sizes=(fft_size,))
+            out = irfft_pairs(out, 1, signal_sizes=(fft_size,))
             if out.shape[-1] > out_size:
                 out = out[..., :out_size]
             elif out.shape[-1] < out_size:
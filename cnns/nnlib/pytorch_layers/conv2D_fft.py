@@ -13,15 +13,24 @@ import torch
 import time
 from torch import tensor
 from torch.nn import Module
+from torch.nn.functional import conv2d
 from torch.nn.functional import pad as torch_pad
 from torch.nn.parameter import Parameter
 from torch.nn import init
 
+from cnns.nnlib.pytorch_layers.energy_index import EnergyPrefix2D
+from cnns.nnlib.pytorch_layers.conv_tiled import conv2D_tiled
+from cnns.nnlib.pytorch_layers.conv_tuner import get_tuner
+from cnns.nnlib.pytorch_layers.conv_tuner import is_compressed
+from cnns.nnlib.pytorch_layers.filter_cache import FilterSpectrumCache
 from cnns.nnlib.pytorch_layers.pytorch_utils import correlate_fft_signals2D
 from cnns.nnlib.pytorch_layers.pytorch_utils import from_tensor
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_pair
-from cnns.nnlib.pytorch_layers.pytorch_utils import preserve_energy2D_symmetry
 from cnns.nnlib.pytorch_layers.pytorch_utils import pytorch_conjugate
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_einsum
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_matmul
+from cnns.nnlib.pytorch_layers.complex_spectral import to_complex
+from cnns.nnlib.pytorch_layers.complex_spectral import to_real
 from cnns.nnlib.pytorch_layers.pytorch_utils import complex_mul
 from cnns.nnlib.pytorch_layers.pytorch_utils import complex_mul2
 from cnns.nnlib.pytorch_layers.pytorch_utils import complex_mul3
@@ -37,7 +46,9 @@ from cnns.nnlib.pytorch_layers.pytorch_utils import get_elem_size
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_tensors_elem_size
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_step_estimate
 from cnns.nnlib.pytorch_layers.pytorch_utils import restore_size_2D
-from cnns.nnlib.utils.general_utils import CompressType, next_power2
+from cnns.nnlib.utils.general_utils import CompressType
+from cnns.nnlib.utils.general_utils import FFTSizeType
+from cnns.nnlib.utils.general_utils import get_fft_size
 from cnns.nnlib.utils.general_utils import ConvExecType
 from cnns.nnlib.utils.general_utils import StrideType
 from cnns.nnlib.utils.arguments import Arguments
@@ -98,29 +109,41 @@ global_threshold = 5321
 
 def fast_multiply(xfft, yfft):
     """
-    Fast complex multiplication (3 real multiplications instead of 4) using
-    torch.matmul (SGEMM).
+    Complex matrix multiplication for each frequency using the native complex
+    torch.matmul (CGEMM).
 
     :param xfft: input with dims: (H, W, N, C, I)
-    :param yfft: input with dims: (H, W, C, F, I
-    :return: outfft: output with dims: (N, F, H, W, I)
+    :param yfft: input with dims: (H, W, C, F, I)
+    :return: outfft: output with dims: (H, W, N, F, I)
     """
-    x_re = xfft[..., 0]
-    x_im = xfft[..., 1]
-    y_re = yfft[..., 0]
-    y_im = yfft[..., 1]
-
-    # Change to matrix multiply.
-    # UaVc = x_re * (y_re + y_im)
-    # out_re = UaVc - (x_re + x_im) * y_im
-    # out_im = (x_im - x_re) * y_re + UaVc
-    UaVc = torch.matmul(x_re, (y_re + y_im))
-    out_re = UaVc - torch.matmul((x_re + x_im), y_im)
-    out_im = torch.matmul((x_im - x_re), y_re) + UaVc
-    outfft = torch.cat((out_re.unsqueeze(-1),
-                        out_im.unsqueeze(-1)),
-                       dim=-1)
-    return outfft
+    return complex_matmul(xfft, yfft)
+
+
+def get_filter_spectrum2D(filter, init_H_fft, init_W_fft, fft_type="real_fft",
+                          indexes_forward=()):
+    """
+    Compute the spectrum of the filter for the correlation with the input.
+
+    :param filter: the filter (F, C, HH, WW)
+    :param init_H_fft: the height of the fft
+    :param init_W_fft: the width of the fft
+    :param fft_type: real_fft or complex_fft
+    :param indexes_forward: the indexes forward of the spectral pooling and
+    the compression (applied in this order)
+    :return: the conjugated spectrum of the filter padded to the fft size and
+    compressed
+    """
+    _, _, HH, WW = filter.size()
+    filter = torch_pad(filter, (0, init_W_fft - WW, 0, init_H_fft - HH),
+                       'constant', 0)
+    # The spectrum is viewed as the pairs (the last dimension of size 2).
+    if fft_type == "real_fft":
+        yfft = torch.view_as_real(torch.fft.rfftn(filter, dim=(-2, -1)))
+    else:
+        yfft = torch.view_as_real(torch.fft.fftn(filter, dim=(-2, -1)))
+    for index_forward in indexes_forward:
+        yfft = compress_2D_index_forward(yfft, index_forward)
+    return pytorch_conjugate(yfft)
 
 
 class Conv2dfftFunction(torch.autograd.Function):
@@ -133,7 +156,7 @@ class Conv2dfftFunction(torch.autograd.Function):
     @staticmethod
     def forward(ctx, input, filter, bias=None, padding=(0, 0), stride=(1, 1),
                 args=Arguments(), out_size=None, is_manual=tensor([0]),
-                conv_index=None):
+                conv_index=None, filter_cache=None):
         """
         Compute the forward pass for the 2D convolution.
 
@@ -174,6 +197,8 @@ class Conv2dfftFunction(torch.autograd.Function):
         representation in the frequency domain? STANDARD: cut off the same
         number of coefficients for each signal and filter in the batch based on
         the whole energy of the signals in the batch.
+        :param filter_cache: the cache of the spectra of the filter (for the
+        inference mode), None: compute the spectrum of the filter.
 
         :return: the result of convolution.
         """
@@ -292,9 +317,12 @@ class Conv2dfftFunction(torch.autograd.Function):
         WWW = max(out_W, WW)
         init_W_fft = W + 2 * pad_W + WWW - 1
 
-        if use_next_power2 is True:
-            init_H_fft = next_power2(init_H_fft)
-            init_W_fft = next_power2(init_W_fft)
+        fft_size_type = args.fft_size_type
+        if fft_size_type is None:
+            fft_size_type = FFTSizeType.POWER2 if use_next_power2 is True \
+                else FFTSizeType.EXACT
+        init_H_fft = get_fft_size(init_H_fft, fft_size_type)
+        init_W_fft = get_fft_size(init_W_fft, fft_size_type)
 
         if is_debug:
             global_init_time += time.time() - start_init_time
@@ -315,13 +343,6 @@ class Conv2dfftFunction(torch.autograd.Function):
             input, (pad_W, pad_W + fft_padding_input_W, pad_H,
                     pad_H + fft_padding_input_H), 'constant', 0)
 
-        fft_padding_filter_H = init_H_fft - HH
-        fft_padding_filter_W = init_W_fft - WW
-
-        filter = torch_pad(
-            filter, (0, fft_padding_filter_W, 0, fft_padding_filter_H),
-            'constant', 0)
-
         if is_debug:
             global global_pad_time
             global_pad_time += time.time() - start_pad_time
@@ -338,29 +359,14 @@ class Conv2dfftFunction(torch.autograd.Function):
         if args.fft_type == "real_fft":
             # This is the main fft (real) type. However, PyTorch might run this
             # slower than the fft complex type.
-            # fft of the input and filters
-            xfft = torch.rfft(input, signal_ndim=Conv2dfftFunction.signal_ndim,
-                              onesided=True)
+            # fft of the input (the filters are fft-ed once the compression
+            # indexes are known)
+            xfft = to_real(torch.fft.rfftn(input, dim=(-2, -1)))
             del input
-
-            yfft = torch.rfft(filter,
-                              signal_ndim=Conv2dfftFunction.signal_ndim,
-                              onesided=True)
-            del filter
         else:
-            # build complex tensors with 0 in the imaginary part
-            n, c, h, w = input.size()
-            zeros = torch.zeros(n, c, h, w, 1, dtype=input.dtype,
-                                device=input.device)
-            input.unsqueeze_(-1)
-            filter.unsqueeze(-1)
-            input = torch.cat((input, zeros), dim=-1)
-            filter = torch.cat((filter, zeros), dim=-1)
-            xfft = torch.fft(input, signal_ndim=Conv2dfftFunction.signal_ndim)
-            yfft = torch.fft(filter, signal_ndim=Conv2dfftFunction.signal_ndim)
-
+            # The complex fft of the real input (0 in the imaginary part).
+            xfft = to_real(torch.fft.fftn(input, dim=(-2, -1)))
             del input
-            del filter
 
         if is_debug:
             global_fft_time += time.time() - start_fft_time
@@ -376,6 +382,11 @@ class Conv2dfftFunction(torch.autograd.Function):
         init_half_W_fft = xfft.shape[-2]
         init_H_fft = xfft.shape[-3]
 
+        # The spectrum of the filter is compressed with the same indexes
+        # forward as the spectrum of the input.
+        indexes_forward = []
+        yfft = None
+
         # Pooling either via stride or explicitly via out_size_W.
         if out_size or stride_type is StrideType.SPECTRAL:
             # We take one-sided fft so the output after the inverse fft should
@@ -383,16 +394,19 @@ class Conv2dfftFunction(torch.autograd.Function):
             # twice smaller than the one in the spatial domain.
             half_fft_W = out_W // 2 + 1
             xfft = compress_2D_index_forward(xfft, half_fft_W)
-            yfft = compress_2D_index_forward(yfft, half_fft_W)
+            indexes_forward.append(half_fft_W)
 
         # Compression.
         if preserve_energy is not None and preserve_energy < 100.0:
             if is_debug:
                 start_energy = time.time()
 
-            xfft, yfft = preserve_energy2D_symmetry(
-                xfft, yfft, preserve_energy_rate=preserve_energy,
-                is_debug=is_debug)
+            # The index depends only on the energy of the input (as in
+            # preserve_energy2D_symmetry).
+            index_forward = EnergyPrefix2D(xfft).get_index_forward(
+                preserve_energy)
+            xfft = compress_2D_index_forward(xfft, index_forward)
+            indexes_forward.append(index_forward)
 
             if is_debug:
                 global global_preserve_energy_time
@@ -403,6 +417,9 @@ class Conv2dfftFunction(torch.autograd.Function):
         elif compress_rate_W is not None and compress_rate_W > 0:
             is_fine_grained_sparsification = False  # this is for tests
             if is_fine_grained_sparsification:
+                yfft = get_filter_spectrum2D(
+                    filter, init_H_fft=init_H_fft, init_W_fft=init_W_fft,
+                    fft_type=args.fft_type, indexes_forward=indexes_forward)
                 xfft_spectrum = get_spectrum(xfft)
                 yfft_spectrum = get_spectrum(yfft)
                 for _ in range(compress_rate_W):
@@ -416,7 +433,7 @@ class Conv2dfftFunction(torch.autograd.Function):
                 # index_forward_W_fft = min(index_forward_W_fft,
                 #                           init_half_W_fft - 1)
                 xfft = compress_2D_index_forward(xfft, index_forward_W_fft)
-                yfft = compress_2D_index_forward(yfft, index_forward_W_fft)
+                indexes_forward.append(index_forward_W_fft)
 
         _, _, half_fft_compressed_H, half_fft_compressed_W, _ = xfft.size()
 
@@ -449,12 +466,26 @@ class Conv2dfftFunction(torch.autograd.Function):
             global global_conjugate_time
             start_conjugate = time.time()
 
-        yfft = pytorch_conjugate(yfft)
+        if yfft is None:
+            def compute_spectrum(filter):
+                return get_filter_spectrum2D(
+                    filter, init_H_fft=init_H_fft, init_W_fft=init_W_fft,
+                    fft_type=args.fft_type, indexes_forward=indexes_forward)
+
+            if filter_cache is None:
+                yfft = compute_spectrum(filter)
+            else:
+                key = (init_H_fft, init_W_fft, args.fft_type,
+                       tuple(indexes_forward))
+                yfft = filter_cache.get(filter, key=key,
+                                        compute=compute_spectrum)
+        del filter
 
         if is_debug:
             global_conjugate_time += time.time() - start_conjugate
             if global_counter % global_threshold == 0:
-                print("conjugate time: ", global_conjugate_time)
+                print("filter spectrum (fft, compress, conjugate) time: ",
+                      global_conjugate_time)
 
         if is_debug:
             start_correlation = time.time()
@@ -566,15 +597,9 @@ class Conv2dfftFunction(torch.autograd.Function):
             #     xfft_nn = xfft[start:stop]
             #     outfft[start:stop] = complex_mul_cpp(xfft_nn, yfft).sum(dim=2)
             elif args.conv_exec_type is ConvExecType.BATCH:
-                xfft = xfft.unsqueeze(dim=1)
-                # outfft = torch.empty([N, F, C, xfft.shape[2], xfft.shape[3], 2],
-                #                      dtype=dtype, device=device)
-                # complex_mul5(xfft, yfft, outfft)
-                outfft = complex_mul(xfft, yfft)
-                # outfft = complex_mul_cpp(xfft, yfft)
-                outfft = outfft.sum(dim=2)
-                # torch.cuda.synchronize()
-                xfft = xfft.squeeze(dim=1)
+                # Sum the products over the channels (C) with a single
+                # complex contraction: N, C, H, W x F, C, H, W -> N, F, H, W.
+                outfft = complex_einsum('nchw,fchw->nfhw', xfft, yfft)
 
             else:
                 raise Exception(f"Unknown conv exec "
@@ -604,15 +629,13 @@ class Conv2dfftFunction(torch.autograd.Function):
                 start_irfft_time = time.time()
 
             if args.fft_type == "real_fft":
-                out = torch.irfft(input=outfft,
-                                  signal_ndim=Conv2dfftFunction.signal_ndim,
-                                  signal_sizes=(init_H_fft, init_W_fft),
-                                  onesided=True)
+                out = torch.fft.irfftn(to_complex(outfft),
+                                       s=(init_H_fft, init_W_fft),
+                                       dim=(-2, -1))
             elif args.fft_type == "complex_fft":
-                out = torch.ifft(input=outfft,
-                                 signal_ndim=Conv2dfftFunction.signal_ndim)
+                out = torch.fft.ifftn(to_complex(outfft), dim=(-2, -1))
                 # print("out: ", out)
-                out = out[..., 0]  # retain only the real numbers
+                out = out.real  # retain only the real numbers
 
             if is_debug:
                 global global_irfft_time
@@ -806,9 +829,7 @@ class Conv2dfftFunction(torch.autograd.Function):
         if is_debug:
             start_fft_grad = time.time()
 
-        doutfft = torch.rfft(padded_dout,
-                             signal_ndim=Conv2dfftFunction.signal_ndim,
-                             onesided=True)
+        doutfft = to_real(torch.fft.rfftn(padded_dout, dim=(-2, -1)))
         del padded_dout
 
         if is_debug:
@@ -951,21 +972,9 @@ class Conv2dfftFunction(torch.autograd.Function):
 
                 elif args.conv_exec_type is ConvExecType.BATCH:
 
-                    dxfft = torch.zeros([N, C, half_fft_compressed_H,
-                                         half_fft_compressed_W, 2],
-                                        dtype=dtype, device=device)
-
-                    # Convolve some part of the dout batch with all filters.
-                    # 2 is for complex numbers
-                    start = 0
-                    # step = get_step_estimate(xfft, yfft, args.memory_size, scale=1)
-                    step = args.min_batch_size
-                    doutfft = doutfft.unsqueeze(dim=2)
-                    for start in range(start, N, step):
-                        stop = min(start + step, N)
-                        doutfft_nn = doutfft[start:stop]
-                        dxfft[start:stop] = complex_mul(doutfft_nn,
-                                                        yfft).sum(dim=1)
+                    # Sum the products over the filters (F):
+                    # N, F, H, W x F, C, H, W -> N, C, H, W.
+                    dxfft = complex_einsum('nfhw,fchw->nchw', doutfft, yfft)
                 else:
                     raise Exception(f"Unknown conv exec "
                                     f"type: {args.conv_exec_type.name}.")
@@ -992,10 +1001,8 @@ class Conv2dfftFunction(torch.autograd.Function):
                 if is_debug:
                     start_irfft_input = time.time()
 
-                dx = torch.irfft(input=dxfft,
-                                 signal_ndim=Conv2dfftFunction.signal_ndim,
-                                 signal_sizes=(init_H_fft, init_W_fft),
-                                 onesided=True)
+                dx = torch.fft.irfftn(to_complex(dxfft),
+                                      s=(init_H_fft, init_W_fft), dim=(-2, -1))
                 del dxfft
 
                 if is_debug:
@@ -1161,25 +1168,9 @@ class Conv2dfftFunction(torch.autograd.Function):
                             "device is available.")
                 elif args.conv_exec_type is ConvExecType.BATCH:
 
-                    # 2 is for the complex numbers
-                    dwfft = torch.zeros([F, C, half_fft_compressed_H,
-                                         half_fft_compressed_W, 2],
-                                        dtype=dtype, device=device)
-
-                    # Convolve some part of the dout batch with all input maps.
-                    start = 0
-                    # step = get_step_estimate(xfft, doutfft, memory_size=memory_size,
-                    #                          scale=4)
-                    step = args.min_batch_size
-                    if len(
-                            doutfft.shape) == 5:  # we did not need grad for input
-                        doutfft.unsqueeze_(dim=2)
-                    doutfft = doutfft.permute(1, 0, 2, 3, 4, 5)
-                    for start in range(start, F, step):
-                        stop = min(start + step, F)
-                        doutfft_nn = doutfft[start:stop]
-                        dwfft[start:stop] = complex_mul(xfft, doutfft_nn).sum(
-                            dim=1)
+                    # Sum the products over the data points (N):
+                    # N, C, H, W x N, F, H, W -> F, C, H, W.
+                    dwfft = complex_einsum('nchw,nfhw->fchw', xfft, doutfft)
                 else:
                     raise Exception(f"Unknown conv exec "
                                     f"type: {args.conv_exec_type.name}.")
@@ -1206,10 +1197,8 @@ class Conv2dfftFunction(torch.autograd.Function):
                 if is_debug:
                     start_irfft_filter = time.time()
 
-                dw = torch.irfft(input=dwfft,
-                                 signal_ndim=Conv2dfftFunction.signal_ndim,
-                                 signal_sizes=(init_H_fft, init_W_fft),
-                                 onesided=True)
+                dw = torch.fft.irfftn(to_complex(dwfft),
+                                      s=(init_H_fft, init_W_fft), dim=(-2, -1))
                 del dwfft
 
                 if is_debug:
@@ -1230,7 +1219,7 @@ class Conv2dfftFunction(torch.autograd.Function):
         # else:
         #     print("dw size: ", dw.size())
 
-        return dx, dw, db, None, None, None, None, None, None
+        return dx, dw, db, None, None, None, None, None, None, None
 
 
 class Conv2dfft(Module):
@@ -1239,6 +1228,10 @@ class Conv2dfft(Module):
     2d fft layers .
     """
     conv_index_counter = 0
+    # The conv exec types supported by the layer (for the tuner).
+    conv_exec_types = (ConvExecType.SERIAL, ConvExecType.BATCH,
+                       ConvExecType.SGEMM, ConvExecType.CUDA,
+                       ConvExecType.CUDA_SHARED_LOG, ConvExecType.CUDA_DEEP)
 
     def __init__(self, in_channels=None, out_channels=None, kernel_size=None,
                  stride=1, padding=0, dilation=None, groups=None, bias=False,
@@ -1364,8 +1357,61 @@ class Conv2dfft(Module):
             self.is_debug = args.is_debug
             self.compress_type = args.compress_type
 
+        self.filter_cache = None
+        if args is not None and args.filter_cache:
+            self.set_filter_cache(is_enabled=True)
+
+        # The conv exec type and fft size picked by the tuner for the last
+        # shape of the input.
+        self.tuner = None
+        self.tuned_key = None
+        self.tuned_args = None
+        if args is not None and args.conv_tuning:
+            self.set_tuner(get_tuner(args.tuning_file))
+
         self.reset_parameters()
 
+    def set_tuner(self, tuner):
+        """
+        :param tuner: the ConvTuner that picks the conv exec type and the fft
+        size for each shape of the input (None: use the args)
+        """
+        self.tuner = tuner
+        self.tuned_key = None
+        self.tuned_args = None
+
+    def get_filter(self):
+        return self.weight
+
+    def set_filter_cache(self, is_enabled=True):
+        """
+        Cache the spectra of the filters in the inference mode (the cache is
+        cleared when the weights change or the layer is switched to the train
+        mode).
+        """
+        self.filter_cache = FilterSpectrumCache() if is_enabled else None
+
+    def get_filter_cache(self):
+        """
+        :return: the filter spectrum cache if it can be used in this pass
+        """
+        if self.training:
+            return None
+        return self.filter_cache
+
+    def get_filter_cache_memory(self):
+        """
+        :return: the number of bytes held by the cached spectra of the filters
+        """
+        if self.filter_cache is None:
+            return 0
+        return self.filter_cache.get_memory_size()
+
+    def train(self, mode=True):
+        if self.filter_cache is not None:
+            self.filter_cache.clear()
+        return super(Conv2dfft, self).train(mode)
+
     def reset_parameters(self):
         if self.is_weight_value is not None and self.is_weight_value is False:
             if self.weight.dtype is torch.half:
@@ -1397,12 +1443,39 @@ class Conv2dfft(Module):
         :param input: the input map (e.g., an image)
         :return: the result of 2D convolution
         """
+        args = self.args
+        if self.tuner is not None:
+            args = self.tuner.get_layer_args(self, input)
+            if args is None:
+                return self.forward_standard(input)
+        return self.forward_fft(input, args=args,
+                                filter_cache=self.get_filter_cache())
+
+    def forward_fft(self, input, args, filter_cache=None):
         # ctx, input, filter, bias, padding = (0, 0), stride = (1, 1),
         # args = None, out_size = None, is_manual = tensor([0]),
-        # conv_index = None
+        # conv_index = None, filter_cache = None
+        if args.conv_exec_type is ConvExecType.TILED:
+            if is_compressed(self):
+                raise Exception("The tiled conv does not support the "
+                                "compression.")
+            return conv2D_tiled(input, self.weight, self.bias,
+                                padding=get_pair(self.padding),
+                                stride=get_pair(self.stride),
+                                tile_size=args.tile_size,
+                                memory_size=args.tile_memory_size)
         return Conv2dfftFunction.apply(
             input, self.weight, self.bias, self.padding, self.stride,
-            self.args, self.out_size, self.is_manual, self.conv_index)
+            args, self.out_size, self.is_manual, self.conv_index,
+            filter_cache)
+
+    def forward_standard(self, input):
+        """
+        The standard PyTorch convolution (the same result as the fft based
+        one without compression).
+        """
+        return conv2d(input, self.weight, self.bias, stride=self.stride,
+                      padding=self.padding)
 
 
 class Conv2dfftAutograd(Conv2dfft):
@@ -1641,7 +1714,9 @@ class Conv2dfftAutograd(Conv2dfft):
         return Conv2dfftFunction.forward(
             ctx=None, input=input, filter=self.weight, bias=self.bias,
             padding=self.padding, stride=self.stride, is_manual=self.is_manual,
-            conv_index=self.conv_index, args=self.args, out_size=self.out_size)
+            conv_index=self.conv_index, args=self.args, out_size=self.out_size,
+            filter_cache=None if torch.is_grad_enabled() else
+            self.get_filter_cache())
 
 
 def test_run():
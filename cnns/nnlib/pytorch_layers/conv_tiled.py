@@ -0,0 +1,191 @@
+"""
+The tiled (overlap-save) FFT based convolution with bounded memory.
+
+The output map is split into tiles of size T (for each spatial dimension).
+Each output tile is computed from the input tile of size L = T + K - 1 (K is
+the size of the filter) that overlaps with the neighbouring input tiles by
+K - 1 elements. The circular correlation of the input tile with the filter
+(zero padded to L) via the FFT of size L is exact for the first T elements
+(no wrap-around) - this is the overlap-save method.
+
+The tiles are processed in chunks that fit in the memory budget. The
+products of the spectra are summed over the input channels by a complex
+einsum (a batched matrix multiplication for each frequency), so the full
+(N, F, C, H, W) product is never materialised. The peak memory is bounded by
+the budget (plus the input, the output and the spectrum of the filter).
+
+The 1D convolution is the 2D convolution with the height of 1.
+
+The backward pass is computed by autograd (the tensors of each chunk are
+kept for the backward pass, so the budget bounds the memory only in the
+inference mode).
+"""
+import math
+import torch
+from torch.nn.functional import pad as torch_pad
+
+from cnns.nnlib.utils.general_utils import next_smooth
+
+# The size of a complex number (in float32) in bytes.
+COMPLEX_SIZE = 8
+
+
+def get_smooth_sizes(min_size, max_size):
+    """
+    :return: the 2-3-5-7 smooth numbers in [min_size, next_smooth(max_size)]
+    """
+    sizes = []
+    size = next_smooth(min_size)
+    while True:
+        sizes.append(size)
+        if size >= max_size:
+            return sizes
+        size = next_smooth(size + 1)
+
+
+def get_tile_cost(out_size, kernel_size, fft_size):
+    """
+    :return: the cost of the ffts (n log n) of all the tiles along one
+    dimension
+    """
+    tiles = math.ceil(out_size / (fft_size - kernel_size + 1))
+    return tiles * fft_size * math.log2(max(fft_size, 2))
+
+
+def get_tile_bytes(C, F, fft_H, fft_W):
+    """
+    :return: the number of bytes used to compute one output tile: the input
+    tile, its spectrum, the spectrum of the output tile and the output tile
+    """
+    half_W = fft_W // 2 + 1
+    return ((C + F) * fft_H * half_W * COMPLEX_SIZE +
+            (C + F) * fft_H * fft_W * COMPLEX_SIZE // 2)
+
+
+def get_fft_tile_size(out_size, kernel_size, tile_size=None):
+    """
+    :param out_size: the size of the output (along one dimension)
+    :param kernel_size: the size of the filter
+    :param tile_size: the size of the fft of the tile (None: pick the 2-3-5-7
+    smooth size with the smallest cost of the ffts)
+    :return: the fft size of the tile
+    """
+    if tile_size is not None:
+        if tile_size < kernel_size:
+            raise Exception(f"The tile size {tile_size} is smaller than the "
+                            f"filter size {kernel_size}.")
+        return min(tile_size, out_size + kernel_size - 1)
+    sizes = get_smooth_sizes(min_size=kernel_size,
+                             max_size=out_size + kernel_size - 1)
+    return min(sizes, key=lambda size: get_tile_cost(
+        out_size=out_size, kernel_size=kernel_size, fft_size=size))
+
+
+def get_chunks(N, rows, rows_per_chunk):
+    """
+    :return: the chunks of the tiles: (first data point, last data point,
+    first row of tiles, last row of tiles) - whole data points if all their
+    rows fit in a chunk, otherwise the rows of a single data point
+    """
+    if rows_per_chunk >= rows:
+        step = rows_per_chunk // rows
+        return [(n, min(n + step, N), 0, rows) for n in range(0, N, step)]
+    return [(n, n + 1, row, min(row + rows_per_chunk, rows)) for n in
+            range(N) for row in range(0, rows, rows_per_chunk)]
+
+
+def conv2D_tiled(input, filter, bias=None, padding=(0, 0), stride=(1, 1),
+                 tile_size=None, memory_size=1.0):
+    """
+    The 2D convolution (correlation, as in PyTorch) via the tiled FFT.
+
+    :param input: the input maps (N, C, H, W)
+    :param filter: the filters (F, C, HH, WW)
+    :param bias: the bias terms (F)
+    :param padding: the padding (pad_H, pad_W)
+    :param stride: the stride (stride_H, stride_W)
+    :param tile_size: the fft size of the tiles (tile_H, tile_W), None: picked
+    by the cost of the ffts
+    :param memory_size: the memory budget for the tiles (in GB)
+    :return: the output maps (N, F, out_H, out_W)
+    """
+    dtype = input.dtype
+    N, C, H, W = input.size()
+    F, _, HH, WW = filter.size()
+    pad_H, pad_W = padding
+    stride_H, stride_W = stride
+    out_H = H + 2 * pad_H - HH + 1
+    out_W = W + 2 * pad_W - WW + 1
+    if tile_size is None or isinstance(tile_size, int):
+        tile_size = (tile_size, tile_size)
+    fft_H = get_fft_tile_size(out_H, HH, tile_size[0])
+    fft_W = get_fft_tile_size(out_W, WW, tile_size[1])
+    # The number of the output values in a tile.
+    tile_H = fft_H - HH + 1
+    tile_W = fft_W - WW + 1
+    rows = math.ceil(out_H / tile_H)
+    cols = math.ceil(out_W / tile_W)
+
+    # The half precision fft is not supported on all devices, so it is
+    # computed in float32 (float32 and float64 are kept as they are).
+    fft_dtype = dtype
+    if dtype in (torch.float16, torch.bfloat16):
+        fft_dtype = torch.float32
+    input = input.to(fft_dtype)
+    filter = filter.to(fft_dtype)
+    # Pad the input so that all the tiles are full.
+    input = torch_pad(input, (pad_W, cols * tile_W + WW - 1 - W - pad_W,
+                              pad_H, rows * tile_H + HH - 1 - H - pad_H))
+    # The tiles overlap (it is a view of the input): N, C, rows, cols, L, L.
+    tiles = input.unfold(2, fft_H, tile_H).unfold(3, fft_W, tile_W)
+
+    yfft = torch.fft.rfft2(filter, s=(fft_H, fft_W)).conj()
+
+    memory_bytes = memory_size * 2 ** 30
+    row_bytes = cols * get_tile_bytes(C=C, F=F, fft_H=fft_H, fft_W=fft_W)
+    rows_per_chunk = max(1, int(memory_bytes // row_bytes))
+
+    out = torch.empty(N, F, rows * tile_H, cols * tile_W, dtype=input.dtype,
+                      device=input.device)
+    for n_start, n_stop, row_start, row_stop in get_chunks(
+            N=N, rows=rows, rows_per_chunk=rows_per_chunk):
+        chunk = tiles[n_start:n_stop, :, row_start:row_stop]
+        chunk_N, _, chunk_rows, _, _, _ = chunk.size()
+        # From N, C, rows, cols, L, L to N * rows * cols, C, L, L.
+        chunk = chunk.permute(0, 2, 3, 1, 4, 5).reshape(-1, C, fft_H, fft_W)
+        xfft = torch.fft.rfft2(chunk)
+        del chunk
+        # Sum over the input channels (without the 5D product).
+        outfft = torch.einsum('bchw,fchw->bfhw', xfft, yfft)
+        del xfft
+        chunk_out = torch.fft.irfft2(outfft, s=(fft_H, fft_W))
+        del outfft
+        chunk_out = chunk_out[..., :tile_H, :tile_W]
+        # From N * rows * cols, F, T, T to N, F, rows * T, cols * T.
+        chunk_out = chunk_out.reshape(chunk_N, chunk_rows, cols, F, tile_H,
+                                      tile_W).permute(0, 3, 1, 4, 2, 5)
+        chunk_out = chunk_out.reshape(chunk_N, F, chunk_rows * tile_H,
+                                      cols * tile_W)
+        out[n_start:n_stop, :, row_start * tile_H:row_stop * tile_H] = \
+            chunk_out
+    out = out[..., :out_H:stride_H, :out_W:stride_W]
+    if bias is not None:
+        out = out + bias.to(fft_dtype).view(1, F, 1, 1)
+    return out.to(dtype)
+
+
+def conv1D_tiled(input, filter, bias=None, padding=0, stride=1,
+                 tile_size=None, memory_size=1.0):
+    """
+    The 1D convolution (correlation, as in PyTorch) via the tiled FFT.
+
+    :param input: the input time-series (N, C, W)
+    :param filter: the filters (F, C, WW)
+    :param tile_size: the fft size of the tiles, None: picked by the cost of
+    the ffts
+    :return: the output (N, F, out_W)
+    """
+    out = conv2D_tiled(input.unsqueeze(2), filter.unsqueeze(2), bias=bias,
+                       padding=(0, padding), stride=(1, stride),
+                       tile_size=(1, tile_size), memory_size=memory_size)
+    return out.squeeze(2)
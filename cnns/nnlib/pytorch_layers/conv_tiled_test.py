@@ -0,0 +1,111 @@
+import unittest
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from cnns.nnlib.pytorch_layers.conv1D_fft import Conv1dfft
+from cnns.nnlib.pytorch_layers.conv2D_fft import Conv2dfft
+from cnns.nnlib.pytorch_layers.conv_tiled import conv1D_tiled
+from cnns.nnlib.pytorch_layers.conv_tiled import conv2D_tiled
+from cnns.nnlib.pytorch_layers.conv_tiled import get_chunks
+from cnns.nnlib.pytorch_layers.conv_tiled import get_fft_tile_size
+from cnns.nnlib.utils.arguments import Arguments
+from cnns.nnlib.utils.general_utils import ConvExecType
+
+
+class TestConvTiled(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+
+    def test_conv2D(self):
+        input = torch.randn(3, 4, 17, 13)
+        filter = torch.randn(5, 4, 3, 3)
+        bias = torch.randn(5)
+        expected = F.conv2d(input, filter, bias, padding=1, stride=2)
+        for tile_size, memory_size in [(None, 1.0), ((6, 5), 1e-7), (8, 1e-6)]:
+            result = conv2D_tiled(input, filter, bias, padding=(1, 1),
+                                  stride=(2, 2), tile_size=tile_size,
+                                  memory_size=memory_size)
+            np.testing.assert_allclose(actual=result.numpy(),
+                                       desired=expected.numpy(), rtol=1e-4,
+                                       atol=1e-4)
+
+    def test_dtypes(self):
+        input = torch.randn(2, 3, 10, 10, dtype=torch.float64)
+        filter = torch.randn(4, 3, 3, 3, dtype=torch.float64)
+        expected = F.conv2d(input, filter, padding=1)
+        result = conv2D_tiled(input, filter, padding=(1, 1), stride=(1, 1),
+                              tile_size=6)
+        # The double precision is not downcast.
+        self.assertEqual(result.dtype, torch.float64)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), rtol=1e-10,
+                                   atol=1e-10)
+        # The half precision is computed in float32 and cast back.
+        result = conv2D_tiled(input.half(), filter.half(), padding=(1, 1),
+                              stride=(1, 1), tile_size=6)
+        self.assertEqual(result.dtype, torch.float16)
+        np.testing.assert_allclose(actual=result.float().numpy(),
+                                   desired=expected.numpy(), rtol=1e-2,
+                                   atol=5e-2)
+
+    def test_conv1D_backward(self):
+        input = torch.randn(2, 3, 100, requires_grad=True)
+        filter = torch.randn(4, 3, 7, requires_grad=True)
+        result = conv1D_tiled(input, filter, padding=3, tile_size=16,
+                              memory_size=1e-7)
+        result.sum().backward()
+        grads = input.grad.clone(), filter.grad.clone()
+        input.grad, filter.grad = None, None
+        expected = F.conv1d(input, filter, padding=3)
+        expected.sum().backward()
+        np.testing.assert_allclose(actual=result.detach().numpy(),
+                                   desired=expected.detach().numpy(),
+                                   rtol=1e-4, atol=1e-4)
+        for grad, expected_grad in zip(grads, [input.grad, filter.grad]):
+            np.testing.assert_allclose(actual=grad.numpy(),
+                                       desired=expected_grad.numpy(),
+                                       rtol=1e-4, atol=1e-4)
+
+    def test_tiles(self):
+        # Whole data points per chunk or the rows of a single data point.
+        self.assertEqual(get_chunks(N=3, rows=2, rows_per_chunk=4),
+                         [(0, 2, 0, 2), (2, 3, 0, 2)])
+        self.assertEqual(get_chunks(N=2, rows=3, rows_per_chunk=2),
+                         [(0, 1, 0, 2), (0, 1, 2, 3), (1, 2, 0, 2),
+                          (1, 2, 2, 3)])
+        # Two tiles of size 7 (5 outputs each) are cheaper than one of 12.
+        self.assertEqual(get_fft_tile_size(out_size=10, kernel_size=3), 7)
+        self.assertEqual(get_fft_tile_size(out_size=1, kernel_size=3), 3)
+        self.assertEqual(get_fft_tile_size(out_size=10, kernel_size=3,
+                                           tile_size=8), 8)
+        with self.assertRaises(Exception):
+            get_fft_tile_size(out_size=10, kernel_size=3, tile_size=2)
+
+    def test_layers(self):
+        args = Arguments(conv_exec_type=ConvExecType.TILED, compress_rate=None,
+                         tile_size=8, tile_memory_size=1e-6)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         padding=1, bias=True, args=args)
+        input = torch.randn(2, 3, 20, 20)
+        expected = F.conv2d(input, conv.weight, conv.bias, padding=1)
+        np.testing.assert_allclose(actual=conv(input).detach().numpy(),
+                                   desired=expected.detach().numpy(),
+                                   rtol=1e-4, atol=1e-4)
+        conv = Conv1dfft(in_channels=3, out_channels=4, kernel_size=5,
+                         args=args)
+        input = torch.randn(2, 3, 50)
+        expected = F.conv1d(input, conv.filter, conv.bias)
+        np.testing.assert_allclose(actual=conv(input).detach().numpy(),
+                                   desired=expected.detach().numpy(),
+                                   rtol=1e-4, atol=1e-4)
+        args = Arguments(conv_exec_type=ConvExecType.TILED, compress_rate=30)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=args)
+        with self.assertRaises(Exception):
+            conv(torch.randn(2, 3, 20, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
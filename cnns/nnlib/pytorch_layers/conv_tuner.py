@@ -0,0 +1,246 @@
+"""
+The auto-tuner of the fft based convolution layers.
+
+The best conv exec type (SERIAL, BATCH, SGEMM, CUDA, ...) and fft size
+(exact, the next power of 2 or the next 2-3-5-7 smooth size) depend on the
+shape of each layer (N, C, F, H, W), so one global setting leaves throughput
+unused on the networks with layers of many shapes. The tuner benchmarks the
+candidates (and the standard PyTorch convolution, if the layer does not
+compress the signals, so the results are the same) for each shape of a layer
+and stores the winners in an on-disk tuning cache (a json file) keyed by the
+layer, the shapes, the compression, the tile settings, the device, the
+dtype and the mode.
+
+The compressed spectrum depends on the fft size, so for the layers that
+compress the signals only the conv exec type is tuned (the fft size is set
+by the args of the layer). For the layers in the training mode the forward
+and backward passes are timed and the SERIAL exec type (its gradient of the
+input is not exact) is not a candidate.
+"""
+import copy
+import json
+import logging
+import os
+import time
+import torch
+
+from cnns.nnlib.utils.general_utils import ConvExecType
+from cnns.nnlib.utils.general_utils import FFTSizeType
+from cnns.nnlib.utils.general_utils import StrideType
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TUNING_FILE = os.path.join(os.path.expanduser('~'), '.cnns',
+                                   'conv_tuning.json')
+# The standard (PyTorch) convolution.
+STANDARD_CONV = 'STANDARD'
+CUDA_EXEC_TYPES = (ConvExecType.CUDA, ConvExecType.CUDA_SHARED_LOG,
+                   ConvExecType.CUDA_DEEP)
+
+
+def is_compressed(layer):
+    """
+    :return: True if the layer compresses the signals (then its results
+    differ from the standard convolution)
+    """
+    args = layer.args
+    return (args.compress_rate is not None and args.compress_rate > 0) or (
+            args.preserve_energy is not None and args.preserve_energy < 100) or (
+                   args.layers_compress_rates is not None) or (
+                   layer.out_size is not None) or (
+                   args.stride_type is not StrideType.STANDARD)
+
+
+def get_key(layer, input):
+    """
+    :return: the key of the layer and its input in the tuning cache
+    """
+    args = layer.args
+    fields = [type(layer).__name__, tuple(input.shape),
+              tuple(layer.get_filter().shape), layer.padding, layer.stride,
+              layer.out_size, args.compress_rate, args.preserve_energy,
+              args.layers_compress_rates, args.compress_type.name,
+              args.stride_type.name, args.fft_type, args.tile_size,
+              args.tile_memory_size, input.device, input.dtype, layer.training]
+    return ",".join([str(field) for field in fields])
+
+
+class ConvTuner(object):
+
+    def __init__(self, tuning_file=None, repeat=3):
+        """
+        :param tuning_file: the on-disk cache of the tuned layers
+        :param repeat: the number of the timed runs of each candidate
+        """
+        if tuning_file is None:
+            tuning_file = DEFAULT_TUNING_FILE
+        self.tuning_file = tuning_file
+        self.repeat = repeat
+        self.configs = self.load()
+
+    def load(self):
+        if not os.path.exists(self.tuning_file):
+            return {}
+        with open(self.tuning_file, "r") as file:
+            return json.load(file)
+
+    def save(self):
+        dir_name = os.path.dirname(self.tuning_file)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        # Write the whole cache at once (the readers never see a partial file).
+        tmp_file = self.tuning_file + ".tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(self.configs, file, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.tuning_file)
+
+    def get_candidates(self, layer, input):
+        """
+        :return: the list of the candidates: (conv exec type, fft size type)
+        or (TILED, None) or (STANDARD, None), the fft size type None keeps
+        the fft size of the layer
+        """
+        if is_compressed(layer):
+            # The compressed spectrum depends on the fft size.
+            fft_size_types = [None]
+        else:
+            fft_size_types = [fft_size_type.name for fft_size_type in
+                              FFTSizeType]
+        candidates = []
+        for conv_exec_type in layer.conv_exec_types:
+            if conv_exec_type in CUDA_EXEC_TYPES and not input.is_cuda:
+                continue
+            if conv_exec_type is ConvExecType.SERIAL and layer.training:
+                # The gradient of the input is not exact.
+                continue
+            for fft_size_type in fft_size_types:
+                candidates.append((conv_exec_type.name, fft_size_type))
+        if not is_compressed(layer):
+            # The tiles pick their own fft size.
+            candidates.append((ConvExecType.TILED.name, None))
+            candidates.append((STANDARD_CONV, None))
+        return candidates
+
+    def get_args(self, layer, config):
+        """
+        :return: the args of the layer with the tuned conv exec type and fft
+        size (None for the standard convolution)
+        """
+        conv_exec_type, fft_size_type = config
+        if conv_exec_type == STANDARD_CONV:
+            return None
+        args = copy.copy(layer.args)
+        args.conv_exec_type = ConvExecType[conv_exec_type]
+        if fft_size_type is not None:
+            args.fft_size_type = FFTSizeType[fft_size_type]
+        return args
+
+    def benchmark(self, layer, input, config):
+        """
+        :return: the average time of the forward pass (in sec) of the layer
+        with the config (the forward and backward passes in the training
+        mode)
+        """
+        args = self.get_args(layer, config)
+
+        def forward(input):
+            if args is None:
+                return layer.forward_standard(input)
+            return layer.forward_fft(input, args=args, filter_cache=None)
+
+        if layer.training:
+            input = input.detach().requires_grad_(True)
+            params = [input] + [param for param in layer.parameters() if
+                                param.requires_grad]
+
+            def run():
+                out = forward(input)
+                # The gradients are not accumulated in the parameters.
+                torch.autograd.grad(out, params,
+                                    grad_outputs=torch.ones_like(out))
+        else:
+            def run():
+                with torch.no_grad():
+                    forward(input)
+
+        run()  # warm up
+        if input.is_cuda:
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(self.repeat):
+            run()
+        if input.is_cuda:
+            torch.cuda.synchronize()
+        return (time.time() - start) / self.repeat
+
+    def tune(self, layer, input):
+        """
+        :return: the best config: (conv exec type, fft size type) for the
+        layer and the input
+        """
+        best_config, best_time = None, None
+        for config in self.get_candidates(layer, input):
+            try:
+                config_time = self.benchmark(layer, input, config)
+            except Exception as exception:
+                # The candidate is not supported for this layer.
+                logger.debug(f"skip the conv candidate {config}: {exception}")
+                continue
+            if best_time is None or config_time < best_time:
+                best_config, best_time = config, config_time
+        return best_config, best_time
+
+    def get_layer_args(self, layer, input):
+        """
+        :return: the tuned args of the layer for the input (None for the
+        standard convolution), the layer is tuned if it is not in the cache
+        """
+        key = get_key(layer, input)
+        if layer.tuned_key == key:
+            return layer.tuned_args
+        config = self.configs.get(key)
+        if config is None:
+            best_config, best_time = self.tune(layer, input)
+            if best_config is not None:
+                config = {'conv_exec_type': best_config[0],
+                          'fft_size_type': best_config[1],
+                          'time': best_time}
+                self.configs[key] = config
+                self.save()
+        if config is None:
+            # None of the candidates runs, keep the args of the layer.
+            tuned_args = layer.args
+        else:
+            tuned_args = self.get_args(
+                layer, (config['conv_exec_type'], config['fft_size_type']))
+        layer.tuned_key = key
+        layer.tuned_args = tuned_args
+        return tuned_args
+
+
+tuners = {}
+
+
+def get_tuner(tuning_file=None):
+    """
+    :return: the tuner shared by all the layers with the tuning file
+    """
+    if tuning_file not in tuners:
+        tuners[tuning_file] = ConvTuner(tuning_file=tuning_file)
+    return tuners[tuning_file]
+
+
+def tune_model(model, input, tuning_file=None):
+    """
+    Tune all the fft based convolution layers of the model (e.g. when the
+    model is built) with a single forward pass of the input.
+    """
+    tuner = get_tuner(tuning_file)
+    for module in model.modules():
+        if hasattr(module, 'set_tuner'):
+            module.set_tuner(tuner)
+    is_training = model.training
+    model.eval()
+    with torch.no_grad():
+        model(input)
+    model.train(is_training)
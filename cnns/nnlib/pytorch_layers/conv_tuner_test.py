@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.pytorch_layers.conv1D_fft import Conv1dfft
+from cnns.nnlib.pytorch_layers.conv2D_fft import Conv2dfft
+from cnns.nnlib.pytorch_layers.conv_tuner import ConvTuner
+from cnns.nnlib.pytorch_layers.conv_tuner import STANDARD_CONV
+from cnns.nnlib.pytorch_layers.conv_tuner import get_key
+from cnns.nnlib.pytorch_layers.conv_tuner import tune_model
+from cnns.nnlib.utils.arguments import Arguments
+from cnns.nnlib.utils.general_utils import ConvExecType
+
+
+class TestConvTuner(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.dir = tempfile.mkdtemp()
+        self.tuning_file = os.path.join(self.dir, "tuning.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_tune_conv2D(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH, compress_rate=None)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         padding=1, bias=True, args=args)
+        input = torch.randn(2, 3, 9, 9)
+        expected = conv(input).detach()
+        tuner = ConvTuner(tuning_file=self.tuning_file, repeat=1)
+        conv.set_tuner(tuner)
+        result = conv(input).detach()
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), rtol=1e-4,
+                                   atol=1e-4)
+        self.assertEqual(len(tuner.configs), 1)
+        self.assertTrue(os.path.exists(self.tuning_file))
+        # The config is read from the disk and the layer is not benchmarked.
+        tuner = ConvTuner(tuning_file=self.tuning_file)
+        self.assertEqual(len(tuner.configs), 1)
+        tuner.tune = None
+        conv.set_tuner(tuner)
+        result = conv(input).detach()
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), rtol=1e-4,
+                                   atol=1e-4)
+
+    def test_candidates(self):
+        tuner = ConvTuner(tuning_file=self.tuning_file)
+        input = torch.randn(2, 3, 9, 9)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=Arguments(compress_rate=None))
+        candidates = tuner.get_candidates(conv, input)
+        self.assertIn((STANDARD_CONV, None), candidates)
+        self.assertIn((ConvExecType.SGEMM.name, 'SMOOTH'), candidates)
+        self.assertNotIn((ConvExecType.CUDA.name, 'EXACT'), candidates)
+        # The compressed layer cannot be replaced by the standard conv.
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=Arguments(compress_rate=30))
+        candidates = tuner.get_candidates(conv, input)
+        self.assertNotIn((STANDARD_CONV, None), candidates)
+        # Only the conv exec type is tuned (the fft size of the layer).
+        self.assertEqual({fft_size for _, fft_size in candidates}, {None})
+        # The gradient of the SERIAL exec type is not exact.
+        self.assertNotIn(ConvExecType.SERIAL.name,
+                         [exec_type for exec_type, _ in candidates])
+        conv.eval()
+        candidates = tuner.get_candidates(conv, input)
+        self.assertIn((ConvExecType.SERIAL.name, None), candidates)
+        conv = Conv1dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=Arguments(compress_rate=None))
+        candidates = tuner.get_candidates(conv, torch.randn(2, 3, 20))
+        self.assertNotIn((ConvExecType.SGEMM.name, 'EXACT'), candidates)
+
+    def test_key(self):
+        args = Arguments(conv_exec_type=ConvExecType.TILED, compress_rate=None,
+                         tile_size=8)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=args)
+        input = torch.randn(2, 3, 9, 9)
+        key = get_key(conv, input)
+        # The tiles of a tuned TILED conv depend on the tile settings.
+        args.tile_size = 16
+        self.assertNotEqual(get_key(conv, input), key)
+        args.tile_size = 8
+        args.tile_memory_size = 0.5
+        self.assertNotEqual(get_key(conv, input), key)
+        args.tile_memory_size = 1.0
+        self.assertEqual(get_key(conv, input), key)
+        conv.eval()
+        self.assertNotEqual(get_key(conv, input), key)
+
+    def test_tune_model(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH, compress_rate=20)
+        model = torch.nn.Sequential(
+            Conv2dfft(in_channels=3, out_channels=4, kernel_size=3, args=args),
+            torch.nn.ReLU(),
+            Conv2dfft(in_channels=4, out_channels=2, kernel_size=5, args=args))
+        input = torch.randn(2, 3, 12, 12)
+        expected = model(input).detach()
+        tune_model(model, input, tuning_file=self.tuning_file)
+        self.assertTrue(model.training)
+        for conv in [model[0], model[2]]:
+            self.assertIsNotNone(conv.tuned_args)
+            self.assertIn(conv.tuned_args.conv_exec_type,
+                          Conv2dfft.conv_exec_types)
+        self.assertEqual(len(model[0].tuner.configs), 2)
+        # The tuning does not change the results of the compressed layers.
+        model.eval()
+        with torch.no_grad():
+            result = model(input)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), rtol=1e-4,
+                                   atol=1e-4)
+        model.train()
+        result = model(input)
+        np.testing.assert_allclose(actual=result.detach().numpy(),
+                                   desired=expected.numpy(), rtol=1e-4,
+                                   atol=1e-4)
+        # The training mode is tuned on its own (with the backward pass).
+        self.assertEqual(len(model[0].tuner.configs), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
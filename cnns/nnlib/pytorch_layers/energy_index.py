@@ -0,0 +1,189 @@
+"""
+The energy-retention engine for the spectral compression.
+
+The cumulative energy (the prefix sums of the squared magnitudes of the
+coefficients) is computed once per fft-ed batch and then any preserve energy
+rate is answered with a binary search (torch.searchsorted) over the prefix
+sums instead of the Python loops over the coefficients.
+
+The policies:
+batch - a single cut-off for the whole batch (the energy of all the data
+points is summed), this is what the compression with a shared size needs,
+sample - a cut-off for each data point (for the crops, the largest of them is
+used, so that each data point retains at least the required energy).
+"""
+import torch
+import torch.nn.functional as F
+
+ENERGY_POLICIES = ('batch', 'sample')
+
+
+def check_policy(policy):
+    if policy not in ENERGY_POLICIES:
+        raise Exception(f'Unknown energy policy: {policy}, choose from: '
+                        f'{",".join(ENERGY_POLICIES)}')
+
+
+def get_squared(xfft):
+    """
+    :param xfft: the fft-ed signal with the complex numbers as the last
+    dimension of size 2
+    :return: the squared magnitudes of the coefficients (in float64, so that
+    the prefix sums are exact enough for the comparisons with the targets)
+    """
+    xfft = xfft.detach().to(torch.float64)
+    return xfft[..., 0] ** 2 + xfft[..., 1] ** 2
+
+
+def first_reaching(prefix, targets):
+    """
+    :param prefix: the non-decreasing prefix sums (..., L)
+    :param targets: the targets (...)
+    :return: the first index i for which prefix[..., i] >= target (L if there
+    is no such index)
+    """
+    return torch.searchsorted(prefix.contiguous(),
+                              targets.unsqueeze(-1).contiguous()).squeeze(-1)
+
+
+class EnergyPrefix2D(object):
+    """
+    The 2D prefix sums of the energy of a fft-ed batch of 2D maps (N, C, H, W,
+    2) summed over the channels (and the data points for the batch policy).
+
+    The cut-offs chosen by the last query are stored in self.cutoffs (e.g.
+    for logging).
+    """
+
+    def __init__(self, xfft, policy='batch'):
+        if len(xfft.shape) != 5:
+            raise ValueError(
+                "The expected input is fft-ed 2D map in a batch with channels. "
+                "The expected dimensions: N, C, H, W, X (complex number)")
+        check_policy(policy)
+        self.policy = policy
+        _, _, self.H, self.W, _ = xfft.shape
+        squared = get_squared(xfft).sum(dim=1)
+        if policy == 'batch':
+            squared = squared.sum(dim=0, keepdim=True)
+        # prefix[m, i, j] = the energy of squared[m, :i, :j]
+        self.prefix = F.pad(squared.cumsum(dim=1).cumsum(dim=2), (1, 0, 1, 0))
+        self.full_energy = self.prefix[:, -1, -1]
+        self.cutoffs = None
+
+    def get_targets(self, preserve_energy_rate):
+        return self.full_energy * preserve_energy_rate / 100.0
+
+    def get_index_forward(self, preserve_energy_rate):
+        """
+        The same as the binary search with compress_2D_energy in
+        preserve_energy2D_symmetry.
+
+        :return: the smallest index forward (in [0, W]) for which the top left
+        and the bottom left squares (compress_2D_index_forward) retain the
+        energy rate
+        """
+        H, W = self.H, self.W
+        k = torch.arange(W + 1, device=self.prefix.device)
+        cols = k.clamp(max=W)
+        top = self.prefix[:, k.clamp(max=H), cols]
+        # The bottom left square has k - 1 rows (all the rows if k - 1 > H).
+        bottom_start = (H - (k - 1)).clamp(min=0, max=H)
+        bottom = self.prefix[:, H, cols] - self.prefix[:, bottom_start, cols]
+        energy = top + torch.where(k > 1, bottom, torch.zeros_like(bottom))
+        index = first_reaching(energy, self.get_targets(preserve_energy_rate))
+        self.cutoffs = index.clamp(max=W)
+        return self.cutoffs.max().item()
+
+    def get_index_back(self, preserve_energy_rate):
+        """
+        The same as the loops in preserve_energy2D_index_back: grow the top
+        left square and then the columns (if W > H) or the rows (if H > W).
+
+        :return: index_back_H and index_back_W
+        """
+        H, W = self.H, self.W
+        D = min(H, W)
+        targets = self.get_targets(preserve_energy_rate)
+        k = torch.arange(D + 1, device=self.prefix.device)
+        index = first_reaching(self.prefix[:, k, k], targets)
+        # The square of side D does not retain enough energy.
+        is_short = index > D
+        index_H = index.clamp(max=D)
+        index_W = index_H.clone()
+        if W > H:
+            columns = first_reaching(self.prefix[:, H, D:], targets) + D
+            index_W = torch.where(is_short, columns, index_W)
+        elif H > W:
+            rows = first_reaching(self.prefix[:, D:, W], targets) + D
+            index_H = torch.where(is_short, rows, index_H)
+        elif is_short.any():
+            index_W = torch.where(is_short, index, index_W)
+        if (index_H > H).any() or (index_W > W).any():
+            raise AssertionError(
+                "We have to accumulate at least preserve energy! "
+                "The index_H and index_W are too low.")
+        self.cutoffs = torch.stack((index_H, index_W), dim=-1)
+        return H - index_H.max().item(), W - index_W.max().item()
+
+
+class EnergyPrefixSorted(object):
+    """
+    The prefix sums of the energy of the coefficients sorted from the largest
+    one, for each channel of a fft-ed batch (N, C, L, 2) (for each data point
+    with the sample policy or summed over the data points with the batch
+    policy).
+
+    The numbers of the retained coefficients chosen by the last query are
+    stored in self.cutoffs (e.g. for logging).
+    """
+
+    def __init__(self, xfft, policy='sample'):
+        if len(xfft.shape) != 4:
+            raise ValueError(
+                "The expected input is fft-ed 1D signal in a batch with "
+                "channels. The expected dimensions: N, C, L, X (complex "
+                "number)")
+        check_policy(policy)
+        self.policy = policy
+        squared = get_squared(xfft)
+        if policy == 'batch':
+            squared = squared.sum(dim=0, keepdim=True)
+        # The stable sort keeps the lower index first for the equal values
+        # (as the heap in retain_big_coef).
+        squared, self.indices = torch.sort(squared, dim=-1, descending=True,
+                                           stable=True)
+        self.prefix = squared.cumsum(dim=-1)
+        self.full_energy = self.prefix[..., -1]
+        self.cutoffs = None
+
+    def get_counts(self, preserve_energy=None, index_back=None):
+        """
+        :param preserve_energy: the percentage of the energy to retain
+        :param index_back: the number of the smallest coefficients to zero out
+        :return: the number of the retained (largest) coefficients for each
+        channel (M, C)
+        """
+        L = self.prefix.shape[-1]
+        if preserve_energy is not None:
+            targets = self.full_energy * preserve_energy / 100.0
+            # Retain the coefficients until the target energy is reached.
+            counts = first_reaching(self.prefix, targets) + 1
+            counts = torch.where(targets > 0, counts.clamp(max=L),
+                                 torch.zeros_like(counts))
+        else:
+            counts = torch.full_like(self.full_energy, L, dtype=torch.long)
+        if index_back is not None:
+            counts = counts.clamp(max=max(L - index_back, 0))
+        self.cutoffs = counts
+        return counts
+
+    def retain(self, xfft, counts):
+        """
+        :return: xfft with the coefficients zeroed out except for the counts
+        largest ones in each channel
+        """
+        L = self.prefix.shape[-1]
+        is_kept = torch.arange(L, device=counts.device) < counts.unsqueeze(-1)
+        mask = torch.zeros_like(is_kept).scatter_(-1, self.indices, is_kept)
+        return xfft * mask.unsqueeze(-1).to(xfft.dtype)
@@ -0,0 +1,81 @@
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.pytorch_layers.energy_index import EnergyPrefix2D
+from cnns.nnlib.pytorch_layers.energy_index import EnergyPrefixSorted
+from cnns.nnlib.pytorch_layers.pytorch_utils import compress_2D_energy
+from cnns.nnlib.pytorch_layers.pytorch_utils import get_full_energy_only
+
+
+class TestEnergyIndex(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+
+    def test_index_forward(self):
+        xfft = torch.randn(3, 2, 8, 5, 2)
+        energy_prefix = EnergyPrefix2D(xfft)
+        full_energy = get_full_energy_only(xfft)
+        previous = 0
+        for rate in [10, 50, 90, 99]:
+            index = energy_prefix.get_index_forward(rate)
+            self.assertGreaterEqual(index, previous)
+            previous = index
+            target = full_energy * rate / 100
+            self.assertGreaterEqual(
+                compress_2D_energy(xfft, index_forward=index), target * 0.9999)
+            self.assertLess(compress_2D_energy(xfft, index_forward=index - 1),
+                            target)
+
+    def test_index_forward_sample(self):
+        xfft = torch.randn(3, 2, 8, 5, 2)
+        # The energy of the last data point is in the first coefficient.
+        xfft[2] *= 0.01
+        xfft[2, :, 0, 0, :] = 100.0
+        energy_prefix = EnergyPrefix2D(xfft, policy='sample')
+        index = energy_prefix.get_index_forward(90)
+        cutoffs = energy_prefix.cutoffs.tolist()
+        self.assertEqual(len(cutoffs), 3)
+        self.assertEqual(cutoffs[2], 1)
+        self.assertEqual(index, max(cutoffs))
+        # Each data point alone gives its own cut-off.
+        for i in range(3):
+            self.assertEqual(
+                EnergyPrefix2D(xfft[i:i + 1]).get_index_forward(90),
+                cutoffs[i])
+
+    def test_retain_counts(self):
+        xfft = torch.tensor([[[[1., 2.], [3., 4.], [0.1, 0.1]],
+                              [[0.0, 0.1], [2.0, -6.0], [0.01, 0.002]]]])
+        energy_prefix = EnergyPrefixSorted(xfft)
+        counts = energy_prefix.get_counts(preserve_energy=90)
+        np.testing.assert_equal(actual=counts.numpy(), desired=[[2, 1]])
+        counts = energy_prefix.get_counts(preserve_energy=99.99)
+        np.testing.assert_equal(actual=counts.numpy(), desired=[[3, 2]])
+        counts = energy_prefix.get_counts(index_back=2)
+        np.testing.assert_equal(actual=counts.numpy(), desired=[[1, 1]])
+        result = energy_prefix.retain(xfft, counts)
+        expected = torch.tensor([[[[0., 0.], [3., 4.], [0.0, 0.0]],
+                                  [[0.0, 0.0], [2.0, -6.0], [0.0, 0.0]]]])
+        np.testing.assert_equal(actual=result.numpy(),
+                                desired=expected.numpy())
+
+    def test_retain_batch(self):
+        xfft = torch.randn(4, 3, 16, 2)
+        energy_prefix = EnergyPrefixSorted(xfft, policy='batch')
+        counts = energy_prefix.get_counts(preserve_energy=80)
+        self.assertEqual(counts.shape, (1, 3))
+        result = energy_prefix.retain(xfft, counts)
+        # The same coefficients are retained for all the data points.
+        is_kept = (result != 0).any(dim=-1)
+        self.assertTrue((is_kept == is_kept[:1]).all())
+        kept_energy = (result ** 2).sum(dim=(0, 2, 3))
+        full_energy = (xfft ** 2).sum(dim=(0, 2, 3))
+        self.assertTrue((kept_energy >= 0.8 * full_energy * 0.9999).all())
+        with self.assertRaises(Exception):
+            EnergyPrefixSorted(xfft, policy='channel')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,8 @@ from cnns.nnlib.utils.general_utils import next_power2
 from torch.nn.functional import pad as torch_pad
 import numpy as np
 from cnns.nnlib.utils.shift_DC_component import shift_DC
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 
 
 class FFTBandFunction2D(torch.autograd.Function):
@@ -52,7 +54,7 @@ class FFTBandFunction2D(torch.autograd.Function):
             H_fft = H
             W_fft = W
 
-        xfft = torch.rfft(input, signal_ndim=FFTBandFunction2D.signal_ndim,
+        xfft = rfft_pairs(input, signal_ndim=FFTBandFunction2D.signal_ndim,
                           onesided=onesided)
 
         del input
@@ -111,7 +113,7 @@ class FFTBandFunction2D(torch.autograd.Function):
                                 f"is: {fraction_zeroed}")
 
         # N, C, H_fft, W_fft = xfft
-        out = torch.irfft(input=xfft,
+        out = irfft_pairs(input=xfft,
                           signal_ndim=FFTBandFunction2D.signal_ndim,
                           signal_sizes=(H_fft, W_fft),
                           onesided=onesided)
@@ -1,10 +1,44 @@
 import torch
 from torch.nn import Module
 from cnns.nnlib.utils.general_utils import next_power2
-from torch.nn.functional import pad as torch_pad
 from cnns.nnlib.utils.complex_mask import get_disk_mask
 from cnns.nnlib.utils.complex_mask import get_hyper_mask
+from cnns.nnlib.utils.complex_mask import get_cached_mask
 from cnns.nnlib.utils.shift_DC_component import shift_DC
+from cnns.nnlib.pytorch_layers.bpda import straight_through
+from cnns.nnlib.pytorch_layers.bpda import restore_format
+
+
+def get_fft_sizes(H, W, is_next_power2=False):
+    if is_next_power2:
+        return next_power2(H), next_power2(W)
+    return H, W
+
+
+def fft_band_mask(input, mask, fft_sizes, onesided=True):
+    """
+    Zero out (mask) the coefficients of the 2D FFT of the input.
+
+    The FFT is computed with torch.fft in float32 (half and bfloat16 FFTs
+    are not supported for all sizes and lose precision), the output has the
+    dtype and memory format of the input.
+
+    :param input: the input images (N, C, H, W)
+    :param mask: the real mask (H_xfft, W_xfft) for the spectrum
+    :param fft_sizes: the sizes (H_fft, W_fft) of the FFT (the input is padded
+    with zeros to them)
+    :param onesided: use the onesided FFT (thanks to the conjugate symmetry)
+    :return: the compressed input
+    """
+    H, W = input.shape[-2:]
+    x = input.float()
+    if onesided:
+        xfft = torch.fft.rfft2(x, s=fft_sizes)
+        out = torch.fft.irfft2(xfft * mask, s=fft_sizes)
+    else:
+        xfft = torch.fft.fft2(x, s=fft_sizes)
+        out = torch.fft.ifft2(xfft * mask).real
+    return restore_format(out[..., :H, :W], input)
 
 class FFTBandFunctionComplexMask2D(torch.autograd.Function):
     """
@@ -42,45 +76,34 @@ class FFTBandFunctionComplexMask2D(torch.autograd.Function):
         if H != W:
             raise Exception("We support only squared input.")
 
-        if args.next_power2:
-            H_fft = next_power2(H)
-            W_fft = next_power2(W)
-            pad_H = H_fft - H
-            pad_W = W_fft - W
-            input = torch_pad(input, (0, pad_W, 0, pad_H), 'constant', 0)
+        H_fft, W_fft = get_fft_sizes(H, W, is_next_power2=args.next_power2)
+        if onesided:
+            xfft = torch.fft.rfft2(input.float(), s=(H_fft, W_fft))
         else:
-            H_fft = H
-            W_fft = W
-        xfft = torch.rfft(input,
-                          signal_ndim=FFTBandFunctionComplexMask2D.signal_ndim,
-                          onesided=onesided)
-        del input
-
-        _, _, H_xfft, W_xfft, _ = xfft.size()
+            xfft = torch.fft.fft2(input.float(), s=(H_fft, W_fft))
+
+        _, _, H_xfft, W_xfft = xfft.size()
         # assert H_fft == W_xfft, "The input tensor has to be squared."
 
-        mask, _ = get_mask(H=H_xfft, W=W_xfft,
-                           compress_rate=args.compress_fft_layer,
-                           val=val, interpolate=args.interpolate,
-                           onesided=onesided)
-        mask = mask[:, 0:W_xfft, :]
-        # print(mask)
-        mask = mask.to(xfft.dtype).to(xfft.device)
-        xfft = xfft * mask
+        # The complex mask (H, W, 2) has the same real and imaginary parts.
+        mask = get_cached_mask(H=H_xfft, W=W_xfft,
+                               compress_rate=args.compress_fft_layer,
+                               val=val, interpolate=args.interpolate,
+                               onesided=onesided, get_mask=get_mask,
+                               dtype=torch.float32, device=xfft.device)
+        xfft = xfft * mask[..., 0]
 
         if ctx is not None:
-            ctx.xfft = xfft
+            # The (..., 2) real-pair representation of the spectrum.
+            ctx.xfft = torch.view_as_real(xfft)
             if args.is_DC_shift:
-                ctx.xfft = shift_DC(xfft, onesided=onesided)
+                ctx.xfft = shift_DC(ctx.xfft, onesided=onesided)
 
-        # xfft = shift_DC(xfft, onesided=onesided, shift_to="center")
-        # xfft = shift_DC(xfft, onesided=onesided, shift_to="corner")
-        out = torch.irfft(input=xfft,
-                          signal_ndim=FFTBandFunctionComplexMask2D.signal_ndim,
-                          signal_sizes=(H_fft, W_fft),
-                          onesided=onesided)
-        out = out[..., :H, :W]
-        return out
+        if onesided:
+            out = torch.fft.irfft2(xfft, s=(H_fft, W_fft))
+        else:
+            out = torch.fft.ifft2(xfft).real
+        return restore_format(out[..., :H, :W], input)
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -114,23 +137,37 @@ class FFTBand2DcomplexMask(Module):
     FFT Band layer removes high frequency coefficients.
     """
 
-    def __init__(self, args):
+    def __init__(self, args, onesided=True):
         super(FFTBand2DcomplexMask, self).__init__()
         self.args = args
+        self.onesided = onesided
+
+    def get_mask(self, H_xfft, W_xfft, device):
+        # the hyper mask is the most precise one, we zero out the coefficients
+        mask = get_cached_mask(H=H_xfft, W=W_xfft,
+                               compress_rate=self.args.compress_fft_layer,
+                               val=0, interpolate=self.args.interpolate,
+                               onesided=self.onesided, get_mask=get_hyper_mask,
+                               dtype=torch.float32, device=device)
+        return mask[..., 0]
 
     def forward(self, input):
         """
-        This is the fully manual implementation of the forward and backward
-        passes via the torch.autograd.Function.
+        The compression with the gradient of the identity (as in
+        FFTBandFunctionComplexMask2D). The mask is a constant for the given
+        input size, so the layer can be traced with torch.jit.
 
         :param input: the input map (e.g., an image)
-        :return: the result of 1D convolution
+        :return: the compressed input
         """
-        return FFTBandFunctionComplexMask2D.apply(
-            input,  # input image
-            self.args,  # arguments for compression rate, is_nextPower2, etc.
-            0,
-            # value set after compression (we usually zero out the coefficients)
-            get_hyper_mask,  # get_mask (the hyper mask is the most precise one)
-            True,  # onesided
-        )
+        # The sizes are constants for the trace (as is the mask).
+        H, W = int(input.size(-2)), int(input.size(-1))
+        if H != W:
+            raise Exception("We support only squared input.")
+        H_fft, W_fft = get_fft_sizes(H, W,
+                                     is_next_power2=self.args.next_power2)
+        W_xfft = W_fft // 2 + 1 if self.onesided else W_fft
+        mask = self.get_mask(H_xfft=H_fft, W_xfft=W_xfft, device=input.device)
+        output = fft_band_mask(input, mask=mask, fft_sizes=(H_fft, W_fft),
+                               onesided=self.onesided)
+        return straight_through(input, output)
@@ -1,5 +1,7 @@
 from cnns.nnlib.pytorch_layers.fft_band_2D_complex_mask import \
     FFTBandFunctionComplexMask2D
+from cnns.nnlib.pytorch_layers.fft_band_2D_complex_mask import \
+    FFTBand2DcomplexMask
 
 import unittest
 import torch
@@ -29,3 +31,26 @@ class TestFFTBandFunction2DdiskMask(unittest.TestCase):
         zero1 = torch.sum(ctx.xfft == 0.0).item() / 2
         print("% of zeroed out elements: ", zero1 / input.size * 100)
         print("result: ", result)
+
+    def test_fft_band_half_channels_last_trace(self):
+        args = Arguments()
+        args.compress_fft_layer = 50
+        args.next_power2 = False
+        band = FFTBand2DcomplexMask(args=args)
+        a = torch.randn(2, 3, 16, 16)
+        expected = band(a)
+        ctx = Object()
+        result = FFTBandFunctionComplexMask2D.forward(
+            ctx=ctx, input=a, args=args, val=0)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), atol=1e-6)
+        b = a.half().contiguous(memory_format=torch.channels_last)
+        result = band(b)
+        self.assertEqual(result.dtype, torch.half)
+        self.assertTrue(
+            result.is_contiguous(memory_format=torch.channels_last))
+        np.testing.assert_allclose(actual=result.float().numpy(),
+                                   desired=expected.numpy(), atol=1e-2)
+        traced = torch.jit.trace(band, a)
+        np.testing.assert_allclose(actual=traced(a).numpy(),
+                                   desired=expected.numpy())
@@ -7,6 +7,8 @@ from cnns.nnlib.utils.shift_DC_component import shift_DC
 from cnns.nnlib.pytorch_layers.pytorch_utils import compress_2D_index_forward
 from cnns.nnlib.pytorch_layers.pytorch_utils import \
     compress_2D_index_forward_full
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 
 
 class FFTBandFunction2DPool(torch.autograd.Function):
@@ -52,7 +54,7 @@ class FFTBandFunction2DPool(torch.autograd.Function):
             pad_W = W_fft - W
             input = torch_pad(input, (0, pad_W, 0, pad_H), 'constant', 0)
 
-        xfft = torch.rfft(input, signal_ndim=FFTBandFunction2DPool.signal_ndim,
+        xfft = rfft_pairs(input, signal_ndim=FFTBandFunction2DPool.signal_ndim,
                           onesided=onesided)
 
         del input
@@ -93,7 +95,7 @@ class FFTBandFunction2DPool(torch.autograd.Function):
         if onesided:
             W_xfft = (W_xfft - 1) * 2
 
-        out = torch.irfft(input=xfft,
+        out = irfft_pairs(input=xfft,
                           signal_ndim=FFTBandFunction2DPool.signal_ndim,
                           signal_sizes=(H_xfft, W_xfft),
                           onesided=onesided)
@@ -0,0 +1,89 @@
+"""
+The cache of the spectra of the filters for the fft based convolutions in the
+inference mode.
+
+In the inference mode the filters do not change, so the padded, compressed
+and conjugated spectra of the filters can be computed once per (fft size,
+compression indexes) and reused for all the following batches. The cache is
+invalidated when the filter changes (its storage, version counter, shape,
+dtype or device - the version counter is bumped by each in-place update,
+e.g., by an optimizer step or load_state_dict) and it is cleared when the
+layer is switched to the train mode.
+"""
+import torch
+
+
+def get_tensor_state(tensor):
+    """
+    :return: the state of the tensor that changes with each update of its
+    values
+    """
+    return (tensor.data_ptr(), tensor._version, tuple(tensor.shape),
+            tensor.dtype, tensor.device)
+
+
+class FilterSpectrumCache(object):
+
+    def __init__(self):
+        self.spectra = {}
+        self.filter_state = None
+        self.hits = 0
+        self.misses = 0
+
+    def check(self, filter):
+        """
+        Clear the cache if the filter was changed since the spectra were
+        computed.
+        """
+        filter_state = get_tensor_state(filter)
+        if filter_state != self.filter_state:
+            self.spectra.clear()
+            self.filter_state = filter_state
+
+    def get(self, filter, key, compute):
+        """
+        :param filter: the filter (the weights of the layer)
+        :param key: the sizes and the compression indexes of the spectrum
+        :param compute: maps the filter to its spectrum
+        :return: the cached spectrum (computed and stored if missing)
+        """
+        self.check(filter)
+        spectrum = self.spectra.get(key)
+        if spectrum is None:
+            self.misses += 1
+            with torch.no_grad():
+                spectrum = compute(filter)
+            self.spectra[key] = spectrum
+        else:
+            self.hits += 1
+        return spectrum
+
+    def clear(self):
+        self.spectra.clear()
+        self.filter_state = None
+
+    def get_memory_size(self):
+        """
+        :return: the number of bytes held by the cached spectra
+        """
+        return sum([spectrum.numel() * spectrum.element_size() for spectrum in
+                    self.spectra.values()])
+
+
+def set_filter_cache(model, is_enabled=True):
+    """
+    Enable (or disable) the filter spectrum cache in all the fft based
+    convolutions of the model.
+    """
+    for module in model.modules():
+        if hasattr(module, 'set_filter_cache'):
+            module.set_filter_cache(is_enabled=is_enabled)
+
+
+def get_filter_cache_memory(model):
+    """
+    :return: the number of bytes held by the filter spectrum caches in the
+    model
+    """
+    return sum([module.get_filter_cache_memory() for module in model.modules()
+                if hasattr(module, 'get_filter_cache_memory')])
@@ -0,0 +1,85 @@
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.pytorch_layers.conv1D_fft import Conv1dfft
+from cnns.nnlib.pytorch_layers.conv2D_fft import Conv2dfft
+from cnns.nnlib.pytorch_layers.filter_cache import get_filter_cache_memory
+from cnns.nnlib.pytorch_layers.filter_cache import set_filter_cache
+from cnns.nnlib.utils.arguments import Arguments
+from cnns.nnlib.utils.general_utils import CompressType
+from cnns.nnlib.utils.general_utils import ConvExecType
+
+
+class TestFilterCache(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+
+    def check_cache(self, conv, input):
+        expected = conv(input).detach()
+        set_filter_cache(conv, is_enabled=True)
+        conv.eval()
+        with torch.no_grad():
+            result = conv(input)
+            self.assertGreater(get_filter_cache_memory(conv), 0)
+            self.assertEqual(conv.filter_cache.misses, 1)
+            result = conv(input)
+            self.assertEqual(conv.filter_cache.hits, 1)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expected.numpy(), rtol=1e-5,
+                                   atol=1e-5)
+
+    def test_conv2D(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH, compress_rate=20)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         bias=True, args=args)
+        self.check_cache(conv, torch.randn(2, 3, 8, 8))
+
+    def test_conv2D_preserve_energy(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH,
+                         preserved_energy=90, compress_rate=None)
+        conv = Conv2dfft(in_channels=3, out_channels=4, kernel_size=3,
+                         args=args)
+        self.check_cache(conv, torch.randn(2, 3, 8, 8))
+
+    def test_conv1D(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH,
+                         compress_type=CompressType.BIG_COEFF,
+                         compress_rate=30)
+        conv = Conv1dfft(in_channels=2, out_channels=3, kernel_size=3,
+                         bias=True, args=args)
+        self.check_cache(conv, torch.randn(4, 2, 16))
+
+    def test_invalidate(self):
+        args = Arguments(conv_exec_type=ConvExecType.BATCH)
+        conv = Conv2dfft(in_channels=2, out_channels=3, kernel_size=3,
+                         args=args)
+        set_filter_cache(conv)
+        conv.eval()
+        input = torch.randn(2, 2, 6, 6)
+        with torch.no_grad():
+            conv(input)
+            # An in-place update of the weights (e.g. an optimizer step).
+            conv.weight.mul_(2.0)
+            result = conv(input)
+        self.assertEqual(conv.filter_cache.misses, 2)
+        conv.set_filter_cache(is_enabled=False)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=conv(input).detach().numpy(),
+                                   rtol=1e-5, atol=1e-5)
+
+        set_filter_cache(conv)
+        conv.eval()
+        with torch.no_grad():
+            conv(input)
+        self.assertGreater(conv.get_filter_cache_memory(), 0)
+        # The cache is cleared and not used in the train mode.
+        conv.train()
+        self.assertEqual(conv.get_filter_cache_memory(), 0)
+        conv(input)
+        self.assertEqual(conv.get_filter_cache_memory(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
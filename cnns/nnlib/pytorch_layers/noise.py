@@ -1,11 +1,100 @@
 import torch
 from torch.nn import Module
-from cnns.nnlib.robustness.utils import AdditiveUniformNoiseAttack
-from cnns.nnlib.robustness.utils import AdditiveGaussianNoiseAttack
-from cnns.nnlib.robustness.utils import AdditiveLaplaceNoiseAttack
 import numpy as np
 
 
+def sample_noise_torch(noise_type, noise_level, input, min_=0.0, max_=1.0,
+                       generator=None, out=None):
+    """
+    Sample the noise directly on the device and with the dtype of the input.
+
+    The distributions are the same as the ones from the numpy (foolbox
+    based) noisers in cnns.nnlib.robustness.utils: uniform_noise,
+    gauss_noise and laplace_noise.
+
+    :param noise_type: gauss, uniform or laplace
+    :param noise_level: the strength of the noise (sigma or epsilon)
+    :param input: the input tensor (gives the shape, dtype and device)
+    :param min_: min value of a pixel
+    :param max_: max value of a pixel
+    :param generator: the torch.Generator on the device of the input
+    :param out: the (optional) preallocated buffer for the noise
+    :return: the noise for the input (with its memory format, e.g.
+    channels_last)
+    """
+    if out is None:
+        out = torch.empty_like(input)
+    if noise_type == 'gauss':
+        std = noise_level / np.sqrt(3) * (max_ - min_)
+        out.normal_(mean=0.0, std=std, generator=generator)
+    elif noise_type == 'uniform':
+        w = noise_level * (max_ - min_)
+        out.uniform_(-w, w, generator=generator)
+    elif noise_type == 'laplace':
+        scale = noise_level / np.sqrt(3) * (max_ - min_)
+        # Inverse of the cdf for u from the open interval (-0.5, 0.5).
+        eps = torch.finfo(out.dtype).eps
+        out.uniform_(-0.5 + eps, 0.5, generator=generator)
+        sign = torch.sign(out)
+        out.abs_().mul_(-2).log1p_().mul_(sign).mul_(-scale)
+    else:
+        raise Exception(f"Unknown noise type: {noise_type}")
+    return out
+
+
+class NoiseSampler(object):
+    """
+    Sample the noise for the Noise layers with a torch.Generator per device.
+    """
+
+    def __init__(self, noise_type, noise_level, min_=0.0, max_=1.0,
+                 seed=None, preallocate=False):
+        """
+        :param noise_type: gauss, uniform or laplace
+        :param noise_level: the strength of the noise (sigma or epsilon)
+        :param min_: min value of a pixel
+        :param max_: max value of a pixel
+        :param seed: the seed for the generators (None - non-deterministic)
+        :param preallocate: re-use the same noise buffer across the calls
+        """
+        self.noise_type = noise_type
+        self.noise_level = noise_level
+        self.min = min_
+        self.max = max_
+        self.seed = seed
+        self.preallocate = preallocate
+        self.generators = {}
+        self.buffer = None
+
+    def get_generator(self, device):
+        generator = self.generators.get(device)
+        if generator is None:
+            generator = torch.Generator(device=device)
+            if self.seed is None:
+                generator.seed()
+            else:
+                generator.manual_seed(self.seed)
+            self.generators[device] = generator
+        return generator
+
+    def get_buffer(self, input):
+        buffer = self.buffer
+        if buffer is None or buffer.shape != input.shape or (
+                buffer.stride() != input.stride()) or (
+                buffer.dtype != input.dtype) or (
+                buffer.device != input.device):
+            buffer = torch.empty_like(input)
+            self.buffer = buffer
+        return buffer
+
+    def __call__(self, input):
+        out = self.get_buffer(input) if self.preallocate else None
+        return sample_noise_torch(
+            noise_type=self.noise_type, noise_level=self.noise_level,
+            input=input, min_=self.min, max_=self.max,
+            generator=self.get_generator(input.device), out=out)
+
+
 class NoiseFunction(torch.autograd.Function):
     """
     We can implement our own custom autograd Functions by subclassing
@@ -14,7 +103,7 @@ class NoiseFunction(torch.autograd.Function):
     """
 
     @staticmethod
-    def forward(ctx, input, noiser, noise_level, min_, max_):
+    def forward(ctx, input, sampler):
         """
         In the forward pass we receive a Tensor containing the input
         and return a Tensor containing the output. ctx is a context
@@ -23,20 +112,13 @@ class NoiseFunction(torch.autograd.Function):
         backward pass using the ctx.save_for_backward method.
 
         :param input: the input image
-        :param rounder: the rounder object to execute the actual rounding
+        :param sampler: the NoiseSampler object to draw the noise on the
+        device of the input
         """
         # ctx.save_for_backward(input)
         # print("round forward")
         NoiseFunction.mark_dirty(input)
-        N, C, H, W = input.shape
-        dtype = np.float
-        if input.dtype == torch.double:
-            dtype = np.double
-        dummy_image_for_type = np.zeros((N, C, H, W), dtype=dtype)
-        noise = noiser._sample_noise(
-            epsilon=noise_level,
-            bounds=(min_, max_), image=dummy_image_for_type)
-        noise = torch.from_numpy(noise).to(input.dtype).to(input.device)
+        noise = sampler(input)
         return input + noise
 
     @staticmethod
@@ -53,7 +135,7 @@ class NoiseFunction(torch.autograd.Function):
         Defenses that mask a network’s gradients by quantizingthe input values pose a challenge to gradient-based opti-mization  methods  for  generating  adversarial  examples,such  as  the  procedure  we  describe  in  Section  2.4.   Astraightforward application of the approach would findzero gradients, because small changes to the input do notalter the output at all.  In Section 3.1.1, we describe anapproach where we run the optimizer on a substitute net-work without the color depth reduction step, which ap-proximates the real network.
         """
         # print("round backward")
-        return grad_output.clone(), None, None, None, None
+        return grad_output.clone(), None
 
 
 class Noise(Module):
@@ -61,57 +143,70 @@ class Noise(Module):
     No PyTorch Autograd used - we compute backward pass on our own.
     """
 
-    def __init__(self, args):
+    def __init__(self, args, preallocate=False):
         super(Noise, self).__init__()
         self.args = args
+        self.preallocate = preallocate
+        self.noise_type = None
+        self.noise_level = 0.0
+        self.sampler = None
         if args.noise_sigma > 0:
             # gauss_image = gauss(image_numpy=image, sigma=args.noise_sigma)
-            self.noiser = AdditiveGaussianNoiseAttack(args=args)
-            self.noise_level = args.noise_sigma
+            self.set_noise(noise_type='gauss', noise_level=args.noise_sigma)
         elif args.noise_epsilon > 0:
-            self.noiser = AdditiveUniformNoiseAttack(args=args)
-            self.noise_level = args.noise_epsilon
+            self.set_noise(noise_type='uniform',
+                           noise_level=args.noise_epsilon)
         elif args.laplace_epsilon > 0:
-            self.noiser = AdditiveLaplaceNoiseAttack(args=args)
-            self.noise_level = args.laplace_epsilon
+            self.set_noise(noise_type='laplace',
+                           noise_level=args.laplace_epsilon)
         self.min = args.min
         self.max = args.max
 
+    def set_noise(self, noise_type, noise_level):
+        self.noise_type = noise_type
+        self.noise_level = noise_level
+        self.sampler = NoiseSampler(noise_type=noise_type,
+                                    noise_level=noise_level,
+                                    min_=self.args.min, max_=self.args.max,
+                                    seed=getattr(self.args, 'seed', None),
+                                    preallocate=self.preallocate)
+
     def forward(self, input):
         """
-        This is the fully manual implementation of the forward and backward
-        passes via the torch.autograd.Function.
+        Add the noise sampled in the dtype and memory format of the input.
+        The gradient of the addition is the identity (as in NoiseFunction),
+        so the layer can be traced with torch.jit.
 
         :param input: the input map (e.g., an image)
-        :return: the result of 1D convolution
+        :return: the noisy input
         """
-        return NoiseFunction.apply(input, self.noiser, self.noise_level,
-                                   self.min, self.max)
+        if self.sampler is None:
+            return input
+        return input + self.sampler(input)
 
 
 class NoiseGauss(Noise):
 
-    def __init__(self, args):
-        super(NoiseGauss, self).__init__(args=args)
+    def __init__(self, args, preallocate=False):
+        super(NoiseGauss, self).__init__(args=args, preallocate=preallocate)
         # overwrite the noiser
         if args.noise_sigma > 0:
-            self.noiser = AdditiveGaussianNoiseAttack(args=args)
-            self.noise_level = args.noise_sigma
+            self.set_noise(noise_type='gauss', noise_level=args.noise_sigma)
 
 
 class NoiseUniform(Noise):
 
-    def __init__(self, args):
-        super(NoiseUniform, self).__init__(args=args)
+    def __init__(self, args, preallocate=False):
+        super(NoiseUniform, self).__init__(args=args, preallocate=preallocate)
         if args.noise_epsilon > 0:
-            self.noiser = AdditiveUniformNoiseAttack(args=args)
-            self.noise_level = args.noise_epsilon
+            self.set_noise(noise_type='uniform',
+                           noise_level=args.noise_epsilon)
 
 
 class NoiseLaplace(Noise):
 
-    def __init__(self, args):
-        super(NoiseLaplace, self).__init__(args=args)
+    def __init__(self, args, preallocate=False):
+        super(NoiseLaplace, self).__init__(args=args, preallocate=preallocate)
         if args.laplace_epsilon > 0:
-            self.noiser = AdditiveLaplaceNoiseAttack(args=args)
-            self.noise_level = args.laplace_epsilon
+            self.set_noise(noise_type='laplace',
+                           noise_level=args.laplace_epsilon)
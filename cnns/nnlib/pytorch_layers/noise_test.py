@@ -0,0 +1,114 @@
+import torch
+import unittest
+
+from cnns.nnlib.pytorch_layers.noise import NoiseGauss
+from cnns.nnlib.pytorch_layers.noise import NoiseUniform
+from cnns.nnlib.pytorch_layers.noise import NoiseLaplace
+from cnns.nnlib.pytorch_layers.noise import sample_noise_torch
+from cnns.nnlib.utils.arguments import Arguments
+import numpy as np
+
+
+class TestNoise(unittest.TestCase):
+
+    def get_args(self):
+        args = Arguments()
+        args.min = 0.0
+        args.max = 1.0
+        args.noise_sigma = 0.0
+        args.noise_epsilon = 0.0
+        args.laplace_epsilon = 0.0
+        return args
+
+    def test_gauss(self):
+        args = self.get_args()
+        args.noise_sigma = 0.1
+        noise = NoiseGauss(args=args)
+        input = torch.zeros(16, 3, 32, 32, dtype=torch.double)
+        result = noise(input)
+        self.assertEqual(result.dtype, torch.double)
+        self.assertEqual(result.shape, input.shape)
+        std = 0.1 / np.sqrt(3)
+        np.testing.assert_allclose(actual=result.std().item(), desired=std,
+                                   rtol=0.02)
+        np.testing.assert_allclose(actual=result.mean().item(), desired=0.0,
+                                   atol=0.01)
+
+    def test_uniform(self):
+        args = self.get_args()
+        args.noise_epsilon = 0.03
+        noise = NoiseUniform(args=args)
+        input = torch.zeros(16, 3, 32, 32)
+        result = noise(input)
+        self.assertLessEqual(result.abs().max().item(), 0.03)
+        np.testing.assert_allclose(actual=result.std().item(),
+                                   desired=0.03 / np.sqrt(3), rtol=0.02)
+
+    def test_laplace(self):
+        args = self.get_args()
+        args.laplace_epsilon = 0.1
+        noise = NoiseLaplace(args=args)
+        input = torch.zeros(16, 3, 32, 32, dtype=torch.double)
+        result = noise(input)
+        self.assertTrue(torch.isfinite(result).all())
+        scale = 0.1 / np.sqrt(3)
+        # The mean absolute deviation of the Laplace distribution is its scale.
+        np.testing.assert_allclose(actual=result.abs().mean().item(),
+                                   desired=scale, rtol=0.02)
+
+    def test_seed_and_buffer(self):
+        args = self.get_args()
+        args.noise_sigma = 0.1
+        args.seed = 31
+        input = torch.zeros(2, 3, 8, 8)
+        noise1 = NoiseGauss(args=args, preallocate=True)
+        noise2 = NoiseGauss(args=args)
+        result1 = noise1(input)
+        result2 = noise2(input)
+        np.testing.assert_equal(actual=result1.numpy(),
+                                desired=result2.numpy())
+        # The next draw is fresh noise sampled into the same buffer.
+        buffer = noise1.sampler.buffer
+        result3 = noise1(input)
+        self.assertIs(buffer, noise1.sampler.buffer)
+        self.assertFalse(torch.equal(result1, result3))
+
+    def test_sample_noise_torch_out(self):
+        input = torch.zeros(4, 5)
+        out = torch.empty(4, 5)
+        noise = sample_noise_torch(noise_type='uniform', noise_level=0.5,
+                                   input=input, out=out)
+        self.assertIs(noise, out)
+        with self.assertRaises(Exception):
+            sample_noise_torch(noise_type='beta', noise_level=0.5,
+                               input=input)
+
+    def test_half_channels_last(self):
+        args = self.get_args()
+        args.noise_epsilon = 0.03
+        noise = NoiseUniform(args=args)
+        for dtype in (torch.half, torch.bfloat16):
+            input = torch.zeros(2, 3, 8, 8, dtype=dtype).contiguous(
+                memory_format=torch.channels_last)
+            result = noise(input)
+            self.assertEqual(result.dtype, dtype)
+            self.assertTrue(
+                result.is_contiguous(memory_format=torch.channels_last))
+            self.assertLessEqual(result.abs().max().item(), 0.03)
+
+    def test_gradient_and_trace(self):
+        args = self.get_args()
+        args.noise_sigma = 0.1
+        noise = NoiseGauss(args=args)
+        input = torch.zeros(2, 3, 8, 8, requires_grad=True)
+        noise(input).sum().backward()
+        np.testing.assert_equal(actual=input.grad.numpy(),
+                                desired=np.ones((2, 3, 8, 8)))
+        traced = torch.jit.trace(noise, torch.zeros(2, 3, 8, 8),
+                                 check_trace=False)
+        # The noise is sampled again in each call of the traced layer.
+        self.assertFalse(torch.equal(traced(input), traced(input)))
+
+
+if __name__ == '__main__':
+    unittest.main()
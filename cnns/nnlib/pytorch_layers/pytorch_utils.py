@@ -10,7 +10,6 @@ import re
 import torch
 import torch.nn.functional as F
 from torch import tensor
-from heapq import heappush, heappop
 from cnns.nnlib.utils.general_utils import mem_log_file, next_power2
 import gc
 from cnns.nnlib.utils.log_utils import get_logger
@@ -19,6 +18,16 @@ import math
 import torch_dct
 import sys
 from torch.nn.functional import pad as torch_pad
+from cnns.nnlib.pytorch_layers.energy_index import EnergyPrefix2D
+from cnns.nnlib.pytorch_layers.energy_index import EnergyPrefixSorted
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_conjugate
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_multiply
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_multiply_out
+from cnns.nnlib.pytorch_layers.complex_spectral import complex_zero_pad
+from cnns.nnlib.pytorch_layers.complex_spectral import get_squared_magnitude
+from cnns.nnlib.pytorch_layers.complex_spectral import to_complex
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 
 if torch.cuda.is_available() and sys.platform != 'win32':
     # from complex_mul_cpp import complex_mul as complex_mul_cpp
@@ -260,7 +269,7 @@ def complex_mul(x, y):
     >>> np.testing.assert_array_equal(complex_mul(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
     >>> h
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
@@ -299,30 +308,7 @@ def complex_mul(x, y):
     >>> np.testing.assert_array_equal(xy,
     ... tensor([[[-4., 7.], [1., 7.]], [[108.,   0.], [ -8.,  16.]]]))
     """
-    # mul = torch.mul
-    # add = torch.add
-    cat = torch.cat
-
-    # ua = x.narrow(dim=-1, start=0, length=1)
-    ua = x[..., :1]
-    # ud = x.narrow(-1, 1, 1)
-    ud = x[..., 1:]
-    # va = y.narrow(-1, 0, 1)
-    va = y[..., :1]
-    # vb = y.narrow(-1, 1, 1)
-    vb = y[..., 1:]
-    ub = ua + ud
-    uc = ud - ua
-    vc = va + vb
-    uavc = ua * vc
-    # real part of the complex number
-    # result_rel = add(uavc, mul(mul(ub, vb), -1))
-    result_rel = uavc - ub * vb
-    # imaginary part of the complex number
-    result_im = uc * va + uavc
-    # use the last dimension: dim=-1
-    result = cat((result_rel, result_im), dim=-1)
-    return result
+    return complex_multiply(x, y)
 
 
 def complex_mul2(x, y):
@@ -351,9 +337,9 @@ def complex_mul2(x, y):
     >>> np.testing.assert_array_equal(complex_mul2(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -392,26 +378,7 @@ def complex_mul2(x, y):
     >>> del x
     >>> del y
     """
-    # mul = torch.mul
-    # add = torch.add
-    cat = torch.cat
-
-    # x = a + bi
-    # y = c + di
-    # x * y = (ac - bd) + i(ad + bc)
-    a = x[..., :1]
-    b = x[..., 1:]
-    c = y[..., :1]
-    d = y[..., 1:]
-
-    # relational part of the complex number
-    # result_rel = add(uavc, mul(mul(ub, vb), -1))
-    result_rel = a * c - b * d
-    # imaginary part of the complex number
-    result_im = a * d + b * c
-    # use the last dimension: dim=-1
-    result = cat(tensors=(result_rel, result_im), dim=-1)
-    return result
+    return complex_multiply(x, y)
 
 
 def complex_mul3(x, y):
@@ -440,9 +407,9 @@ def complex_mul3(x, y):
     >>> np.testing.assert_array_equal(complex_mul3(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -481,25 +448,7 @@ def complex_mul3(x, y):
     >>> del x
     >>> del y
     """
-
-    # x = a + bi
-    # y = c + di
-    # x * y = (ac - bd) + i(ad + bc)
-    # a = x[..., :1]
-    # b = x[..., 1:]
-    # c = y[..., :1]
-    # d = y[..., 1:]
-
-    # relational part of the complex number
-    # result_rel = add(uavc, mul(mul(ub, vb), -1))
-    # result_rel = a * c - b * d
-    # imaginary part of the complex number
-    # result_im = a * d + b * c
-    # use the last dimension: dim=-1
-    return torch.cat(tensors=(x[..., :1] * y[..., :1] - x[..., 1:] * y[..., 1:],
-                              x[..., 1:] * y[..., :1] + x[..., :1] * y[...,
-                                                                     1:]),
-                     dim=-1)
+    return complex_multiply(x, y)
 
 
 def complex_mul4(x, y):
@@ -528,9 +477,9 @@ def complex_mul4(x, y):
     >>> np.testing.assert_array_equal(complex_mul4(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -569,14 +518,7 @@ def complex_mul4(x, y):
     >>> del x
     >>> del y
     """
-    # mul = torch.mul
-    # add = torch.add
-    # torch.cat(tensors=(x[..., :1]*y[..., :1]-x[..., 1:]*y[..., 1:],
-    #                    x[..., 1:]*y[..., :1]+x[..., :1]*y[..., 1:]))
-    out = x * y[..., :1]
-    out[..., :1].add_(-1 * x[..., 1:] * y[..., 1:])
-    out[..., 1:].add_(x[..., :1] * y[..., 1:])
-    return out
+    return complex_multiply(x, y)
 
 
 def complex_mul5(x, y, out):
@@ -610,9 +552,9 @@ def complex_mul5(x, y, out):
     >>> complex_mul5(x, y, out)
     >>> np.testing.assert_array_equal(out, expect)
 
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -663,29 +605,7 @@ def complex_mul5(x, y, out):
     >>> complex_mul5(x, y, out)
     >>> np.testing.assert_array_equal(expect, out)
     """
-    # # ua = x.narrow(dim=-1, start=0, length=1)
-    # ua = x[..., :1]
-    # # ud = x.narrow(-1, 1, 1)
-    # ud = x[..., 1:]
-    # # va = y.narrow(-1, 0, 1)
-    # va = y[..., :1]
-    # # vb = y.narrow(-1, 1, 1)
-    # vb = y[..., 1:]
-    # ub = ua + ud
-    # uc = ud - ua
-    # vc = va + vb
-    # uavc = ua * vc
-    # # result_rel = add(uavc, mul(mul(ub, vb), -1))
-    # result_rel = uavc - ub * vb
-    # # imaginary part of the complex number
-    # result_im = uc * va + uavc
-
-    uavc = x[..., 0] * (y[..., 0] + y[..., 1])
-    # real part of the complex number
-    # result_rel = add(uavc, mul(mul(ub, vb), -1))
-    out[..., 0] = uavc - (x[..., 0] + x[..., 1]) * y[..., 1]
-    # imaginary part of the complex number
-    out[..., 1] = (x[..., 1] - x[..., 0]) * y[..., 0] + uavc
+    complex_multiply_out(x, y, out)
 
 
 def complex_mul6_cpp(x, y):
@@ -714,9 +634,9 @@ def complex_mul6_cpp(x, y):
     >>> np.testing.assert_array_equal(complex_mul6_cpp(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -753,8 +673,7 @@ def complex_mul6_cpp(x, y):
     >>> np.testing.assert_array_equal(xy,
     ... tensor([[[-4., 7.], [1., 7.]], [[108.,   0.], [ -8.,  16.]]]))
     """
-    pass
-    # return complex_mul_cpp(x, y)
+    return complex_multiply(x, y)
 
 
 def complex_mul7_cuda(x, y, out):
@@ -788,9 +707,9 @@ def complex_mul7_cuda(x, y, out):
     >>> complex_mul7_cuda(x, y, out)
     >>> np.testing.assert_array_equal(out, expect)
 
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -841,11 +760,11 @@ def complex_mul7_cuda(x, y, out):
     >>> complex_mul7_cuda(x, y, out)
     >>> np.testing.assert_array_equal(expect, out)
     """
-    return complex_mul_cuda(x, y, out)
+    complex_multiply_out(x, y, out)
 
 
 def complex_mul8_stride_cuda(x, y, out):
-    return complex_mul_strid_cuda(x, y, out)
+    complex_multiply_out(x, y, out)
 
 
 def pytorch_conjugate(x):
@@ -879,9 +798,7 @@ def pytorch_conjugate(x):
     ... [[3, -2], [1, 0], [0, -3]], [[1, -2], [8, -9], [10, -121]]]]))
     >>> del x
     """
-    con_x = x.clone()
-    con_x.narrow(dim=-1, start=1, length=1).mul_(-1)
-    return con_x
+    return complex_conjugate(x)
 
 
 def get_full_energy(x):
@@ -921,8 +838,7 @@ def get_full_energy(x):
     """
     # the signal in frequency domain is symmetric and pytorch already
     # discards second half of the signal
-    squared = torch.add(torch.pow(x.narrow(-1, 0, 1), 2),
-                        torch.pow(x.narrow(-1, 1, 1), 2)).squeeze()
+    squared = get_squared_magnitude(x).squeeze()
     # sum of squared values of the signal
     full_energy = torch.sum(squared).item()
     return full_energy, squared
@@ -976,8 +892,7 @@ def get_full_energy_only(x):
     >>> expected_full_energy = np.sum(np.power(np.absolute(x_numpy), 2))
     >>> np.testing.assert_almost_equal(full_energy, expected_full_energy, decimal=4)
     """
-    return torch.sum(torch.add(torch.pow(x.narrow(-1, 0, 1), 2),
-                               torch.pow(x.narrow(-1, 1, 1), 2))).item()
+    return torch.sum(get_squared_magnitude(x)).item()
 
 
 def get_spectrum(xfft, squeeze=True):
@@ -1025,7 +940,7 @@ def get_xfft_hw(input, is_next_power2=False, signal_ndim=2, onesided=True):
         H_fft = H
         W_fft = W
 
-    xfft = torch.rfft(input,
+    xfft = rfft_pairs(input,
                       signal_ndim=signal_ndim,
                       onesided=onesided)
     return xfft, H_fft, W_fft
@@ -1045,7 +960,7 @@ def get_ifft_hw(xfft, H_fft, W_fft, H, W, onesided=True, signal_ndim=2):
     (conjugate symmetry).
     :return: the image in the spatial domain with H, W sizes
     """
-    out = torch.irfft(input=xfft,
+    out = irfft_pairs(input=xfft,
                       signal_ndim=signal_ndim,
                       signal_sizes=(H_fft, W_fft),
                       onesided=onesided)
@@ -1150,8 +1065,7 @@ def get_full_energy_simple(x):
     # print(x[..., 1])
     # The signal in frequency domain is symmetric and pytorch already
     # discards second half of the signal.
-    squared = torch.add(torch.pow(x[..., 0], 2),
-                        torch.pow(x[..., 1], 2)).squeeze()
+    squared = get_squared_magnitude(x).squeeze()
     # sum of squared values of the signal
     full_energy = torch.sum(squared).item()
     return full_energy, squared
@@ -1356,12 +1270,16 @@ def preserve_energy_index_back(xfft, preserve_energy_rate=None,
     return input_length - index
 
 
-def preserve_energy2D_index_back(xfft, preserve_energy_rate=None):
+def preserve_energy2D_index_back(xfft, preserve_energy_rate=None,
+                                 policy='batch', energy_prefix=None):
     """
     Give index_back_H and index_back_W for the given energy rate.
 
     :param xfft: the input fft-ed signal
     :param energy_rate: how much energy of xfft should be preserved?
+    :param policy: batch or sample (see EnergyPrefix2D)
+    :param energy_prefix: the EnergyPrefix2D computed for xfft before (to
+    answer many energy rates for the same xfft)
     :return: the index back for H and W (how many coefficients from both ends of
     the signal should be discarded)?
 
@@ -1440,51 +1358,11 @@ def preserve_energy2D_index_back(xfft, preserve_energy_rate=None):
         """The dimensions: N, C, H, W, X (complex number)."""
         raise ValueError(
             "The expected input is fft-ed 2D map in a batch with channels.")
-    # The third dimension from the end is the length because this is a complex
-    # 2D input, the second dimension from the end is the width.
-    input_H = xfft.shape[-3]
-    input_W = xfft.shape[-2]
     if xfft is None or len(xfft) == 0:
         return 0
-    squared = torch.add(torch.pow(xfft[..., 0], 2),
-                        torch.pow(xfft[..., 1], 2))
-    # Sum the batch and channel dimensions (we first reduce to many channels -
-    # first 0, and then to only a single channel - next 0 (the dimensions
-    # collapse one by one).
-    squared = squared.sum(dim=0).sum(dim=0)
-    assert squared.shape[0] == input_H
-    assert squared.shape[1] == input_W
-
-    # Sum of squared values of the signal of length input_length.
-    full_energy = torch.sum(squared).item()
-    current_energy = 0.0
-    preserved_energy = full_energy * preserve_energy_rate / 100.0
-    index_H = 0
-    index_W = 0
-    # Accumulate the energy (and increment the index) until the required
-    # preserved energy is reached.
-    while current_energy < preserved_energy and (
-            index_W < input_W and index_H < input_H):
-        """
-        Try to generate a square output first.
-        """
-        current_energy += get_squared_energy(squared, index_W)
-        index_W += 1
-        index_H += 1
-
-    # Then proceed along the columns and then rows.
-    while current_energy < preserved_energy and index_W < input_W:
-        col_energy = torch.sum(squared[:, index_W]).item()
-        current_energy += col_energy
-        index_W += 1
-    while current_energy < preserved_energy and index_H < input_H:
-        row_energy = torch.sum(squared[index_H, :]).item()
-        current_energy += row_energy
-        index_H += 1
-    if current_energy < preserved_energy:
-        raise AssertionError("We have to accumulate at least preserve energy! "
-                             "The index_H and index_W are too low.")
-    return input_H - index_H, input_W - index_W
+    if energy_prefix is None:
+        energy_prefix = EnergyPrefix2D(xfft, policy=policy)
+    return energy_prefix.get_index_back(preserve_energy_rate)
 
 
 def zero_out_row_span(xfft, row, start_col, end_col=None):
@@ -1913,7 +1791,8 @@ def preserve_energy2D(xfft, yfft, preserve_energy_rate=None):
 
 
 def preserve_energy2D_symmetry(xfft, yfft, preserve_energy_rate=None,
-                               is_debug=False):
+                               is_debug=False, policy='batch',
+                               energy_prefix=None):
     """
     Compress xfft and yfft taking into account Hermitian symmetry of the fft-ed
     2D maps.
@@ -1922,6 +1801,10 @@ def preserve_energy2D_symmetry(xfft, yfft, preserve_energy_rate=None,
     :param yfft: filter in frequency domain.
     :param preserve_energy_rate: how much energy to preserve in the input
     activation map.
+    :param policy: batch - the energy of the whole batch is preserved, sample -
+    the energy of each data point is preserved (see EnergyPrefix2D)
+    :param energy_prefix: the EnergyPrefix2D computed for xfft before (to
+    answer many energy rates for the same xfft)
     :return: the compressed xfft and yfft.
 
     >>> # xfft: tensor 6 x 4 (4 = 6 // 2 + 1)
@@ -1983,31 +1866,23 @@ def preserve_energy2D_symmetry(xfft, yfft, preserve_energy_rate=None,
             "The expected input is fft-ed 2D map in a batch with channels. "
             "The expected dimensions: N, C, H, W, X (complex number)")
     input_W = xfft.shape[3]
-    preserved_energy = get_full_energy_only(xfft) * preserve_energy_rate / 100.0
-
-    # binary search
-    low = 0  # lower bound inclusive
-    high = input_W  # upper bound inclusive
-    index = low + (high - low) // 2
-    while low < high:
-        if compress_2D_energy(xfft, index_forward=index) >= preserved_energy:
-            high = index
-            index = low + (high - low) // 2
-        else:
-            low = index + 1
-            index = low + (high - low) // 2
+    if energy_prefix is None:
+        energy_prefix = EnergyPrefix2D(xfft, policy=policy)
+    # The smallest index for which the energy of the compressed xfft
+    # (compress_2D_energy) reaches the preserved energy.
+    index = energy_prefix.get_index_forward(preserve_energy_rate)
 
     cxfft = compress_2D_index_forward(xfft, index)
     cyfft = compress_2D_index_forward(yfft, index)
 
-    # if is_debug:
-    #     xfft_numel = xfft.numel()
-    #     cxfft_numel = cxfft.numel()
-    #     compression_ratio = (xfft_numel - cxfft_numel) / xfft_numel
-    #     print(f"total width,{input_W},index forward,{index}, "
-    #           f"num elems xfft,{xfft_numel}, "
-    #           f"num elems compressed xfft,{cxfft_numel}, "
-    #           f"compression ratio,{compression_ratio},stop")
+    if is_debug:
+        xfft_numel = xfft.numel()
+        cxfft_numel = cxfft.numel()
+        compression_ratio = (xfft_numel - cxfft_numel) / xfft_numel
+        print(f"total width,{input_W},index forward,{index},"
+              f"index forward per data point,"
+              f"{energy_prefix.cutoffs.tolist()},"
+              f"compression ratio,{compression_ratio},stop")
     return cxfft, cyfft
 
 
@@ -2027,7 +1902,7 @@ def compress_2D_energy(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     >>> index_forward = 3
     >>> xfft_compressed = compress_2D_index_forward(xfft, index_forward = index_forward)
     >>> _, _, H, W, _ = xfft_compressed.size()
@@ -2073,7 +1948,7 @@ def compress_2D_index_forward(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     >>> # print("xfft: ", xfft)
     >>> xfft_compressed = compress_2D_index_forward(xfft, index_forward = 3)
     >>> # print("xfft compressed: ", xfft_compressed)
@@ -2088,7 +1963,7 @@ def compress_2D_index_forward(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     >>> # print("xfft: ", xfft)
     >>> xfft_compressed = compress_2D_index_forward(xfft, index_forward = 4)
     >>> # print("xfft compressed: ", xfft_compressed)
@@ -2131,7 +2006,7 @@ def compress_2D_index_forward_full(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     >>> xfft_compressed = compress_2D_index_forward_full(xfft, index_forward = 2)
     >>> _, _, H, W, _ = xfft_compressed.size()
     >>> # print(xfft_compressed.size())
@@ -2144,7 +2019,7 @@ def compress_2D_index_forward_full(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     >>> xfft_compressed = compress_2D_index_forward_full(xfft, index_forward = 3)
     >>> _, _, H, W, _ = xfft_compressed.size()
     >>> # print(xfft_compressed.size())
@@ -2157,7 +2032,7 @@ def compress_2D_index_forward_full(xfft, index_forward):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     >>> xfft_compressed = compress_2D_index_forward_full(xfft, index_forward = 4)
     >>> _, _, H, W, _ = xfft_compressed.size()
     >>> # print(xfft_compressed.size())
@@ -2218,7 +2093,7 @@ def restore_size_2D_batch(xfft, init_H_fft, init_half_W_fft):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     >>> N, K, C, init_H_fft, init_half_W_fft, _ = xfft.size()
     >>> index_forward = 3
     >>> xfft_compressed = compress_2D_index_forward(xfft, index_forward)
@@ -2273,7 +2148,7 @@ def restore_size_2D(xfft, init_H_fft, init_half_W_fft):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     >>> N, C, init_H_fft, init_half_W_fft, _ = xfft.size()
     >>> index_forward = 3
     >>> xfft_compressed = compress_2D_index_forward(xfft, index_forward)
@@ -2330,7 +2205,7 @@ def restore_size_2D_full(xfft, init_H_fft, init_W_fft):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     >>> N, C, initH, initW, _ = xfft.size()
     >>> assert initH == initW
     >>> index_forward = 3
@@ -2350,7 +2225,7 @@ def restore_size_2D_full(xfft, init_H_fft, init_W_fft):
     ... [5.0, 3.0, 0.0, -1.0, 0.0, 4.0],
     ... [3.0, 0.0, 1.0, -1.0, 0.0  , 5.0],
     ... [1.0, 2.0, 1.0, 1.0, 0.0   , 5.0]]]])
-    >>> xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    >>> xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     >>> N, C, initH, initW, _ = xfft.size()
     >>> assert initH == initW
     >>> index_forward = 2
@@ -2403,12 +2278,12 @@ def compress_2D_half_test(x, index_back=0):
     :return: the compressed x after its compression in the frequency domain.
     """
     N, C, H, W = x.size()
-    xfft = torch.rfft(x, signal_ndim=2, onesided=True)
+    xfft = rfft_pairs(x, signal_ndim=2, onesided=True)
     N, C, init_H_fft, init_half_W_fft, _ = xfft.size()
     cxfft = compress_2D_index_back(xfft, index_back)
     cxfft_zeros = restore_size_2D(cxfft, init_H_fft=init_H_fft,
                                   init_half_W_fft=init_half_W_fft)
-    cx = torch.irfft(cxfft_zeros, signal_ndim=2, signal_sizes=(H, W),
+    cx = irfft_pairs(cxfft_zeros, signal_ndim=2, signal_sizes=(H, W),
                      onesided=True)
     return cx
 
@@ -2422,7 +2297,7 @@ def show2D_spectra_test(x, index_back=0):
     the frequency domain?
     :return: the 2D spectrum of x.
     """
-    xfft = torch.rfft(x, signal_ndim=2, onesided=False)
+    xfft = rfft_pairs(x, signal_ndim=2, onesided=False)
     N, C, init_H_fft, init_W_fft, _ = xfft.size()
     cxfft = compress_2D_in(xfft, index_back)
     cxfft_zeros = restore_size_2D_full(cxfft, init_H_fft=init_H_fft,
@@ -2540,8 +2415,8 @@ def correlate_signals(x, y, fft_size, out_size, preserve_energy_rate=None,
     # frequency are retained (about half the length of the
     # input signal) so the original signal can be still exactly
     # reconstructed from the frequency samples.
-    xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=True)
-    yfft = torch.rfft(y, signal_ndim=signal_ndim, onesided=True)
+    xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=True)
+    yfft = rfft_pairs(y, signal_ndim=signal_ndim, onesided=True)
     if preserve_energy_rate is not None or index_back is not None:
         index_xfft = preserve_energy_index(xfft, preserve_energy_rate,
                                            index_back)
@@ -2581,7 +2456,7 @@ def correlate_signals(x, y, fft_size, out_size, preserve_energy_rate=None,
         input = torch.cat((input, complex_pad), dim=-2)
     else:
         input = complex_mul(xfft, pytorch_conjugate(yfft))
-    out = torch.irfft(input, signal_ndim=signal_ndim,
+    out = irfft_pairs(input, signal_ndim=signal_ndim,
                       signal_sizes=(x.shape[-1],))
 
     # plot_signal(out, "out after ifft")
@@ -2647,8 +2522,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> y_padded = F.pad(y, (0, fft_size - y.shape[-1]), 'constant', 0.0)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft,
     ... fft_size=x.shape[-1])
     >>> # print("result: ", result)
@@ -2663,8 +2538,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> y_padded = F.pad(y, (0, fft_size - y.shape[-1]), 'constant', 0.0)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft,
     ... fft_size=x.shape[-1])
     >>> # print("result: ", result)
@@ -2680,8 +2555,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> y_padded = F.pad(y, (0, fft_size - y.shape[-1]), 'constant', 0.0)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft,
     ... fft_size=x.shape[-1])
     >>> # print("result: ", result)
@@ -2697,8 +2572,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> y_padded = F.pad(y, (0, fft_size - y.shape[-1]), 'constant', 0.0)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft,
     ... fft_size=x.shape[-1])
     >>> # print("result: ", result)
@@ -2712,8 +2587,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> y_padded = F.pad(y, (0, fft_size - y.shape[-1]), 'constant', 0.0)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft, fft_size=len(x))
     >>> out_size=len(x)-len(y) + 1
     >>> np.testing.assert_array_almost_equal(result[..., :out_size],
@@ -2726,8 +2601,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> # print("y_padded: ", y_padded)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft, fft_size=len(x))
     >>> out_size=len(x)-len(y) + 1
     >>> expected_result = np.correlate(x, y, mode='valid')
@@ -2741,8 +2616,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     >>> # print("y_padded: ", y_padded)
     >>> signal_ndim = 1
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals(xfft=xfft, yfft=yfft, fft_size=len(x))
     >>> out_size=x.shape[-1]-y.shape[-1] + 1
     >>> expected_result = np.correlate(x, y, mode='valid')
@@ -2760,8 +2635,8 @@ def correlate_fft_signals(xfft, yfft, fft_size: int,
     freq_mul = complex_mul(xfft, pytorch_conjugate(yfft))
     freq_mul = complex_pad_simple(xfft=freq_mul, fft_size=fft_size)
     # print("freq mul size: ", freq_mul.size())
-    out = torch.irfft(
-        input=freq_mul, signal_ndim=signal_ndim, signal_sizes=(fft_size,))
+    out = torch.fft.irfftn(to_complex(freq_mul), s=(fft_size,),
+                           dim=tuple(range(-signal_ndim, 0)))
     del freq_mul
     return out
 
@@ -2849,8 +2724,8 @@ def correlate_fft_signals2D(xfft, yfft, input_height, input_width,
     ... err_msg="The expected result x is different than the computed y.")
     >>> signal_ndim = 2
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals2D(xfft=xfft,
     ... yfft=pytorch_conjugate(yfft),
     ... input_height=fft_height, input_width=fft_width,
@@ -2877,8 +2752,8 @@ def correlate_fft_signals2D(xfft, yfft, input_height, input_width,
     ... err_msg="The expected result x is different than the computed y.")
     >>> signal_ndim = 2
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals2D(xfft=xfft, yfft=pytorch_conjugate(yfft),
     ... input_height=fft_height, input_width=fft_width,
     ... init_fft_height=xfft.shape[-2], init_half_fft_width=xfft.shape[-1],
@@ -2903,8 +2778,8 @@ def correlate_fft_signals2D(xfft, yfft, input_height, input_width,
     ... err_msg="The expected result x is different than the computed y.")
     >>> signal_ndim = 2
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals2D(xfft=xfft, yfft=pytorch_conjugate(yfft),
     ... input_height=fft_height, input_width=fft_width,
     ... init_fft_height=xfft.shape[-3], init_half_fft_width=xfft.shape[-2],
@@ -2932,8 +2807,8 @@ def correlate_fft_signals2D(xfft, yfft, input_height, input_width,
     ... err_msg="The expected result x is different than the computed y.")
     >>> signal_ndim = 2
     >>> onesided = True
-    >>> xfft = torch.rfft(x, signal_ndim=signal_ndim, onesided=onesided)
-    >>> yfft = torch.rfft(y_padded, signal_ndim=signal_ndim, onesided=onesided)
+    >>> xfft = rfft_pairs(x, signal_ndim=signal_ndim, onesided=onesided)
+    >>> yfft = rfft_pairs(y_padded, signal_ndim=signal_ndim, onesided=onesided)
     >>> result = correlate_fft_signals2D(xfft=xfft, yfft=pytorch_conjugate(yfft),
     ... input_height=fft_height, input_width=fft_width,
     ... init_fft_height=xfft.shape[-3], init_half_fft_width=xfft.shape[-2],
@@ -2977,8 +2852,9 @@ def correlate_fft_signals2D(xfft, yfft, input_height, input_width,
                                    init_half_W_fft=init_half_fft_width)
     else:
         raise Exception(f"Unsupported number of dimensions: {xfft.dim()}")
-    out = torch.irfft(input=freq_mul, signal_ndim=signal_ndim,
-                      signal_sizes=(input_height, input_width), onesided=True)
+    out = torch.fft.irfftn(to_complex(freq_mul),
+                           s=(input_height, input_width),
+                           dim=tuple(range(-signal_ndim, 0)))
     all_tensors_size = get_tensors_elem_size()
     # print("all tensor size in corr: ", all_tensors_size / 2 ** 30)
     # print("torch max memory in corr: ", torch.cuda.max_memory_allocated() / 2 ** 30)
@@ -3154,7 +3030,7 @@ def complex_pad2D(fft_input, half_fft_height, half_fft_width):
     if current_height < half_fft_height or current_width < half_fft_width:
         pad_bottom = half_fft_height - current_height
         pad_right = half_fft_width - current_width
-        return F.pad(fft_input, (0, 0, 0, pad_right, 0, pad_bottom))
+        return complex_zero_pad(fft_input, (0, pad_right, 0, pad_bottom))
     return fft_input
 
 
@@ -3191,9 +3067,9 @@ def fast_jmul(input, filter):
     >>> np.testing.assert_array_equal(fast_jmul(x, y),
     ... tensor([[12.,   0.], [-12., 0.], [0., 1.], [ 0.,   2.],
     ... [-4., 7.]]))
-    >>> # x = torch.rfft(torch.tensor([1., 2., 3., 0.]), 1)
+    >>> # x = rfft_pairs(torch.tensor([1., 2., 3., 0.]), 1)
     >>> x = tensor([[ 6.,  0.], [-2., -2.], [ 2.,  0.]])
-    >>> # y = torch.rfft(torch.tensor([5., 6., 7., 0.]), 1)
+    >>> # y = rfft_pairs(torch.tensor([5., 6., 7., 0.]), 1)
     >>> y = tensor([[18.,  0.], [-2., -6.], [ 6.,  0.]])
     >>> # torch.equal(tensor1, tensor2): True if two tensors
     >>> # have the same size and elements, False otherwise.
@@ -3230,21 +3106,7 @@ def fast_jmul(input, filter):
     >>> del y
     >>> del xy
     """
-    a = input[..., :1]
-    b = input[..., 1:]
-    c = filter[..., :1]
-    d = filter[..., 1:]
-
-    ac = torch.mul(a, c)
-    bd = torch.mul(b, d)
-
-    a_bc_d = torch.mul(torch.add(a, b), torch.add(c, d))
-    out_re = ac - bd
-    out_im = a_bc_d - ac - bd
-
-    out = torch.cat((out_re, out_im), -1)
-
-    return out
+    return complex_multiply(input, filter)
 
 
 def retain_low_coef(xfft, preserve_energy=None, index_back=None):
@@ -3356,7 +3218,8 @@ def retain_low_coef(xfft, preserve_energy=None, index_back=None):
     return xfft
 
 
-def retain_big_coef(xfft, preserve_energy=None, index_back=None):
+def retain_big_coef(xfft, preserve_energy=None, index_back=None,
+                    policy='sample'):
     """
     Retain the largest coefficients to either to reach the required
     preserve_energy or after removing compress_rate coefficients. Only one of them
@@ -3367,6 +3230,9 @@ def retain_big_coef(xfft, preserve_energy=None, index_back=None):
     :param preserve_energy: the percentage of energy to be preserved
     :param index_back: the number of zeroed out coefficients (starting from the
     smallest one).
+    :param policy: sample - the largest coefficients of each data point are
+    retained, batch - the same coefficients are retained for all the data
+    points (see EnergyPrefixSorted)
     :return: the zeroed-out small coefficients
 
     >>> # Simple compress_rate.
@@ -3439,41 +3305,17 @@ def retain_big_coef(xfft, preserve_energy=None, index_back=None):
         return xfft
     if (preserve_energy is not None and preserve_energy < 100) or (
             index_back is not None and index_back > 0):
-        out = torch.zeros_like(xfft, device=xfft.device)
-        for data_point_index, data_point_value in enumerate(xfft):
-            for channel_index, channel_value in enumerate(data_point_value):
-                full_energy, squared = get_full_energy(channel_value)
-                current_energy = 0.0
-                added_indexes = 0
-                preserved_indexes = len(squared)
-                if index_back is not None:
-                    preserved_indexes = len(squared) - index_back
-                preserved_energy = full_energy
-                if preserve_energy is not None:
-                    preserved_energy = full_energy * preserve_energy / 100
-                # Creates the priority queue with the pair: coefficient
-                # absolute value and the position (index) in the signal
-                # (array).
-                heap = []
-                # Index and value of a coefficient.
-                for square_index, square_value in enumerate(squared):
-                    # We want to get the largest coefficients.
-                    heappush(heap, (-square_value, square_index))
-                while current_energy < preserved_energy and (
-                        added_indexes < preserved_indexes):
-                    neg_energy, coeff_index = heappop(heap)
-                    energy = (-neg_energy.item())
-                    # np.testing.assert_almost_equal(actual=energy,
-                    #                                desired=squared[coeff_index])
-                    current_energy += (-neg_energy)
-                    added_indexes += 1
-                    out[data_point_index, channel_index, coeff_index, :] = \
-                        xfft[data_point_index, channel_index, coeff_index, :]
-        return out
+        # The prefix sums of the sorted energies replace the scan over the
+        # coefficients.
+        energy_prefix = EnergyPrefixSorted(xfft, policy=policy)
+        counts = energy_prefix.get_counts(preserve_energy=preserve_energy,
+                                          index_back=index_back)
+        return energy_prefix.retain(xfft, counts)
     return xfft
 
 
-def retain_big_coef_bulk(xfft, preserve_energy=None, index_back=None):
+def retain_big_coef_bulk(xfft, preserve_energy=None, index_back=None,
+                         policy='sample'):
     """
     Retain the largest coefficients to either to reach the required
     preserve_energy or after removing compress_rate coefficients. Only one of them
@@ -3484,6 +3326,9 @@ def retain_big_coef_bulk(xfft, preserve_energy=None, index_back=None):
     :param preserve_energy: the percentage of energy to be preserved
     :param index_back: the number of zeroed out coefficients (starting from the
     smallest one).
+    :param policy: sample - the largest coefficients of each data point are
+    retained, batch - the same coefficients are retained for all the data
+    points (see EnergyPrefixSorted)
     :return: the zeroed-out small coefficients
 
     >>> # Simple compress_rate.
@@ -3556,35 +3401,12 @@ def retain_big_coef_bulk(xfft, preserve_energy=None, index_back=None):
         return xfft
     if (preserve_energy is not None and preserve_energy < 100) or (
             index_back is not None and index_back > 0):
-        out = torch.zeros_like(xfft, device=xfft.device)
-        full_energy_bulk, squared_bulk = get_full_energy_bulk(xfft)
-        # plot_signal_freq(squared_bulk[0, 0].numpy())
-        squared_bulk, indices_bulk = torch.sort(squared_bulk, descending=True)
-        N, C, _, _ = xfft.size()
-        for data_point_index in range(N):
-            for channel_index in range(C):
-                full_energy = full_energy_bulk[data_point_index, channel_index]
-                squared = squared_bulk[data_point_index, channel_index]
-                indices = indices_bulk[data_point_index, channel_index]
-                current_energy = 0.0
-                added_index = 0
-                # Number of coefficients in the squared array (the amplitudes of
-                # the coefficients).
-                preserved_indexes = len(squared)
-                if index_back is not None:
-                    preserved_indexes -= index_back
-                preserved_energy = full_energy
-                if preserve_energy is not None:
-                    preserved_energy = full_energy * preserve_energy / 100
-                while current_energy < preserved_energy and (
-                        added_index < preserved_indexes):
-                    energy = squared[added_index]
-                    coeff_index = indices[added_index]
-                    current_energy += energy
-                    added_index += 1
-                    out[data_point_index, channel_index, coeff_index, :] = \
-                        xfft[data_point_index, channel_index, coeff_index, :]
-        return out
+        # The prefix sums of the sorted energies replace the scan over the
+        # coefficients.
+        energy_prefix = EnergyPrefixSorted(xfft, policy=policy)
+        counts = energy_prefix.get_counts(preserve_energy=preserve_energy,
+                                          index_back=index_back)
+        return energy_prefix.retain(xfft, counts)
     return xfft
 
 
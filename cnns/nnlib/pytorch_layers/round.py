@@ -1,7 +1,31 @@
 import torch
-from cnns.nnlib.datasets.transformations.denorm_round_norm import \
-    DenormRoundNorm
 from torch.nn import Module
+from cnns.nnlib.pytorch_layers.bpda import restore_format
+from cnns.nnlib.pytorch_layers.bpda import straight_through
+
+
+def round_values(input, mean, std, values_per_channel: float):
+    """
+    Denormalize the input, round it to values_per_channel values in the range
+    [0, 1] and normalize it back.
+
+    The rounding is computed in float32 (half and bfloat16 do not resolve the
+    quantization levels), the output has the dtype and memory format of the
+    input (half, bfloat16, channels_last). Only tensor ops are used so it can
+    be scripted.
+
+    :param input: the normalized input
+    :param mean: the mean (broadcastable to the input)
+    :param std: the std (broadcastable to the input)
+    :param values_per_channel: the number of values per channel
+    :return: the rounded input
+    """
+    x = input.float()
+    mean = mean.float()
+    std = std.float()
+    round_multiplier = values_per_channel - 1.0
+    output = torch.round((x * std + mean) * round_multiplier)
+    return restore_format((output / round_multiplier - mean) / std, input)
 
 
 class RoundFunction(torch.autograd.Function):
@@ -55,17 +79,22 @@ class Round(Module):
 
     def __init__(self, args):
         super(Round, self).__init__()
-        self.rounder = DenormRoundNorm(
-            values_per_channel=args.values_per_channel,
-            mean_array=args.mean_array,
-            std_array=args.std_array, device=args.device)
+        self.values_per_channel = float(args.values_per_channel)
+        # The buffers follow the module across devices (the model.to(...)).
+        self.register_buffer('mean', torch.as_tensor(
+            args.mean_array, dtype=torch.float32, device=args.device))
+        self.register_buffer('std', torch.as_tensor(
+            args.std_array, dtype=torch.float32, device=args.device))
+
+    def rounder(self, input):
+        return round_values(input, mean=self.mean, std=self.std,
+                            values_per_channel=self.values_per_channel)
 
     def forward(self, input):
         """
-        This is the fully manual implementation of the forward and backward
-        passes via the torch.autograd.Function.
+        The rounding with the gradient of the identity (as in RoundFunction).
 
         :param input: the input map (e.g., an image)
-        :return: the result of 1D convolution
+        :return: the rounded input
         """
-        return RoundFunction.apply(input, self.rounder)
+        return straight_through(input, self.rounder(input))
@@ -38,6 +38,40 @@ class TestRound(unittest.TestCase):
         expected_gradient = torch.tensor([[0.1, 0.2], [0.4, 0.3]])
         self.assertTrue(a.grad.equal(expected_gradient))
 
+    def get_args(self):
+        args = Arguments()
+        args.mean_array = np.array((0.4, 0.5, 0.6)).reshape((3, 1, 1))
+        args.std_array = np.array((0.2, 0.25, 0.3)).reshape((3, 1, 1))
+        args.device = torch.device("cpu")
+        args.values_per_channel = 8
+        return args
+
+    def test_round_half_channels_last(self):
+        round = Round(args=self.get_args())
+        a = torch.randn(2, 3, 8, 8)
+        expected = round(a)
+        b = a.half().contiguous(memory_format=torch.channels_last)
+        result = round(b)
+        self.assertEqual(result.dtype, torch.half)
+        self.assertTrue(
+            result.is_contiguous(memory_format=torch.channels_last))
+        # The same rounding (up to the values at the rounding boundaries).
+        close = (result.float() - expected).abs() < 1e-2
+        self.assertGreater(close.float().mean().item(), 0.99)
+
+    def test_round_bfloat16(self):
+        round = Round(args=self.get_args())
+        a = torch.randn(2, 3, 16, 16).bfloat16()
+        # The same quantization levels as the float32 rounding of the input.
+        expected = round(a.float()).bfloat16()
+        self.assertTrue(round(a).equal(expected))
+
+    def test_round_script(self):
+        round = Round(args=self.get_args())
+        scripted = torch.jit.script(round)
+        a = torch.randn(2, 3, 8, 8)
+        self.assertTrue(scripted(a).equal(round(a)))
+
 
 if __name__ == '__main__':
     unittest.main()
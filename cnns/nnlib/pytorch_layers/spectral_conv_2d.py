@@ -2,6 +2,8 @@ import math
 
 import numpy as np
 import torch
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 from torch.nn import Module
 from torch.nn import functional as F
 from torch.nn.modules.utils import _pair
@@ -95,7 +97,7 @@ class SpectralConv2d(Module):
         :return: a feature map
         """
         spatial = torch.cat((self.real, self.imag), dim=-1)
-        weight = torch.irfft(spatial, signal_ndim=self.signal_ndim,
+        weight = irfft_pairs(spatial, signal_ndim=self.signal_ndim,
                              onesided=True)
         return F.conv2d(input, weight, self.bias, self.stride,
                         self.padding, self.dilation, self.groups)
@@ -110,7 +112,7 @@ class SpectralConv2d(Module):
         stdv = 1. / math.sqrt(n)
         self.weight.data.uniform_(-stdv, stdv)
 
-        fft = torch.rfft(self.weight, signal_ndim=self.signal_ndim,
+        fft = rfft_pairs(self.weight, signal_ndim=self.signal_ndim,
                          onesided=True)
         real = fft.narrow(-1, 0, 1)
         imag = fft.narrow(-1, 1, 1)
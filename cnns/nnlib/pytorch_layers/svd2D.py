@@ -1,6 +1,8 @@
 import torch
-from cnns.nnlib.utils.svd2d import compress_svd
+from cnns.nnlib.robustness.channels.channels_definition import \
+    compress_svd_batch
 from torch.nn import Module
+from cnns.nnlib.pytorch_layers.bpda import restore_format
 
 
 class SVDcompress(Module):
@@ -20,8 +22,12 @@ class SVDcompress(Module):
         This is the fully manual implementation of the forward and backward
         passes via the torch.autograd.Function.
 
+        The svd is computed in float32 (it is not implemented for half and
+        bfloat16), the output has the dtype and memory format of the input.
+
         :param input: the input map (e.g., an image)
-        :return: the result of 1D convolution
+        :return: the compressed input
         """
-        return compress_svd(torch_img=input,
-                            compress_rate=self.args.svd_compress)
+        output = compress_svd_batch(x=input.float(),
+                                    compress_rate=self.args.svd_compress)
+        return restore_format(output, input)
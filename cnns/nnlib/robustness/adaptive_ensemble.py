@@ -0,0 +1,87 @@
+import torch
+
+
+def get_z_alpha(alpha):
+    """
+    :param alpha: the significance level
+    :return: the critical value of the one-sided test for the standard normal
+    """
+    return torch.distributions.Normal(0.0, 1.0).icdf(
+        torch.tensor(1.0 - alpha)).item()
+
+
+def is_plurality_settled(class_id_counters, alpha):
+    """
+    Check if the top class is statistically settled: one-sided sign test
+    (with the normal approximation) that the top class is selected more often
+    than the runner-up class. This is a single test, a caller that repeats it
+    after every pass has to split alpha over the tests.
+
+    :param class_id_counters: the votes (N, num_classes)
+    :param alpha: the significance level
+    :return: bool tensor (N) - True if the top class is settled
+    """
+    top2 = torch.topk(class_id_counters, k=2, dim=1)[0]
+    n1, n2 = top2[:, 0], top2[:, 1]
+    return (n1 - n2) > get_z_alpha(alpha) * torch.sqrt(n1 + n2)
+
+
+def adaptive_ensemble_infer(input, net, n=50, nclass=10, alpha=0.0,
+                            min_passes=5, vote=False):
+    """
+    Ensemble inference for a randomized network (e.g., RSE or PNI): sum the
+    softmax outputs from many noisy forward passes.
+
+    With alpha > 0, we track the votes (the class with the max output of each
+    pass) for each sample and stop drawing new passes for the samples whose
+    top class leads the runner-up class significantly after at least
+    min_passes passes. The test is repeated after each of the (at most)
+    n - min_passes + 1 passes, so alpha is spent evenly over them (the
+    Bonferroni bound): each test is run at the level
+    alpha / (n - min_passes + 1) and the chance that a sample stops on a
+    plurality that is not the true one is at most alpha. The prediction is
+    then the most voted class (the same statistic as the stopping rule). Only
+    the unsettled samples are sent through the net in the next pass (as a
+    compacted smaller batch).
+
+    :param input: the input batch
+    :param net: the randomized network
+    :param n: the max number of passes
+    :param nclass: the number of classes
+    :param alpha: the overall significance level for the early stopping (0 -
+    run all the n passes for all the samples)
+    :param min_passes: the min number of passes before the early stopping
+    :param vote: predict the most voted class instead of the class with the
+    largest probability mass (always done for alpha > 0)
+    :return: the predicted classes and the number of passes used per sample
+    """
+    net.eval()
+    batch_size = input.size()[0]
+    device = input.device
+    prob = torch.zeros(batch_size, nclass, device=device)
+    votes = torch.zeros(batch_size, nclass, device=device)
+    passes = torch.zeros(batch_size, dtype=torch.long, device=device)
+    active = torch.arange(batch_size, device=device)
+    # The alpha spent on each of the repeated tests.
+    test_alpha = alpha / max(n - min_passes + 1, 1)
+    with torch.no_grad():
+        for i in range(n):
+            if i == 0:
+                output = net(input)
+            else:
+                output = net(input[active])
+            prob.index_add_(0, active, torch.softmax(output, dim=1))
+            votes.index_add_(0, active, torch.zeros_like(output).scatter_(
+                dim=1, index=output.argmax(dim=1, keepdim=True), value=1))
+            passes[active] += 1
+            if alpha > 0 and i + 1 >= min_passes:
+                is_settled = is_plurality_settled(votes[active],
+                                                  alpha=test_alpha)
+                active = active[~is_settled]
+                if len(active) == 0:
+                    break
+    if vote or alpha > 0:
+        _, pred = torch.max(votes, 1)
+    else:
+        _, pred = torch.max(prob, 1)
+    return pred, passes
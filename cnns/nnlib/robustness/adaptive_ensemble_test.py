@@ -0,0 +1,89 @@
+import unittest
+import numpy as np
+import torch
+from torch import nn
+from cnns.nnlib.robustness.adaptive_ensemble import adaptive_ensemble_infer
+from cnns.nnlib.robustness.adaptive_ensemble import is_plurality_settled
+
+
+class NoisyNet(nn.Module):
+    """
+    The logits are the inputs plus the gauss noise, count the input sizes.
+    """
+
+    def __init__(self, sigma):
+        super(NoisyNet, self).__init__()
+        self.sigma = sigma
+        self.batch_sizes = []
+
+    def forward(self, x):
+        self.batch_sizes.append(x.size(0))
+        return x + self.sigma * torch.randn_like(x)
+
+
+class CycleNet(nn.Module):
+    """
+    The logits of the passes are taken from the outputs in a cycle.
+    """
+
+    def __init__(self, outputs):
+        super(CycleNet, self).__init__()
+        self.outputs = outputs
+        self.passes = 0
+
+    def forward(self, x):
+        output = self.outputs[self.passes % len(self.outputs)]
+        self.passes += 1
+        return output.expand(x.size(0), -1)
+
+
+class TestAdaptiveEnsemble(unittest.TestCase):
+
+    def test_is_plurality_settled(self):
+        counters = torch.tensor([[10.0, 0.0, 0.0], [5.0, 5.0, 0.0]])
+        np.testing.assert_equal(
+            is_plurality_settled(counters, alpha=0.05).numpy(), [True, False])
+
+    def test_full_ensemble(self):
+        torch.manual_seed(31)
+        input = torch.eye(4)
+        net = NoisyNet(sigma=0.1)
+        pred, passes = adaptive_ensemble_infer(input, net, n=20, nclass=4)
+        np.testing.assert_equal(pred.numpy(), [0, 1, 2, 3])
+        np.testing.assert_equal(passes.numpy(), [20] * 4)
+        self.assertEqual(net.batch_sizes, [4] * 20)
+
+    def test_early_stop(self):
+        torch.manual_seed(31)
+        # The first two samples are easy, the last one is ambiguous.
+        input = torch.tensor([[5.0, 0.0], [0.0, 5.0], [1.0, 1.0]])
+        net = NoisyNet(sigma=1.0)
+        pred, passes = adaptive_ensemble_infer(
+            input, net, n=50, nclass=2, alpha=0.01, min_passes=8)
+        np.testing.assert_equal(pred[:2].numpy(), [0, 1])
+        # The alpha is split over 43 tests (z = 3.5), the unanimous votes
+        # settle after 13 passes.
+        np.testing.assert_equal(passes[:2].numpy(), [13, 13])
+        self.assertGreater(passes[2].item(), 13)
+        # The settled samples are not sent through the net again.
+        self.assertEqual(net.batch_sizes[:13], [3] * 13)
+        self.assertEqual(set(net.batch_sizes[13:]), {1})
+        self.assertEqual(len(net.batch_sizes), passes.max().item())
+
+    def test_early_stop_predicts_votes(self):
+        # Class 0 wins 3 of 5 passes by a small margin, class 1 wins the
+        # other passes by a large margin (and has more probability mass).
+        outputs = torch.tensor([[0.1, 0.0], [0.1, 0.0], [0.1, 0.0],
+                                [0.0, 9.0], [0.0, 9.0]])
+        input = torch.zeros(1, 2)
+        pred, _ = adaptive_ensemble_infer(input, CycleNet(outputs), n=10,
+                                          nclass=2)
+        np.testing.assert_equal(pred.numpy(), [1])
+        # The stopping rule uses the votes, so does the prediction.
+        pred, _ = adaptive_ensemble_infer(input, CycleNet(outputs), n=10,
+                                          nclass=2, alpha=0.05)
+        np.testing.assert_equal(pred.numpy(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,241 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import SequentialSampler
+
+# The attacks against the channels below depend on the channel (they are
+# adaptive), so the channel is a part of the key of the stored adversarials.
+ADAPTIVE_CHANNELS = ('perturb', 'fft_adaptive')
+
+
+class AdversarialStore(object):
+    """
+    A persistent store of adversarial examples.
+
+    The store is keyed by (dataset, model checkpoint, attack name, attack
+    params) - each key has its own directory (named by the hash of the key)
+    and the adversarial examples inside are addressed by the index of the
+    original sample in the (unshuffled) dataset.
+
+    The samples are kept in fixed-size chunks of .npy files that are memory
+    mapped (np.lib.format.open_memmap), so a batch is written in place
+    (without reallocating or rewriting the data stored so far) and only the
+    chunks that are read or written are paged in. For each chunk, we keep the
+    adversarial images, their labels and a mask of the samples done.
+    """
+
+    def __init__(self, root, dataset, model, attack, params=None,
+                 chunk_size=1024):
+        """
+        :param root: the directory with the stores
+        :param dataset: the name of the dataset
+        :param model: the model checkpoint (path) used by the attack
+        :param attack: the name of the attack
+        :param params: the dict with the parameters of the attack
+        :param chunk_size: the number of samples in a chunk
+        """
+        self.key = {'dataset': dataset, 'model': model, 'attack': attack,
+                    'params': params if params is not None else {}}
+        key_str = json.dumps(self.key, sort_keys=True, default=str)
+        key_hash = hashlib.sha1(key_str.encode('utf-8')).hexdigest()[:16]
+        self.dir = os.path.join(root, f'{dataset}-{attack}-{key_hash}')
+        os.makedirs(self.dir, exist_ok=True)
+        self.meta_file = os.path.join(self.dir, 'meta.json')
+        if os.path.exists(self.meta_file):
+            with open(self.meta_file) as f:
+                meta = json.load(f)
+            self.chunk_size = meta['chunk_size']
+            self.image_shape = meta['image_shape']
+            self.image_dtype = meta['image_dtype']
+        else:
+            self.chunk_size = chunk_size
+            self.image_shape = None
+            self.image_dtype = None
+        self.chunks = {}
+
+    def save_meta(self):
+        meta = {'key': self.key, 'chunk_size': self.chunk_size,
+                'image_shape': self.image_shape,
+                'image_dtype': self.image_dtype}
+        with open(self.meta_file, 'w') as f:
+            json.dump(meta, f, sort_keys=True, default=str, indent=2)
+
+    def get_chunk_file(self, chunk_idx, name):
+        return os.path.join(self.dir, f'chunk-{chunk_idx}-{name}.npy')
+
+    def get_chunk(self, chunk_idx, create=False):
+        """
+        :return: the memory mapped (images, labels, done) of the chunk or
+        None if the chunk does not exist (and create is False)
+        """
+        chunk = self.chunks.get(chunk_idx, None)
+        if chunk is not None:
+            return chunk
+        done_file = self.get_chunk_file(chunk_idx, 'done')
+        if os.path.exists(done_file):
+            chunk = tuple(np.load(self.get_chunk_file(chunk_idx, name),
+                                  mmap_mode='r+')
+                          for name in ('images', 'labels', 'done'))
+        elif create:
+            images = np.lib.format.open_memmap(
+                self.get_chunk_file(chunk_idx, 'images'), mode='w+',
+                dtype=np.dtype(self.image_dtype),
+                shape=(self.chunk_size, *self.image_shape))
+            labels = np.lib.format.open_memmap(
+                self.get_chunk_file(chunk_idx, 'labels'), mode='w+',
+                dtype=np.int64, shape=(self.chunk_size,))
+            # The done mask is created last, it marks an existing chunk.
+            done = np.lib.format.open_memmap(
+                done_file, mode='w+', dtype=np.bool_,
+                shape=(self.chunk_size,))
+            chunk = (images, labels, done)
+        else:
+            return None
+        self.chunks[chunk_idx] = chunk
+        return chunk
+
+    def split(self, indices):
+        """
+        Group the sample indices by chunks.
+
+        :return: the list of (chunk_idx, positions in indices, offsets in the
+        chunk)
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        chunk_ids = indices // self.chunk_size
+        groups = []
+        for chunk_idx in np.unique(chunk_ids):
+            positions = np.nonzero(chunk_ids == chunk_idx)[0]
+            groups.append((int(chunk_idx), positions,
+                           indices[positions] % self.chunk_size))
+        return groups
+
+    def contains(self, indices):
+        """
+        :param indices: the indices of the samples
+        :return: bool array - True if the adversarial for a sample is stored
+        """
+        found = np.zeros(len(indices), dtype=np.bool_)
+        for chunk_idx, positions, offsets in self.split(indices):
+            chunk = self.get_chunk(chunk_idx)
+            if chunk is not None:
+                found[positions] = chunk[2][offsets]
+        return found
+
+    def get(self, indices):
+        """
+        :param indices: the indices of the stored samples
+        :return: the adversarial images and labels
+        """
+        if self.image_shape is None:
+            raise Exception(f'The adversarial store is empty: {self.dir}')
+        images = np.empty((len(indices), *self.image_shape),
+                          dtype=np.dtype(self.image_dtype))
+        labels = np.empty(len(indices), dtype=np.int64)
+        for chunk_idx, positions, offsets in self.split(indices):
+            chunk = self.get_chunk(chunk_idx)
+            if chunk is None or not chunk[2][offsets].all():
+                raise Exception(
+                    f'Missing adversarial examples in chunk: {chunk_idx}')
+            images[positions] = chunk[0][offsets]
+            labels[positions] = chunk[1][offsets]
+        return images, labels
+
+    def put(self, indices, images, labels):
+        """
+        Write the adversarial images and labels for the samples.
+
+        :param indices: the indices of the samples
+        :param images: the adversarial images (numpy array)
+        :param labels: the labels of the samples (numpy array)
+        """
+        if self.image_shape is None:
+            self.image_shape = list(images.shape[1:])
+            self.image_dtype = images.dtype.str
+            self.save_meta()
+        elif list(images.shape[1:]) != self.image_shape:
+            raise Exception(
+                f'The shape of the images: {images.shape[1:]} does not match '
+                f'the store: {self.image_shape}')
+        for chunk_idx, positions, offsets in self.split(indices):
+            chunk_images, chunk_labels, done = self.get_chunk(
+                chunk_idx, create=True)
+            chunk_images[offsets] = images[positions]
+            chunk_labels[offsets] = labels[positions]
+            # Mark the samples as done only after their data is written.
+            done[offsets] = True
+
+    def flush(self):
+        for chunk in self.chunks.values():
+            for array in chunk:
+                array.flush()
+
+
+def get_attack_params(args, names, channel=None, channel_param=None):
+    """
+    Collect the parameters of the attack for the key of the store.
+
+    :param args: the program arguments
+    :param names: the names of the arguments used by the attack
+    :param channel: the channel (it is a part of the key only for the attacks
+    that adapt to the channel)
+    :param channel_param: the strength of the channel
+    :return: the dict with the parameters
+    """
+    params = {}
+    for name in names:
+        value = getattr(args, name, None)
+        if isinstance(value, np.ndarray):
+            value = value.tolist()
+        params[name] = value
+    if channel in ADAPTIVE_CHANNELS:
+        params['channel'] = channel
+        params['channel_param'] = channel_param
+    return params
+
+
+def get_sample_indices(dataloader, batch_idx, batch_len):
+    """
+    :return: the indices of the samples in the batch of an unshuffled
+    dataloader
+    """
+    if not isinstance(dataloader.sampler, SequentialSampler):
+        raise Exception('The adversarial store requires an unshuffled '
+                        'dataloader.')
+    start = batch_idx * dataloader.batch_size
+    return np.arange(start, start + batch_len)
+
+
+def attack_with_store(store, indices, input, labels, attack_fn):
+    """
+    Load the stored adversarial examples and run the attack only for the
+    samples that are missing in the store.
+
+    :param store: the AdversarialStore (None - always run the attack)
+    :param indices: the indices of the samples (numpy array)
+    :param input: the batch of the original images
+    :param labels: the labels of the images
+    :param attack_fn: the attack: (input, labels) -> adversarial images
+    :return: the adversarial images
+    """
+    if store is None:
+        return attack_fn(input, labels)
+    found = store.contains(indices)
+    if found.all():
+        adv, _ = store.get(indices)
+        return torch.from_numpy(adv).to(device=input.device, dtype=input.dtype)
+    missing = torch.from_numpy(np.nonzero(~found)[0]).to(input.device)
+    adv = input.clone().detach()
+    adv[missing] = attack_fn(input[missing], labels[missing]).detach()
+    if found.any():
+        adv_found, _ = store.get(indices[found])
+        adv[torch.from_numpy(np.nonzero(found)[0]).to(input.device)] = \
+            torch.from_numpy(adv_found).to(device=input.device,
+                                           dtype=input.dtype)
+    missing_np = missing.cpu().numpy()
+    store.put(indices[missing_np], adv[missing].cpu().numpy(),
+              labels[missing].cpu().numpy())
+    store.flush()
+    return adv
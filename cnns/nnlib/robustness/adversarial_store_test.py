@@ -0,0 +1,97 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data import TensorDataset
+
+from cnns.nnlib.robustness.adversarial_store import AdversarialStore
+from cnns.nnlib.robustness.adversarial_store import attack_with_store
+from cnns.nnlib.robustness.adversarial_store import get_attack_params
+from cnns.nnlib.robustness.adversarial_store import get_sample_indices
+from cnns.nnlib.utils.arguments import Arguments
+
+
+class TestAdversarialStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def get_store(self, params=None, chunk_size=4):
+        return AdversarialStore(root=self.root, dataset='cifar10',
+                                model='model.pth', attack='attack_cw',
+                                params=params, chunk_size=chunk_size)
+
+    def test_put_get_across_chunks(self):
+        store = self.get_store(params={'c': 0.01})
+        images = np.random.rand(6, 3, 2, 2).astype(np.float32)
+        labels = np.arange(6)
+        indices = np.array([1, 2, 3, 4, 5, 9])
+        store.put(indices, images, labels)
+        store.flush()
+        np.testing.assert_equal(
+            store.contains([0, 1, 5, 9, 10]),
+            np.array([False, True, True, True, False]))
+        # Reopen the store and read the samples in a random order.
+        store = self.get_store(params={'c': 0.01}, chunk_size=16)
+        self.assertEqual(store.chunk_size, 4)
+        stored_images, stored_labels = store.get([9, 1, 4])
+        np.testing.assert_equal(stored_images, images[[5, 0, 3]])
+        np.testing.assert_equal(stored_labels, labels[[5, 0, 3]])
+        with self.assertRaises(Exception):
+            store.get([0])
+
+    def test_key(self):
+        store = self.get_store(params={'c': 0.01})
+        store.put([0], np.zeros((1, 3)), np.zeros(1))
+        other = self.get_store(params={'c': 0.1})
+        self.assertNotEqual(store.dir, other.dir)
+        self.assertFalse(other.contains([0])[0])
+
+    def test_get_attack_params(self):
+        args = Arguments()
+        args.noise_epsilon = 0.03
+        params = get_attack_params(args=args, names=['attack_iters'],
+                                   channel='gauss', channel_param=0.03)
+        self.assertNotIn('channel', params)
+        params = get_attack_params(args=args, names=['attack_iters'],
+                                   channel='fft_adaptive', channel_param=50)
+        self.assertEqual(params['channel_param'], 50)
+
+    def test_attack_with_store(self):
+        store = self.get_store()
+        input = torch.rand(6, 3, 2, 2)
+        labels = torch.arange(6)
+        loader = DataLoader(TensorDataset(input, labels), batch_size=3)
+        calls = []
+
+        def attack(x, y):
+            calls.append(len(x))
+            return x + 0.1
+
+        for k, (x, y) in enumerate(loader):
+            if k == 0:
+                # Compute only a part of the batch.
+                attack_with_store(store, get_sample_indices(loader, k, 2),
+                                  x[:2], y[:2], attack)
+            adv = attack_with_store(store, get_sample_indices(loader, k, 3),
+                                    x, y, attack)
+            np.testing.assert_allclose(adv.numpy(), (x + 0.1).numpy(),
+                                       rtol=1e-6)
+        self.assertEqual(calls, [2, 1, 3])
+        for k, (x, y) in enumerate(loader):
+            attack_with_store(store, get_sample_indices(loader, k, 3), x, y,
+                              attack)
+        self.assertEqual(calls, [2, 1, 3])
+        shuffled = DataLoader(TensorDataset(input, labels), batch_size=3,
+                              shuffle=True)
+        with self.assertRaises(Exception):
+            get_sample_indices(shuffled, 0, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
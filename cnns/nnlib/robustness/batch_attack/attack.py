@@ -12,18 +12,17 @@ import numpy as np
 import time
 from cnns import matplotlib_backend
 from cnns.nnlib.robustness.batch_attack.eot_pgd import EOT_PGD
+from cnns.nnlib.robustness.adaptive_ensemble import adaptive_ensemble_infer
+from cnns.nnlib.robustness.channels.channel_pipeline import ChannelPipeline
+from cnns.nnlib.robustness.adversarial_store import AdversarialStore
+from cnns.nnlib.robustness.adversarial_store import attack_with_store
+from cnns.nnlib.robustness.adversarial_store import get_attack_params
+from cnns.nnlib.robustness.adversarial_store import get_sample_indices
 from cnns.nnlib.robustness.batch_attack.raw_pgd import RAW_PGD
 from cnns.nnlib.robustness.batch_attack.eot_cw import EOT_CW
-from cnns.nnlib.robustness.channels_definition import fft_channel
+from cnns.nnlib.robustness.batch_attack.cw import CW
 from cnns.nnlib.robustness.channels_definition import fft_layer
-from cnns.nnlib.robustness.channels_definition import round
 from cnns.nnlib.robustness.channels_definition import gauss_noise_torch
-from cnns.nnlib.robustness.channels_definition import uniform_noise_torch
-from cnns.nnlib.robustness.channels.channels_definition import \
-    compress_svd_batch
-from cnns.nnlib.robustness.channels_definition import laplace_noise_torch
-from cnns.nnlib.utils.complex_mask import get_inverse_hyper_mask
-from cnns.nnlib.robustness.channels_definition import subtract_rgb
 import cnns.nnlib.pytorch_architecture as models
 from cnns.nnlib.pytorch_architecture import vgg
 from cnns.nnlib.pytorch_architecture import vgg_rse
@@ -45,7 +44,7 @@ from cnns.nnlib.pytorch_architecture import vgg_rse_unrolled
 from cnns.nnlib.pytorch_architecture import vgg_fft
 
 from cnns.nnlib.pytorch_architecture import resnet
-from cnns.nnlib.robustness.param_perturbation.utils import perturb_model_params
+from cnns.nnlib.robustness.param_perturbation.weight_noise import WeightNoise
 
 
 def attack_eot_pgd(input_v, label_v, net, epsilon=8.0 / 255.0, opt=None):
@@ -60,7 +59,42 @@ def attack_eot_cw(input_v, label_v, net, c, opt, untarget=True, n_class=10):
     return adverse_v
 
 
+def attack_cw_search(input_v, label_v, net, c, opt, untarget=True):
+    """
+    The C&W attack with the binary search over the constant c (starting from
+    c) run for each sample of the batch concurrently.
+
+    :return: the best (smallest L2) adversarial examples (or the input images
+    if not found)
+    """
+    net.eval()
+    model = net
+    gradient_iters = opt.gradient_iters
+    if opt.channel == 'perturb':
+        weight_noise = get_weight_noise(net=net, opt=opt)
+
+        def model(images):
+            # Each gradient iteration uses an independent draw of the weights.
+            return weight_noise.forward_draws(
+                images, draws=opt.gradient_iters).mean(dim=0)
+
+        gradient_iters = 1
+    elif opt.channel == 'fft_adaptive':
+        model = torch.nn.Sequential(
+            fft_layer(compress_rate=opt.noise_epsilon),
+            net
+        )
+    cw = CW(model=model, binary_search_steps=opt.cw_binary_search_steps,
+            max_iterations=opt.attack_iters, initial_const=c,
+            targeted=not untarget, gradient_iters=gradient_iters)
+    adverse_v, _, _ = cw.attack(input_v, label_v)
+    return adverse_v
+
+
 def attack_cw(input_v, label_v, net, c, opt, untarget=True, n_class=10):
+    if getattr(opt, 'cw_binary_search_steps', 0) > 0:
+        return attack_cw_search(input_v=input_v, label_v=label_v, net=net,
+                                c=c, opt=opt, untarget=untarget)
     net.eval()
     # net.train()
     index = label_v.cpu().view(-1, 1)
@@ -74,11 +108,11 @@ def attack_cw(input_v, label_v, net, c, opt, untarget=True, n_class=10):
     w_v = w.requires_grad_(True)
     optimizer = optim.Adam([w_v], lr=1.0e-3)
     zero_v = torch.tensor([0.0], requires_grad=False).cuda()
+    if opt.channel == 'perturb':
+        weight_noise = get_weight_noise(net=net, opt=opt)
     for _ in range(opt.attack_iters):
         net.zero_grad()
-        if opt.channel == 'perturb':
-            attack_net = get_perturbed_net(opt=opt)
-        elif opt.channel == 'fft_adaptive':
+        if opt.channel == 'fft_adaptive':
             attack_net = torch.nn.Sequential(
                 fft_layer(compress_rate=opt.noise_epsilon),
                 net
@@ -87,10 +121,15 @@ def attack_cw(input_v, label_v, net, c, opt, untarget=True, n_class=10):
             attack_net = net
         optimizer.zero_grad()
         adverse_v = 0.5 * (torch.tanh(w_v) + 1.0)
-        logits = torch.zeros(batch_size, n_class).cuda()
-        for i in range(opt.gradient_iters):
-            logits += attack_net(adverse_v)
-        output = logits / opt.gradient_iters
+        if opt.channel == 'perturb':
+            # Each gradient iteration uses an independent draw of the weights.
+            output = weight_noise.forward_draws(
+                adverse_v, draws=opt.gradient_iters).mean(dim=0)
+        else:
+            logits = torch.zeros(batch_size, n_class).cuda()
+            for i in range(opt.gradient_iters):
+                logits += attack_net(adverse_v)
+            output = logits / opt.gradient_iters
         # output = logits
         # The logits for the correct class labels.
         real = (torch.max(torch.mul(output, label_onehot), 1)[0])
@@ -155,23 +194,47 @@ def attack_rand_fgsm(input_v, label_v, net, epsilon):
 
 
 # Ensemble by sum of probability
-def ensemble_infer(input_v, net, n=50, nclass=10):
-    net.eval()
-    batch_size = input_v.size()[0]
-    softmax = nn.Softmax()
-    prob = torch.zeros(batch_size, nclass).cuda()
-    for i in range(n):
-        prob += softmax(net(input_v))
-    _, pred = torch.max(prob, 1)
+def ensemble_infer(input_v, net, n=50, nclass=10, alpha=0.0, min_passes=5,
+                   return_passes=False):
+    """
+    Sum the softmax outputs from n passes of the randomized net. With
+    alpha > 0, stop the passes for the samples whose top class is settled
+    (see adaptive_ensemble_infer).
+    """
+    pred, passes = adaptive_ensemble_infer(
+        input=input_v, net=net, n=n, nclass=nclass, alpha=alpha,
+        min_passes=min_passes)
+    if return_passes:
+        return pred, passes
     return pred
 
 
-def get_perturbed_net(opt):
-    perturbed_net, _ = get_nets(opt)
-    perturbed_net = perturb_model_params(
-        model=perturbed_net, epsilon=opt.noise_epsilon, min=0, max=1)
-    perturbed_net.eval()
-    return perturbed_net
+def get_weight_noise(net, opt):
+    """
+    :return: the weight noise for the perturb channel (it keeps the clean
+    weights of the net on its device instead of reloading the net for each
+    draw of the noise)
+    """
+    return WeightNoise(model=net, epsilon=opt.noise_epsilon, min=0, max=1)
+
+
+def get_adversarial_store(attack_f, c, opt):
+    """
+    :return: the store of the adversarial examples for the attack or None if
+    the store is disabled (opt.adv_store_dir is empty)
+    """
+    if not getattr(opt, 'adv_store_dir', ''):
+        return None
+    params = get_attack_params(
+        args=opt, names=['net', 'defense', 'noise_type', 'noiseInit',
+                         'noiseInner', 'paramNoise', 'compress_rate',
+                         'attack_iters', 'gradient_iters', 'eot_sample_size',
+                         'eot_sampling', 'cw_binary_search_steps'],
+        channel=opt.channel, channel_param=opt.noise_epsilon)
+    params['c'] = c
+    return AdversarialStore(root=opt.adv_store_dir, dataset=opt.dataset,
+                            model=opt.modelInAttack, attack=attack_f.__name__,
+                            params=params)
 
 
 def acc_under_attack(dataloader, net, c, attack_f, opt, netAttack=None):
@@ -179,6 +242,12 @@ def acc_under_attack(dataloader, net, c, attack_f, opt, netAttack=None):
     tot = 0
     distort = 0.0
     distort_linf = 0.0
+    ensemble_passes = 0
+    channel = ChannelPipeline(spec=opt.channel, param=opt.noise_epsilon,
+                              bounds=(0.0, 1.0), timing=opt.channel_timing)
+    store = get_adversarial_store(attack_f=attack_f, c=c, opt=opt)
+    if opt.channel == 'perturb':
+        weight_noise = get_weight_noise(net=net, opt=opt)
 
     for k, (input, output) in enumerate(dataloader):
         # beg = time.time()
@@ -187,53 +256,34 @@ def acc_under_attack(dataloader, net, c, attack_f, opt, netAttack=None):
         if netAttack is None:
             netAttack = net
 
-        adverse_v = attack_f(input_v, label_v, netAttack, c, opt)
+        adverse_v = attack_with_store(
+            store=store, indices=get_sample_indices(
+                dataloader, k, len(input_v)) if store else None,
+            input=input_v, labels=label_v,
+            attack_fn=lambda x, y: attack_f(x, y, netAttack, c, opt))
         diff = adverse_v - input_v
         # print('min max: ', adverse_v.min().item(), adverse_v.max().item())
-        bounds = (0.0, 1.0)
-        if opt.channel == 'empty':
-            pass
-        elif opt.channel == 'perturb':
-            pass
-        elif opt.channel == 'gauss':
-            adverse_v += gauss_noise_torch(epsilon=opt.noise_epsilon,
-                                           images=adverse_v, bounds=bounds)
-        elif opt.channel == 'round':
-            adverse_v = round(values_per_channel=opt.noise_epsilon,
-                              images=adverse_v)
-        elif opt.channel in ('fft', 'fft_adaptive'):
-            adverse_v = fft_channel(input=adverse_v,
-                                    compress_rate=opt.noise_epsilon)
-        elif opt.channel == 'uniform':
-            adverse_v += uniform_noise_torch(epsilon=opt.noise_epsilon,
-                                             images=adverse_v,
-                                             bounds=bounds)
-        elif opt.channel == 'laplace':
-            adverse_v += laplace_noise_torch(epsilon=opt.noise_epsilon,
-                                             images=adverse_v,
-                                             bounds=bounds)
-        elif opt.channel == 'svd':
-            adverse_v = compress_svd_batch(x=adverse_v,
-                                           compress_rate=opt.noise_epsilon)
-        elif opt.channel == 'inv_fft':
-            adverse_v = fft_channel(input=adverse_v,
-                                    compress_rate=opt.noise_epsilon,
-                                    get_mask=get_inverse_hyper_mask)
-        elif opt.channel == 'sub_rgb':
-            adverse_v = subtract_rgb(images=adverse_v,
-                                     subtract_value=opt.noise_epsilon)
-        else:
-            raise Exception(f'Unknown channel: {opt.channel}')
+        adverse_v = channel(adverse_v)
         # defense
         net.eval()
-        if opt.ensemble == 1:
+        if opt.channel == 'perturb' and opt.weight_noise_draws > 1:
+            # Sum the softmax outputs of the independent weight draws.
+            with torch.no_grad():
+                logits = weight_noise.forward_draws(
+                    adverse_v, draws=opt.weight_noise_draws)
+            _, idx = torch.max(torch.softmax(logits, dim=2).sum(dim=0), 1)
+        elif opt.ensemble == 1:
             if opt.channel == 'perturb':
-                net_infer = get_perturbed_net(opt=opt)
+                with torch.no_grad(), weight_noise.perturbed():
+                    logits = net(adverse_v)
             else:
-                net_infer = net
-            _, idx = torch.max(net_infer(adverse_v), 1)
+                logits = net(adverse_v)
+            _, idx = torch.max(logits, 1)
         else:
-            idx = ensemble_infer(adverse_v, net, n=opt.ensemble)
+            idx, passes = ensemble_infer(
+                adverse_v, net, n=opt.ensemble, alpha=opt.ensemble_alpha,
+                min_passes=opt.ensemble_min_passes, return_passes=True)
+            ensemble_passes += passes.sum().item()
         correct += torch.sum(label_v.eq(idx)).item()
         tot += output.numel()
         distort += torch.sum(diff * diff)
@@ -253,6 +303,10 @@ def acc_under_attack(dataloader, net, c, attack_f, opt, netAttack=None):
         if opt.limit_batch_number > 0 and k >= opt.limit_batch_number:
             break
 
+    if opt.ensemble > 1:
+        print('average ensemble passes per sample: ', ensemble_passes / tot)
+    if opt.channel_timing:
+        print('channel timings (sec): ', channel.get_timings_str())
     return correct / tot, np.sqrt(distort_np / tot), distort_linf_np / tot
 
 
@@ -757,18 +811,48 @@ if __name__ == "__main__":
                         default='cifar10')
     parser.add_argument('--mode', type=str, default='test')  # peek or test
     parser.add_argument('--ensemble', type=int, default=1)
+    parser.add_argument('--ensemble_alpha', type=float, default=0.0,
+                        help='stop the ensemble passes for a sample when its '
+                             'most voted class is significant, the overall '
+                             'level split evenly (Bonferroni) over the '
+                             'repeated tests, 0 runs all the passes')
+    parser.add_argument('--ensemble_min_passes', type=int, default=5)
+    parser.add_argument('--weight_noise_draws', type=int, default=1,
+                        help='for the perturb channel, the number of the '
+                             'independent draws of the weights per batch (run '
+                             'in a single vectorized pass)')
+    parser.add_argument('--channel_timing', action='store_true',
+                        default=False,
+                        help='record the time spent in each channel')
     parser.add_argument('--batch_size', type=int,
                         default=3584,
                         # default=256,
                         # default=1024,
                         # default=32,
                         )
+    parser.add_argument('--adv_store_dir', type=str, default='',
+                        help='the directory of the store of the adversarial '
+                             'examples, they are loaded instead of rerunning '
+                             'the attack, empty - disable the store')
     parser.add_argument('--noise_type', type=str,
                         default='standard',
                         # default='backward',
                         )
     parser.add_argument('--gradient_iters', type=int, default=1)
+    parser.add_argument('--cw_binary_search_steps', type=int, default=0,
+                        help='the number of the steps of the per-sample '
+                             'binary search over c in the C&W attack, 0 - '
+                             'a single c for the whole batch')
     parser.add_argument('--eot_sample_size', type=int, default=32)
+    parser.add_argument('--eot_micro_batch_size', type=int, default=0,
+                        help='the number of EOT samples in a single forward '
+                             'pass, 0 - derive it from the memory')
+    parser.add_argument('--eot_memory_budget', type=int, default=0,
+                        help='the memory (in MB) for the EOT micro-batch, '
+                             '0 - use the free GPU memory')
+    parser.add_argument('--eot_sampling', type=str, default='iid',
+                        help='the sampling of the EOT random passes: iid, '
+                             'crn (common random numbers) or antithetic')
     parser.add_argument('--noiseInit', type=float, default=0.0)
     parser.add_argument('--noiseInner', type=float, default=0.0)
     parser.add_argument('--paramNoise', type=float, default=0.0)
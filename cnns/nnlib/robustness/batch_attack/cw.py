@@ -0,0 +1,167 @@
+import numpy as np
+import torch
+import torch.optim as optim
+
+
+class CW(object):
+    """
+    The batched L2 Carlini & Wagner attack.
+
+    Each image in the batch has its own constant c (the weight of the
+    classification loss), its own bounds of the binary search over c and its
+    own best (smallest L2) adversarial example. All the images are optimized
+    together (Adam is elementwise, so the optimization of an image does not
+    depend on the other images) and the binary search updates the constants
+    of all the images after each search step.
+
+    The optional channel (e.g. a ChannelPipeline with rounding, FFT
+    compression or noise) is applied to the adversarial images in the loss.
+    Its gradient is approximated by the identity (BPDA), so the channels that
+    are not differentiable can be attacked as well. The optional defense
+    decides if the images are adversarial (e.g. the votes of the noise trials
+    run on the device), by default the classes predicted in the loss are
+    used.
+    """
+
+    def __init__(self, model, binary_search_steps=5, max_iterations=1000,
+                 confidence=0.0, learning_rate=5e-3, initial_const=1e-2,
+                 abort_early=True, targeted=False, bounds=(0.0, 1.0),
+                 channel=None, gradient_iters=1, defense=None):
+        """
+        :param model: the model (maps the images to the logits)
+        :param binary_search_steps: the number of the steps of the binary
+        search over the constant c
+        :param max_iterations: the max number of the Adam steps per search step
+        :param confidence: the margin of the classification loss
+        :param learning_rate: the learning rate of Adam
+        :param initial_const: the initial value of c
+        :param abort_early: stop a search step if the loss does not decrease
+        for a tenth of max_iterations
+        :param targeted: the labels are the targets
+        :param bounds: the min and max values of the pixels
+        :param channel: the (random) transformation of the images in the loss
+        :param gradient_iters: the number of the forward passes (of a random
+        model or channel) whose logits are averaged
+        :param defense: maps the images and the labels to the mask of the
+        adversarial images
+        """
+        self.model = model
+        self.binary_search_steps = binary_search_steps
+        self.max_iterations = max_iterations
+        self.confidence = confidence
+        self.learning_rate = learning_rate
+        self.initial_const = initial_const
+        self.abort_early = abort_early
+        self.targeted = targeted
+        self.bounds = bounds
+        self.channel = channel
+        self.gradient_iters = gradient_iters
+        self.defense = defense
+
+    def to_attack_space(self, x):
+        min_, max_ = self.bounds
+        # map from [min_, max_] to approx. (-1, +1) and then to (-inf, +inf)
+        x = (x - (min_ + max_) / 2) / ((max_ - min_) / 2) * 0.999999
+        return 0.5 * torch.log((1 + x) / (1 - x))
+
+    def to_model_space(self, w):
+        min_, max_ = self.bounds
+        return torch.tanh(w) * ((max_ - min_) / 2) + (min_ + max_) / 2
+
+    def get_logits(self, images):
+        logits = 0
+        for _ in range(self.gradient_iters):
+            channel_images = images
+            if self.channel is not None:
+                # BPDA: the channel (resampled in each pass) in the forward
+                # pass, the identity in the backward pass.
+                channel_images = images + (
+                        self.channel(images) - images).detach()
+            logits = logits + self.model(channel_images)
+        return logits / self.gradient_iters
+
+    def get_class_loss(self, logits, labels):
+        """
+        :return: the classification loss per image
+        """
+        real = logits.gather(1, labels.unsqueeze(1)).squeeze(1)
+        others = logits.clone()
+        others.scatter_(1, labels.unsqueeze(1), -np.inf)
+        other = others.max(dim=1)[0]
+        if self.targeted:
+            margin = other - real
+        else:
+            margin = real - other
+        return torch.clamp(margin + self.confidence, min=0.0)
+
+    def is_adversarial(self, images, logits, labels):
+        if self.defense is not None:
+            return self.defense(images, labels)
+        preds = logits.argmax(dim=1)
+        if self.targeted:
+            return preds == labels
+        return preds != labels
+
+    def attack(self, x, labels):
+        """
+        :param x: the images (N, C, H, W)
+        :param labels: the labels (or the targets) (N)
+        :return: the best adversarial images (the images for which no
+        adversarial was found are unchanged), the squared L2 distances of the
+        best adversarials (inf if not found) and the last constants
+        """
+        x = x.detach()
+        N = x.size(0)
+        device = x.device
+        const = torch.full((N,), self.initial_const, device=device)
+        lower_bound = torch.zeros(N, device=device)
+        upper_bound = torch.full((N,), np.inf, device=device)
+        best_l2 = torch.full((N,), np.inf, device=device)
+        best_adv = x.clone()
+        att_original = self.to_attack_space(x)
+
+        for search_step in range(self.binary_search_steps):
+            if search_step == self.binary_search_steps - 1 and \
+                    self.binary_search_steps >= 10:
+                # In the last step use the upper bound (if it was found).
+                const = torch.where(torch.isinf(upper_bound), const,
+                                    upper_bound)
+            perturbation = torch.zeros_like(x, requires_grad=True)
+            optimizer = optim.Adam([perturbation], lr=self.learning_rate)
+            found_adv = torch.zeros(N, dtype=torch.bool, device=device)
+            loss_at_previous_check = np.inf
+            for iteration in range(self.max_iterations):
+                adv = self.to_model_space(att_original + perturbation)
+                logits = self.get_logits(adv)
+                l2 = (adv - x).pow(2).flatten(1).sum(dim=1)
+                loss = (l2 + const * self.get_class_loss(logits, labels)).sum()
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+
+                with torch.no_grad():
+                    adv = adv.detach()
+                    is_adv = self.is_adversarial(adv, logits.detach(), labels)
+                    found_adv |= is_adv
+                    improved = is_adv & (l2.detach() < best_l2)
+                    best_l2[improved] = l2.detach()[improved]
+                    best_adv[improved] = adv[improved]
+
+                if self.abort_early and \
+                        iteration % (np.ceil(self.max_iterations / 10)) == 0:
+                    # After each tenth of the iterations, check progress.
+                    loss = loss.item()
+                    if not (loss <= .9999 * loss_at_previous_check):
+                        break
+                    loss_at_previous_check = loss
+
+            upper_bound = torch.where(found_adv,
+                                      torch.min(upper_bound, const),
+                                      upper_bound)
+            lower_bound = torch.where(found_adv, lower_bound,
+                                      torch.max(lower_bound, const))
+            # The exponential search until the first adversarial is found,
+            # then the binary search.
+            const = torch.where(torch.isinf(upper_bound), const * 10,
+                                (lower_bound + upper_bound) / 2)
+        return best_adv, best_l2, const
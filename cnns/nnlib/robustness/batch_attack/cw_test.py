@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.robustness.batch_attack.cw import CW
+
+
+class TestCW(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(),
+                                         torch.nn.Linear(3 * 4 * 4, 4))
+        self.images = torch.rand(6, 3, 4, 4)
+        self.labels = self.model(self.images).argmax(dim=1).detach()
+
+    def test_untargeted(self):
+        cw = CW(model=self.model, binary_search_steps=6, max_iterations=200,
+                learning_rate=0.05, initial_const=1e-3)
+        adv, best_l2, const = cw.attack(self.images, self.labels)
+        self.assertEqual(adv.shape, self.images.shape)
+        found = ~torch.isinf(best_l2)
+        self.assertTrue(found.all())
+        preds = self.model(adv).argmax(dim=1)
+        self.assertTrue((preds != self.labels).all())
+        l2 = (adv - self.images).pow(2).flatten(1).sum(dim=1)
+        np.testing.assert_allclose(
+            actual=l2.detach().numpy(), desired=best_l2.numpy(), rtol=1e-5)
+        self.assertLessEqual(adv.max().item(), 1.0)
+        self.assertGreaterEqual(adv.min().item(), 0.0)
+        # The binary search is run for each image separately.
+        self.assertGreater(len(set(const.tolist())), 1)
+
+    def test_not_found(self):
+        # With a single step and a tiny constant no adversarial is found.
+        cw = CW(model=self.model, binary_search_steps=1, max_iterations=5,
+                initial_const=1e-6)
+        adv, best_l2, const = cw.attack(self.images, self.labels)
+        self.assertTrue(torch.isinf(best_l2).all())
+        self.assertTrue(torch.equal(adv, self.images))
+        np.testing.assert_allclose(actual=const.numpy(), desired=[1e-5] * 6,
+                                   rtol=1e-5)
+
+    def test_channel_and_defense(self):
+        calls = []
+
+        def channel(images):
+            calls.append('channel')
+            return torch.round(images * 7) / 7
+
+        def defense(images, labels):
+            calls.append('defense')
+            return self.model(channel(images)).argmax(dim=1) != labels
+
+        cw = CW(model=self.model, binary_search_steps=4, max_iterations=100,
+                learning_rate=0.05, channel=channel, defense=defense)
+        adv, best_l2, _ = cw.attack(self.images, self.labels)
+        self.assertIn('channel', calls)
+        self.assertIn('defense', calls)
+        found = ~torch.isinf(best_l2)
+        self.assertTrue(found.any())
+        preds = self.model(channel(adv)).argmax(dim=1)
+        self.assertTrue((preds[found] != self.labels[found]).all())
+
+    def test_channel_resampled_per_gradient_iter(self):
+        noises = []
+
+        def channel(images):
+            noise = 0.1 * torch.randn_like(images)
+            noises.append(noise)
+            return images + noise
+
+        cw = CW(model=self.model, gradient_iters=5, channel=channel)
+        logits = cw.get_logits(self.images)
+        self.assertEqual(len(noises), 5)
+        expected = sum(self.model(self.images + noise) for noise in noises) / 5
+        np.testing.assert_allclose(actual=logits.detach().numpy(),
+                                   desired=expected.detach().numpy(),
+                                   rtol=1e-5, atol=1e-6)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+import torch
+from contextlib import contextmanager
+
+SAMPLINGS = ('iid', 'crn', 'antithetic')
+
+
+class EOTEstimator(object):
+    """
+    Estimate the expectation over transformations (EOT), i.e., over the
+    random passes of a randomized network, of a loss and of its gradient
+    w.r.t. the input image.
+
+    The sample_size copies of the image are sent through the network in
+    micro-batches and the gradients are accumulated, so the memory is bounded
+    by the size of a micro-batch instead of the whole ensemble. The size of
+    the micro-batch is given explicitly or derived from the memory budget
+    (or the free GPU memory) and the memory used by a single sample.
+
+    The sampling of the random passes:
+    iid - independent noise in each pass.
+    crn - common random numbers: the random generators are reset to the
+    same seed for each estimate, so the consecutive attack steps see the same
+    noise draws and their differences are not blurred by the sampling noise.
+    antithetic - the noise layers with the antithetic attribute draw the
+    noise in pairs (z, -z) within a micro-batch.
+    """
+
+    def __init__(self, net, sample_size, micro_batch_size=0, memory_budget=0,
+                 sampling='iid', seed=31):
+        """
+        :param net: the (randomized) network
+        :param sample_size: the number of the random passes per estimate
+        :param micro_batch_size: the number of the passes run together, 0 -
+        derive it from the memory
+        :param memory_budget: the memory (in MB) for a micro-batch, 0 - use
+        the free GPU memory
+        :param sampling: iid, crn or antithetic
+        :param seed: the seed for the crn sampling
+        """
+        if sampling not in SAMPLINGS:
+            raise Exception(f'Unknown EOT sampling: {sampling}, choose from: '
+                            f'{",".join(SAMPLINGS)}')
+        self.net = net
+        self.sample_size = sample_size
+        self.micro_batch_size = micro_batch_size
+        self.memory_budget = memory_budget
+        self.sampling = sampling
+        self.seed = seed
+        # The micro-batch sizes derived from memory for the input shapes.
+        self.micro_batch_sizes = {}
+
+    def get_sample_memory(self, image):
+        """
+        Estimate the memory (in bytes) used by a single sample: the sizes of
+        the outputs of all the modules in the forward pass (kept for the
+        backward pass) and their gradients.
+        """
+        sizes = []
+
+        def hook(module, input, output):
+            if isinstance(output, torch.Tensor):
+                sizes.append(output.numel() * output.element_size())
+
+        handles = [module.register_forward_hook(hook) for module in
+                   self.net.modules() if len(list(module.children())) == 0]
+        try:
+            with torch.no_grad():
+                self.net(image.unsqueeze(0))
+        finally:
+            for handle in handles:
+                handle.remove()
+        return 2 * (sum(sizes) + image.numel() * image.element_size())
+
+    def get_memory_budget(self, image):
+        if self.memory_budget > 0:
+            return self.memory_budget * 2 ** 20
+        if image.is_cuda:
+            if hasattr(torch.cuda, 'mem_get_info'):
+                free_memory = torch.cuda.mem_get_info(image.device)[0]
+            else:
+                free_memory = torch.cuda.get_device_properties(
+                    image.device).total_memory - torch.cuda.memory_reserved(
+                    image.device)
+            # Leave a margin for the allocator fragmentation.
+            return free_memory // 2
+        return None
+
+    def get_micro_batch_size(self, image):
+        if self.micro_batch_size > 0:
+            micro_batch_size = self.micro_batch_size
+        else:
+            key = (tuple(image.shape), image.dtype, image.device)
+            if key not in self.micro_batch_sizes:
+                budget = self.get_memory_budget(image)
+                if budget is None:
+                    # No memory limit on the CPU: run the whole ensemble.
+                    micro_batch_size = self.sample_size
+                else:
+                    micro_batch_size = int(
+                        budget // self.get_sample_memory(image))
+                self.micro_batch_sizes[key] = micro_batch_size
+            micro_batch_size = self.micro_batch_sizes[key]
+        micro_batch_size = max(1, min(micro_batch_size, self.sample_size))
+        if self.sampling == 'antithetic' and micro_batch_size > 1:
+            # Keep the antithetic pairs in the same micro-batch.
+            micro_batch_size -= micro_batch_size % 2
+        return micro_batch_size
+
+    @contextmanager
+    def sampling_context(self, image):
+        if self.sampling == 'crn':
+            devices = [image.device] if image.is_cuda else []
+            with torch.random.fork_rng(devices=devices):
+                torch.manual_seed(self.seed)
+                yield
+        elif self.sampling == 'antithetic':
+            modules = [module for module in self.net.modules() if
+                       hasattr(module, 'antithetic')]
+            for module in modules:
+                module.antithetic = True
+            try:
+                yield
+            finally:
+                for module in modules:
+                    module.antithetic = False
+        else:
+            yield
+
+    def estimate(self, image, loss_fn):
+        """
+        Estimate the EOT loss and gradient.
+
+        :param image: the (adversarial) image (C, H, W), it can be a part of
+        a computation graph (the graph is not traversed)
+        :param loss_fn: maps the logits of a micro-batch to the sum of the
+        losses of its samples
+        :return: the sum of the losses over all the samples, the gradient of
+        the sum w.r.t. the image and the predicted classes of all the samples
+        """
+        image = image.detach().requires_grad_(True)
+        micro_batch_size = self.get_micro_batch_size(image)
+        total_loss = 0.0
+        grad = torch.zeros_like(image)
+        preds = []
+        with self.sampling_context(image):
+            for start in range(0, self.sample_size, micro_batch_size):
+                size = min(micro_batch_size, self.sample_size - start)
+                ensemble = image.unsqueeze(0).repeat(
+                    size, *([1] * image.dim()))
+                logits = self.net(ensemble)
+                loss = loss_fn(logits)
+                # Accumulate only the gradient w.r.t. the image (not the
+                # gradients of the parameters of the net).
+                grad += torch.autograd.grad(loss, image)[0]
+                total_loss += loss.item()
+                preds.append(logits.argmax(dim=1).detach())
+        return total_loss, grad, torch.cat(preds)
+
+
+def get_eot_estimator(net, opt, sample_size):
+    """
+    :param opt: the options with the (optional) eot_micro_batch_size,
+    eot_memory_budget and eot_sampling
+    """
+    return EOTEstimator(
+        net=net, sample_size=sample_size,
+        micro_batch_size=getattr(opt, 'eot_micro_batch_size', 0),
+        memory_budget=getattr(opt, 'eot_memory_budget', 0),
+        sampling=getattr(opt, 'eot_sampling', 'iid'))
@@ -3,6 +3,7 @@ from torch import nn
 import torch.nn.functional as F
 import sys
 from torch import optim
+from cnns.nnlib.robustness.batch_attack.eot import get_eot_estimator
 
 
 def clip(tensor, min_tensor, max_tensor):
@@ -35,6 +36,8 @@ class EOT_CW:
         self._debug = debug
         self._untarget = untarget
         self._n_class = n_class
+        self._eot = get_eot_estimator(net=net, opt=opt,
+                                      sample_size=sample_size)
 
     def eot_attack(self, x, y):
         """
@@ -48,60 +51,51 @@ class EOT_CW:
         """
         self._net.eval()
 
-        # Make vectors from the single element input and label y.
-        label_v = y.repeat(self._sample_size)
-        input_v = x.repeat(self._sample_size, 1, 1, 1)
+        zero_v = torch.tensor([0.0], requires_grad=False, device=x.device)
 
-        index = label_v.cpu().view(-1, 1)
-        # one hot encoding
-        label_onehot = torch.zeros(self._sample_size, self._n_class,
-                                   requires_grad=False)
-        label_onehot.scatter_(dim=1, index=index, value=1)
-        label_onehot = label_onehot.cuda()
-
-        zero_v = torch.tensor([0.0], requires_grad=False).cuda()
+        def class_error_fn(logits):
+            # one hot encoding
+            label_onehot = torch.zeros_like(logits)
+            label_onehot[:, y] = 1
+            real = (torch.max(torch.mul(logits, label_onehot), 1)[0])
+            # Zero out the logits for the correct classes and even make them
+            # much much smaller so that they are not chosen as the other max
+            # class. Then from the logits of other classes find the maximum
+            # one.
+            other = (torch.max(
+                torch.mul(logits, (1 - label_onehot)) - label_onehot * 10000,
+                1)[0])
+            if self._untarget:
+                return torch.sum(torch.max(real - other, zero_v))
+            else:
+                return torch.sum(torch.max(other - real, zero_v))
 
         w = 0.5 * torch.log((x) / (1 - x))
         w.requires_grad = True
         # Below is ~artanh: http://bit.ly/2MAtsMX that is defined on interval (0,1)
         optimizer = optim.Adam([w], lr=self._learning_rate)
-        iter = 0
-        # for iter in range(self._opt.attack_iters):
         succ_adv = None
 
-        while True:
-            print('iter: ', iter)
-            print('c: ', self._c)
-            iter += 1
-            self._net.zero_grad()
+        for iter in range(self._max_steps):
             optimizer.zero_grad()
             adv = 0.5 * (torch.tanh(w) + 1.0)
-            ensemble_adv = adv.repeat(self._sample_size, 1, 1, 1)
-            logits = self._net(ensemble_adv)
-            ensemble_preds = logits.argmax(dim=1)
-            print('ensemble_preds: ', ensemble_preds)
-            print('max ensemble logits: ', logits.max(dim=1)[0])
-            real = (torch.max(torch.mul(logits, label_onehot), 1)[0])
-            # Zero out the logits for the correct classes and even make them much
-            # much smaller so that they are not chosen as the other max class.
-            # Then from the logits of other classes find the maximum one.
-            other = (torch.max(
-                torch.mul(logits, (1 - label_onehot)) - label_onehot * 10000,
-                1)[0])
+            # The class error summed over the ensemble of random passes
+            # (computed in micro-batches) and its gradient w.r.t. adv.
+            class_error, class_error_grad, ensemble_preds = \
+                self._eot.estimate(image=adv, loss_fn=class_error_fn)
             # The squared L2 loss of the difference between the adversarial
-            # example and the input image.
-            diff = adv - input_v
-            dist = torch.sum(diff * diff)
-            print('dist: ', dist)
-            if self._untarget:
-                class_error = torch.sum(torch.max(real - other, zero_v))
-            else:
-                class_error = torch.sum(torch.max(other - real, zero_v))
-
-            loss = dist + self._c * class_error
+            # example and the input image (for each sample in the ensemble).
+            diff = adv - x
+            dist = self._sample_size * torch.sum(diff * diff)
+            loss = dist + self._c * torch.sum(adv * class_error_grad)
             loss.backward()
             optimizer.step()
 
+            if self._debug:
+                print('iter: ', iter, ', c: ', self._c, ', dist: ',
+                      dist.item(), ', class error: ', class_error,
+                      file=sys.stderr)
+
             if y not in ensemble_preds:
                 # we're done
                 if self._debug:
@@ -109,8 +103,11 @@ class EOT_CW:
                 # break
                 # print('c: ', self._c)
                 self._c /= 2
-                succ_adv = adv
+                succ_adv = adv.detach()
 
+        if succ_adv is None:
+            # No adversarial example found, return the last iterate.
+            succ_adv = adv.detach()
         return succ_adv
 
     def eot_batch(self, images, labels):
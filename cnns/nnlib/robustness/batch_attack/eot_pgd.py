@@ -2,6 +2,8 @@ import torch
 from torch import nn
 import torch.nn.functional as F
 import sys
+from cnns.nnlib.robustness.batch_attack.eot import get_eot_estimator
+from cnns.nnlib.robustness.batch_attack.pgd import PGD
 
 
 def clip(tensor, min_tensor, max_tensor):
@@ -10,9 +12,10 @@ def clip(tensor, min_tensor, max_tensor):
     return clipped
 
 
-class EOT_PGD:
+class EOT_PGD(PGD):
     """
-    PGD attack (FGSM with many iterations).
+    PGD attack (FGSM with many iterations) with the gradients estimated over
+    the random passes of the network (EOT).
     """
 
     def __init__(self, net, epsilon, opt,
@@ -23,78 +26,60 @@ class EOT_PGD:
         self._learning_rate = learning_rate
         self._debug = debug
         self._sample_size = opt.eot_sample_size
+        self._eot = get_eot_estimator(net=net, opt=opt,
+                                      sample_size=self._sample_size)
         if untarget == False:  # if targeted attack
             raise NotImplementedError
-
-    def eot_attack(self, x, y):
+        # The gradient is the sum over the ensemble: the step is the mean
+        # gradient scaled by the learning rate. The attack of an image stops
+        # once all the random passes misclassify it.
+        super(EOT_PGD, self).__init__(
+            model=net, eps=epsilon, step_size=learning_rate / self._sample_size,
+            num_steps=self._attack_iters, norm='inf', early_stop=True,
+            raw_grad=True)
+        self.queries_per_step = self._sample_size
+
+    def get_grad(self, x, labels):
         """
         Implementation based on:
         https://github.com/anishathalye/obfuscated-gradients/blob/master/randomization/robustml_attack.py
 
-        :param x: input image
-        :param y: input label
-        :param net: the network
-        :param opt: optimizer
-        :param untarget: targeted or untargeted attack
-        :param n_class: number of classes
-        :return: adversarial examples
+        :param x: the adversarial images
+        :param labels: the labels
+        :return: the EOT gradients and the mask of the images misclassified
+        by all the random passes
         """
-        self._net.eval()
-
-        loss_f = nn.CrossEntropyLoss()
-
-        adv = torch.clone(x)
-        adv.requires_grad = True
-
-        lower = torch.clamp(adv - self._epsilon, 0, 1)
-        upper = torch.clamp(adv + self._epsilon, 0, 1)
-
-        ensemble_y = y.repeat(self._sample_size)
-
-        for i in range(self._attack_iters):
-            ensemble_adv = adv.repeat(self._sample_size, 1, 1, 1)
-            # adv_un = adv.unsqueeze(dim=0)
-            # ensemble_adv = torch.cat([adv_un for _ in range(self._sample_size)], dim=0)
-            # ensemble_adv = adv_un
-
-            ensemble_logits = self._net(ensemble_adv)
-            # ensemble_probs = F.softmax(ensemble_logits, dim=1)
-            ensemble_preds = ensemble_logits.argmax(dim=1)
-            print('correct label: ', y)
-            print('ensemble preds: ', ensemble_preds)
-            print('incorrect preds: %d/%d' % (
-            torch.sum(ensemble_preds != y).item(), ensemble_preds.numel()))
-            print('ensemble logits: ', ensemble_logits.max(dim=1)[0])
-            loss = loss_f(ensemble_logits, ensemble_y)
-
-            loss.backward(adv)
-
-            with torch.no_grad():
-                adv += self._learning_rate * adv.grad
-                # Zero out the existing gradient.
-                # adv.grad.zero_()
-                # self._net.zero_grad()
-                adv = clip(adv, lower, upper)
-                adv.requires_grad = True
+        grads = torch.empty_like(x)
+        is_adv = torch.zeros(x.size(0), dtype=torch.bool, device=x.device)
+        for i, (adv, y) in enumerate(zip(x, labels)):
+            def loss_fn(logits):
+                return F.cross_entropy(logits, y.expand(logits.size(0)),
+                                       reduction='sum')
+
+            # The mean cross entropy loss over the ensemble of random passes
+            # (computed in micro-batches).
+            loss, grads[i], ensemble_preds = self._eot.estimate(
+                image=adv, loss_fn=loss_fn)
+            loss /= self._sample_size
+            is_adv[i] = y not in ensemble_preds
 
             if self._debug:
-                print(
-                    'attack: step %d/%d, loss = %g (true %d, predicted %s)' % (
-                        i + 1, self._attack_iters, loss, y, ensemble_preds),
-                    file=sys.stderr
-                )
+                print('incorrect preds: %d/%d' % (
+                    torch.sum(ensemble_preds != y).item(),
+                    ensemble_preds.numel()), file=sys.stderr)
+                print('attack: loss = %g (true %d, predicted %s)' % (
+                    loss, y, ensemble_preds), file=sys.stderr)
+        return grads, is_adv
 
-            if y not in ensemble_preds:
-                # we're done
-                if self._debug:
-                    print('returning early', file=sys.stderr)
-                break
-
-        return adv
+    def eot_attack(self, x, y):
+        """
+        :param x: input image
+        :param y: input label
+        :return: adversarial example
+        """
+        return self.eot_batch(images=x.unsqueeze(0), labels=y.view(1))[0]
 
     def eot_batch(self, images, labels):
-        advs = torch.zeros_like(images)
-        for i, (x, y) in enumerate(zip(images, labels)):
-            adv = self.eot_attack(x, y)
-            advs[i] = adv
+        self._net.eval()
+        advs, _ = self.attack(images, labels)
         return advs
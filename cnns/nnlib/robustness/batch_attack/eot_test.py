@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+from cnns.nnlib.pytorch_architecture.layer import Noise
+from cnns.nnlib.robustness.batch_attack.eot import EOTEstimator
+
+
+class TestEOT(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.net = nn.Sequential(Noise(0.1), nn.Flatten(),
+                                 nn.Linear(3 * 4 * 4, 5))
+        self.image = torch.rand(3, 4, 4)
+        self.label = torch.tensor(2)
+
+    def loss_fn(self, logits):
+        return F.cross_entropy(logits, self.label.expand(logits.size(0)),
+                               reduction='sum')
+
+    def get_full_estimate(self, sample_size):
+        image = self.image.clone().requires_grad_(True)
+        logits = self.net(image.unsqueeze(0).repeat(sample_size, 1, 1, 1))
+        loss = self.loss_fn(logits)
+        loss.backward()
+        return loss.item(), image.grad
+
+    def test_micro_batches(self):
+        sample_size = 10
+        torch.manual_seed(7)
+        expect_loss, expect_grad = self.get_full_estimate(sample_size)
+        for param in self.net.parameters():
+            param.grad = None
+        for micro_batch_size in [1, 3, 10]:
+            # The same noise draws for the micro-batches and the full batch.
+            torch.manual_seed(7)
+            estimator = EOTEstimator(net=self.net, sample_size=sample_size,
+                                     micro_batch_size=micro_batch_size)
+            loss, grad, preds = estimator.estimate(image=self.image,
+                                                   loss_fn=self.loss_fn)
+            self.assertEqual(preds.shape, (sample_size,))
+            np.testing.assert_allclose(loss, expect_loss, rtol=1e-5)
+            np.testing.assert_allclose(grad.numpy(), expect_grad.numpy(),
+                                       rtol=1e-4, atol=1e-6)
+        # The gradients of the parameters are not accumulated.
+        for param in self.net.parameters():
+            self.assertIsNone(param.grad)
+
+    def test_memory_budget(self):
+        estimator = EOTEstimator(net=self.net, sample_size=64)
+        sample_memory = estimator.get_sample_memory(self.image)
+        self.assertGreater(sample_memory, 0)
+        # No memory limit on the CPU.
+        self.assertEqual(estimator.get_micro_batch_size(self.image), 64)
+        budget = 10 * sample_memory / 2 ** 20
+        estimator = EOTEstimator(net=self.net, sample_size=64,
+                                 memory_budget=budget, sampling='antithetic')
+        self.assertEqual(estimator.get_micro_batch_size(self.image), 10)
+
+    def test_crn(self):
+        estimator = EOTEstimator(net=self.net, sample_size=8,
+                                 sampling='crn')
+        loss1, grad1, _ = estimator.estimate(image=self.image,
+                                             loss_fn=self.loss_fn)
+        loss2, grad2, _ = estimator.estimate(image=self.image,
+                                             loss_fn=self.loss_fn)
+        self.assertEqual(loss1, loss2)
+        np.testing.assert_equal(grad1.numpy(), grad2.numpy())
+        iid = EOTEstimator(net=self.net, sample_size=8)
+        loss3, _, _ = iid.estimate(image=self.image, loss_fn=self.loss_fn)
+        loss4, _, _ = iid.estimate(image=self.image, loss_fn=self.loss_fn)
+        self.assertNotEqual(loss3, loss4)
+
+    def test_antithetic(self):
+        noise = Noise(0.1)
+        net = nn.Sequential(noise)
+        estimator = EOTEstimator(net=net, sample_size=4,
+                                 sampling='antithetic')
+        outputs = []
+
+        def loss_fn(output):
+            outputs.append(output.detach())
+            return output.sum()
+
+        estimator.estimate(image=self.image, loss_fn=loss_fn)
+        noises = outputs[0] - self.image
+        np.testing.assert_allclose(noises[:2].numpy(), -noises[2:].numpy(),
+                                   atol=1e-6)
+        self.assertFalse(noise.antithetic)
+
+    def test_unknown_sampling(self):
+        with self.assertRaises(Exception):
+            EOTEstimator(net=self.net, sample_size=8, sampling='sobol')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import torch
+import torch.nn.functional as F
+from contextlib import contextmanager
+
+NORMS = ('inf', 2)
+
+
+def cross_entropy_sum(logits, labels):
+    return F.cross_entropy(logits, labels, reduction='sum')
+
+
+class PGD(object):
+    """
+    The PGD engine shared by the PGD attacks (Attack.pgd in PNI, RAW_PGD and
+    EOT_PGD).
+
+    The bounds of the Linf ball (clamped to the range of the pixels) are
+    computed once per attack, the adversarial images are updated in place
+    (the sign/normalized step, the projection onto the ball and the clamp),
+    and the gradient is computed only w.r.t. the input (the parameters of the
+    model do not accumulate gradients).
+
+    With early_stop, the images that are already adversarial (misclassified
+    or classified as the target) are frozen and removed from the active set,
+    so they do not use any more forward and backward passes. The number of
+    queries (forward and backward passes) is counted per image.
+    """
+
+    def __init__(self, model, eps, step_size, num_steps, norm='inf',
+                 clamp=(0, 1), targeted=False, early_stop=False, amp=False,
+                 raw_grad=False, loss_fn=cross_entropy_sum):
+        """
+        :param model: the model
+        :param eps: the radius of the ball
+        :param step_size: the size of a step
+        :param num_steps: the number of the steps
+        :param norm: inf or 2 (the norm of the ball and of the step)
+        :param clamp: the range of the pixels
+        :param targeted: the labels are the targets (descend on the loss)
+        :param early_stop: stop attacking the images that are adversarial
+        :param amp: run the forward passes in the mixed precision
+        :param raw_grad: the step is the gradient scaled by the step size
+        (instead of its sign or the normalized gradient)
+        :param loss_fn: maps the logits and the labels to the loss
+        """
+        if norm not in NORMS:
+            raise Exception(f'Unknown norm: {norm}, choose from: '
+                            f'{",".join([str(x) for x in NORMS])}')
+        self.model = model
+        self.eps = eps
+        self.step_size = step_size
+        self.num_steps = num_steps
+        self.norm = norm
+        self.clamp = clamp
+        self.targeted = targeted
+        self.early_stop = early_stop
+        self.amp = amp
+        self.raw_grad = raw_grad
+        self.loss_fn = loss_fn
+        # The number of the queries of an image in a step.
+        self.queries_per_step = 1
+
+    @contextmanager
+    def autocast(self, device):
+        if self.amp and hasattr(torch, 'autocast'):
+            dtype = torch.float16 if device.type == 'cuda' else torch.bfloat16
+            with torch.autocast(device_type=device.type, dtype=dtype):
+                yield
+        else:
+            yield
+
+    def is_adversarial(self, preds, labels):
+        if self.targeted:
+            return preds == labels
+        return preds != labels
+
+    def get_grad(self, x, labels):
+        """
+        :param x: the (active) adversarial images
+        :param labels: the labels of the images
+        :return: the gradient of the loss w.r.t. the images and the mask of
+        the images that are adversarial
+        """
+        x = x.detach().requires_grad_(True)
+        with self.autocast(x.device):
+            logits = self.model(x)
+        loss = self.loss_fn(logits.float(), labels)
+        grad = torch.autograd.grad(loss, x)[0]
+        return grad, self.is_adversarial(logits.argmax(dim=1), labels)
+
+    def step(self, x_adv, grad, x, lower, upper):
+        """
+        Update the adversarial images in place: the step, the projection onto
+        the ball and the clamp.
+        """
+        if self.raw_grad:
+            grad.mul_(self.step_size)
+        elif self.norm == 'inf':
+            grad.sign_().mul_(self.step_size)
+        else:
+            norms = grad.flatten(1).norm(dim=1).clamp_(min=1e-12)
+            grad.mul_((self.step_size / norms).view(-1, *[1] * (x.dim() - 1)))
+        if self.targeted:
+            x_adv.sub_(grad)
+        else:
+            x_adv.add_(grad)
+        # The gradient buffer is reused for the perturbation.
+        self.project(x_adv=x_adv, x=x, lower=lower, upper=upper, buffer=grad)
+
+    def project(self, x_adv, x, lower, upper, buffer):
+        """
+        Project the adversarial images (in place) onto the ball around the
+        images and clamp them to the range of the pixels.
+        """
+        if self.norm == 'inf':
+            torch.min(x_adv, upper, out=x_adv)
+            torch.max(x_adv, lower, out=x_adv)
+        else:
+            delta = torch.sub(x_adv, x, out=buffer)
+            norms = delta.flatten(1).norm(dim=1)
+            factor = torch.clamp(self.eps / (norms + 1e-12), max=1.0)
+            delta.mul_(factor.view(-1, *[1] * (x.dim() - 1)))
+            torch.add(x, delta, out=x_adv).clamp_(*self.clamp)
+
+    def attack(self, x, labels, init=None):
+        """
+        :param x: the images (N, C, H, W)
+        :param labels: the labels (or the targets) (N)
+        :param init: the initial perturbation (the random or warm start)
+        :return: the adversarial images and the number of queries per image
+        """
+        x = x.detach()
+        x_adv = x.clone()
+        lower = upper = None
+        if self.norm == 'inf':
+            lower = torch.clamp(x - self.eps, *self.clamp)
+            upper = torch.clamp(x + self.eps, *self.clamp)
+        if init is not None:
+            x_adv.add_(init)
+            self.project(x_adv=x_adv, x=x, lower=lower, upper=upper,
+                         buffer=torch.empty_like(x))
+        queries = torch.zeros(x.size(0), dtype=torch.long, device=x.device)
+        active = None  # all the images
+        for _ in range(self.num_steps):
+            if active is None:
+                grad, is_adv = self.get_grad(x_adv, labels)
+                queries += self.queries_per_step
+                if self.early_stop and is_adv.any():
+                    active = (~is_adv).nonzero().squeeze(1)
+                else:
+                    self.step(x_adv=x_adv, grad=grad, x=x, lower=lower,
+                              upper=upper)
+                    continue
+            else:
+                grad, is_adv = self.get_grad(x_adv[active], labels[active])
+                queries[active] += self.queries_per_step
+                active = active[~is_adv]
+            grad = grad[~is_adv]
+            if active.numel() == 0:
+                break
+            x_active = x_adv[active]
+            self.step(x_adv=x_active, grad=grad, x=x[active],
+                      lower=None if lower is None else lower[active],
+                      upper=None if upper is None else upper[active])
+            x_adv[active] = x_active
+        return x_adv, queries
@@ -0,0 +1,84 @@
+import unittest
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import nn
+from cnns.nnlib.pytorch_architecture.layer import Noise
+from cnns.nnlib.robustness.batch_attack.eot_pgd import EOT_PGD
+from cnns.nnlib.robustness.batch_attack.pgd import PGD
+from cnns.nnlib.robustness.batch_attack.raw_pgd import RAW_PGD
+from cnns.nnlib.utils.object import Object
+
+
+class TestPGD(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.net = nn.Sequential(nn.Flatten(), nn.Linear(3 * 4 * 4, 5))
+        self.images = torch.rand(6, 3, 4, 4)
+        self.labels = self.net(self.images).argmax(dim=1).detach()
+
+    def get_reference(self, init, eps, step_size, num_steps):
+        # The step by step PGD (as in the previous Attack.pgd).
+        lower = torch.clamp(self.images - eps, 0, 1)
+        upper = torch.clamp(self.images + eps, 0, 1)
+        adv = torch.max(torch.min(self.images + init, upper), lower)
+        for _ in range(num_steps):
+            adv = adv.clone().requires_grad_(True)
+            loss = F.cross_entropy(self.net(adv), self.labels)
+            grad = torch.autograd.grad(loss, adv)[0]
+            with torch.no_grad():
+                adv = adv + step_size * grad.sign()
+                adv = torch.max(torch.min(adv, upper), lower)
+        return adv.detach()
+
+    def test_linf(self):
+        init = torch.empty_like(self.images).uniform_(-0.1, 0.1)
+        pgd = PGD(model=self.net, eps=0.1, step_size=0.02, num_steps=5)
+        adv, queries = pgd.attack(self.images, self.labels, init=init)
+        expect = self.get_reference(init=init, eps=0.1, step_size=0.02,
+                                    num_steps=5)
+        np.testing.assert_allclose(adv.numpy(), expect.numpy(), atol=1e-6)
+        self.assertTrue((queries == 5).all())
+        for param in self.net.parameters():
+            self.assertIsNone(param.grad)
+
+    def test_l2(self):
+        pgd = PGD(model=self.net, eps=0.5, step_size=0.2, num_steps=10,
+                  norm=2)
+        adv, _ = pgd.attack(self.images, self.labels)
+        norms = (adv - self.images).flatten(1).norm(dim=1)
+        self.assertTrue((norms <= 0.5 + 1e-5).all())
+        self.assertGreaterEqual(adv.min().item(), 0)
+        self.assertLessEqual(adv.max().item(), 1)
+        raw = RAW_PGD(model=self.net, num_steps=10, step_size=0.2, eps=0.5)
+        adv = raw.projected_gradient_descent(self.images, self.labels)
+        norms = (adv - self.images).flatten(1).norm(dim=1)
+        self.assertTrue((norms <= 0.5 + 1e-5).all())
+
+    def test_early_stop(self):
+        pgd = PGD(model=self.net, eps=1.0, step_size=0.1, num_steps=50,
+                  early_stop=True)
+        adv, queries = pgd.attack(self.images, self.labels)
+        preds = self.net(adv).argmax(dim=1)
+        self.assertTrue((preds != self.labels).all())
+        self.assertTrue((queries < 50).all())
+        # The adversarial images are not changed after they are found.
+        pgd.num_steps = 100
+        adv_longer, _ = pgd.attack(self.images, self.labels)
+        np.testing.assert_allclose(adv.numpy(), adv_longer.numpy())
+
+    def test_eot(self):
+        net = nn.Sequential(Noise(0.01), self.net)
+        opt = Object()
+        opt.attack_iters = 20
+        opt.eot_sample_size = 4
+        eot = EOT_PGD(net=net, epsilon=0.5, opt=opt, learning_rate=1.0)
+        advs = eot.eot_batch(images=self.images, labels=self.labels)
+        self.assertLessEqual((advs - self.images).abs().max().item(),
+                             0.5 + 1e-6)
+        self.assertTrue((self.net(advs).argmax(dim=1) != self.labels).any())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import torch
 from torch import nn
 from typing import Union
+from cnns.nnlib.robustness.batch_attack.pgd import PGD
 
 
 def project(x: torch.Tensor, x_adv: torch.Tensor, norm: Union[str, int],
@@ -78,7 +79,9 @@ class RAW_PGD:
                  clamp=(0, 1),
                  y_target=None,
                  loss_fn=nn.CrossEntropyLoss(),
-                 random: bool = True):
+                 random: bool = True,
+                 early_stop: bool = False,
+                 amp: bool = False):
         self.model = model
         self.loss_fn = loss_fn
         self.num_steps = num_steps
@@ -88,64 +91,21 @@ class RAW_PGD:
         self.clamp = clamp
         self.y_target = y_target
         self.random = random
+        self.early_stop = early_stop
+        self.amp = amp
+        # The number of the queries per image in the last attack.
+        self.queries = None
 
     def projected_gradient_descent(self, x, y):
         """Performs the projected gradient descent attack on a batch of images."""
-        x_adv = x.clone().detach().requires_grad_(True).to(x.device)
         targeted = self.y_target is not None
-        num_channels = x.shape[1]
-
+        pgd = PGD(model=self.model, eps=self.eps, step_size=self.step_size,
+                  num_steps=self.num_steps, norm=self.norm, clamp=self.clamp,
+                  targeted=targeted, early_stop=self.early_stop,
+                  amp=self.amp, loss_fn=self.loss_fn)
+        init = None
         if self.random:
-            x_adv = random_perturbation(x_adv, self.norm, self.eps)
-
-        for i in range(self.num_steps):
-            _x_adv = x_adv.clone().detach().requires_grad_(True)
-
-            prediction = self.model(_x_adv)
-            loss = self.loss_fn(prediction, self.y_target if targeted else y)
-            loss.backward()
-
-            with torch.no_grad():
-                # Force the gradient step to be a fixed size in a certain norm
-                if self.norm == 'inf':
-                    gradients = _x_adv.grad.sign() * self.step_size
-                else:
-                    # Note .view() assumes batched image data as 4D tensor
-                    gradients = _x_adv.grad * self.step_size / _x_adv.grad.view(
-                        _x_adv.shape[0], -1) \
-                        .norm(self.norm, dim=-1) \
-                        .view(-1, num_channels, 1, 1)
-
-                if targeted:
-                    # Targeted: Gradient descent with on the loss of the (incorrect) target label
-                    # w.r.t. the image data
-                    x_adv -= gradients
-                else:
-                    # Untargeted: Gradient ascent on the loss of the correct label w.r.t.
-                    # the model parameters
-                    x_adv += gradients
-
-            # Project back into l_norm ball and correct range
-            if self.norm == 'inf':
-                # Workaround as PyTorch doesn't have elementwise clip
-                x_adv = torch.max(torch.min(x_adv, x + self.eps), x - self.eps)
-            else:
-                delta = x_adv - x
-
-                # Assume x and x_adv are batched tensors where the first dimension is
-                # a batch dimension
-                mask = delta.view(delta.shape[0], -1).norm(self.norm,
-                                                           dim=1) <= self.eps
-
-                scaling_factor = delta.view(delta.shape[0], -1).norm(self.norm,
-                                                                     dim=1)
-                scaling_factor[mask] = self.eps
-
-                # .view() assumes batched images as a 4D Tensor
-                delta *= self.eps / scaling_factor.view(-1, 1, 1, 1)
-
-                x_adv = x + delta
-
-            x_adv = x_adv.clamp(*self.clamp)
-
-        return x_adv.detach()
+            init = random_perturbation(x, self.norm, self.eps) - x
+        x_adv, self.queries = pgd.attack(
+            x, self.y_target if targeted else y, init=init)
+        return x_adv
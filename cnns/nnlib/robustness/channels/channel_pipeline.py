@@ -0,0 +1,209 @@
+import time
+import torch
+from collections import OrderedDict
+from cnns.nnlib.pytorch_layers.noise import sample_noise_torch
+from cnns.nnlib.utils.complex_mask import get_inverse_hyper_mask
+from cnns.nnlib.robustness.channels.channels_definition import fft_channel
+from cnns.nnlib.robustness.channels.channels_definition import \
+    compress_svd_batch
+from cnns.nnlib.robustness.channels.channels_definition import round
+from cnns.nnlib.robustness.channels.channels_definition import subtract_rgb
+
+# The registry of the channels (the preprocessing defenses) applied to a
+# batch of (adversarial) images in the range [min, max].
+#
+# Each channel is a function: channel(images, param, pipeline, fused) ->
+# images. The elementwise channels are called with fused=True by the pipeline
+# and then work in place on the images (that are owned by the pipeline),
+# otherwise they return new tensors.
+channel_registry = OrderedDict()
+
+
+class Channel(object):
+
+    def __init__(self, name, channel_fn, elementwise):
+        self.name = name
+        self.channel_fn = channel_fn
+        self.elementwise = elementwise
+
+
+def register_channel(name, elementwise=False):
+    """
+    Register a channel under the name.
+
+    :param name: the name of the channel (e.g. the value of opt.channel)
+    :param elementwise: True if the channel can be applied in place
+    """
+
+    def register(channel_fn):
+        channel_registry[name] = Channel(name=name, channel_fn=channel_fn,
+                                         elementwise=elementwise)
+        return channel_fn
+
+    return register
+
+
+def get_channel(name):
+    if name not in channel_registry:
+        raise Exception(f'Unknown channel: {name}')
+    return channel_registry[name]
+
+
+@register_channel('empty')
+@register_channel('perturb')
+def empty_channel(images, param, pipeline, fused=False):
+    # The perturb channel perturbs the weights of the net (not the input).
+    return images
+
+
+def get_noise_channel(noise_type):
+    def noise_channel(images, param, pipeline, fused=False):
+        noise = sample_noise_torch(
+            noise_type=noise_type, noise_level=param, input=images,
+            min_=pipeline.bounds[0], max_=pipeline.bounds[1],
+            generator=pipeline.generator,
+            out=pipeline.get_buffer('noise', images) if fused else None)
+        if fused:
+            return images.add_(noise)
+        return images + noise
+
+    return noise_channel
+
+
+for noise_type in ('gauss', 'uniform', 'laplace'):
+    register_channel(noise_type, elementwise=True)(
+        get_noise_channel(noise_type))
+
+
+@register_channel('round', elementwise=True)
+def round_channel(images, param, pipeline, fused=False):
+    if fused:
+        round_multiplier = param - 1.0
+        return images.mul_(round_multiplier).round_().div_(round_multiplier)
+    return round(values_per_channel=param, images=images)
+
+
+@register_channel('sub_rgb', elementwise=True)
+def subtract_rgb_channel(images, param, pipeline, fused=False):
+    if fused:
+        round_multiplier = 255.0
+        return images.mul_(round_multiplier).round_().sub_(param).div_(
+            round_multiplier)
+    return subtract_rgb(images=images, subtract_value=param)
+
+
+@register_channel('fft')
+@register_channel('fft_adaptive')
+def fft_compress_channel(images, param, pipeline, fused=False):
+    # The power of 2 fft size as in the channels this replaced.
+    return fft_channel(input=images, compress_rate=param, is_next_power2=True)
+
+
+@register_channel('inv_fft')
+def inverse_fft_channel(images, param, pipeline, fused=False):
+    return fft_channel(input=images, compress_rate=param,
+                       get_mask=get_inverse_hyper_mask, is_next_power2=True)
+
+
+@register_channel('svd')
+def svd_channel(images, param, pipeline, fused=False):
+    return compress_svd_batch(x=images, compress_rate=param)
+
+
+class ChannelPipeline(object):
+    """
+    Apply a chain of the registered channels to a batch of images.
+
+    The pipeline is described by a spec: the names of the channels joined
+    by '+', each name with an optional parameter after ':', for example:
+    'round:32+fft:50+gauss:0.03'. The channels without an explicit parameter
+    use the default param (e.g., opt.noise_epsilon) so a single channel name
+    (e.g., 'gauss') works as the old opt.channel option.
+
+    With fuse=True, the elementwise channels (noise, rounding, rgb
+    subtraction) run in place: the input is copied once into a workspace
+    buffer preallocated per batch shape (or the input itself is used with
+    in_place=True) and the noise is sampled into another reused buffer, so no
+    intermediate tensors are allocated for them.
+    """
+
+    def __init__(self, spec, param=None, bounds=(0.0, 1.0), fuse=True,
+                 in_place=False, timing=False, generator=None):
+        """
+        :param spec: the channels, e.g. 'round:32+fft:50+gauss:0.03'
+        :param param: the default parameter of the channels
+        :param bounds: the min and max values of the pixels
+        :param fuse: run the elementwise channels in place
+        :param in_place: modify the input images directly (without the copy
+        to the workspace)
+        :param timing: record the time spent in each stage
+        :param generator: the torch.Generator for the noise channels
+        """
+        self.spec = spec
+        self.bounds = bounds
+        self.fuse = fuse
+        self.in_place = in_place
+        self.timing = timing
+        self.generator = generator
+        self.stages = []
+        for stage in spec.split('+'):
+            name, _, stage_param = stage.partition(':')
+            if stage_param:
+                stage_param = float(stage_param)
+            else:
+                stage_param = param
+            self.stages.append((get_channel(name), stage_param))
+        self.workspace = {}
+        self.reset_timings()
+
+    def reset_timings(self):
+        self.timings = OrderedDict()
+        for channel, _ in self.stages:
+            self.timings[channel.name] = 0.0
+
+    def get_buffer(self, name, like):
+        key = (name, like.shape, like.dtype, like.device)
+        buffer = self.workspace.get(key, None)
+        if buffer is None:
+            buffer = torch.empty_like(like,
+                                      memory_format=torch.contiguous_format)
+            self.workspace[key] = buffer
+        return buffer
+
+    def __call__(self, images):
+        """
+        :param images: the batch of images
+        :return: the images after all the channels (with fuse=True, it can
+        be the workspace buffer that is overwritten in the next call)
+        """
+        with torch.no_grad():
+            return self.run(images)
+
+    def run(self, images):
+        # The images are owned by the pipeline if they can be modified in
+        # place.
+        is_owned = self.in_place
+        for channel, param in self.stages:
+            if self.timing:
+                self.synchronize(images)
+                start = time.time()
+            fused = self.fuse and channel.elementwise
+            if fused and not is_owned:
+                images = self.get_buffer('images', images).copy_(images)
+                is_owned = True
+            result = channel.channel_fn(images, param, self, fused=fused)
+            if result is not images:
+                is_owned = self.fuse
+            images = result
+            if self.timing:
+                self.synchronize(images)
+                self.timings[channel.name] += time.time() - start
+        return images
+
+    def synchronize(self, images):
+        if images.is_cuda:
+            torch.cuda.synchronize(images.device)
+
+    def get_timings_str(self):
+        return ','.join([f'{name},{elapsed}' for name, elapsed in
+                         self.timings.items()])
@@ -0,0 +1,96 @@
+import unittest
+import numpy as np
+import torch
+from cnns.nnlib.robustness.channels.channel_pipeline import ChannelPipeline
+from cnns.nnlib.robustness.channels.channel_pipeline import channel_registry
+from cnns.nnlib.robustness.channels.channel_pipeline import register_channel
+from cnns.nnlib.robustness.channels.channels_definition import round
+from cnns.nnlib.robustness.channels.channels_definition import subtract_rgb
+
+
+class TestChannelPipeline(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.images = torch.rand(4, 3, 8, 8)
+
+    def test_single_channel(self):
+        pipeline = ChannelPipeline(spec='round', param=16)
+        result = pipeline(self.images)
+        np.testing.assert_allclose(
+            actual=result.numpy(),
+            desired=round(values_per_channel=16, images=self.images).numpy(),
+            rtol=1e-6)
+        # The input is not modified (the workspace is used).
+        self.assertIsNot(result, self.images)
+        self.assertFalse(torch.equal(result, self.images))
+
+    def test_fused_matches_unfused(self):
+        spec = 'sub_rgb:3+round:32+gauss:0.03+uniform:0.01'
+        fused = ChannelPipeline(spec=spec,
+                                generator=torch.Generator().manual_seed(7))
+        unfused = ChannelPipeline(spec=spec, fuse=False,
+                                  generator=torch.Generator().manual_seed(7))
+        expect = unfused(self.images)
+        result = fused(self.images)
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expect.numpy(), atol=1e-6)
+        # The workspace buffer is reused for the next batch.
+        self.assertIs(fused(self.images), result)
+
+    def test_fft_power2(self):
+        # The fft size is the next power of 2 (as in the old channels): the
+        # 6x6 images are padded to 8x8 and the compression by 50% retains
+        # the lowest frequencies in the 3 corner rows and 3 columns.
+        images = torch.rand(2, 3, 6, 6)
+        result = ChannelPipeline(spec='fft:50')(images)
+        mask = np.zeros((8, 5))
+        mask[[0, 1, 2, 5, 6, 7], :3] = 1
+        padded = np.pad(images.numpy(), ((0, 0), (0, 0), (0, 2), (0, 2)))
+        expect = np.fft.irfft2(np.fft.rfft2(padded) * mask, s=(8, 8))
+        np.testing.assert_allclose(actual=result.numpy(),
+                                   desired=expect[..., :6, :6], atol=1e-6)
+
+    def test_in_place(self):
+        images = self.images.clone()
+        pipeline = ChannelPipeline(spec='sub_rgb:1', in_place=True)
+        result = pipeline(images)
+        self.assertIs(result, images)
+        np.testing.assert_allclose(
+            actual=result.numpy(),
+            desired=subtract_rgb(images=self.images, subtract_value=1).numpy(),
+            atol=1e-6)
+
+    def test_default_param_and_timings(self):
+        pipeline = ChannelPipeline(spec='round+gauss:0.0+empty', param=4,
+                                   timing=True)
+        result = pipeline(self.images)
+        np.testing.assert_allclose(
+            actual=result.numpy(),
+            desired=round(values_per_channel=4, images=self.images).numpy(),
+            atol=1e-6)
+        self.assertEqual(list(pipeline.timings.keys()),
+                         ['round', 'gauss', 'empty'])
+        self.assertGreater(pipeline.timings['round'], 0.0)
+
+    def test_register_channel(self):
+        @register_channel('negative', elementwise=True)
+        def negative(images, param, pipeline, fused=False):
+            if fused:
+                return images.neg_()
+            return -images
+
+        try:
+            pipeline = ChannelPipeline(spec='negative+round', param=256)
+            np.testing.assert_allclose(
+                actual=pipeline(self.images).numpy(),
+                desired=round(values_per_channel=256,
+                              images=-self.images).numpy(), atol=1e-6)
+        finally:
+            del channel_registry['negative']
+        with self.assertRaises(Exception):
+            ChannelPipeline(spec='negative')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,18 @@ import torch
 import numpy as np
 from cnns.nnlib.utils.complex_mask import get_hyper_mask
 from cnns.nnlib.utils.complex_mask import get_inverse_hyper_mask
+from cnns.nnlib.utils.complex_mask import get_cached_mask
 from cnns.nnlib.utils.general_utils import next_power2
 from torch.nn.functional import pad as torch_pad
 from torch.distributions.laplace import Laplace
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_xfft_hw
+from cnns.nnlib.pytorch_layers.pytorch_utils import get_ifft_hw
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_spectrum
 import functools
 from numpy.linalg import svd
 import math
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 
 nprng = np.random.RandomState()
 nprng.seed(31)
@@ -42,6 +46,164 @@ def fft_zero_values_numpy(numpy_array, high, low=0, onesided=True,
     return torch_image.squeeze().cpu().numpy()
 
 
+class FFTSpectrum(object):
+    """
+    The spectrum of a batch of images computed once and reused for many
+    reconstructions.
+
+    A vector of R compress rates (or masks or thresholds) gives R
+    reconstructions of the whole batch, all of them computed with a single
+    (batched) irfft. With the net given, the reconstructions are also
+    classified in one large batch, so a sweep over the compress rates (or a
+    search for a rate) takes a few vectorized passes instead of a rfft, irfft
+    and forward pass for each rate.
+    """
+
+    def __init__(self, input, onesided=True, is_next_power2=False):
+        """
+        :param input: the batch of images (N, C, H, W)
+        :onesided: should use the onesided FFT thanks to the conjugate symmetry
+        or want to preserve all the coefficients
+        :is_next_power2: should we bring the FFT size to the power of 2
+        """
+        _, _, self.H, self.W = input.size()
+        self.onesided = onesided
+        self.xfft, self.H_fft, self.W_fft = get_xfft_hw(
+            input=input, is_next_power2=is_next_power2, onesided=onesided)
+        _, _, self.H_xfft, self.W_xfft, _ = self.xfft.size()
+        self.spectrum = None
+
+    def get_spectrum(self):
+        """
+        :return: the magnitudes of the coefficients (N, C, H_xfft, W_xfft, 1)
+        """
+        if self.spectrum is None:
+            self.spectrum = get_spectrum(self.xfft, squeeze=False)
+        return self.spectrum
+
+    def get_thresholds(self, values):
+        """
+        :return: the values as a tensor (R, 1, 1, 1, 1, 1) that broadcasts
+        over the (R copies of the) xfft
+        """
+        values = torch.as_tensor(values, dtype=self.xfft.dtype,
+                                 device=self.xfft.device)
+        return values.view(-1, 1, 1, 1, 1, 1)
+
+    def reconstruct(self, masks, net=None, batch_size=0):
+        """
+        :param masks: the masks (R, ..., 2) that broadcast to the R copies of
+        the xfft (R, N, C, H_xfft, W_xfft, 2)
+        :param net: the model to classify the reconstructions
+        :param batch_size: the max batch size for the net (0 - all the R * N
+        reconstructions at once)
+        :return: the reconstructions (R, N, C, H, W) and the predicted classes
+        (R, N) if the net is given
+        """
+        xfft = self.xfft.unsqueeze(0) * masks
+        out = get_ifft_hw(xfft=xfft, H_fft=self.H_fft, W_fft=self.W_fft,
+                          H=self.H, W=self.W, onesided=self.onesided)
+        if net is None:
+            return out
+        return out, predict_reconstructions(net=net, reconstructions=out,
+                                            batch_size=batch_size)
+
+    def get_compress_masks(self, compress_rates, inverse_compress_rates=None,
+                           val=0, get_mask=get_hyper_mask,
+                           get_inv_mask=get_inverse_hyper_mask):
+        masks = []
+        for i, compress_rate in enumerate(compress_rates):
+            mask = get_cached_mask(H=self.H_xfft, W=self.W_xfft,
+                                   compress_rate=compress_rate,
+                                   val=val, interpolate='const',
+                                   onesided=self.onesided, get_mask=get_mask,
+                                   dtype=self.xfft.dtype,
+                                   device=self.xfft.device)
+            if inverse_compress_rates is not None and (
+                    inverse_compress_rates[i] > 0) and (
+                    get_inv_mask is not None):
+                inv_mask = get_cached_mask(
+                    H=self.H_xfft, W=self.W_xfft,
+                    compress_rate=inverse_compress_rates[i],
+                    val=val, interpolate='const', onesided=self.onesided,
+                    get_mask=get_inv_mask, dtype=self.xfft.dtype,
+                    device=self.xfft.device)
+                mask = mask + inv_mask
+            masks.append(mask)
+        # The masks are shared by all the images and channels.
+        return torch.stack(masks).unsqueeze(1).unsqueeze(1)
+
+    def compress(self, compress_rates, inverse_compress_rates=None, val=0,
+                 get_mask=get_hyper_mask, get_inv_mask=get_inverse_hyper_mask,
+                 net=None, batch_size=0):
+        """
+        Remove the high frequency coefficients (see fft_channel) for each of
+        the compress rates.
+
+        :param compress_rates: the vector of the compress rates (R)
+        :param inverse_compress_rates: the vector of the compress rates (R) for
+        the removal of the low frequency coefficients
+        :return: the reconstructions (R, N, C, H, W) (and the predictions)
+        """
+        masks = self.get_compress_masks(
+            compress_rates=compress_rates,
+            inverse_compress_rates=inverse_compress_rates, val=val,
+            get_mask=get_mask, get_inv_mask=get_inv_mask)
+        return self.reconstruct(masks=masks, net=net, batch_size=batch_size)
+
+    def zero_values(self, highs, lows=0, net=None, batch_size=0):
+        """
+        Zero out the real and imaginary parts with the absolute values in
+        [low, high] (see fft_zero_values) for each pair of the thresholds.
+
+        :param highs: the vector of the highest values to be zeroed out (R)
+        :param lows: the vector of the lowest values to be zeroed out (R)
+        :return: the reconstructions (R, N, C, H, W) (and the predictions)
+        """
+        xfft_abs = torch.abs(self.xfft).unsqueeze(0)
+        masks = (xfft_abs < self.get_thresholds(lows)) | (
+                xfft_abs > self.get_thresholds(highs))
+        return self.reconstruct(masks=masks.to(self.xfft.dtype), net=net,
+                                batch_size=batch_size)
+
+    def zero_low_magnitudes(self, highs, lows=0, net=None, batch_size=0):
+        """
+        Zero out the coefficients with the magnitudes in [low, high] (see
+        fft_zero_low_magnitudes) for each pair of the thresholds.
+
+        :param highs: the vector of the highest magnitudes to be zeroed out (R)
+        :param lows: the vector of the lowest magnitudes to be zeroed out (R)
+        :return: the reconstructions (R, N, C, H, W) (and the predictions)
+        """
+        spectrum = self.get_spectrum().unsqueeze(0)
+        # The last dimension of size 1 covers both parts of the complex
+        # numbers.
+        masks = (spectrum < self.get_thresholds(lows)) | (
+                spectrum > self.get_thresholds(highs))
+        return self.reconstruct(masks=masks.to(self.xfft.dtype), net=net,
+                                batch_size=batch_size)
+
+
+def predict_reconstructions(net, reconstructions, batch_size=0):
+    """
+    Classify the reconstructions as one large batch (or in the batches of the
+    batch_size).
+
+    :param net: the model that maps a batch of images to the logits
+    :param reconstructions: the images (R, N, C, H, W)
+    :param batch_size: the max batch size (0 - all at once)
+    :return: the predicted classes (R, N)
+    """
+    R, N = reconstructions.size()[:2]
+    images = reconstructions.reshape(R * N, *reconstructions.size()[2:])
+    if batch_size <= 0:
+        batch_size = R * N
+    with torch.no_grad():
+        preds = [net(images[i:i + batch_size]).argmax(dim=1) for i in
+                 range(0, R * N, batch_size)]
+    return torch.cat(preds).view(R, N)
+
+
 def fft_channel(input, compress_rate, val=0, get_mask=get_hyper_mask,
                 onesided=True, is_next_power2=False, inverse_compress_rate=0,
                 get_inv_mask=get_inverse_hyper_mask):
@@ -59,49 +221,13 @@ def fft_channel(input, compress_rate, val=0, get_mask=get_hyper_mask,
     :get_inv_mask: the inverted mask for the removal of low frequency
     coefficients
     """
-    N, C, H, W = input.size()
-
-    if H != W:
-        raise Exception("We support only squared input.")
-
-    if is_next_power2:
-        H_fft = next_power2(H)
-        W_fft = next_power2(W)
-        pad_H = H_fft - H
-        pad_W = W_fft - W
-        input = torch_pad(input, (0, pad_W, 0, pad_H), 'constant', 0)
-    else:
-        H_fft = H
-        W_fft = W
-    xfft = torch.rfft(input,
-                      signal_ndim=2,
-                      onesided=onesided)
+    spectrum = FFTSpectrum(input=input, onesided=onesided,
+                           is_next_power2=is_next_power2)
     del input
-
-    _, _, H_xfft, W_xfft, _ = xfft.size()
-
-    mask, _ = get_mask(H=H_xfft, W=W_xfft,
-                       compress_rate=compress_rate,
-                       val=val, interpolate='const',
-                       onesided=onesided)
-
-    if inverse_compress_rate > 0 and get_inv_mask is not None:
-        inv_mask, _ = get_inv_mask(H=H_xfft, W=W_xfft,
-                                   compress_rate=inverse_compress_rate,
-                                   val=val, interpolate='const',
-                                   onesided=onesided)
-        mask = mask + inv_mask
-
-    mask = mask[:, 0:W_xfft, :]
-    mask = mask.to(xfft.dtype).to(xfft.device)
-    xfft = xfft * mask
-
-    out = torch.irfft(input=xfft,
-                      signal_ndim=2,
-                      signal_sizes=(H_fft, W_fft),
-                      onesided=onesided)
-    out = out[..., :H, :W]
-    return out
+    return spectrum.compress(compress_rates=[compress_rate],
+                             inverse_compress_rates=[inverse_compress_rate],
+                             val=val, get_mask=get_mask,
+                             get_inv_mask=get_inv_mask)[0]
 
 
 def fft_squared_channel(input, compress_rate, onesided=True,
@@ -134,7 +260,7 @@ def fft_squared_channel(input, compress_rate, onesided=True,
         H_fft = H
         W_fft = W
 
-    xfft = torch.rfft(input,
+    xfft = rfft_pairs(input,
                       signal_ndim=2,
                       onesided=onesided)
     del input
@@ -151,7 +277,7 @@ def fft_squared_channel(input, compress_rate, onesided=True,
     xfft[..., n + 1:-n, :, :] = 0  # zero out center
     xfft[..., :, n + 1:, :] = 0  # zero out right-end stripe
 
-    out = torch.irfft(input=xfft,
+    out = irfft_pairs(input=xfft,
                       signal_ndim=2,
                       signal_sizes=(H_fft, W_fft),
                       onesided=onesided)
@@ -164,33 +290,15 @@ def fft_zero_values(input, high, low=0, onesided=True, is_next_power2=True):
     :param input: the input image
     :param high: the highest value to be zeroed out (up to)
     :param low: the lowest value to be zeroed out (down to)
-    :param val: the value (to change coefficients to) for the mask
     :onesided: should use the onesided FFT thanks to the conjugate symmetry
     or want to preserve all the coefficients
     :is_next_power2: should we bring the FFT size to the power of 2
-    :inverse_compress_rate:
     :return the zero out specific values
     """
-    _, _, H, W = input.size()
-    xfft, H_fft, W_fft = get_xfft_hw(input=input, signal_ndim=2,
-                                     onesided=onesided,
-                                     is_next_power2=is_next_power2)
+    spectrum = FFTSpectrum(input=input, onesided=onesided,
+                           is_next_power2=is_next_power2)
     del input
-
-    _, _, H_xfft, W_xfft, _ = xfft.size()
-    # assert H_fft == W_xfft, "The input tensor has to be squared."
-    mask = torch.zeros_like(xfft)
-    xfft_abs = torch.abs(xfft)
-    mask[xfft_abs < low] = 1.0
-    mask[xfft_abs > high] = 1.0
-    xfft *= mask
-
-    out = torch.irfft(input=xfft,
-                      signal_ndim=2,
-                      signal_sizes=(H_fft, W_fft),
-                      onesided=onesided)
-    out = out[..., :H, :W]
-    return out
+    return spectrum.zero_values(highs=[high], lows=[low])[0]
 
 
 def fft_zero_low_magnitudes(input, high, low=0, onesided=True,
@@ -199,34 +307,15 @@ def fft_zero_low_magnitudes(input, high, low=0, onesided=True,
     :param input: the input image
     :param high: the highest value to be zeroed out (up to)
     :param low: the lowest value to be zeroed out (down to)
-    :param val: the value (to change coefficients to) for the mask
     :onesided: should use the onesided FFT thanks to the conjugate symmetry
     or want to preserve all the coefficients
     :is_next_power2: should we bring the FFT size to the power of 2
-    :inverse_compress_rate:
     :return the zero out specific values corresponding to low magnitudes
     """
-    _, _, H, W = input.size()
-    xfft, H_fft, W_fft = get_xfft_hw(input=input, signal_ndim=2,
-                                     onesided=onesided,
-                                     is_next_power2=is_next_power2)
+    spectrum = FFTSpectrum(input=input, onesided=onesided,
+                           is_next_power2=is_next_power2)
     del input
-
-    _, _, H_xfft, W_xfft, _ = xfft.size()
-    # assert H_fft == W_xfft, "The input tensor has to be squared."
-    spectrum = get_spectrum(xfft, squeeze=False)
-    mask = torch.zeros_like(spectrum)
-    mask[spectrum < low] = 1.0
-    mask[spectrum > high] = 1.0
-    # Extend the mask to cover two parts of the complex numbers in the last dim.
-    mask = torch.cat(tensors=(mask, mask), dim=-1)
-    xfft *= mask
-    out = torch.irfft(input=xfft,
-                      signal_ndim=2,
-                      signal_sizes=(H_fft, W_fft),
-                      onesided=onesided)
-    out = out[..., :H, :W]
-    return out
+    return spectrum.zero_low_magnitudes(highs=[high], lows=[low])[0]
 
 
 def replace_frequencies_numpy(input_to, input_from, compress_rate, val=0,
@@ -288,10 +377,10 @@ def replace_frequencies(input_to, input_from, compress_rate, val=0,
         H_fft = H
         W_fft = W
 
-    xfft_to = torch.rfft(input_to,
+    xfft_to = rfft_pairs(input_to,
                          signal_ndim=2,
                          onesided=onesided)
-    xfft_from = torch.rfft(input_from,
+    xfft_from = rfft_pairs(input_from,
                            signal_ndim=2,
                            onesided=onesided)
     del input_to
@@ -299,19 +388,14 @@ def replace_frequencies(input_to, input_from, compress_rate, val=0,
 
     _, _, H_xfft, W_xfft, _ = xfft_to.size()
 
-    mask, _ = get_mask(H=H_xfft, W=W_xfft,
-                       compress_rate=compress_rate,
-                       val=val, interpolate='const',
-                       onesided=onesided)
+    mask = get_cached_mask(H=H_xfft, W=W_xfft,
+                           compress_rate=compress_rate,
+                           val=val, interpolate='const',
+                           onesided=onesided, get_mask=get_mask,
+                           dtype=xfft_to.dtype, device=xfft_to.device)
 
     inv_mask = mask * (-1) + 1
 
-    mask = mask[:, 0:W_xfft, :]
-    mask = mask.to(xfft_to.dtype).to(xfft_to.device)
-
-    inv_mask = inv_mask[:, 0:W_xfft, :]
-    inv_mask = inv_mask.to(xfft_from.dtype).to(xfft_from.device)
-
     if high:
         xfft_to = xfft_to * mask
         xfft_from = xfft_from * inv_mask
@@ -321,7 +405,7 @@ def replace_frequencies(input_to, input_from, compress_rate, val=0,
 
     xfft_to = xfft_to + xfft_from
 
-    out = torch.irfft(input=xfft_to,
+    out = irfft_pairs(input=xfft_to,
                       signal_ndim=2,
                       signal_sizes=(H_fft, W_fft),
                       onesided=onesided)
@@ -361,7 +445,7 @@ def gauss_noise_fft_torch(std, input, is_next_power2=False, onesided=True):
     else:
         H_fft = H
         W_fft = W
-    xfft = torch.rfft(input,
+    xfft = rfft_pairs(input,
                       signal_ndim=2,
                       onesided=onesided)
     del input
@@ -372,7 +456,7 @@ def gauss_noise_fft_torch(std, input, is_next_power2=False, onesided=True):
     # xfft += xfft * noise
     xfft += noise
 
-    out = torch.irfft(input=xfft,
+    out = irfft_pairs(input=xfft,
                       signal_ndim=2,
                       signal_sizes=(H_fft, W_fft),
                       onesided=onesided)
@@ -464,29 +548,8 @@ def subtract_rgb_numpy(images, subtract_value):
 
 
 def compress_svd(torch_img, compress_rate):
-    C, H, W = torch_img.size()
-    D = min(H, W)
-    index = int((1 - compress_rate / 100) * D)
-    torch_compress_img = torch.zeros_like(torch_img)
-    for c in range(C):
-        iters = 10
-        for i in range(iters):
-            try:
-                u, s, v = torch.svd(torch_img[c])
-                u_c = u[:, :index]
-                s_c = s[:index]
-                v_c = v[:, :index]
-                torch_compress_img[c] = torch.mm(torch.mm(u_c, torch.diag(s_c)),
-                                                 v_c.t())
-                break
-            except RuntimeError as ex:
-                msg = "SVD compression problem: ", ex, " iteration: ", i
-                print(msg)
-
-                if i == (iters - 1):
-                    torch_compress_img[c] = torch_img[c]
-
-    return torch_compress_img
+    return compress_svd_batch(x=torch_img.unsqueeze(0),
+                              compress_rate=compress_rate)[0]
 
 
 def compress_svd_numpy_through_torch(numpy_array, compress_rate):
@@ -496,11 +559,108 @@ def compress_svd_numpy_through_torch(numpy_array, compress_rate):
     return torch_image.cpu().numpy()
 
 
-def compress_svd_batch(x, compress_rate):
-    result = torch.zeros_like(x)
-    for i, torch_img in enumerate(x):
-        result[i] = compress_svd(torch_img=torch_img,
-                                 compress_rate=compress_rate)
+def get_svd_rank(H, W, compress_rate):
+    """
+    The number of singular values retained by the compress_svd.
+    """
+    D = min(H, W)
+    return int((1 - compress_rate / 100) * D)
+
+
+def low_rank_svd(x, index):
+    """
+    Batched low rank reconstruction with the full svd.
+
+    :param x: the input of size (..., H, W)
+    :param index: the number of singular values to retain
+    :return: the reconstruction of x from the index largest singular values
+    """
+    u, s, v = torch.svd(x)
+    u_c = u[..., :index]
+    s_c = s[..., :index]
+    v_c = v[..., :index]
+    return torch.matmul(u_c * s_c.unsqueeze(-2), v_c.transpose(-2, -1))
+
+
+def batch_qr(x):
+    # torch.qr was removed in favor of torch.linalg.qr.
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'qr'):
+        return torch.linalg.qr(x)
+    return torch.qr(x)
+
+
+def low_rank_randomized_svd(x, index, oversample=10, power_iters=2):
+    """
+    Batched low rank reconstruction with the randomized svd (Halko et al.).
+    We only compute the svd of a small (index + oversample) x W matrix per
+    channel, which is much cheaper than the full svd for large images and
+    small ranks.
+
+    :param x: the input of size (..., H, W)
+    :param index: the number of singular values to retain
+    :param oversample: the number of additional random projections
+    :param power_iters: the number of power iterations (for the slow decay
+    of the singular values)
+    :return: the approximate reconstruction from the index largest singular
+    values
+    """
+    H, W = x.shape[-2:]
+    rank = min(index + oversample, H, W)
+    omega = torch.randn(*x.shape[:-2], W, rank, dtype=x.dtype,
+                        device=x.device)
+    x_t = x.transpose(-2, -1)
+    q, _ = batch_qr(torch.matmul(x, omega))
+    for _ in range(power_iters):
+        q, _ = batch_qr(torch.matmul(x_t, q))
+        q, _ = batch_qr(torch.matmul(x, q))
+    b = torch.matmul(q.transpose(-2, -1), x)
+    return torch.matmul(q, low_rank_svd(b, index=index))
+
+
+def compress_svd_batch(x, compress_rate, svd_type='full', iters=10):
+    """
+    Batched SVD compression of all the images and channels at once.
+
+    :param x: the input images (N, C, H, W)
+    :param compress_rate: the percentage of the singular values to remove
+    :param svd_type: full - the exact (batched) svd, randomized - the
+    randomized low rank svd (much faster for large images)
+    :param iters: the number of attempts for the images for which the svd does
+    not converge (the image is returned uncompressed after the last attempt)
+    :return: the compressed images
+    """
+    H, W = x.shape[-2:]
+    index = get_svd_rank(H=H, W=W, compress_rate=compress_rate)
+    if index >= min(H, W):
+        return x.clone()
+    if svd_type == 'full':
+        low_rank = low_rank_svd
+    elif svd_type == 'randomized':
+        low_rank = low_rank_randomized_svd
+    else:
+        raise Exception(f"Unknown svd_type: {svd_type}")
+
+    try:
+        result = low_rank(x, index=index)
+        failed = ~torch.isfinite(result.view(result.shape[0], -1)).all(dim=1)
+    except RuntimeError as ex:
+        print("SVD compression problem for the batch: ", ex)
+        result = x.clone()
+        failed = torch.ones(x.shape[0], dtype=torch.bool, device=x.device)
+
+    # Fall back to the per image svd only for the images that failed.
+    for i in failed.nonzero().view(-1).tolist():
+        result[i] = x[i]
+        for j in range(iters):
+            try:
+                compress_img = low_rank(x[i], index=index)
+                if torch.isfinite(compress_img).all():
+                    result[i] = compress_img
+                    break
+            except RuntimeError as ex:
+                msg = "SVD compression problem: ", ex, " image: ", i, \
+                      " iteration: ", j
+                print(msg)
     return result
 
 
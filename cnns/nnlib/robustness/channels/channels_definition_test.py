@@ -7,9 +7,17 @@ from torch import tensor
 from cnns.nnlib.utils.log_utils import get_logger
 from cnns.nnlib.utils.log_utils import set_up_logging
 from cnns.nnlib.utils.arguments import Arguments
-from numpy.testing.utils import assert_allclose
+from numpy.testing import assert_allclose
 from cnns.nnlib.robustness.channels.channels_definition import \
     svd_transformation
+from cnns.nnlib.robustness.channels.channels_definition import \
+    compress_svd_batch
+from cnns.nnlib.robustness.channels.channels_definition import FFTSpectrum
+from cnns.nnlib.robustness.channels.channels_definition import fft_channel
+from cnns.nnlib.robustness.channels.channels_definition import \
+    fft_zero_values
+from cnns.nnlib.robustness.channels.channels_definition import \
+    fft_zero_low_magnitudes
 
 
 class TestChannelsDefinition(unittest.TestCase):
@@ -45,7 +53,7 @@ class TestChannelsDefinition(unittest.TestCase):
         print('zero-out a: ', a)
 
     def testSVDnumpyReconstructTorch(self):
-        a = np.arange(9).reshape(1, 3, 3).astype(np.float)
+        a = np.arange(9).reshape(1, 3, 3).astype(np.float64)
         print('a: ', a)
         a_svd = svd_transformation(input=a, compress_rate=101)
         u = a_svd['u']
@@ -72,7 +80,7 @@ class TestChannelsDefinition(unittest.TestCase):
         assert_allclose(actual=x, desired=a, rtol=1e-6, atol=1e-12)
 
     def testSVDnumpyReconstructTorchBatchMatrixMultiply(self):
-        a = np.arange(9).reshape(1, 3, 3).astype(np.float)
+        a = np.arange(9).reshape(1, 3, 3).astype(np.float64)
         print('a: ', a)
         a_svd = svd_transformation(input=a, compress_rate=101)
         u = a_svd['u']
@@ -99,7 +107,7 @@ class TestChannelsDefinition(unittest.TestCase):
         assert_allclose(actual=x, desired=a, rtol=1e-6, atol=1e-12)
 
     def testSVDnumpyReconstructTorchBatchMatrixMultiplyManyChannels(self):
-        a = np.arange(27).reshape(3, 3, 3).astype(np.float)
+        a = np.arange(27).reshape(3, 3, 3).astype(np.float64)
         print('a: ', a)
         a_svd = svd_transformation(input=a, compress_rate=101)
         u = a_svd['u']
@@ -129,7 +137,7 @@ class TestChannelsDefinition(unittest.TestCase):
         assert_allclose(actual=x, desired=desired, rtol=1e-6, atol=1e-12)
 
     def testSVDnumpyReconstructTorchBatchMatrixMultiplyManyChannelsMatmul(self):
-        a = np.arange(27).reshape(3, 3, 3).astype(np.float)
+        a = np.arange(27).reshape(3, 3, 3).astype(np.float64)
         print('a: ', a)
         a_svd = svd_transformation(input=a, compress_rate=101)
         u = a_svd['u']
@@ -155,3 +163,63 @@ class TestChannelsDefinition(unittest.TestCase):
         print('x: ', x)
         desired = np.sum(a, axis=0, keepdims=True)
         assert_allclose(actual=x, desired=desired, rtol=1e-6, atol=1e-12)
+
+    def testCompressSVDBatch(self):
+        x = torch.randn(3, 2, 16, 16, dtype=torch.double)
+        compress_rate = 75
+        index = 4
+        result = compress_svd_batch(x=x, compress_rate=compress_rate)
+        for n in range(x.shape[0]):
+            for c in range(x.shape[1]):
+                u, s, v = torch.svd(x[n, c])
+                desired = u[:, :index] @ torch.diag(s[:index]) @ v[:,
+                                                                 :index].t()
+                assert_allclose(actual=result[n, c], desired=desired,
+                                rtol=1e-6, atol=1e-10)
+
+    def testCompressSVDBatchRandomized(self):
+        # The randomized svd is exact for the images of low rank.
+        u = torch.randn(2, 3, 32, 8, dtype=torch.double)
+        v = torch.randn(2, 3, 8, 32, dtype=torch.double)
+        x = u @ v
+        # Retain 4 singular values.
+        compress_rate = 87.5
+        desired = compress_svd_batch(x=x, compress_rate=compress_rate)
+        result = compress_svd_batch(x=x, compress_rate=compress_rate,
+                                    svd_type='randomized')
+        assert_allclose(actual=result, desired=desired, rtol=1e-6, atol=1e-8)
+        self.assertFalse(torch.allclose(result, x))
+        result = compress_svd_batch(x=x, compress_rate=0)
+        assert_allclose(actual=result, desired=x)
+
+    def testFFTSpectrumCompress(self):
+        x = torch.randn(2, 3, 16, 16, dtype=torch.double)
+        compress_rates = [0, 25, 50, 90]
+        spectrum = FFTSpectrum(input=x)
+        result = spectrum.compress(compress_rates=compress_rates)
+        self.assertEqual(result.shape, (4, 2, 3, 16, 16))
+        for i, compress_rate in enumerate(compress_rates):
+            desired = fft_channel(input=x, compress_rate=compress_rate)
+            assert_allclose(actual=result[i], desired=desired, rtol=1e-6,
+                            atol=1e-10)
+
+    def testFFTSpectrumThresholdsAndPredictions(self):
+        x = torch.randn(2, 3, 16, 16, dtype=torch.double)
+        highs = [1.0, 2.0, 4.0]
+        lows = [0.5, 0.5, 1.0]
+        spectrum = FFTSpectrum(input=x, is_next_power2=True)
+        net = torch.nn.Sequential(torch.nn.Flatten(),
+                                  torch.nn.Linear(3 * 16 * 16, 10)).double()
+        values, preds = spectrum.zero_values(highs=highs, lows=lows, net=net,
+                                             batch_size=4)
+        magnitudes = spectrum.zero_low_magnitudes(highs=highs, lows=lows)
+        self.assertEqual(preds.shape, (3, 2))
+        for i in range(len(highs)):
+            assert_allclose(
+                actual=values[i], rtol=1e-6, atol=1e-10,
+                desired=fft_zero_values(input=x, high=highs[i], low=lows[i]))
+            assert_allclose(
+                actual=magnitudes[i], rtol=1e-6, atol=1e-10,
+                desired=fft_zero_low_magnitudes(input=x, high=highs[i],
+                                                low=lows[i]))
+            self.assertTrue(torch.equal(preds[i], net(values[i]).argmax(1)))
@@ -7,18 +7,17 @@ import torch.optim as optim
 import time
 import numpy as np
 from cnns.nnlib.robustness.fast_attack.data_saver import DataSaver
+from cnns.nnlib.robustness.adaptive_ensemble import adaptive_ensemble_infer
+from cnns.nnlib.robustness.channels.channel_pipeline import ChannelPipeline
+from cnns.nnlib.robustness.adversarial_store import AdversarialStore
+from cnns.nnlib.robustness.adversarial_store import attack_with_store
+from cnns.nnlib.robustness.adversarial_store import get_attack_params
+from cnns.nnlib.robustness.adversarial_store import get_sample_indices
 from cnns.nnlib.robustness.fast_attack.eot_pgd import EOT_PGD
 from cnns.nnlib.robustness.fast_attack.eot_cw import EOT_CW
-from cnns.nnlib.robustness.fast_attack.channels import fft_channel
-from cnns.nnlib.robustness.fast_attack.channels import round
+from cnns.nnlib.robustness.batch_attack.cw import CW
 from cnns.nnlib.robustness.fast_attack.channels import gauss_noise_torch
-from cnns.nnlib.robustness.fast_attack.channels import uniform_noise_torch
-from cnns.nnlib.robustness.fast_attack.channels import compress_svd_batch
-from cnns.nnlib.robustness.fast_attack.channels import laplace_noise_torch
-from cnns.nnlib.robustness.fast_attack.complex_mask import \
-    get_inverse_hyper_mask
-from cnns.nnlib.robustness.fast_attack.channels import subtract_rgb
-from cnns.nnlib.robustness.fast_attack.nattack import nattack
+from cnns.nnlib.robustness.fast_attack.nattack import nattack_batch
 from cnns.nnlib.robustness.fast_attack.nattack import \
     iterations as nattack_iterations
 from cnns.nnlib.robustness.fast_attack.nattack import npop as nattack_population
@@ -38,15 +37,8 @@ def nattack_wrapper(input_v, label_v, net, c=None, opt=None):
         iterations = nattack_iterations
         population = nattack_population
 
-    adv_imgs = torch.zeros_like(input_v)
-    device = input_v.device
-    for i, (input, label) in enumerate(zip(input_v, label_v)):
-        adv_img = nattack(input=input, target=label, model=net,
-                          iterations=iterations, population=population)
-        if adv_img is not None:
-            adv_imgs[i] = adv_img.to(device)
-        else:
-            adv_imgs[i] = input
+    adv_imgs, _ = nattack_batch(input=input_v, target=label_v, model=net,
+                                iterations=iterations, population=population)
     return adv_imgs
 
 
@@ -62,7 +54,31 @@ def attack_eot_cw(input_v, label_v, net, c, opt, untarget=True, n_class=10):
     return adverse_v
 
 
+def attack_cw_search(input, label, net, c, args, untarget=True):
+    """
+    The C&W attack with the binary search over the constant c (starting from
+    c) run for each sample of the batch concurrently.
+
+    :return: the best (smallest L2) adversarial examples (or the input images
+    if not found), normalized
+    """
+    net.eval()
+
+    def model(images):
+        return net(args.normalizer(images))
+
+    cw = CW(model=model, binary_search_steps=args.cw_binary_search_steps,
+            max_iterations=args.attack_max_iterations,
+            initial_const=c,
+            targeted=not untarget, gradient_iters=args.gradient_iters)
+    adverse_01, _, _ = cw.attack(args.denormalizer(input), label)
+    return args.normalizer(adverse_01)
+
+
 def attack_cw(input, label, net, c, args, untarget=True):
+    if args.cw_binary_search_steps > 0:
+        return attack_cw_search(input=input, label=label, net=net, c=c,
+                                args=args, untarget=untarget)
     net.eval()
     # net.train()
     index = label.cpu().view(-1, 1)
@@ -153,14 +169,18 @@ def attack_rand_fgsm(input_v, label_v, net, epsilon):
 
 
 # Ensemble by sum of probability
-def ensemble_infer(input_v, net, n=50, nclass=10):
-    net.eval()
-    batch_size = input_v.size()[0]
-    softmax = nn.Softmax()
-    prob = torch.zeros(batch_size, nclass).to(args.device)
-    for i in range(n):
-        prob += softmax(net(input_v))
-    _, pred = torch.max(prob, 1)
+def ensemble_infer(input_v, net, n=50, nclass=10, alpha=0.0, min_passes=5,
+                   return_passes=False):
+    """
+    Sum the softmax outputs from n passes of the randomized net. With
+    alpha > 0, stop the passes for the samples whose top class is settled
+    (see adaptive_ensemble_infer).
+    """
+    pred, passes = adaptive_ensemble_infer(
+        input=input_v, net=net, n=n, nclass=nclass, alpha=alpha,
+        min_passes=min_passes)
+    if return_passes:
+        return pred, passes
     return pred
 
 
@@ -168,12 +188,36 @@ def to_numpy(tensor):
     return tensor.clone().detach().cpu().numpy()
 
 
+def get_adversarial_store(attack_f, c, args):
+    """
+    :return: the store of the adversarial examples for the attack or None if
+    the store is disabled (args.adv_store_dir is empty)
+    """
+    if not args.adv_store_dir:
+        return None
+    params = get_attack_params(
+        args=args, names=['attack_max_iterations', 'attack_iters',
+                          'gradient_iters', 'nattack_population',
+                          'eot_sample_size', 'eot_sampling',
+                          'cw_binary_search_steps'],
+        channel=args.recover_type, channel_param=args.noise_epsilon)
+    params['c'] = c
+    return AdversarialStore(root=args.adv_store_dir, dataset=args.dataset,
+                            model=args.model_path, attack=attack_f.__name__,
+                            params=params)
+
+
 def acc_under_attack(dataloader, net, c, attack_f, args, netAttack=None):
     correct = 0
     tot = 0
     distort_l2 = 0.0
     distort_linf = 0.0
+    ensemble_passes = 0
     data_saver = DataSaver(dataset=args.dataset)
+    channel = ChannelPipeline(spec=args.recover_type, param=args.noise_epsilon,
+                              bounds=(args.min, args.max),
+                              timing=args.channel_timing)
+    store = get_adversarial_store(attack_f=attack_f, c=c, args=args)
 
     for k, (input, labels) in enumerate(dataloader):
         beg = time.time()
@@ -182,45 +226,21 @@ def acc_under_attack(dataloader, net, c, attack_f, args, netAttack=None):
         if netAttack is None:
             netAttack = net
 
-        adv = attack_f(input, labels, netAttack, c, args)
+        adv = attack_with_store(
+            store=store, indices=get_sample_indices(
+                dataloader, k, len(input)) if store else None,
+            input=input, labels=labels,
+            attack_fn=lambda x, y: attack_f(x, y, netAttack, c, args))
         # print('min max adverse: ', adverse.min().item(), adverse.max().item())
-        bounds = (args.min, args.max)
-        if args.recover_type == 'empty':
-            pass
-        elif args.recover_type == 'gauss':
-            adv += gauss_noise_torch(epsilon=args.noise_epsilon,
-                                     images=adv, bounds=bounds)
-        elif args.recover_type == 'round':
-            adv = round(values_per_channel=args.noise_epsilon,
-                        images=adv)
-        elif args.recover_type == 'fft':
-            adv = fft_channel(input=adv,
-                              compress_rate=args.noise_epsilon)
-        elif args.recover_type == 'uniform':
-            adv += uniform_noise_torch(epsilon=args.noise_epsilon,
-                                       images=adv,
-                                       bounds=bounds)
-        elif args.recover_type == 'laplace':
-            adv += laplace_noise_torch(epsilon=args.noise_epsilon,
-                                       images=adv,
-                                       bounds=bounds)
-        elif args.recover_type == 'svd':
-            adv = compress_svd_batch(x=adv,
-                                     compress_rate=args.noise_epsilon)
-        elif args.recover_type == 'inv_fft':
-            adv = fft_channel(input=adv,
-                              compress_rate=args.noise_epsilon,
-                              get_mask=get_inverse_hyper_mask)
-        elif args.recover_type == 'sub_rgb':
-            adv = subtract_rgb(images=adv,
-                               subtract_value=args.noise_epsilon)
-        else:
-            raise Exception(f'Unknown recover_type: {args.recover_type}')
+        adv = channel(adv)
         # defense
         net.eval()
         adverse_torch = args.normalizer(adv)
         if args.ensemble > 1:
-            idx = ensemble_infer(adverse_torch, net, n=50)
+            idx, passes = ensemble_infer(
+                adverse_torch, net, n=50, alpha=args.ensemble_alpha,
+                min_passes=args.ensemble_min_passes, return_passes=True)
+            ensemble_passes += passes.sum().item()
         else:
             logits = net(adverse_torch)
             _, idx = torch.max(logits, dim=1)
@@ -249,6 +269,10 @@ def acc_under_attack(dataloader, net, c, attack_f, args, netAttack=None):
 
     data_saver.save_adv_org()
 
+    if args.ensemble > 1:
+        print('average ensemble passes per sample: ', ensemble_passes / tot)
+    if args.channel_timing:
+        print('channel timings (sec): ', channel.get_timings_str())
     return correct / tot, distort_l2 / tot, distort_linf / tot
 
 
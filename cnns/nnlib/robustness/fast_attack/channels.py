@@ -1,7 +1,12 @@
 import torch
 import numpy as np
 from cnns.nnlib.robustness.fast_attack.complex_mask import get_hyper_mask
+from cnns.nnlib.utils.complex_mask import get_cached_mask
+from cnns.nnlib.robustness.channels.channels_definition import \
+    compress_svd_batch as compress_svd_batch_all
 from cnns.nnlib.utils.general_utils import next_power2
+from cnns.nnlib.pytorch_layers.complex_spectral import irfft_pairs
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 from torch.nn.functional import pad as torch_pad
 from torch.distributions.laplace import Laplace
 
@@ -43,7 +48,7 @@ def fft_channel(input, compress_rate, val=0, get_mask=get_hyper_mask,
     else:
         H_fft = H
         W_fft = W
-    xfft = torch.rfft(input,
+    xfft = rfft_pairs(input,
                       signal_ndim=2,
                       onesided=onesided)
     del input
@@ -51,16 +56,14 @@ def fft_channel(input, compress_rate, val=0, get_mask=get_hyper_mask,
     _, _, H_xfft, W_xfft, _ = xfft.size()
     # assert H_fft == W_xfft, "The input tensor has to be squared."
 
-    mask, _ = get_mask(H=H_xfft, W=W_xfft,
-                       compress_rate=compress_rate,
-                       val=val, interpolate='const',
-                       onesided=onesided)
-    mask = mask[:, 0:W_xfft, :]
-    # print(mask)
-    mask = mask.to(xfft.dtype).to(xfft.device)
+    mask = get_cached_mask(H=H_xfft, W=W_xfft,
+                           compress_rate=compress_rate,
+                           val=val, interpolate='const',
+                           onesided=onesided, get_mask=get_mask,
+                           dtype=xfft.dtype, device=xfft.device)
     xfft = xfft * mask
 
-    out = torch.irfft(input=xfft,
+    out = irfft_pairs(input=xfft,
                       signal_ndim=2,
                       signal_sizes=(H_fft, W_fft),
                       onesided=onesided)
@@ -146,11 +149,7 @@ def compress_svd_numpy(numpy_array, compress_rate):
 
 
 def compress_svd_batch(x, compress_rate):
-    result = torch.zeros_like(x)
-    for i, torch_img in enumerate(x):
-        result[i] = compress_svd(torch_img=torch_img,
-                                 compress_rate=compress_rate)
-    return result
+    return compress_svd_batch_all(x=x, compress_rate=compress_rate)
 
 
 def distort_svd(torch_img, distort_rate):
@@ -0,0 +1,45 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from cnns.nnlib.robustness.fast_attack.data_saver import DataSaver
+
+
+class TestDataSaver(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def test_save_adv_org(self):
+        saver = DataSaver(dataset='cifar10')
+        for labels in [[0, 1], [2]]:
+            images = np.ones((len(labels), 3, 2, 2)) * labels[0]
+            saver.add_data(adv_images=images, adv_labels=np.array(labels),
+                           org_images=images + 1, org_labels=np.array(labels))
+        saver.save_adv_org()
+        file_names = sorted(os.listdir(self.dir))
+        self.assertEqual(len(file_names), 2)
+        for file_name in file_names:
+            self.assertIn('-len-3-', file_name)
+            with open(file_name, 'rb') as f:
+                data = pickle.load(f)
+            self.assertEqual(data['images'].shape, (3, 3, 2, 2))
+            np.testing.assert_equal(data['labels'], [0, 1, 2])
+
+    def test_save_empty(self):
+        # No batch was added (e.g. no adversarial was found).
+        DataSaver(dataset='cifar10').save_adv_org()
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import numpy as np
 import torch
-import cv2
+import torch.nn.functional as F
+from cnns.nnlib.utils.general_utils import get_free_memory
 
 # npop = 300  # population size
 npop = 100  # population size
@@ -18,165 +19,266 @@ epsilon = 1e-30
 
 iterations = 500
 
-
-def softmax(x):
-    return np.divide(np.exp(x), np.sum(np.exp(x), -1, keepdims=True))
+# The approximate memory of the forward pass per byte of the input image.
+activation_factor = 64
 
 
 def torch_arctanh(x, eps=1e-6):
-    x *= (1. - eps)
-    return (np.log((1 + x) / (1 - x))) * 0.5
-
-
-default_mean_array = np.array([0.0, 0.0, 0.0], dtype=np.float32).reshape((3, 1, 1))
-default_std_array = np.array([1.0, 1.0, 1.0], dtype=np.float32).reshape((3, 1, 1))
+    x = x * (1. - eps)
+    return (torch.log((1 + x) / (1 - x))) * 0.5
 
 
 def clipping(realdist, dist_type):
+    """
+    :param realdist: the distortions (N, C, H, W)
+    :param dist_type: Linf or L2 (the L2 norm of each distortion is bounded)
+    :return: the clipped distortions
+    """
     if dist_type == "Linf":
-        realclipdist = np.clip(realdist, -epsi_inf, epsi_inf)
+        realclipdist = torch.clamp(realdist, -epsi_inf, epsi_inf)
     elif dist_type == "L2":
-        l2_realdist = np.sqrt(np.sum(np.square(realdist)))
-        if l2_realdist > epsi_l2:
-            realclipdist = realdist * epsi_l2 / l2_realdist
-        else:
-            realclipdist = realdist.copy()
+        l2_realdist = realdist.flatten(1).norm(dim=1).view(-1, 1, 1, 1)
+        realclipdist = realdist * torch.clamp(
+            epsi_l2 / (l2_realdist + epsilon), max=1.0)
     else:
         raise Exception(f'Unknown dist_type: {dist_type}')
     return realclipdist
 
 
-def nattack(input, target, model, means=default_mean_array,
-            stds=default_std_array, is_channel_last=False,
-            iterations=iterations, is_debug=True, dataset='cifar10',
-            population=npop, dist_type='Linf'):
-    # Nattack as input receives images with value range: [0, 1].
-    # input = input * stds + means
-    input = input.detach().cpu().numpy()
-    if is_channel_last:
-        H, W, C = input.shape
-    else:
-        C, H, W = input.shape
-
-    if torch.cuda.is_available():
-        device = torch.device('cuda')
-    else:
-        device = torch.device('cpu')
-    # Distribution of mean 0 and variance 1 , then multiplied by 0.001.
-    modify = np.random.randn(1, C, H, W) * 0.001
-    for runstep in range(iterations):
-        Nsample = np.random.randn(npop, C, H, W)
-
-        # Step 1: draws a 'seed' z and then maps it by g_0(z) to the space of
-        # the same dimension as the input x. For cifar-10 z lies in the space of
-        # images and g_0(x) is an identity function.
+def get_chunk_size(device, image, chunk_size=0):
+    """
+    :param device: the device of the model
+    :param image: a single image (C, H, W)
+    :param chunk_size: the number of the images in a forward pass, 0 - fit
+    the chunk to a half of the free GPU memory
+    :return: the number of the images in a forward pass (None - no chunks)
+    """
+    if chunk_size > 0:
+        return chunk_size
+    free_memory = get_free_memory(torch.device(device))
+    if free_memory is None:
+        return None
+    sample_memory = image.numel() * image.element_size() * activation_factor
+    return max(1, free_memory // 2 // sample_memory)
+
+
+def get_probs(model, images, chunk_size=None):
+    """
+    :return: the softmax of the model for the images computed in chunks
+    """
+    if chunk_size is None or chunk_size >= images.size(0):
+        return F.softmax(model(images), dim=-1)
+    return torch.cat(
+        [F.softmax(model(chunk), dim=-1) for chunk in
+         torch.split(images, chunk_size)])
+
+
+def upsample(modify, size):
+    """
+    Map the seeds z to the space of the input image with g_0(z): identity if
+    the seeds have the size of the image, otherwise a (batched) bi-linear
+    interpolation.
+    """
+    if tuple(modify.shape[-2:]) == tuple(size):
+        return modify
+    return F.interpolate(modify, size=size, mode='bilinear',
+                         align_corners=False)
+
+
+def get_population_losses(model, newimg, baseimg, modify, target,
+                          population, generator, sigma=sigma,
+                          dist_type='Linf', chunk_size=None):
+    """
+    Sample the population of the seeds z around the means modify and compute
+    the losses of the population images. The population of all the images
+    is processed in chunks: only a chunk of the samples is held in the memory
+    (in the seed and in the image space).
+
+    :param newimg: the images in the arctanh space (A, C, H, W)
+    :param baseimg: the images (A, C, H, W)
+    :param modify: the means of the seeds (A, C, h, w)
+    :param target: the correct labels (A)
+    :param generator: the generator of the population samples
+    :param chunk_size: the number of the images in a forward pass (None - the
+    whole population in a single pass)
+    :return: the losses of the population (A, population)
+    """
+    A, C, h, w = modify.size()
+    H, W = newimg.size()[-2:]
+    rows = A * population
+    if chunk_size is None:
+        chunk_size = rows
+    losses = []
+    for start in range(0, rows, chunk_size):
+        stop = min(start + chunk_size, rows)
+        # The indexes of the images of the population samples.
+        index = torch.arange(start, stop, device=modify.device) // population
+        Nsample = torch.randn(stop - start, C, h, w, device=modify.device,
+                              generator=generator)
+
+        # Step 1: draws a 'seed' z and then maps it by g_0(z) to the space
+        # of the same dimension as the input x. For cifar-10 z lies in the
+        # space of images and g_0(x) is an identity function.
         # For ImageNet, it is a bi-linear interpolation.
-        modify_try = modify.repeat(npop, 0) + sigma * Nsample
-
-        num_classes = 10
-        if dataset == 'imagenet':
-            num_classes = 1000
-            temp = []
-            for x in modify_try:
-                temp.append(cv2.resize(x.transpose(1, 2, 0), dsize=(H, W),
-                                       interpolation=cv2.INTER_LINEAR).transpose(
-                    2, 0, 1))
-            modify_try = np.array(temp)
-
-        newimg = torch_arctanh((input - boxplus) / boxmul)
-
-        if is_channel_last:
-            newimg = newimg.transpose(2, 0, 1)
-        # print('newimg', newimg,flush=True)
+        modify_try = upsample(modify[index] + sigma * Nsample, size=(H, W))
 
         # tanh(x) in [-1, +1]
         # g(z) = tanh(g_0(z)) * 0.5 + 0.5
-        inputimg = np.tanh(newimg + modify_try) * boxmul + boxplus
-        if runstep % 10 == 0:
-            if dataset == 'imagenet':
-                temp = []
-                for x in modify:
-                    temp.append(
-                        cv2.resize(x.transpose(1, 2, 0), dsize=(H, W),
-                                   interpolation=cv2.INTER_LINEAR).transpose(2,
-                                                                             0,
-                                                                             1))
-                modify_test = np.array(temp)
-            else:
-                modify_test = modify
-            realinputimg = np.tanh(newimg + modify_test) * boxmul + boxplus
-            realdist = realinputimg - (np.tanh(newimg) * boxmul + boxplus)
-            realclipdist = clipping(realdist=realdist, dist_type=dist_type)
-            # print('realclipdist :', realclipdist, flush=True)
-            realclipinput = realclipdist + (
-                    np.tanh(newimg) * boxmul + boxplus)
-            l2real = np.sum((realclipinput - (
-                    np.tanh(newimg) * boxmul + boxplus)) ** 2) ** 0.5
-            # l2real =  np.abs(realclipinput - inputs.numpy())
-            # print('inputs shape: ', input.shape)
-            # outputsreal = model(realclipinput.transpose(0,2,3,1)).data.cpu().numpy()
-
-            # Adjust the input to the PyTorch model.
-            # realclipinput = (realclipinput - means) / stds
-            realclipinput = realclipinput.astype('float32')
-            input_var = torch.from_numpy(realclipinput).to(device)
-
-            # (input_var - means) / stds)
-            # outputsreal = model((input_var - means) / stds).data.cpu().numpy()[0]
-            outputsreal = model(input_var).data.cpu().numpy()[0]
-            outputsreal = softmax(outputsreal)
-            # print(outputsreal)
-            if is_debug:
-                print('correct label: ', target)
-                print('probs ', np.sort(outputsreal)[-1:-6:-1])
-                print('target label ', np.argsort(outputsreal)[-1:-6:-1])
-                print('negative_probs ', np.sort(outputsreal)[0:3:1])
-
-            if (np.argmax(outputsreal) != target) and (
-                    np.abs(realclipdist).max() <= epsi_inf):
-                print('Found adversarial example.')
-                # success = True
-                # break
-                # return realclipinput.squeeze()
-                return input_var.squeeze()
-                # imsave(folder+classes[targets[0]]+'_'+str("%06d" % batch_idx)+'.jpg',inputs.transpose(1,2,0))
-        dist = inputimg - (np.tanh(newimg) * boxmul + boxplus)
-        clipdist = clipping(realdist=dist, dist_type=dist_type)
-        clipinput = (clipdist + (
-                np.tanh(newimg) * boxmul + boxplus)).reshape(npop, C, H, W)
-        target_onehot = np.zeros((1, num_classes))
-
-        target_onehot[0][target] = 1.
-        clipinput = np.squeeze(clipinput)
-        clipinput = np.asarray(clipinput, dtype='float32')
-
-        # Adjust the input to the PyTorch model.
-        # clipinput = (clipinput - means) / stds
-        input_var = torch.from_numpy(clipinput).to(device)
-        # outputs = model(clipinput.transpose(0,2,3,1)).data.cpu().numpy()
-        # outputs = model((input_var - means) / stds).data.cpu().numpy()
-        outputs = model(input_var).data.cpu().numpy()
-        outputs = softmax(outputs)
-
-        target_onehot = target_onehot.repeat(npop, 0)
-
-        real = np.log((target_onehot * outputs).sum(1) + epsilon)
-        other = np.log(
+        inputimg = torch.tanh(newimg[index] + modify_try) * boxmul + boxplus
+        dist = inputimg - baseimg[index]
+        clipinput = clipping(realdist=dist, dist_type=dist_type) + \
+                    baseimg[index]
+        outputs = F.softmax(model(clipinput), dim=-1)
+        target_onehot = F.one_hot(
+            target[index], num_classes=outputs.size(1)).to(outputs.dtype)
+
+        real = torch.log((target_onehot * outputs).sum(1) + epsilon)
+        other = torch.log(
             ((1. - target_onehot) * outputs - target_onehot * 10000.).max(
                 1)[0] + epsilon)
 
-        loss1 = np.clip(real - other, 0., 1000)
-
-        Reward = 0.5 * loss1
-        # Reward = l2dist
-
-        Reward = -Reward
-
-        A = (Reward - np.mean(Reward)) / (np.std(Reward) + 1e-7)
-
-        modify = modify + (alpha / (npop * sigma)) * (
-            (np.dot(Nsample.reshape(npop, -1).T, A)).reshape(C, H, W))
-
-    print('An adversarial example has not been found.')
-    return None
-
+        losses.append(torch.clamp(real - other, 0., 1000))
+    return torch.cat(losses).view(A, population)
+
+
+def get_population_step(weights, modify, generator, chunk_size=None):
+    """
+    Re-sample the same population (the generator is in the state from before
+    get_population_losses) and sum the samples weighted by the normalized
+    rewards, chunk by chunk.
+
+    :param weights: the normalized rewards (A, population)
+    :param modify: the means of the seeds (A, C, h, w)
+    :return: the weighted sums of the samples for each image (A, C, h, w)
+    """
+    A, population = weights.size()
+    rows = A * population
+    if chunk_size is None:
+        chunk_size = rows
+    weights = weights.reshape(-1, 1)
+    step = torch.zeros(A, modify[0].numel(), dtype=modify.dtype,
+                       device=modify.device)
+    for start in range(0, rows, chunk_size):
+        stop = min(start + chunk_size, rows)
+        index = torch.arange(start, stop, device=modify.device) // population
+        Nsample = torch.randn(stop - start, *modify.size()[1:],
+                              device=modify.device, generator=generator)
+        step.index_add_(0, index, weights[start:stop] * Nsample.flatten(1))
+    return step.view_as(modify)
+
+
+def nattack_batch(input, target, model, iterations=iterations,
+                  population=npop, dist_type='Linf', sigma=sigma,
+                  alpha=alpha, seed_size=None, chunk_size=0, is_debug=False):
+    """
+    N-Attack of a batch of images on the device of the images.
+
+    The population of all the images in the work set is sampled with torch
+    and evaluated by the model in chunks that fit into the memory (the same
+    chunk size for the sampling, the mapping to the image space and the
+    forward pass), so the population is never held in the memory at once.
+    The samples of a chunk are drawn again (from the same generator state) for
+    the update of the means. The images for which an adversarial example is
+    found are removed from the work set (the test for the success is run
+    every 10 iterations, as in nattack).
+
+    :param input: the images in the range [0, 1] (N, C, H, W)
+    :param target: the correct labels (N)
+    :param model: the model that takes the images in the range [0, 1]
+    :param population: the size of the population for each image
+    :param seed_size: the size (h, w) of the seeds z, by default the size of
+    the image (the original N-Attack uses (32, 32) for ImageNet)
+    :param chunk_size: the number of the images in a forward pass, 0 - fit
+    the chunk to the free GPU memory
+    :return: the adversarial images (the input images if the attack failed)
+    and the success mask (N)
+    """
+    device = input.device
+    N, C, H, W = input.size()
+    if seed_size is None:
+        seed_size = (H, W)
+    h, w = seed_size
+    target = target.to(device)
+    chunk_size = get_chunk_size(device=device, image=input[0],
+                                chunk_size=chunk_size)
+    adv = input.detach().clone()
+    success = torch.zeros(N, dtype=torch.bool, device=device)
+    newimg = torch_arctanh((input.detach() - boxplus) / boxmul)
+    baseimg = torch.tanh(newimg) * boxmul + boxplus
+    # Distribution of mean 0 and variance 1 , then multiplied by 0.001.
+    modify = torch.randn(N, C, h, w, device=device) * 0.001
+    # The population samples are drawn twice from the same generator state.
+    generator = torch.Generator(device=device)
+    generator.manual_seed(torch.randint(2 ** 62, size=(1,)).item())
+    active = torch.arange(N, device=device)
+    with torch.no_grad():
+        for runstep in range(iterations):
+            if runstep % 10 == 0:
+                realinputimg = torch.tanh(
+                    newimg + upsample(modify, size=(H, W))) * boxmul + boxplus
+                realclipdist = clipping(realdist=realinputimg - baseimg,
+                                        dist_type=dist_type)
+                realclipinput = realclipdist + baseimg
+                outputsreal = get_probs(model, realclipinput,
+                                        chunk_size=chunk_size)
+                done = (outputsreal.argmax(dim=1) != target) & (
+                        realclipdist.flatten(1).abs().max(
+                            dim=1)[0] <= epsi_inf)
+                adv[active[done]] = realclipinput[done]
+                success[active[done]] = True
+                active = active[~done]
+                newimg = newimg[~done]
+                baseimg = baseimg[~done]
+                modify = modify[~done]
+                target = target[~done]
+                if is_debug:
+                    print(f'step: {runstep}, active images: {len(active)}')
+                if len(active) == 0:
+                    break
+            generator_state = generator.get_state()
+            loss1 = get_population_losses(
+                model=model, newimg=newimg, baseimg=baseimg, modify=modify,
+                target=target, population=population, generator=generator,
+                sigma=sigma, dist_type=dist_type, chunk_size=chunk_size)
+
+            Reward = -0.5 * loss1
+            A_norm = (Reward - Reward.mean(dim=1, keepdim=True)) / (
+                    Reward.std(dim=1, unbiased=False, keepdim=True) + 1e-7)
+
+            generator.set_state(generator_state)
+            modify = modify + (alpha / (population * sigma)) * \
+                     get_population_step(weights=A_norm, modify=modify,
+                                         generator=generator,
+                                         chunk_size=chunk_size)
+    if is_debug and len(active) > 0:
+        print(f'An adversarial example has not been found for '
+              f'{len(active)} images.')
+    return adv, success
+
+
+def nattack(input, target, model, means=None, stds=None,
+            is_channel_last=False, iterations=iterations, is_debug=True,
+            dataset='cifar10', population=npop, dist_type='Linf'):
+    """
+    N-Attack of a single image (C, H, W) in the range [0, 1].
+
+    :return: the adversarial image or None if it has not been found
+    """
+    # Nattack as input receives images with value range: [0, 1].
+    input = torch.as_tensor(input)
+    if is_channel_last:
+        input = input.permute(2, 0, 1)
+    if torch.cuda.is_available():
+        device = torch.device('cuda')
+    else:
+        device = torch.device('cpu')
+    adv, success = nattack_batch(
+        input=input.unsqueeze(0).to(device),
+        target=torch.as_tensor(target).view(1), model=model,
+        iterations=iterations, population=population, dist_type=dist_type,
+        is_debug=is_debug)
+    if not success.item():
+        print('An adversarial example has not been found.')
+        return None
+    print('Found adversarial example.')
+    return adv.squeeze(0)
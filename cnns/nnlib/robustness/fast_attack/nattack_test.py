@@ -0,0 +1,75 @@
+import unittest
+import torch
+
+from cnns.nnlib.robustness.fast_attack.nattack import clipping
+from cnns.nnlib.robustness.fast_attack.nattack import epsi_inf
+from cnns.nnlib.robustness.fast_attack.nattack import epsi_l2
+from cnns.nnlib.robustness.fast_attack.nattack import nattack
+from cnns.nnlib.robustness.fast_attack.nattack import nattack_batch
+
+
+class TestNattack(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(),
+                                         torch.nn.Linear(3 * 8 * 8, 4))
+        self.images = torch.rand(5, 3, 8, 8)
+        self.labels = self.model(self.images).argmax(dim=1).detach()
+
+    def test_clipping(self):
+        dist = torch.randn(4, 3, 8, 8)
+        self.assertLessEqual(clipping(dist, 'Linf').abs().max().item(),
+                             epsi_inf)
+        norms = clipping(dist, 'L2').flatten(1).norm(dim=1)
+        self.assertTrue(torch.allclose(norms, torch.full((4,), epsi_l2)))
+        small = dist * 1e-3
+        self.assertTrue(torch.equal(clipping(small, 'L2'), small))
+
+    def test_batch(self):
+        adv, success = nattack_batch(input=self.images, target=self.labels,
+                                     model=self.model, iterations=100,
+                                     population=50, is_debug=False)
+        self.assertEqual(adv.shape, self.images.shape)
+        self.assertTrue(success.any())
+        adv_labels = self.model(adv).argmax(dim=1)
+        self.assertTrue((adv_labels[success] != self.labels[success]).all())
+        self.assertTrue(torch.equal(adv[~success], self.images[~success]))
+        self.assertLessEqual((adv - self.images).abs().max().item(),
+                             epsi_inf + 1e-5)
+
+    def test_chunks_and_seed_size(self):
+        results = []
+        for chunk_size in [7, 1000]:
+            torch.manual_seed(1)
+            results.append(nattack_batch(
+                input=self.images, target=self.labels, model=self.model,
+                iterations=20, population=10, seed_size=(4, 4),
+                chunk_size=chunk_size, is_debug=False))
+        self.assertTrue(torch.allclose(results[0][0], results[1][0],
+                                       atol=1e-6))
+        self.assertTrue(torch.equal(results[0][1], results[1][1]))
+
+    def test_chunk_size_bounds_population(self):
+        batch_sizes = []
+
+        def model(images):
+            batch_sizes.append(images.size(0))
+            return self.model(images)
+
+        nattack_batch(input=self.images, target=self.labels, model=model,
+                      iterations=5, population=10, chunk_size=7,
+                      is_debug=False)
+        self.assertLessEqual(max(batch_sizes), 7)
+
+    def test_single(self):
+        adv = nattack(input=self.images[0], target=self.labels[0],
+                      model=self.model, iterations=100, population=50,
+                      is_debug=False)
+        if adv is not None:
+            self.assertNotEqual(self.model(adv.unsqueeze(0)).argmax().item(),
+                                self.labels[0].item())
+
+
+if __name__ == '__main__':
+    unittest.main()
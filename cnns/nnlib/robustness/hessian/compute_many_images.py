@@ -12,6 +12,7 @@ import numpy as np
 from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings import compute_hessian_eigenthings
 from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings import HVPOperatorInputs
 from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings import HVPOperatorParams
+from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings import compute_hessian_eigenthings_batch
 from cnns.nnlib.robustness.foolbox_model import get_fmodel
 from cnns.nnlib.utils.exec_args import get_args
 from cnns.nnlib.datasets.load_data import get_data
@@ -21,7 +22,16 @@ from torch.nn.functional import softmax
 
 
 def compute_hessian(args, num_eigens=20, file_pickle=None,
-                    hvp_operator_class=HVPOperatorParams):
+                    hvp_operator_class=HVPOperatorParams, is_batch=True,
+                    mode='power_iter'):
+    """
+    Compute the top eigenvalues of the Hessian for each image.
+
+    :param is_batch: for the Hessian w.r.t. the inputs (HVPOperatorInputs),
+    compute the eigenvalues for the whole batch of images at once
+    :param mode: power_iter or lanczos
+    :return: the list with the eigenvalues for each image
+    """
     fmodel, pytorch_model, from_class_idx_to_label = get_fmodel(args=args)
     if file_pickle:
         test_loader, test_dataset = get_pickled_args(file=file_pickle,
@@ -40,6 +50,20 @@ def compute_hessian(args, num_eigens=20, file_pickle=None,
     eigenset = []
     confidences = []
     for data_batch, target_batch in dataloader:
+        if is_batch and hvp_operator_class is HVPOperatorInputs:
+            with torch.no_grad():
+                output = pytorch_model(data_batch.to(args.device)).cpu()
+            predicted = torch.argmax(output, dim=1)
+            if not predicted.eq(target_batch).all():
+                raise Exception('Predicted class is different from the label.')
+            probs = softmax(output, dim=1)
+            confidence = probs.gather(dim=1, index=target_batch.unsqueeze(1))
+            confidences.extend(confidence.squeeze(1).tolist())
+            eigenvals, _ = compute_hessian_eigenthings_batch(
+                model=model, images=data_batch, labels=target_batch,
+                loss=loss, num_eigenthings=num_eigenthings, mode=mode)
+            eigenset.extend(list(eigenvals))
+            continue
         for image, label in zip(data_batch, target_batch):
             output = pytorch_model(
                 image.unsqueeze(0).to(args.device)).squeeze().detach().cpu()
@@ -54,7 +78,7 @@ def compute_hessian(args, num_eigens=20, file_pickle=None,
             dataloader = DataLoader([(image, label)], batch_size=1)
             eigenvals, _ = compute_hessian_eigenthings(
                 model=model, dataloader=dataloader, loss=loss,
-                num_eigenthings=num_eigenthings,
+                num_eigenthings=num_eigenthings, mode=mode,
                 hvp_operator_class=hvp_operator_class)
             eigenset.append(eigenvals)
     return eigenset
@@ -1,18 +1,27 @@
 """ Top-level module for hessian eigenvec computation """
 from hessian_eigenthings.power_iter import power_iteration,\
     deflated_power_iteration
-from hessian_eigenthings.lanczos import lanczos
+from hessian_eigenthings.power_iter import batch_power_iteration,\
+    batch_deflated_power_iteration
+from hessian_eigenthings.lanczos import lanczos, batch_lanczos
 from hessian_eigenthings.hvp_operator import HVPOperatorParams,\
     compute_hessian_eigenthings
 from hessian_eigenthings.hvp_operator import HVPOperatorInputs
+from hessian_eigenthings.hvp_operator import HVPOperatorInputsBatch,\
+    compute_hessian_eigenthings_batch
 
 __all__ = [
     'power_iteration',
     'deflated_power_iteration',
     'lanczos',
+    'batch_power_iteration',
+    'batch_deflated_power_iteration',
+    'batch_lanczos',
     'HVPOperatorParams',
     'HVPOperatorInputs',
-    'compute_hessian_eigenthings'
+    'HVPOperatorInputsBatch',
+    'compute_hessian_eigenthings',
+    'compute_hessian_eigenthings_batch'
 ]
 
 name = 'hessian_eigenthings'
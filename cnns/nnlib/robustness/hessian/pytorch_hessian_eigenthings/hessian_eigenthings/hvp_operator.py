@@ -4,7 +4,9 @@ for a given pytorch model using subsampled data.
 """
 import torch
 from hessian_eigenthings.power_iter import Operator, deflated_power_iteration
-from hessian_eigenthings.lanczos import lanczos
+from hessian_eigenthings.power_iter import BatchOperator,\
+    batch_deflated_power_iteration
+from hessian_eigenthings.lanczos import lanczos, batch_lanczos
 
 
 class HVPOperatorParams(Operator):
@@ -186,6 +188,113 @@ class HVPOperatorInputs(Operator):
         return self.grad_vec
 
 
+class HVPOperatorInputsBatch(BatchOperator):
+    """
+    Use PyTorch autograd for Hessian Vec products with respect to the inputs
+    for a batch of independent images: apply(vecs) returns H_i vec_i for each
+    image i, where H_i is the hessian of the loss of the i-th image w.r.t.
+    this image. The model has to process the images independently (e.g. be
+    in the eval mode).
+
+    model:  PyTorch network to compute hessian for
+    images: the batch of images
+    labels: the labels of the images
+    criterion: loss function with the reduction argument (e.g. F.cross_entropy)
+    use_gpu: use cuda or not
+    """
+
+    def __init__(self, model, images, labels, criterion, use_gpu=True):
+        batch_size = images.size(0)
+        size = images[0].numel()
+        super(HVPOperatorInputsBatch, self).__init__(size, batch_size)
+        self.model = model
+        self.images = images.detach().clone()
+        self.labels = labels
+        if use_gpu:
+            self.model = self.model.cuda()
+            self.images = self.images.cuda()
+            self.labels = self.labels.cuda()
+        self.images.requires_grad_(requires_grad=True)
+        self.criterion = criterion
+        self.use_gpu = use_gpu
+        # The gradient (with its graph) is computed once and reused for all
+        # the Hessian vector products.
+        self.grad_vec = self.prepare_grad()
+
+    def apply(self, vec):
+        """
+        Returns H_i*vec_i for each image where H_i is the hessian of the loss
+        w.r.t. the vectorized i-th input
+        """
+        vec = vec.view(self.batch_size, self.size).to(self.grad_vec)
+        grad_grad = torch.autograd.grad(outputs=self.grad_vec,
+                                        inputs=self.images,
+                                        grad_outputs=vec,
+                                        retain_graph=True,
+                                        only_inputs=True)[0]
+        return grad_grad.contiguous().view(self.batch_size, self.size)
+
+    def prepare_grad(self):
+        """
+        Compute gradient of loss w.r.t inputs and vectorize per image
+        """
+        output = self.model(self.images)
+        # The gradient of the sum of the losses w.r.t. the i-th image is the
+        # gradient of the loss of the i-th image.
+        loss = self.criterion(output, self.labels, reduction='sum')
+        grad = torch.autograd.grad(outputs=loss, inputs=self.images,
+                                   create_graph=True)[0]
+        return grad.contiguous().view(self.batch_size, self.size)
+
+
+def compute_hessian_eigenthings_batch(model, images, labels, loss,
+                                      num_eigenthings=10,
+                                      mode='power_iter',
+                                      use_gpu=True,
+                                      **kwargs):
+    """
+    Computes the top `num_eigenthings` eigenvalues and eigenvecs for the
+    hessian of the loss w.r.t. each input image, for all the images in a
+    batch at once.
+
+    Parameters
+    ---------------
+
+    model : Module
+        pytorch model for this netowrk (in the eval mode)
+    images : torch.Tensor
+        the batch of images
+    labels : torch.Tensor
+        the labels of the images
+    loss : torch.nn.functional criterion
+        loss function (with the reduction argument) to differentiate through
+    num_eigenthings : int
+        number of eigenvalues/eigenvecs to compute per image.
+    mode : str ['power_iter', 'lanczos']
+        which backend to use to compute the top eigenvalues.
+    use_gpu:
+        if true, attempt to use cuda for all lin alg computatoins
+    **kwargs:
+        contains additional parameters passed onto batch_lanczos or
+        batch_deflated_power_iteration.
+
+    Returns the eigenvalues (batch_size x num_eigenthings) in descending
+    order and the eigenvectors (batch_size x num_eigenthings x image size).
+    """
+    hvp_operator = HVPOperatorInputsBatch(model, images, labels, loss,
+                                          use_gpu=use_gpu)
+    if mode == 'power_iter':
+        eigenvals, eigenvecs = batch_deflated_power_iteration(
+            hvp_operator, num_eigenthings, use_gpu=use_gpu, **kwargs)
+    elif mode == 'lanczos':
+        eigenvals, eigenvecs = batch_lanczos(
+            hvp_operator, num_eigenthings, use_gpu=use_gpu, **kwargs)
+    else:
+        raise ValueError("Unsupported mode %s (must be power_iter or lanczos)"
+                         % mode)
+    return eigenvals, eigenvecs
+
+
 def compute_hessian_eigenthings(model, dataloader, loss,
                                 num_eigenthings=10,
                                 full_dataset=True,
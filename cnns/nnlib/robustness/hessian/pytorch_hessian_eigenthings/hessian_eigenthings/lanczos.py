@@ -75,3 +75,126 @@ def lanczos(operator,
         ncv=num_lanczos_vectors,
         return_eigenvectors=True)
     return eigenvals, eigenvecs.T
+
+
+def batch_eigh(matrices):
+    """
+    Eigendecomposition of a batch of symmetric matrices (ascending order).
+    """
+    if hasattr(torch, 'linalg') and hasattr(torch.linalg, 'eigh'):
+        return torch.linalg.eigh(matrices)
+    return torch.symeig(matrices, eigenvectors=True)
+
+
+def batch_lanczos(operator,
+                  num_eigenthings=10,
+                  which='LM',
+                  num_lanczos_vectors=None,
+                  init_vec=None,
+                  use_gpu=False,
+                  to_numpy=True):
+    """
+    Run the Lanczos algorithm (with full reorthogonalization) for a batch of
+    independent symmetric operators at once: each operator gets its own
+    Krylov subspace and the tridiagonal matrices are diagonalized in a batch.
+
+    Parameters
+    -------------
+    operator: power_iter.BatchOperator
+        batch of linear operators to solve.
+    num_eigenthings : int
+        number of eigenvalue/eigenvector pairs to compute per operator
+    which : str ['LM', SM', 'LA', SA']
+        L,S = largest, smallest. M, A = in magnitude, algebriac
+        SM = smallest in magnitude. LA = largest algebraic.
+    num_lanczos_vectors : int
+        dimension of the Krylov subspace. if None, 2*num_eigenthings + 30
+    init_vec: [torch.Tensor, torch.cuda.Tensor]
+        if None, use random tensor (batch_size x size).
+    use_gpu: bool
+        if true, use cuda tensors.
+
+    Returns
+    ----------------
+    eigenvalues : np.ndarray
+        array (batch_size x num_eigenthings) with the eigenvalues of each
+        operator in descending order
+    eigenvectors : np.ndarray
+        array (batch_size x num_eigenthings x size) with the eigenvectors
+    """
+    size = operator.size
+    batch_size = operator.batch_size
+    if num_lanczos_vectors is None:
+        num_lanczos_vectors = 2 * num_eigenthings + 30
+    num_lanczos_vectors = min(num_lanczos_vectors, size)
+    if num_lanczos_vectors < num_eigenthings:
+        raise ValueError("[batch_lanczos] number of lanczos vectors has to be "
+                         ">= num_eigenthings")
+
+    if init_vec is None:
+        init_vec = torch.rand(batch_size, size)
+    if use_gpu:
+        init_vec = init_vec.cuda()
+    vec = init_vec / torch.norm(init_vec, dim=1, keepdim=True)
+
+    lanczos_vecs = torch.zeros(batch_size, num_lanczos_vectors, size,
+                               dtype=vec.dtype, device=vec.device)
+    alphas = torch.zeros(batch_size, num_lanczos_vectors, dtype=vec.dtype,
+                         device=vec.device)
+    betas = torch.zeros(batch_size, num_lanczos_vectors - 1, dtype=vec.dtype,
+                        device=vec.device)
+
+    def _orthogonalize(x, basis):
+        # Subtract the projections on the basis vectors (twice for stability).
+        for _ in range(2):
+            coeffs = torch.bmm(basis, x.unsqueeze(2))
+            x = x - torch.bmm(basis.transpose(1, 2), coeffs).squeeze(2)
+        return x
+
+    for j in range(num_lanczos_vectors):
+        lanczos_vecs[:, j] = vec
+        new_vec = operator.apply(vec).detach()
+        alphas[:, j] = (new_vec * vec).sum(dim=1)
+        if j == num_lanczos_vectors - 1:
+            break
+        new_vec = _orthogonalize(new_vec, lanczos_vecs[:, :j + 1])
+        beta = torch.norm(new_vec, dim=1)
+        # Restart with a random vector if the Krylov subspace is invariant.
+        breakdown = beta < 1e-6 * alphas[:, :j + 1].abs().max(dim=1)[0]
+        if breakdown.any():
+            random_vec = _orthogonalize(torch.rand_like(new_vec),
+                                        lanczos_vecs[:, :j + 1])
+            new_vec = torch.where(breakdown.unsqueeze(1), random_vec,
+                                  new_vec)
+            beta = torch.where(breakdown, torch.zeros_like(beta), beta)
+        betas[:, j] = beta
+        vec = new_vec / torch.norm(new_vec, dim=1, keepdim=True)
+
+    tridiagonal = torch.diag_embed(alphas) + torch.diag_embed(
+        betas, offset=1) + torch.diag_embed(betas, offset=-1)
+    ritz_vals, ritz_vecs = batch_eigh(tridiagonal)
+
+    if which == 'LM':
+        keys = ritz_vals.abs()
+    elif which == 'SM':
+        keys = -ritz_vals.abs()
+    elif which == 'LA':
+        keys = ritz_vals
+    elif which == 'SA':
+        keys = -ritz_vals
+    else:
+        raise ValueError("Unsupported which %s (must be LM, SM, LA or SA)"
+                         % which)
+    inds = torch.topk(keys, k=num_eigenthings, dim=1)[1]
+    eigenvals = ritz_vals.gather(dim=1, index=inds)
+    # sort them in descending order
+    eigenvals, sorted_inds = torch.sort(eigenvals, dim=1, descending=True)
+    inds = inds.gather(dim=1, index=sorted_inds)
+    ritz_vecs = ritz_vecs.gather(
+        dim=2, index=inds.unsqueeze(1).expand(-1, num_lanczos_vectors, -1))
+    eigenvecs = torch.bmm(ritz_vecs.transpose(1, 2), lanczos_vecs)
+    eigenvals = eigenvals.cpu()
+    eigenvecs = eigenvecs.cpu()
+    if to_numpy:
+        return eigenvals.numpy(), eigenvecs.numpy()
+    return eigenvals, eigenvecs
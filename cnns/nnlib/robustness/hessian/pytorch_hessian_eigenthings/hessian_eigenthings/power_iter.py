@@ -33,6 +33,29 @@ class LambdaOperator(Operator):
         return self.apply_fn(x)
 
 
+class BatchOperator(Operator):
+    """
+    maps X -> [L_1 x_1, ..., L_n x_n] for a batch of n independent linear
+    operators, X is a tensor of size (batch_size, size)
+    """
+
+    def __init__(self, size, batch_size):
+        super(BatchOperator, self).__init__(size)
+        self.batch_size = batch_size
+
+
+class BatchLambdaOperator(BatchOperator):
+    """
+    Batch of linear operators based on a provided lambda function
+    """
+    def __init__(self, apply_fn, size, batch_size):
+        super(BatchLambdaOperator, self).__init__(size, batch_size)
+        self.apply_fn = apply_fn
+
+    def apply(self, x):
+        return self.apply_fn(x)
+
+
 def deflated_power_iteration(operator,
                              num_eigenthings=10,
                              power_iter_steps=20,
@@ -117,3 +140,97 @@ def power_iteration(operator, steps=20, error_threshold=1e-4,
         prev_lambda = lambda_estimate
 
     return lambda_estimate, vec
+
+
+def batch_deflated_power_iteration(operator,
+                                   num_eigenthings=10,
+                                   power_iter_steps=20,
+                                   power_iter_err_threshold=1e-4,
+                                   momentum=0.0,
+                                   use_gpu=True,
+                                   to_numpy=True):
+    """
+    Compute top k eigenvalues for each operator in a batch by repeatedly
+    subtracting out dyads (see deflated_power_iteration)
+    operator: BatchOperator that gives us access to the matrix vector products
+    num_eigenthings: number of eigenvalues to compute
+    power_iter_steps: number of steps per run of power iteration
+    power_iter_err_threshold: early stopping threshold for power iteration
+    returns: top eigenvalues (batch_size x num_eigenthings) in descending
+    order, top eigenvectors (batch_size x num_eigenthings x size)
+    """
+    eigenvals = []
+    eigenvecs = []
+    current_op = operator
+    prev_vec = None
+
+    def _deflate(x, val, vec):
+        return val.unsqueeze(1) * (vec * x).sum(dim=1, keepdim=True) * vec
+
+    for _ in range(num_eigenthings):
+        eigenval, eigenvec = batch_power_iteration(current_op,
+                                                   power_iter_steps,
+                                                   power_iter_err_threshold,
+                                                   momentum=momentum,
+                                                   use_gpu=use_gpu,
+                                                   init_vec=prev_vec)
+
+        def _new_op_fn(x, op=current_op, val=eigenval, vec=eigenvec):
+            return op.apply(x) - _deflate(x, val, vec)
+        current_op = BatchLambdaOperator(_new_op_fn, operator.size,
+                                         operator.batch_size)
+        prev_vec = eigenvec
+        eigenvals.append(eigenval.cpu())
+        eigenvecs.append(eigenvec.cpu())
+
+    eigenvals = torch.stack(eigenvals, dim=1)
+    eigenvecs = torch.stack(eigenvecs, dim=1)
+
+    # sort them in descending order
+    eigenvals, sorted_inds = torch.sort(eigenvals, dim=1, descending=True)
+    eigenvecs = eigenvecs.gather(
+        dim=1, index=sorted_inds.unsqueeze(2).expand_as(eigenvecs))
+    if to_numpy:
+        return eigenvals.numpy(), eigenvecs.numpy()
+    return eigenvals, eigenvecs
+
+
+def batch_power_iteration(operator, steps=20, error_threshold=1e-4,
+                          momentum=0.0, use_gpu=True,
+                          init_vec=None):
+    """
+    Compute dominant eigenvalue/eigenvector of each matrix in a batch
+    operator: BatchOperator giving us the matrix-vector products access
+    steps: number of update steps to take
+    returns: (principal eigenvalues, principal eigenvectors) pair, the
+    estimates for a matrix are not updated after they converge
+    """
+    if init_vec is None:
+        vec = torch.rand(operator.batch_size, operator.size)
+    else:
+        vec = init_vec
+
+    if use_gpu:
+        vec = vec.cuda()
+
+    prev_lambda = torch.zeros(operator.batch_size, device=vec.device)
+    lambda_estimate = prev_lambda.clone()
+    converged = torch.zeros(operator.batch_size, dtype=torch.bool,
+                            device=vec.device)
+    prev_vec = torch.zeros_like(vec)
+    for _ in range(steps):
+        new_vec = operator.apply(vec) - momentum * prev_vec
+        prev_vec = vec / (torch.norm(vec, dim=1, keepdim=True) + 1e-6)
+
+        new_lambda = (vec * new_vec).sum(dim=1).detach()
+        diff = new_lambda - prev_lambda
+        lambda_estimate = torch.where(converged, lambda_estimate, new_lambda)
+        new_vec = new_vec.detach() / torch.norm(new_vec, dim=1, keepdim=True)
+        vec = torch.where(converged.unsqueeze(1), vec, new_vec)
+        error = torch.abs(diff / new_lambda)
+        converged = converged | (error < error_threshold)
+        if converged.all():
+            break
+        prev_lambda = new_lambda
+
+    return lambda_estimate, vec
@@ -0,0 +1,74 @@
+"""
+This file tests the batched power iteration and lanczos methods against
+torch eigh results for a batch of random symmetric matrices and the batched
+Hessian vector products w.r.t. the inputs against the full Hessians.
+"""
+import unittest
+import numpy as np
+import torch
+import torch.nn.functional as F
+from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings.power_iter import BatchLambdaOperator, batch_deflated_power_iteration
+from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings.lanczos import batch_lanczos
+from cnns.nnlib.robustness.hessian.pytorch_hessian_eigenthings.hessian_eigenthings.hvp_operator import HVPOperatorInputsBatch
+
+
+class TestBatchEigenthings(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        batch_size, size = 3, 30
+        # Symmetric matrices with the well separated top eigenvalues.
+        eigenvecs = torch.linalg.qr(torch.randn(batch_size, size, size))[0]
+        eigenvals = torch.rand(batch_size, size)
+        eigenvals[:, :4] = torch.tensor([10.0, 8.0, 6.0, 4.0])
+        self.matrices = torch.bmm(eigenvecs * eigenvals.unsqueeze(1),
+                                  eigenvecs.transpose(1, 2))
+        self.operator = BatchLambdaOperator(
+            lambda x: torch.bmm(self.matrices, x.unsqueeze(2)).squeeze(2),
+            size, batch_size)
+        self.expected = torch.linalg.eigvalsh(self.matrices).flip(
+            dims=[1])[:, :4].numpy()
+
+    def check_eigenthings(self, eigenvals, eigenvecs):
+        np.testing.assert_allclose(eigenvals, self.expected, rtol=1e-2)
+        eigenvecs = torch.from_numpy(eigenvecs)
+        for i in range(len(eigenvals)):
+            for val, vec in zip(eigenvals[i], eigenvecs[i]):
+                np.testing.assert_allclose(
+                    torch.mv(self.matrices[i], vec).numpy(),
+                    (val * vec).numpy(), atol=0.15)
+
+    def test_batch_power_iteration(self):
+        eigenvals, eigenvecs = batch_deflated_power_iteration(
+            self.operator, num_eigenthings=4, power_iter_steps=300,
+            power_iter_err_threshold=1e-7, use_gpu=False)
+        self.assertEqual(eigenvals.shape, (3, 4))
+        self.assertEqual(eigenvecs.shape, (3, 4, 30))
+        self.check_eigenthings(eigenvals, eigenvecs)
+
+    def test_batch_lanczos(self):
+        eigenvals, eigenvecs = batch_lanczos(
+            self.operator, num_eigenthings=4, num_lanczos_vectors=30,
+            use_gpu=False)
+        self.check_eigenthings(eigenvals, eigenvecs)
+
+    def test_hvp_operator_inputs_batch(self):
+        model = torch.nn.Sequential(torch.nn.Linear(6, 5), torch.nn.Tanh(),
+                                    torch.nn.Linear(5, 3))
+        images = torch.randn(4, 6)
+        labels = torch.tensor([0, 1, 2, 0])
+        operator = HVPOperatorInputsBatch(model, images, labels,
+                                          F.cross_entropy, use_gpu=False)
+        vecs = torch.randn(4, 6)
+        hvps = operator.apply(vecs)
+        for i in range(4):
+            hessian = torch.autograd.functional.hessian(
+                lambda x: F.cross_entropy(model(x.unsqueeze(0)),
+                                          labels[i:i + 1]), images[i])
+            np.testing.assert_allclose(hvps[i].numpy(),
+                                       torch.mv(hessian, vecs[i]).numpy(),
+                                       rtol=1e-4, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -41,6 +41,9 @@ from cnns.nnlib.robustness.utils import to_fft
 from cnns.nnlib.robustness.utils import laplace_noise
 from cnns.nnlib.robustness.utils import subtract_rgb
 from cnns.nnlib.robustness.randomized_defense import defend
+from cnns.nnlib.robustness.channels.channel_pipeline import ChannelPipeline
+from cnns.nnlib.robustness.adversarial_store import AdversarialStore
+from cnns.nnlib.robustness.adversarial_store import get_attack_params
 import matplotlib
 from cnns.nnlib.pytorch_layers.fft_band_2D import FFTBandFunction2D
 from cnns.nnlib.datasets.transformations.denorm_round_norm import \
@@ -497,11 +500,59 @@ def rounduniform_recover(result, image, original_image):
         result.rounduniform_label = None
 
 
+def is_channel_pipeline(recover_type):
+    # A chain of the channels, e.g. round:32+fft:50+gauss:0.03.
+    return '+' in recover_type
+
+
+def pipeline_recover(result, image, original_image):
+    if image is not None:
+        channel = ChannelPipeline(spec=args.recover_type,
+                                  param=args.noise_epsilon)
+        image_01 = torch.from_numpy(
+            args.denormalizer.denormalize(image)).unsqueeze(0).to(args.device)
+        pipeline_image = channel(image_01)[0].cpu().numpy()
+        pipeline_image = args.normalizer.normalize(pipeline_image)
+        result_pipeline = classify_image(
+            image=pipeline_image,
+            original_image=original_image,
+            args=args)
+        result.add(result_pipeline, prefix="pipeline_")
+    else:
+        result.pipeline_label = None
+
+
+def get_adversarial_store(attack_name, args):
+    """
+    :return: the store of the adversarial examples for the attack (by the
+    image index) or None if the store is disabled (the empty adv_store_dir)
+    """
+    if not args.adv_store_dir or attack_name == "FFTReplaceFrequencyAttack":
+        # The replace frequency attack returns also the 2nd original image.
+        return None
+    names = ['use_set', 'use_foolbox_data', 'attack_strength',
+             'attack_max_iterations', 'binary_search_steps',
+             'attack_confidence', 'target_class', 'compress_rate']
+    if attack_name == "CarliniWagnerL2AttackRoundFFT":
+        # The attack runs through the defense, so the adversarials depend on
+        # all the parameters of the defense it reads.
+        names += ['recover_type', 'values_per_channel', 'compress_fft_layer',
+                  'svd_compress', 'noise_sigma', 'noise_epsilon',
+                  'laplace_epsilon', 'attack_type', 'noise_iterations',
+                  'recover_early_stop_alpha', 'cw_binary_search_steps',
+                  'torch_defense']
+    params = get_attack_params(args=args, names=names)
+    return AdversarialStore(root=args.adv_store_dir, dataset=args.dataset,
+                            model=args.model_path, attack=attack_name,
+                            params=params)
+
+
 def run(args):
     result = Object()
     fmodel, pytorch_model, from_class_idx_to_label = get_fmodel(args=args)
 
     args.fmodel = fmodel
+    args.pytorch_model = pytorch_model
     args.from_class_idx_to_label = from_class_idx_to_label
     args.decimals = 4  # How many digits to print after the decimal point.
 
@@ -781,8 +832,18 @@ def run(args):
             if args.target_class:
                 full_name += '-target-class-' + str(args.target_class)
             print("full name of stored adversarial example: ", full_name)
+            store = get_adversarial_store(attack_name=attack_name, args=args)
+            store_index = [args.image_index]
             is_load_image = False
-            if is_load_image and os.path.exists(full_name + ".npy") and (
+            if store is not None and store.contains(store_index)[0]:
+                print('found the adversarial example in the store: ',
+                      store.dir)
+                stored_images, stored_labels = store.get(store_index)
+                # The label -1 marks the adversarial example not found.
+                if stored_labels[0] >= 0:
+                    adv_image = stored_images[0]
+                result.adv_timing = -1
+            elif is_load_image and os.path.exists(full_name + ".npy") and (
                     attack_name != "CarliniWagnerL2AttackRoundFFT") and (
                     attack_name != "GaussAttack") and (
                     # attack_name != "CarliniWagnerL2Attack") and (
@@ -795,7 +856,21 @@ def run(args):
             else:
                 print('Loading pre-computed adversarial images is disabled.')
                 start_adv = time.time()
-                if attack_name.startswith("Carlini"):
+                if attack_name == "CarliniWagnerL2AttackRoundFFT" and (
+                        args.cw_binary_search_steps > 0):
+                    # The batched C&W on the device of the model with the
+                    # per-image binary search over c (and the torch defense).
+                    adv_images, found = attack.attack_batch(
+                        np.expand_dims(original_image, 0),
+                        np.array([args.True_class_id]),
+                        model=args.pytorch_model,
+                        binary_search_steps=args.cw_binary_search_steps,
+                        max_iterations=args.attack_max_iterations,
+                        initial_const=args.attack_strength,
+                        confidence=args.attack_confidence)
+                    if found[0].item():
+                        adv_image = adv_images[0].detach().cpu().numpy()
+                elif attack_name.startswith("Carlini"):
                     adv_image = attack(
                         original_image, args.True_class_id,
                         max_iterations=args.attack_max_iterations,
@@ -815,18 +890,18 @@ def run(args):
                 elif attack_name == "FFTHighFrequencyAttackAdversary":
                     adv_image = attack(
                         original_image, label=args.True_class_id,
-                        net=fmodel.predictions)
+                        net=fmodel.forward)
                 elif attack_name == "FFTLimitFrequencyAttack":
                     adv_image = attack(
                         input_or_adv=original_image,
                         label=args.True_class_id,
-                        net=fmodel.predictions,
+                        net=fmodel.forward,
                         compress_rate=args.compress_rate)
                 elif attack_name == "FFTLimitFrequencyAttackAdversary":
                     adv_image = attack(
                         input_or_adv=original_image,
                         label=args.True_class_id,
-                        net=fmodel.predictions)
+                        net=fmodel.forward)
                 elif attack_name == "FFTReplaceFrequencyAttack":
                     adv_image, original_image2 = replace_frequency(
                         original_image=original_image, images=images,
@@ -851,6 +926,15 @@ def run(args):
                                        label=args.True_class_id)
                 result.adv_timing = time.time() - start_adv
                 created_new_adversarial = True
+                if store is not None:
+                    if adv_image is None:
+                        store.put(store_index,
+                                  np.expand_dims(original_image, 0),
+                                  np.array([-1]))
+                    else:
+                        store.put(store_index, np.expand_dims(adv_image, 0),
+                                  np.array([args.True_class_id]))
+                    store.flush()
 
             if show_2nd and original_image2 is not None:
                 result_original2 = classify_image(
@@ -1220,6 +1304,10 @@ def run(args):
             rounduniform_recover(result=result, image=image,
                                  original_image=original_image)
 
+        if is_channel_pipeline(args.recover_type):
+            pipeline_recover(result=result, image=image,
+                             original_image=original_image)
+
         if args.adv_type == AdversarialType.AFTER:
             full_name += "-after"
             print("adv_type: ", args.adv_type, " attack name: ",
@@ -1462,7 +1550,11 @@ def randomized_defense(image, fmodel, original_image=None, defense_name=""):
             fmodel=fmodel,
             args=args,
             iters=iters,
-            original_image=original_image)
+            original_image=original_image,
+            # The torch engine counts the votes differently, so it is used
+            # only on request.
+            model=getattr(args, 'pytorch_model', None) if getattr(
+                args, 'torch_defense', False) else None)
         print(
             f"{defense_name} recovered label, id by {args.noise_iterations} "
             f"iterations: ",
@@ -1570,6 +1662,8 @@ if __name__ == "__main__":
         val_range = range(1)
     elif args.recover_type == "rounduniform":
         val_range = range(1)
+    elif is_channel_pipeline(args.recover_type):
+        val_range = range(1)
     elif args.recover_type == "gauss":
         # val_range = [0.001, 0.009, 0.03, 0.07, 0.1, 0.2, 0.3, 0.4, 0.5]
         val_range = args.noise_sigmas
@@ -1689,6 +1783,8 @@ if __name__ == "__main__":
             pass
         elif args.recover_type == "rounduniform":
             pass
+        elif is_channel_pipeline(args.recover_type):
+            pass
         elif args.recover_type == "all" or args.recover_type == "empty":
             pass
         else:
@@ -1809,6 +1905,15 @@ if __name__ == "__main__":
                                     sum_Linf_distance_defense += result_run.rounduniform_Linf_distance
                                     sum_confidence_defense += result_run.rounduniform_confidence
 
+                            elif is_channel_pipeline(args.recover_type):
+                                if result_run.pipeline_label is not None:
+                                    if result_run.true_label == result_run.pipeline_label:
+                                        count_recovered += 1
+                                    sum_L2_distance_defense += result_run.pipeline_L2_distance
+                                    sum_L1_distance_defense += result_run.pipeline_L1_distance
+                                    sum_Linf_distance_defense += result_run.pipeline_Linf_distance
+                                    sum_confidence_defense += result_run.pipeline_confidence
+
                             elif args.recover_type == "fftround":
                                 if result_run.fftround_label is not None:
                                     if result_run.true_label == result_run.fftround_label:
@@ -4,34 +4,53 @@ import sys
 
 from cnns import matplotlib_backend
 from cnns.nnlib.utils.exec_args import get_args
+from cnns.nnlib.utils.general_utils import get_log_time
+from cnns.nnlib.robustness.pytorch_model import get_model
 from cnns.nnlib.robustness.param_perturbation.utils import get_data_loader
-from cnns.nnlib.robustness.param_perturbation.utils import get_accuracy
-from cnns.nnlib.robustness.param_perturbation.utils import get_perturbed_fmodel
-from cnns.nnlib.robustness.param_perturbation.utils import get_clean_accuracy
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import SigmaSweep
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import delimiter
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import get_summary
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import \
+    load_eval_data
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import write_table
 from cnns.nnlib.robustness.param_perturbation.sigmas import sigmas3
 
 
 def compute(args):
+    start = time.time()
+    # The model and the data are loaded once for the whole sweep.
+    model = get_model(args)
     data_loader = get_data_loader(args)
-
-    get_clean_accuracy(args=args, data_loader=data_loader)
-
-    print(f'noise sigma, perturb {args.use_set} accuracy, elapsed time')
-
-    # for noise_sigma in args.noise_sigmas:
-    # for noise_sigma in np.linspace(0.0001, 0.01, 100):
-    # for noise_sigma in np.linspace(0.0, 0.05, 30):
-    # for noise_sigma in sigmas2:
-    for noise_sigma in [0.0044, 0.004, 0.0039]:
-    # for noise_sigma in sigmas3:
-        start = time.time()
-        args.noise_sigma = noise_sigma
-        perturb_fmodel = get_perturbed_fmodel(args)
-        perturb_accuracy = get_accuracy(fmodel=perturb_fmodel,
-                                        data_loader=data_loader)
-        elapsed_time = time.time() - start
-        print(args.noise_sigma, ',', perturb_accuracy, ',', elapsed_time)
-        sys.stdout.flush()
+    batches = load_eval_data(data_loader=data_loader, device=args.device,
+                             memory_budget=args.sweep_memory_budget)
+    sweep = SigmaSweep(model=model, batches=batches, device=args.device,
+                       min=args.min, max=args.max)
+    print('load time (sec): ', time.time() - start)
+
+    start = time.time()
+    print(f'clean {args.use_set} accuracy: ', sweep.get_clean_accuracy())
+    print('elapsed time: ', time.time() - start)
+
+    # sigmas = np.linspace(0.0001, 0.01, 100)
+    # sigmas = np.linspace(0.0, 0.05, 30)
+    # sigmas = sigmas3
+    sigmas = args.noise_sigmas
+    header = ['noise sigma', 'seed', f'perturb {args.use_set} accuracy',
+              'elapsed time']
+    rows = sweep.run(sigmas=sigmas, seeds=args.noise_seeds)
+    print(delimiter.join(header))
+    for row in rows:
+        print(delimiter.join([str(x) for x in row]))
+    sys.stdout.flush()
+
+    log_time = get_log_time()
+    write_table(file_name=log_time + '-sigma-sweep-' + args.dataset + '.csv',
+                header=header, rows=rows)
+    summary_header = ['noise sigma', 'mean accuracy', 'std accuracy',
+                      'seeds', 'elapsed time']
+    write_table(
+        file_name=log_time + '-sigma-sweep-summary-' + args.dataset + '.csv',
+        header=summary_header, rows=get_summary(rows))
 
 
 if __name__ == "__main__":
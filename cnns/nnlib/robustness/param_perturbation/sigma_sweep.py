@@ -0,0 +1,143 @@
+import time
+import numpy as np
+import torch
+from cnns.nnlib.robustness.param_perturbation.weight_noise import WeightNoise
+from cnns.nnlib.utils.general_utils import get_free_memory
+
+delimiter = ';'
+
+
+def load_eval_data(data_loader, device, memory_budget=0):
+    """
+    Read the evaluation set once.
+
+    :param data_loader: the loader of the evaluation set
+    :param device: the device of the model
+    :param memory_budget: the memory (in MB) for the data on the device, 0 -
+    use half of the free GPU memory
+    :return: the list of the (images, labels) batches - kept on the device if
+    the whole set fits into the memory budget, otherwise in the pinned CPU
+    memory (for the asynchronous copies to the device)
+    """
+    device = torch.device(device)
+    batches = [(images, labels) for images, labels in data_loader]
+    size = sum(images.numel() * images.element_size() +
+               labels.numel() * labels.element_size()
+               for images, labels in batches)
+    if memory_budget > 0:
+        budget = memory_budget * 2 ** 20
+    else:
+        free_memory = get_free_memory(device)
+        budget = free_memory // 2 if free_memory is not None else None
+    if budget is None or size <= budget:
+        return [(images.to(device), labels.to(device))
+                for images, labels in batches]
+    return [(images.pin_memory(), labels.pin_memory())
+            for images, labels in batches]
+
+
+class SigmaSweep(object):
+    """
+    Evaluate the accuracy of a model with the Gaussian noise added to its
+    weights for a whole vector of noise sigmas and several noise seeds.
+
+    The model and the evaluation set are loaded once. For each seed, the
+    standard normal noise is drawn once (on the device) and scaled by each
+    sigma, so a sigma costs only an in-place update of the weights. Each
+    batch of the data is reused for all the sigmas before the next batch is
+    moved to the device.
+    """
+
+    def __init__(self, model, batches, device, min=0.0, max=1.0):
+        """
+        :param model: the clean model
+        :param batches: the evaluation set (from load_eval_data)
+        :param device: the device of the model
+        :param min: the min value of a pixel
+        :param max: the max value of a pixel
+        """
+        self.model = model
+        self.batches = batches
+        self.device = torch.device(device)
+        self.weight_noise = WeightNoise(model=model, epsilon=1.0, min=min,
+                                        max=max,
+                                        generator=torch.Generator(
+                                            device=self.device))
+        # The std of the weight noise for sigma = 1.
+        self.unit_std = self.weight_noise.std
+
+    def synchronize(self):
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+
+    def get_clean_accuracy(self):
+        correct = 0
+        total = 0
+        self.model.eval()
+        with torch.no_grad():
+            for images, labels in self.batches:
+                images = images.to(self.device, non_blocking=True)
+                labels = labels.to(self.device, non_blocking=True)
+                correct += self.model(images).argmax(dim=1).eq(
+                    labels).sum().item()
+                total += labels.numel()
+        return correct / total
+
+    def run(self, sigmas, seeds=(31,)):
+        """
+        :param sigmas: the vector of the noise sigmas
+        :param seeds: the seeds of the noise draws
+        :return: the list of the rows: noise sigma, seed, accuracy, elapsed
+        time (in sec) for the sigma and seed
+        """
+        rows = []
+        self.model.eval()
+        for seed in seeds:
+            self.weight_noise.generator.manual_seed(seed)
+            unit_noise = self.weight_noise.sample_unit_noise()
+            correct = np.zeros(len(sigmas), dtype=np.int64)
+            elapsed = np.zeros(len(sigmas))
+            total = 0
+            with torch.no_grad():
+                for images, labels in self.batches:
+                    images = images.to(self.device, non_blocking=True)
+                    labels = labels.to(self.device, non_blocking=True)
+                    total += labels.numel()
+                    for i, sigma in enumerate(sigmas):
+                        self.synchronize()
+                        start = time.time()
+                        self.weight_noise.set_noise(
+                            unit_noise=unit_noise, std=sigma * self.unit_std)
+                        correct[i] += self.model(images).argmax(dim=1).eq(
+                            labels).sum().item()
+                        elapsed[i] += time.time() - start
+            self.weight_noise.restore()
+            for i, sigma in enumerate(sigmas):
+                rows.append([sigma, seed, correct[i] / total, elapsed[i]])
+        return rows
+
+
+def get_summary(rows):
+    """
+    :param rows: the rows from SigmaSweep.run
+    :return: the rows: noise sigma, mean accuracy, std of accuracy, number of
+    seeds, total elapsed time (in sec)
+    """
+    summary = []
+    sigmas = []
+    for row in rows:
+        if row[0] not in sigmas:
+            sigmas.append(row[0])
+    for sigma in sigmas:
+        accuracies = [row[2] for row in rows if row[0] == sigma]
+        elapsed = sum([row[3] for row in rows if row[0] == sigma])
+        summary.append([sigma, np.mean(accuracies), np.std(accuracies),
+                        len(accuracies), elapsed])
+    return summary
+
+
+def write_table(file_name, header, rows):
+    with open(file_name, 'w') as f:
+        f.write(delimiter.join(header) + '\n')
+        for row in rows:
+            f.write(delimiter.join([str(x) for x in row]) + '\n')
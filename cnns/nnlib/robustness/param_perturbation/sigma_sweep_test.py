@@ -0,0 +1,61 @@
+import unittest
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data import TensorDataset
+
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import SigmaSweep
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import get_summary
+from cnns.nnlib.robustness.param_perturbation.sigma_sweep import \
+    load_eval_data
+from cnns.nnlib.robustness.param_perturbation.weight_noise import WeightNoise
+
+
+class TestSigmaSweep(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(torch.nn.Flatten(),
+                                         torch.nn.Linear(3 * 4 * 4, 5))
+        images = torch.rand(20, 3, 4, 4)
+        labels = self.model(images).argmax(dim=1).detach()
+        self.data_loader = DataLoader(TensorDataset(images, labels),
+                                      batch_size=8)
+
+    def get_accuracy(self, model):
+        correct = 0
+        for images, labels in self.data_loader:
+            correct += model(images).argmax(dim=1).eq(labels).sum().item()
+        return correct / 20
+
+    def test_sweep(self):
+        batches = load_eval_data(data_loader=self.data_loader, device='cpu')
+        self.assertEqual(len(batches), 3)
+        clean = [param.detach().clone() for param in self.model.parameters()]
+        sweep = SigmaSweep(model=self.model, batches=batches, device='cpu')
+        self.assertEqual(sweep.get_clean_accuracy(), 1.0)
+        sigmas = [0.0, 0.5, 2.0]
+        rows = sweep.run(sigmas=sigmas, seeds=[1, 2])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0][:3], [0.0, 1, 1.0])
+        # The clean weights are restored after the sweep.
+        for param, clean_param in zip(self.model.parameters(), clean):
+            self.assertTrue(torch.equal(param, clean_param))
+        # The same draw as the per-sigma perturbation of the model.
+        generator = torch.Generator()
+        weight_noise = WeightNoise(model=self.model, epsilon=2.0,
+                                   generator=generator)
+        generator.manual_seed(2)
+        weight_noise.set_noise(weight_noise.sample_unit_noise())
+        self.assertEqual(rows[5][2], self.get_accuracy(self.model))
+        weight_noise.restore()
+
+        summary = get_summary(rows)
+        self.assertEqual([row[0] for row in summary], sigmas)
+        np.testing.assert_allclose(
+            actual=summary[2][1], desired=(rows[2][2] + rows[5][2]) / 2)
+        self.assertEqual(summary[2][3], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
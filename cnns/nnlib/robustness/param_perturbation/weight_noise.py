@@ -0,0 +1,142 @@
+import numpy as np
+import torch
+from contextlib import contextmanager
+
+try:
+    from torch.func import functional_call
+    from torch.func import vmap
+except ImportError:
+    # Older PyTorch: the draws are run one after another.
+    functional_call = None
+    vmap = None
+
+
+class WeightNoise(object):
+    """
+    Inference with the Gaussian noise added to the weights of a model.
+
+    A clean copy of the weights is kept on the device of the model, so a
+    fresh draw of the noise does not rebuild the model or reload its
+    checkpoint (as perturb_model_params on a newly loaded model does). The
+    noise is sampled with torch directly on the device:
+
+    perturbed() - a context in which the weights of the model are perturbed in
+    place and restored to the clean weights at the exit,
+
+    forward_draws() - K independent draws of the weights for the same batch in
+    a single vectorized pass (the noisy weights are a functional overlay and
+    the model itself is not modified).
+
+    The std of the noise follows gauss_noise_raw: epsilon / sqrt(3) * (max -
+    min).
+    """
+
+    def __init__(self, model, epsilon, min=0.0, max=1.0, generator=None):
+        """
+        :param model: the model (it can be wrapped in nn.DataParallel)
+        :param epsilon: the strength of the noise
+        :param min: the min value of a pixel
+        :param max: the max value of a pixel
+        :param generator: the torch.Generator for the noise
+        """
+        if isinstance(model, torch.nn.DataParallel):
+            model = model.module
+        self.model = model
+        self.std = epsilon / np.sqrt(3) * (max - min)
+        self.generator = generator
+        self.names = []
+        self.params = []
+        self.clean_params = []
+        for name, param in model.named_parameters():
+            self.names.append(name)
+            self.params.append(param)
+            self.clean_params.append(param.detach().clone())
+
+    def perturb(self):
+        """
+        Overwrite the weights of the model with the clean weights and a fresh
+        draw of the noise.
+        """
+        with torch.no_grad():
+            for param, clean_param in zip(self.params, self.clean_params):
+                param.normal_(mean=0.0, std=self.std,
+                              generator=self.generator)
+                param.add_(clean_param)
+
+    def sample_unit_noise(self):
+        """
+        :return: the draw of the standard normal noise for each weight
+        """
+        return [torch.randn(clean_param.shape, dtype=clean_param.dtype,
+                            device=clean_param.device,
+                            generator=self.generator)
+                for clean_param in self.clean_params]
+
+    def set_noise(self, unit_noise, std=None):
+        """
+        Overwrite the weights with the clean weights and the given draw of
+        the noise scaled by the std (so the same draw can be reused for many
+        noise levels).
+
+        :param unit_noise: the draw from sample_unit_noise
+        :param std: the std of the noise (the std of the weight noise by
+        default)
+        """
+        if std is None:
+            std = self.std
+        with torch.no_grad():
+            for param, clean_param, noise in zip(
+                    self.params, self.clean_params, unit_noise):
+                param.copy_(clean_param).add_(noise, alpha=std)
+
+    def restore(self):
+        with torch.no_grad():
+            for param, clean_param in zip(self.params, self.clean_params):
+                param.copy_(clean_param)
+
+    @contextmanager
+    def perturbed(self):
+        """
+        Run the model with the perturbed weights, for example:
+
+        with weight_noise.perturbed():
+            logits = model(images)
+        """
+        self.perturb()
+        try:
+            yield self.model
+        finally:
+            self.restore()
+
+    def sample_params(self, draws):
+        """
+        :param draws: the number of the independent draws K
+        :return: the dict: name -> the noisy weights (K, *param.shape)
+        """
+        params = {}
+        for name, clean_param in zip(self.names, self.clean_params):
+            noise = torch.randn((draws, *clean_param.shape),
+                                dtype=clean_param.dtype,
+                                device=clean_param.device,
+                                generator=self.generator)
+            params[name] = noise.mul_(self.std).add_(clean_param)
+        return params
+
+    def forward_draws(self, input, draws):
+        """
+        :param input: the batch of images (N, C, H, W)
+        :param draws: the number of the independent draws of the weights K
+        :return: the logits for each draw (K, N, num_classes)
+        """
+        if vmap is None:
+            outputs = []
+            for _ in range(draws):
+                with self.perturbed():
+                    outputs.append(self.model(input))
+            return torch.stack(outputs)
+        params = self.sample_params(draws=draws)
+
+        def forward(draw_params):
+            return functional_call(self.model, draw_params, (input,))
+
+        return vmap(forward, randomness='different')(params)
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+import torch
+
+from cnns.nnlib.robustness.param_perturbation.weight_noise import WeightNoise
+
+
+class TestWeightNoise(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, kernel_size=3), torch.nn.BatchNorm2d(4),
+            torch.nn.ReLU(), torch.nn.Flatten(), torch.nn.Linear(4 * 6 * 6, 10))
+        self.model.eval()
+        self.input = torch.rand(5, 3, 8, 8)
+
+    def test_perturbed_restores_clean_weights(self):
+        clean = [param.detach().clone() for param in self.model.parameters()]
+        weight_noise = WeightNoise(model=torch.nn.DataParallel(self.model),
+                                   epsilon=0.3)
+        with weight_noise.perturbed() as model:
+            self.assertIs(model, self.model)
+            diff = [param - clean_param for param, clean_param in
+                    zip(self.model.parameters(), clean)]
+        std = torch.cat([d.flatten() for d in diff]).std().item()
+        np.testing.assert_allclose(actual=std, desired=0.3 / np.sqrt(3),
+                                   rtol=0.1)
+        for param, clean_param in zip(self.model.parameters(), clean):
+            self.assertTrue(torch.equal(param, clean_param))
+
+    def test_forward_draws(self):
+        weight_noise = WeightNoise(model=self.model, epsilon=0.0)
+        logits = weight_noise.forward_draws(self.input, draws=3)
+        self.assertEqual(logits.shape, (3, 5, 10))
+        expected = self.model(self.input)
+        for draw in logits:
+            np.testing.assert_allclose(actual=draw.detach().numpy(),
+                                       desired=expected.detach().numpy(),
+                                       rtol=1e-5, atol=1e-6)
+        weight_noise = WeightNoise(model=self.model, epsilon=0.1)
+        logits = weight_noise.forward_draws(self.input, draws=2)
+        self.assertFalse(torch.allclose(logits[0], logits[1]))
+
+    def test_forward_draws_gradient(self):
+        weight_noise = WeightNoise(model=self.model, epsilon=0.1)
+        input = self.input.clone().requires_grad_(True)
+        weight_noise.forward_draws(input, draws=4).mean(dim=0).sum().backward()
+        self.assertEqual(input.grad.shape, input.shape)
+        self.assertGreater(input.grad.abs().sum().item(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,7 +16,6 @@ from cnns.nnlib.robustness.pni.code.utils_.utils import AverageMeter, \
     convert_secs2time
 from tensorboardX import SummaryWriter
 from cnns.nnlib.robustness.pni.code import models
-import copy
 
 from cnns.nnlib.robustness.pni.code.models.attack_model import Attack
 from cnns.nnlib.robustness.pni.code.models.attack_model import pgd_adapter
@@ -108,6 +107,13 @@ parser.add_argument('--adv_train',
                     dest='adv_train',
                     action='store_true',
                     help='enable the adversarial training')
+parser.add_argument('--adv_train_iters', type=int, default=7,
+                    help='number of the PGD steps in the adversarial training')
+parser.add_argument('--adv_warm_start',
+                    dest='adv_warm_start',
+                    action='store_true',
+                    help='start PGD in the adversarial training from the '
+                         'perturbation of the previous batch')
 parser.add_argument('--adv_eval', dest='adv_eval',
                     action='store_true',
                     help='enable the adversarial evaluation')
@@ -575,9 +581,10 @@ def train(train_loader, model, criterion, optimizer, epoch, log, attacker=None,
 
         # perturb data inference
         if adv_train and (attacker is not None):
-            model_cp = copy.deepcopy(model)
-            perturbed_data = attacker.attack_method(
-                model_cp, input, pred_target)
+            # Attack the live model in the eval mode (no deep copy).
+            perturbed_data = attacker.adv_train_attack(
+                model, input, pred_target, k=args.adv_train_iters,
+                warm_start=args.adv_warm_start)
             output_adv = model(perturbed_data)
             loss_adv = criterion(output_adv, target)
 
@@ -647,7 +654,7 @@ def validate(val_loader, model, criterion, log, attacker=None, adv_eval=False):
 
     for i, (input, target) in enumerate(val_loader):
         if args.use_cuda:
-            target = target.cuda(async=True)
+            target = target.cuda(non_blocking=True)
             input = input.cuda()
 
         # compute output
@@ -1,10 +1,37 @@
 import torch.nn as nn
 import torch.nn.functional as F
 import torch
+from contextlib import contextmanager
 from cnns.nnlib.robustness.batch_attack.attack import attack_cw
+from cnns.nnlib.robustness.batch_attack.pgd import PGD
 from cnns.nnlib.utils.object import Object
 
 
+@contextmanager
+def attack_mode(model):
+    """
+    Attack the live model (instead of its deep copy) during the training.
+
+    Inside the context, all the modules are in the eval mode (the BN layers
+    use and do not update their running statistics) and the parameters do
+    not require gradients, so the backward passes of the attack compute only
+    the gradients of the input. The train/eval mode of each module and the
+    requires_grad of each parameter are restored at the exit.
+    """
+    modes = [(module, module.training) for module in model.modules()]
+    params = [(param, param.requires_grad) for param in model.parameters()]
+    model.eval()
+    for param, _ in params:
+        param.requires_grad_(False)
+    try:
+        yield model
+    finally:
+        for module, training in modes:
+            module.training = training
+        for param, requires_grad in params:
+            param.requires_grad_(requires_grad)
+
+
 class Attack(object):
 
     def __init__(self, dataloader, criterion=None, gpu_id=0,
@@ -18,6 +45,11 @@ class Attack(object):
         self.dataloader = dataloader
         self.epsilon = epsilon
         self.gpu_id = gpu_id  # this is integer
+        # The last perturbation for the warm start of the adversarial
+        # training.
+        self.delta = None
+        # The number of the queries per image in the last PGD attack.
+        self.queries = None
 
         if attack_method is 'fgsm':
             self.attack_method = self.fgsm
@@ -66,43 +98,40 @@ class Attack(object):
         return perturbed_data
 
     def pgd(self, model, data, target, k=7, a=0.01, random_start=True,
-            d_min=0, d_max=1):
+            d_min=0, d_max=1, init=None, early_stop=False, amp=False):
 
         model.eval()
-        # perturbed_data = copy.deepcopy(data)
-        perturbed_data = data.clone()
-
-        perturbed_data.requires_grad = True
-
-        data_max = data + self.epsilon
-        data_min = data - self.epsilon
-        data_max.clamp_(d_min, d_max)
-        data_min.clamp_(d_min, d_max)
-
-        if random_start:
-            with torch.no_grad():
-                perturbed_data.data = data + perturbed_data.uniform_(
-                    -1 * self.epsilon, self.epsilon)
-                perturbed_data.data.clamp_(d_min, d_max)
-
-        for _ in range(k):
-
-            output = model(perturbed_data)
-            loss = F.cross_entropy(output, target)
-
-            if perturbed_data.grad is not None:
-                perturbed_data.grad.data.zero_()
-
-            loss.backward()
-            data_grad = perturbed_data.grad.data
-
-            with torch.no_grad():
-                perturbed_data.data += a * torch.sign(data_grad)
-                perturbed_data.data = torch.max(
-                    torch.min(perturbed_data, data_max),
-                    data_min)
-        perturbed_data.requires_grad = False
+        if init is None and random_start:
+            init = torch.empty_like(data).uniform_(-1 * self.epsilon,
+                                                   self.epsilon)
+        pgd = PGD(model=model, eps=self.epsilon, step_size=a, num_steps=k,
+                  norm='inf', clamp=(d_min, d_max), early_stop=early_stop,
+                  amp=amp)
+        perturbed_data, self.queries = pgd.attack(data, target, init=init)
+        return perturbed_data
 
+    def adv_train_attack(self, model, data, target, k=7, warm_start=False):
+        """
+        Generate the adversarial examples for the adversarial training against
+        the live model (in the attack_mode).
+
+        :param k: the number of the PGD steps
+        :param warm_start: start PGD from the perturbation of the previous
+        batch (as in the free adversarial training), so fewer steps are
+        needed
+        :return: the perturbed data
+        """
+        with attack_mode(model):
+            if self.attack_method == self.pgd:
+                init = None
+                if warm_start and self.delta is not None and (
+                        self.delta.shape == data.shape):
+                    init = self.delta
+                perturbed_data = self.pgd(model, data, target, k=k, init=init)
+            else:
+                perturbed_data = self.attack_method(model, data, target)
+        if warm_start:
+            self.delta = (perturbed_data - data).detach()
         return perturbed_data
 
     def cw(self, net, input_v, label_v, c=0.01, gradient_iters=1, untarget=True,
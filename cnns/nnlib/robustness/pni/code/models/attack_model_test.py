@@ -0,0 +1,71 @@
+import unittest
+import torch
+
+from cnns.nnlib.robustness.pni.code.models.attack_model import Attack
+from cnns.nnlib.robustness.pni.code.models.attack_model import attack_mode
+
+
+class TestAttackModel(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(31)
+        self.model = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 4, kernel_size=3, padding=1),
+            torch.nn.BatchNorm2d(4), torch.nn.ReLU(), torch.nn.Flatten(),
+            torch.nn.Linear(4 * 4 * 4, 10))
+        self.data = torch.rand(8, 3, 4, 4)
+        self.target = torch.randint(10, (8,))
+
+    def get_bn_stats(self):
+        bn = self.model[1]
+        return [bn.running_mean.clone(), bn.running_var.clone(),
+                bn.num_batches_tracked.clone()]
+
+    def test_attack_mode(self):
+        # The modes and flags are mixed to check that each one is restored.
+        self.model.train()
+        self.model[2].eval()
+        self.model[0].bias.requires_grad_(False)
+        modes = [module.training for module in self.model.modules()]
+        flags = [param.requires_grad for param in self.model.parameters()]
+        with attack_mode(self.model):
+            self.assertFalse(any(
+                module.training for module in self.model.modules()))
+            self.assertFalse(any(
+                param.requires_grad for param in self.model.parameters()))
+        self.assertEqual(
+            [module.training for module in self.model.modules()], modes)
+        self.assertEqual(
+            [param.requires_grad for param in self.model.parameters()], flags)
+
+    def test_attack_mode_exception(self):
+        self.model.train()
+        with self.assertRaises(ValueError):
+            with attack_mode(self.model):
+                raise ValueError()
+        self.assertTrue(all(
+            module.training for module in self.model.modules()))
+        self.assertTrue(all(
+            param.requires_grad for param in self.model.parameters()))
+
+    def test_adv_train_attack(self):
+        self.model.train()
+        stats = self.get_bn_stats()
+        attack = Attack(dataloader=None, epsilon=0.03)
+        perturbed = attack.adv_train_attack(self.model, self.data,
+                                            self.target, k=3)
+        # The BN running statistics are not updated by the attack.
+        for stat, expected in zip(self.get_bn_stats(), stats):
+            self.assertTrue(torch.equal(stat, expected))
+        self.assertTrue(self.model.training)
+        self.assertTrue(all(
+            param.requires_grad for param in self.model.parameters()))
+        # No gradients of the parameters are accumulated by the attack.
+        self.assertTrue(all(
+            param.grad is None for param in self.model.parameters()))
+        self.assertLessEqual((perturbed - self.data).abs().max().item(),
+                             0.03 + 1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
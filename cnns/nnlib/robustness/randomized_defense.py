@@ -5,12 +5,17 @@ from cnns.nnlib.robustness.utils import laplace_noise
 from cnns.nnlib.robustness.utils import gauss_noise
 from cnns.nnlib.robustness.utils import elem_wise_dist
 from cnns.nnlib.robustness.utils import most_frequent_class
+from cnns.nnlib.pytorch_layers.noise import sample_noise_torch
+from cnns.nnlib.robustness.adaptive_ensemble import is_plurality_settled
+import math
 import numpy as np
+import torch
 from cnns.nnlib.datasets.transformations.denormalize import Denormalize
 nprng = np.random.RandomState()
 
 
-def defend(image, fmodel, args, iters=None, is_batch=True, original_image=None):
+def defend(image, fmodel, args, iters=None, is_batch=True, original_image=None,
+           model=None):
     """
     Recover the correct label.
 
@@ -18,11 +23,19 @@ def defend(image, fmodel, args, iters=None, is_batch=True, original_image=None):
     :param fmodel: a foolbox model
     :param args: the global arguments
     :param original_image: the original image
+    :param model: the pytorch model, if given we run the noise trials on
+    device with defend_torch (without the foolbox round trips)
 
     :return: the result object with selected label, distances and confidence
     """
     if iters is None:
         iters = args.noise_iterations
+    if model is not None:
+        results, avg_predictions, class_id_counters = defend_torch(
+            images=image, model=model, args=args, iters=iters,
+            original_images=original_image,
+            early_stop_alpha=args.recover_early_stop_alpha)
+        return results[0], avg_predictions[0], list(class_id_counters[0])
     from_class_idx_to_label = args.from_class_idx_to_label
 
     result = Object()
@@ -137,3 +150,168 @@ def defend(image, fmodel, args, iters=None, is_batch=True, original_image=None):
     result.Linf_distance = np.average(result.Linf_distance)
 
     return result, avg_predictions, class_id_counters
+
+
+def get_noise_type(args):
+    if args.noise_epsilon > 0:
+        return 'uniform', args.noise_epsilon
+    elif args.laplace_epsilon > 0:
+        return 'laplace', args.laplace_epsilon
+    elif args.noise_sigma > 0:
+        return 'gauss', args.noise_sigma
+    else:
+        raise Exception("No noise was used.")
+
+
+def defend_torch(images, model, args, iters=None, original_images=None,
+                 batch_size=None, early_stop_alpha=0.0, min_iters=10,
+                 generator=None):
+    """
+    Recover the correct labels with many noise trials run as large batches on
+    the device of the model.
+
+    All the noise trials for all the images are run in batches of
+    batch_size inputs. We accumulate the votes (the class with the max logit
+    for each trial), the logits and the softmax probabilities with
+    scatter-adds and compute the L1, L2 and Linf distances from the original
+    images in the same pass.
+
+    With the early stopping, the votes are tested after every min_iters
+    trials, so early_stop_alpha is spent evenly over the (at most)
+    ceil(iters / min_iters) tests (the Bonferroni bound, as in
+    adaptive_ensemble_infer).
+
+    :param images: the input images (after attack), (C, H, W) or
+    (N, C, H, W), numpy arrays or tensors
+    :param model: the pytorch model
+    :param args: the global arguments
+    :param iters: the number of noise trials per image
+    :param original_images: the original images (for the distances)
+    :param batch_size: the number of the noisy images in a single forward pass
+    (args.test_batch_size by default)
+    :param early_stop_alpha: if > 0, stop the trials for an image when the
+    plurality class is significant at this overall level
+    :param min_iters: the min number of trials before the early stopping
+    :param generator: the torch.Generator for the noise
+    :return: the list of result objects (one per image) with the selected
+    label, distances and confidence, the averaged logits (N, num_classes),
+    the votes for each class (N, num_classes)
+    """
+    if iters is None:
+        iters = args.noise_iterations
+    if iters < 1:
+        raise Exception(f"The number of noise trials has to be positive but "
+                        f"iters={iters}.")
+    if batch_size is None:
+        batch_size = args.test_batch_size
+    noise_type, noise_level = get_noise_type(args)
+
+    device = args.device
+    is_single = len(images.shape) == 3
+    images = torch.as_tensor(images, device=device)
+    if is_single:
+        images = images.unsqueeze(0)
+    N, C, H, W = images.shape
+
+    if original_images is not None:
+        original_images = torch.as_tensor(original_images, device=device,
+                                          dtype=images.dtype)
+        if is_single:
+            original_images = original_images.unsqueeze(0)
+        mean = torch.as_tensor(args.mean_array, device=device,
+                               dtype=images.dtype).view(1, -1, 1, 1)
+        std = torch.as_tensor(args.std_array, device=device,
+                              dtype=images.dtype).view(1, -1, 1, 1)
+        denorm_originals = original_images * std + mean
+
+    # The accumulators for the votes, logits and softmax probabilities are
+    # allocated after the first forward pass (when we know the num of classes).
+    class_id_counters = sum_predictions = sum_confidence = None
+    dist_sums = torch.zeros(3, N, device=device, dtype=images.dtype)
+    trials = torch.zeros(N, dtype=torch.long, device=device)
+    active = torch.arange(N, device=device)
+    noise_buffer = None
+    # The alpha spent on each of the repeated tests.
+    test_alpha = early_stop_alpha / math.ceil(iters / min_iters)
+
+    model.eval()
+    with torch.no_grad():
+        while len(active) > 0:
+            n_active = len(active)
+            remaining = iters - trials[active[0]].item()
+            trials_per_image = min(max(1, batch_size // n_active), remaining)
+            if early_stop_alpha > 0:
+                # Check the votes after every min_iters trials.
+                trials_per_image = min(
+                    trials_per_image,
+                    min_iters - trials[active[0]].item() % min_iters)
+            batch_images = images[active].repeat_interleave(trials_per_image,
+                                                            dim=0)
+            if noise_buffer is None or noise_buffer.shape != batch_images.shape:
+                noise_buffer = torch.empty_like(batch_images)
+            noise = sample_noise_torch(
+                noise_type=noise_type, noise_level=noise_level,
+                input=batch_images, min_=args.min, max_=args.max,
+                generator=generator, out=noise_buffer)
+            noise_images = batch_images.add_(noise)
+
+            predictions = model(noise_images).float()
+            num_classes = predictions.shape[-1]
+            predictions = predictions.view(n_active, trials_per_image,
+                                           num_classes)
+            if class_id_counters is None:
+                class_id_counters = torch.zeros(N, num_classes, device=device)
+                sum_predictions = torch.zeros_like(class_id_counters)
+                sum_confidence = torch.zeros_like(class_id_counters)
+            votes = torch.zeros_like(predictions).scatter_(
+                dim=2, index=predictions.argmax(dim=2, keepdim=True), value=1)
+            class_id_counters.index_add_(0, active, votes.sum(dim=1))
+            sum_predictions.index_add_(0, active, predictions.sum(dim=1))
+            sum_confidence.index_add_(
+                0, active, torch.softmax(predictions, dim=2).sum(dim=1))
+
+            if original_images is not None:
+                denorm_noise_images = noise_images * std + mean
+                diff = denorm_noise_images.view(
+                    n_active, trials_per_image, -1) - denorm_originals[
+                    active].view(n_active, 1, -1)
+                dist_sums[0].index_add_(0, active, diff.abs().sum(dim=2).sum(
+                    dim=1))
+                dist_sums[1].index_add_(0, active, diff.norm(p=2, dim=2).sum(
+                    dim=1))
+                dist_sums[2].index_add_(0, active, diff.abs().max(
+                    dim=2)[0].sum(dim=1))
+
+            trials[active] += trials_per_image
+            is_done = trials[active] >= iters
+            if early_stop_alpha > 0 and (
+                    trials[active[0]].item() % min_iters == 0):
+                is_done |= is_plurality_settled(class_id_counters[active],
+                                                alpha=test_alpha)
+            active = active[~is_done]
+
+    trials_float = trials.to(sum_predictions.dtype).unsqueeze(1)
+    avg_predictions = (sum_predictions / trials_float).cpu().numpy()
+    avg_confidence = (sum_confidence / trials_float).cpu().numpy()
+    class_ids = class_id_counters.argmax(dim=1).cpu().numpy()
+    if original_images is not None:
+        distances = (dist_sums / trials.to(dist_sums.dtype)).cpu().numpy()
+    else:
+        distances = -np.ones((3, N))
+    from_class_idx_to_label = getattr(args, 'from_class_idx_to_label', None)
+
+    results = []
+    for i in range(N):
+        result = Object()
+        result.class_id = class_ids[i]
+        if from_class_idx_to_label is not None:
+            result.label = from_class_idx_to_label[result.class_id]
+        result.confidence = np.max(avg_confidence[i])
+        result.L1_distance = distances[0][i]
+        result.L2_distance = distances[1][i]
+        result.Linf_distance = distances[2][i]
+        result.iters = trials[i].item()
+        results.append(result)
+
+    class_id_counters = class_id_counters.long().cpu().numpy()
+    return results, avg_predictions, class_id_counters
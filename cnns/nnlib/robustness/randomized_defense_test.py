@@ -0,0 +1,76 @@
+import unittest
+import numpy as np
+import torch
+from torch import nn
+from cnns.nnlib.utils.arguments import Arguments
+from cnns.nnlib.robustness.randomized_defense import defend_torch
+
+
+class TestRandomizedDefense(unittest.TestCase):
+
+    def get_args(self):
+        args = Arguments()
+        args.min = 0.0
+        args.max = 1.0
+        args.noise_sigma = 0.0
+        args.noise_epsilon = 0.1
+        args.laplace_epsilon = 0.0
+        args.test_batch_size = 32
+        args.device = torch.device("cpu")
+        args.mean_array = np.zeros((3, 1, 1), dtype=np.float32)
+        args.std_array = np.ones((3, 1, 1), dtype=np.float32)
+        args.from_class_idx_to_label = {0: 'zero', 1: 'one', 2: 'two'}
+        return args
+
+    def get_model(self):
+        # The class is the index of the channel with the largest mean.
+        class MeanChannel(nn.Module):
+            def forward(self, x):
+                return x.mean(dim=(2, 3))
+
+        return MeanChannel()
+
+    def test_defend_torch(self):
+        torch.manual_seed(31)
+        args = self.get_args()
+        images = torch.zeros(4, 3, 8, 8)
+        for i in range(3):
+            images[i, i] = 0.5
+        images[3, 1] = 0.5
+        original_images = images.clone()
+        results, avg_predictions, class_id_counters = defend_torch(
+            images=images, model=self.get_model(), args=args, iters=50,
+            original_images=original_images)
+        self.assertEqual([result.class_id for result in results], [0, 1, 2, 1])
+        self.assertEqual(results[1].label, 'one')
+        np.testing.assert_equal(class_id_counters.sum(axis=1), [50] * 4)
+        self.assertEqual(avg_predictions.shape, (4, 3))
+        # The uniform noise is in [-0.1, 0.1].
+        for result in results:
+            self.assertLessEqual(result.Linf_distance, 0.1)
+            self.assertGreater(result.Linf_distance, 0.09)
+            np.testing.assert_allclose(
+                actual=result.L1_distance, desired=3 * 8 * 8 * 0.05,
+                rtol=0.05)
+
+    def test_defend_torch_early_stop(self):
+        torch.manual_seed(31)
+        args = self.get_args()
+        images = torch.zeros(2, 3, 8, 8)
+        images[0, 2] = 0.5
+        # The second image is ambiguous between the classes 0 and 1.
+        images[1, 0] = 0.5
+        images[1, 1] = 0.5
+        results, _, class_id_counters = defend_torch(
+            images=images, model=self.get_model(), args=args, iters=200,
+            early_stop_alpha=0.01, min_iters=10)
+        self.assertEqual(results[0].class_id, 2)
+        # The alpha is split over 20 tests (z = 3.29): the unanimous votes
+        # are not settled after 10 trials but after 20 trials.
+        self.assertEqual(results[0].iters, 20)
+        self.assertEqual(results[0].L2_distance, -1)
+        self.assertGreater(results[1].iters, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,6 +16,7 @@ from cnns.nnlib.datasets.transformations.rounding import RoundingTransformation
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_spectrum
 from cnns.nnlib.pytorch_layers.pytorch_utils import get_phase
 from cnns.nnlib.utils.shift_DC_component import shift_DC
+from cnns.nnlib.pytorch_layers.complex_spectral import rfft_pairs
 from foolbox.attacks.additive_noise import AdditiveNoiseAttack
 
 nprng = np.random.RandomState()
@@ -208,7 +209,7 @@ def to_fft(x, fft_type, is_log=True, signal_dim=2, onesided=False,
     x = torch.from_numpy(x)
     # x = torch.tensor(x)
     # x = x.permute(2, 0, 1)  # move channel as the first dimension
-    xfft = torch.rfft(x, onesided=onesided, signal_ndim=signal_dim)
+    xfft = rfft_pairs(x, onesided=onesided, signal_ndim=signal_dim)
     if is_DC_shift:
         xfft = shift_DC(xfft, onesided=onesided)
     if fft_type == "magnitude":
@@ -1,4 +1,14 @@
 import unittest
+import numpy as np
+
+from cnns.nnlib.layers import conv_backward
+from cnns.nnlib.layers import conv_backward_1D
+from cnns.nnlib.layers import conv_forward
+from cnns.nnlib.layers import conv_forward_1D
+from cnns.nnlib.layers import max_pool_backward
+from cnns.nnlib.layers import max_pool_backward_1D
+from cnns.nnlib.layers import max_pool_forward
+from cnns.nnlib.layers import max_pool_forward_1D
 
 
 class TestLayersMethods(unittest.TestCase):
@@ -6,6 +16,74 @@ class TestLayersMethods(unittest.TestCase):
     def test_upper(self):
         self.assertEqual('foo'.upper(), 'FOO')
 
+    def check_methods(self, forward, backward, inputs, param, dout_seed=7):
+        """
+        Compare the im2col and the naive implementations (the outputs and the
+        gradients), the im2col is run twice to reuse the workspace.
+        """
+        results = []
+        for method, workspace in [('naive', None), ('im2col', {}),
+                                  ('im2col', 'reuse')]:
+            param = dict(param, method=method)
+            if workspace == 'reuse':
+                param['workspace'] = results[-1][2]
+            elif workspace is not None:
+                param['workspace'] = workspace
+            out, cache = forward(*inputs, param)
+            dout = np.random.RandomState(dout_seed).randn(*out.shape)
+            grads = backward(dout, cache)
+            if not isinstance(grads, tuple):
+                grads = (grads,)
+            results.append((out, grads, param.get('workspace')))
+        (expected, expected_grads, _), *im2col_results = results
+        for out, grads, _ in im2col_results:
+            np.testing.assert_allclose(actual=out, desired=expected,
+                                       rtol=1e-7, atol=1e-10)
+            for grad, expected_grad in zip(grads, expected_grads):
+                np.testing.assert_allclose(actual=grad, desired=expected_grad,
+                                           rtol=1e-7, atol=1e-10)
+        self.assertTrue(len(results[1][2]) > 0)
+
+    def test_conv(self):
+        random = np.random.RandomState(31)
+        x = random.randn(2, 3, 9, 8)
+        w = random.randn(4, 3, 3, 2)
+        b = random.randn(4)
+        for pad, stride in [(0, 1), (1, 2), (2, 3)]:
+            self.check_methods(conv_forward, conv_backward, (x, w, b),
+                               {'pad': pad, 'stride': stride})
+
+    def test_conv_1D(self):
+        random = np.random.RandomState(31)
+        x = random.randn(3, 2, 20)
+        w = random.randn(5, 2, 4)
+        b = random.randn(5)
+        for pad, stride in [(0, 1), (3, 2), ((1, 2), 3)]:
+            self.check_methods(conv_forward_1D, conv_backward_1D, (x, w, b),
+                               {'pad': pad, 'stride': stride})
+
+    def test_max_pool(self):
+        random = np.random.RandomState(31)
+        x = random.randn(2, 3, 9, 9)
+        # Ties: the gradient goes to all the max positions.
+        x[0, 0, :2, :2] = 5.0
+        for pool, stride in [(2, 2), (3, 2), (3, 3)]:
+            self.check_methods(max_pool_forward, max_pool_backward, (x,),
+                               {'pool_height': pool, 'pool_width': pool,
+                                'stride': stride})
+
+    def test_max_pool_1D(self):
+        random = np.random.RandomState(31)
+        x = random.randn(2, 3, 17)
+        for pool, stride in [(2, 2), (4, 1)]:
+            self.check_methods(max_pool_forward_1D, max_pool_backward_1D, (x,),
+                               {'pool_width': pool, 'stride': stride})
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            conv_forward(np.zeros((1, 1, 3, 3)), np.zeros((1, 1, 2, 2)),
+                         np.zeros(1), {'pad': 0, 'stride': 1, 'method': 'fft'})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -362,6 +362,12 @@ class Arguments(object):
                  memory_size=25,
                  is_progress_bar=False,
                  log_conv_size=False,
+                 filter_cache=False,
+                 conv_tuning=False,
+                 tuning_file=None,
+                 fft_size_type=None,
+                 tile_size=None,
+                 tile_memory_size=1.0,
                  stride_type=StrideType.STANDARD,
                  # is_dev_dataset = True,
                  is_dev_dataset=False,
@@ -389,6 +395,8 @@ class Arguments(object):
                  # noise_sigmas=[0.05, 0.06, 0.07, 0.08, 0.09],
                  # noise_sigmas=[0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0],
                  # noise_epsilons=[0.1, 0.07, 0.03, 0.009, 0.007, 0.04, 0.02, 0.3],
+                 noise_seeds=[31],
+                 sweep_memory_budget=0,
                  fft_type="real_fft",  # real_fft or complex_fft
                  imagenet_path="/home/" + str(USER) + "/imagenet",
                  distributed=False,
@@ -446,6 +454,8 @@ class Arguments(object):
                  many_noise_iterations=[0],
                  recover_iterations=0,
                  many_recover_iterations=[0],
+                 recover_early_stop_alpha=0.0,
+                 torch_defense=False,
                  attack_max_iterations=0,
                  many_attack_iterations=[1000],
                  laplace_epsilon=0.0,
@@ -470,6 +480,11 @@ class Arguments(object):
                  attack_strengths=[100.0],
                  gradient_iters=1,
                  ensemble=1,
+                 ensemble_alpha=0.0,
+                 ensemble_min_passes=5,
+                 channel_timing=False,
+                 adv_store_dir='',
+                 cw_binary_search_steps=0,
                  attack_confidence=0,
                  target_class=-1,
                  rgb_value=0,
@@ -519,6 +534,18 @@ class Arguments(object):
         :param is_progress_bar: specify if the progress bar should be shown
         during training and testing of the model.
         :param log_conv_size: log the size of the convolutional layers
+        :param filter_cache: cache the spectra of the filters in the fft
+        based convolutions in the inference mode
+        :param conv_tuning: pick the conv exec type and the fft size for each
+        fft based convolution layer by benchmarking the candidates
+        :param tuning_file: the on-disk cache of the tuned layers (None: the
+        default file in the home directory)
+        :param fft_size_type: the type of the fft size (FFTSizeType), None:
+        given by next_power2
+        :param tile_size: the fft size of the tiles for the TILED conv exec
+        type (None: picked by the cost of the ffts)
+        :param tile_memory_size: the memory budget (in GB) for the tiles of
+        the TILED conv exec type
         :param is_dev_set: is the dev dataset used (extracted from the trina set)
         :param dev_percent: % of data used from the train set as the dev set
         :param is_serial_conv: is the convolution exeucted as going serially
@@ -581,6 +608,12 @@ class Arguments(object):
         self.memory_size = memory_size
         self.is_progress_bar = is_progress_bar
         self.log_conv_size = log_conv_size
+        self.filter_cache = filter_cache
+        self.conv_tuning = conv_tuning
+        self.tuning_file = tuning_file
+        self.fft_size_type = fft_size_type
+        self.tile_size = tile_size
+        self.tile_memory_size = tile_memory_size
         self.stride_type = stride_type
         self.is_dev_dataset = is_dev_dataset
         self.dev_percent = dev_percent
@@ -595,6 +628,8 @@ class Arguments(object):
         self.test_compress_rates = test_compress_rates
         self.noise_sigma = noise_sigma
         self.noise_sigmas = noise_sigmas
+        self.noise_seeds = noise_seeds
+        self.sweep_memory_budget = sweep_memory_budget
         self.fft_type = fft_type
         self.imagenet_path = imagenet_path
         self.distributed = distributed
@@ -617,6 +652,8 @@ class Arguments(object):
         self.many_noise_iterations = many_noise_iterations
         self.recover_iterations = recover_iterations
         self.many_recover_iterations = many_recover_iterations
+        self.recover_early_stop_alpha = recover_early_stop_alpha
+        self.torch_defense = torch_defense
         self.attack_max_iterations = attack_max_iterations
         self.many_attack_iterations = many_attack_iterations
         self.laplace_epsilon = laplace_epsilon
@@ -631,6 +668,11 @@ class Arguments(object):
         self.target_class = target_class
         self.gradient_iters = gradient_iters
         self.ensemble = ensemble
+        self.ensemble_alpha = ensemble_alpha
+        self.ensemble_min_passes = ensemble_min_passes
+        self.channel_timing = channel_timing
+        self.adv_store_dir = adv_store_dir
+        self.cw_binary_search_steps = cw_binary_search_steps
         self.attack_confidence = attack_confidence
         self.rgb_value = rgb_value
         self.rgb_values = rgb_values
@@ -775,6 +817,12 @@ class Arguments(object):
         self.visulize = self.get_bool(parsed_args.visualize)
         self.is_progress_bar = self.get_bool(parsed_args.is_progress_bar)
         self.log_conv_size = self.get_bool(parsed_args.log_conv_size)
+        self.filter_cache = self.get_bool(parsed_args.filter_cache)
+        self.torch_defense = self.get_bool(parsed_args.torch_defense)
+        self.conv_tuning = self.get_bool(parsed_args.conv_tuning)
+        self.tuning_file = parsed_args.tuning_file
+        self.tile_size = parsed_args.tile_size
+        self.tile_memory_size = parsed_args.tile_memory_size
         self.is_data_augmentation = self.get_bool(
             parsed_args.is_data_augmentation)
         self.is_dev_dataset = self.get_bool(parsed_args.is_dev_dataset)
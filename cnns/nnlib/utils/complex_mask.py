@@ -1,5 +1,6 @@
 import numpy as np
 import torch
+from collections import OrderedDict
 
 
 def get_val_from_interpolate_disk(interpolate, val, ceil_init_r):
@@ -251,6 +252,85 @@ def get_array_mask(mask, n=7, val=0, back=1, dtype=np.float32,
     return array
 
 
+class MaskCache(object):
+    """
+    Bounded LRU registry of the finished complex masks.
+
+    The masks are built on the host with numpy (ogrid + a loop over the radius
+    for the interpolated masks) so we keep the final masks (sliced to the
+    onesided width, cast to the dtype and placed on the device of the xfft
+    maps) and re-use them across batches.
+
+    The returned masks are shared so they must not be modified in-place.
+    """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+        self.masks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, get_mask, H, W, compress_rate, val=0, interpolate=None,
+            onesided=True, dtype=torch.float32, device=None):
+        """
+        :param get_mask: the function to generate the mask, e.g.,
+        get_hyper_mask, get_disk_mask or get_inverse_hyper_mask
+        :param H: the height of the xfft map
+        :param W: the width of the xfft map (W_xfft for the onesided fft)
+        :param dtype: the dtype of the xfft map
+        :param device: the device of the xfft map
+        :return: the complex mask of size (H, W, 2)
+        """
+        device = torch.device('cpu') if device is None else torch.device(
+            device)
+        key = (get_mask, H, W, float(compress_rate), val, interpolate,
+               onesided, dtype, device)
+        mask = self.masks.get(key)
+        if mask is not None:
+            self.hits += 1
+            self.masks.move_to_end(key)
+            return mask
+        self.misses += 1
+        mask, _ = get_mask(H=H, W=W, compress_rate=compress_rate, val=val,
+                           interpolate=interpolate, onesided=onesided)
+        mask = mask[:, 0:W, :]
+        mask = mask.to(dtype=dtype, device=device)
+        if self.max_size > 0:
+            self.masks[key] = mask
+            while len(self.masks) > self.max_size:
+                self.masks.popitem(last=False)
+        return mask
+
+    def clear(self):
+        self.masks.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.masks)
+
+
+mask_cache = MaskCache()
+
+
+def get_cached_mask(H, W, compress_rate, val=0, interpolate=None,
+                    onesided=True, get_mask=None, dtype=torch.float32,
+                    device=None):
+    """
+    Get the mask from the global mask_cache.
+
+    :param get_mask: the function to generate the mask (get_hyper_mask by
+    default)
+    :return: the complex mask of size (H, W, 2) ready to multiply the xfft
+    """
+    if get_mask is None:
+        get_mask = get_hyper_mask
+    return mask_cache.get(get_mask=get_mask, H=H, W=W,
+                          compress_rate=compress_rate, val=val,
+                          interpolate=interpolate, onesided=onesided,
+                          dtype=dtype, device=device)
+
+
 if __name__ == "__main__":
     a, b = 1, 1
     n = 7
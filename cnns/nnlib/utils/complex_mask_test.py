@@ -1,6 +1,7 @@
 from cnns.nnlib.utils.complex_mask import get_disk_mask
 from cnns.nnlib.utils.complex_mask import get_hyper_mask
 from cnns.nnlib.utils.complex_mask import get_inverse_hyper_mask
+from cnns.nnlib.utils.complex_mask import MaskCache
 
 import torch
 import unittest
@@ -310,6 +311,35 @@ class TestGetComplexMask(unittest.TestCase):
         np.testing.assert_allclose(actual=array_mask, desired=desired_array_mask,
                                 rtol=1e-3)
 
+    def test_mask_cache(self):
+        cache = MaskCache(max_size=2)
+        H, W_xfft = 8, 5
+        mask = cache.get(get_mask=get_hyper_mask, H=H, W=W_xfft,
+                         compress_rate=50, interpolate='const',
+                         dtype=torch.float64)
+        desired, _ = get_hyper_mask(H=H, W=W_xfft, compress_rate=50,
+                                    interpolate='const')
+        np.testing.assert_equal(actual=mask.numpy(),
+                                desired=desired[:, 0:W_xfft, :].numpy())
+        self.assertEqual(mask.dtype, torch.float64)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        mask2 = cache.get(get_mask=get_hyper_mask, H=H, W=W_xfft,
+                          compress_rate=50, interpolate='const',
+                          dtype=torch.float64)
+        self.assertIs(mask, mask2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Evict the least recently used mask.
+        cache.get(get_mask=get_hyper_mask, H=H, W=W_xfft, compress_rate=60)
+        cache.get(get_mask=get_inverse_hyper_mask, H=H, W=W_xfft,
+                  compress_rate=50)
+        self.assertEqual(len(cache), 2)
+        mask3 = cache.get(get_mask=get_hyper_mask, H=H, W=W_xfft,
+                          compress_rate=50, interpolate='const',
+                          dtype=torch.float64)
+        self.assertIsNot(mask, mask3)
+        self.assertEqual(cache.misses, 4)
 
 
 if __name__ == '__main__':
@@ -193,6 +193,29 @@ def get_args():
                         # "TRUE", "FALSE"
                         help="should we show log the size of each of the fft based"
                              "conv layers? " + ",".join(Bool.get_names()))
+    parser.add_argument("--filter_cache",
+                        default="TRUE" if args.filter_cache else "FALSE",
+                        help="should the spectra of the filters in the fft "
+                             "based conv layers be cached in the inference "
+                             "mode? " + ",".join(Bool.get_names()))
+    parser.add_argument("--conv_tuning",
+                        default="TRUE" if args.conv_tuning else "FALSE",
+                        help="should the conv exec type and the fft size be "
+                             "picked for each fft based conv layer by "
+                             "benchmarking the candidates? " + ",".join(
+                            Bool.get_names()))
+    parser.add_argument("--tuning_file",
+                        default=args.tuning_file,
+                        help="the on-disk cache of the tuned conv layers "
+                             "(by default in the home directory)")
+    parser.add_argument("--tile_size", type=int, default=args.tile_size,
+                        help="the fft size of the tiles for the TILED conv "
+                             "exec type (by default picked by the cost of "
+                             "the ffts)")
+    parser.add_argument("--tile_memory_size", type=float,
+                        default=args.tile_memory_size,
+                        help="the memory budget (in GB) for the tiles of the "
+                             "TILED conv exec type")
     parser.add_argument("--only_train",
                         default="TRUE" if args.only_train else "FALSE",
                         # "TRUE", "FALSE"
@@ -257,6 +280,16 @@ def get_args():
     parser.add_argument("--noise_sigmas", default=args.noise_sigmas, nargs="+",
                         type=float,
                         help=f"how much Gaussian noise to add: {args.noise_sigmas}")
+    parser.add_argument("--noise_seeds", default=args.noise_seeds, nargs="+",
+                        type=int,
+                        help=f"the seeds of the weight noise draws for each "
+                             f"noise sigma in the sweep: {args.noise_seeds}")
+    parser.add_argument("--sweep_memory_budget",
+                        default=args.sweep_memory_budget, type=int,
+                        help=f"the memory (in MB) to keep the evaluation set "
+                             f"on the device in the sigma sweep, 0 - use half "
+                             f"of the free GPU memory: "
+                             f"{args.sweep_memory_budget}")
     parser.add_argument("--noise_epsilon", default=args.noise_epsilon,
                         type=float,
                         help=f"how much uniform noise to add: "
@@ -355,6 +388,21 @@ def get_args():
                              f"the defense that the "
                              f"attacker is not aware of "
                              f"(default: {args.many_recover_iterations})")
+    parser.add_argument('--recover_early_stop_alpha', type=float,
+                        default=args.recover_early_stop_alpha,
+                        help=f"stop the noise trials of the defense for an "
+                             f"image when the plurality class is significant "
+                             f"at this overall level (split evenly over the "
+                             f"tests after every 10 trials, Bonferroni), 0 "
+                             f"runs all the iterations "
+                             f"(default: {args.recover_early_stop_alpha})")
+    parser.add_argument("--torch_defense",
+                        default="TRUE" if args.torch_defense else "FALSE",
+                        help="should the randomized defense run all the noise "
+                             "trials on the device with the pytorch model "
+                             "(the votes are counted per trial and the "
+                             "confidence is the mean softmax of the trials)? "
+                             + ",".join(Bool.get_names()))
     parser.add_argument('--attack_max_iterations', type=int,
                         default=args.attack_max_iterations,
                         help=f"number of iterations for the attack that the "
@@ -477,6 +525,41 @@ def get_args():
                         default=args.ensemble,
                         help='For the RSE defense, how many models in the '
                              'ensemble.')
+    parser.add_argument("--ensemble_alpha",
+                        type=float,
+                        default=args.ensemble_alpha,
+                        help='For the RSE defense, stop drawing the models '
+                             'for a sample when its most voted class is '
+                             'significant (0 - use all the models). This is '
+                             'the overall level: it is split evenly over the '
+                             'repeated tests (Bonferroni) and the sign test '
+                             'uses the normal approximation.')
+    parser.add_argument("--ensemble_min_passes",
+                        type=int,
+                        default=args.ensemble_min_passes,
+                        help='For the RSE defense, the min number of models '
+                             'before the early stopping.')
+    parser.add_argument("--channel_timing",
+                        action='store_true',
+                        default=args.channel_timing,
+                        help='Record the time spent in each channel (the '
+                             'recover_type can chain the channels, e.g. '
+                             'round:32+fft:50+gauss:0.03).')
+    parser.add_argument("--adv_store_dir",
+                        type=str,
+                        default=args.adv_store_dir,
+                        help='The directory of the store of the adversarial '
+                             'examples that are loaded instead of rerunning '
+                             'the same attack (empty - disable the store).')
+    parser.add_argument("--cw_binary_search_steps",
+                        type=int,
+                        default=args.cw_binary_search_steps,
+                        help='The number of the steps of the per-sample binary '
+                             'search over c in the batched C&W attack '
+                             '(fast_attack and the CarliniWagnerL2Attack'
+                             'RoundFFT of main_adversarial), 0 - a single c '
+                             'for the batch (the per-image foolbox C&W in '
+                             'main_adversarial).')
     parser.add_argument("--attack_confidence",
                         type=float,
                         default=args.attack_confidence,
@@ -194,6 +194,13 @@ class ConvExecType(EnumWithNames):
     CUDA_SHARED_LOG = 4
     CUDA_DEEP = 5
     SGEMM = 6
+    TILED = 7  # overlap-save tiles with bounded memory (no compression)
+
+
+class FFTSizeType(EnumWithNames):
+    EXACT = 1  # the size of the signal with the required padding
+    POWER2 = 2  # the next power of 2
+    SMOOTH = 3  # the next 2-3-5-7 smooth number
 
 
 class TensorType(EnumWithNames):
@@ -474,3 +481,64 @@ def next_power2(x):
     """
     # return math.pow(2, math.ceil(math.log2(x)))
     return int(2 ** np.ceil(np.log2(x)))
+
+
+def next_smooth(x, primes=(2, 3, 5, 7)):
+    """
+    :param x: an integer number
+    :param primes: the allowed prime factors
+    :return: the smallest number larger or equal to x whose prime factors are
+    only from primes (the FFT is fast for such sizes)
+
+    >>> result = next_smooth(11)
+    >>> np.testing.assert_equal(result, 12)
+    >>> result = next_smooth(1)
+    >>> np.testing.assert_equal(result, 1)
+    >>> result = next_smooth(97)
+    >>> np.testing.assert_equal(result, 98)
+    >>> result = next_smooth(127)
+    >>> np.testing.assert_equal(result, 128)
+    """
+    x = max(int(x), 1)
+    while True:
+        remainder = x
+        for prime in primes:
+            while remainder % prime == 0:
+                remainder //= prime
+        if remainder == 1:
+            return x
+        x += 1
+
+
+def get_fft_size(x, fft_size_type):
+    """
+    :param x: the size of the signal (with the padding)
+    :param fft_size_type: the type of the fft size (FFTSizeType)
+    :return: the size of the fft
+
+    >>> result = get_fft_size(33, FFTSizeType.POWER2)
+    >>> np.testing.assert_equal(result, 64)
+    >>> result = get_fft_size(33, FFTSizeType.SMOOTH)
+    >>> np.testing.assert_equal(result, 35)
+    """
+    if fft_size_type is FFTSizeType.POWER2:
+        return next_power2(x)
+    elif fft_size_type is FFTSizeType.SMOOTH:
+        return next_smooth(x)
+    elif fft_size_type is FFTSizeType.EXACT:
+        return x
+    else:
+        raise Exception(f"Unknown fft size type: {fft_size_type}")
+
+
+def get_free_memory(device):
+    """
+    :param device: the torch device
+    :return: the free memory (in bytes) on the GPU device, None for the CPU
+    """
+    if device.type != 'cuda':
+        return None
+    if hasattr(torch.cuda, 'mem_get_info'):
+        return torch.cuda.mem_get_info(device)[0]
+    return torch.cuda.get_device_properties(
+        device).total_memory - torch.cuda.memory_reserved(device)